@@ -0,0 +1,225 @@
+"""
+KC Speedshop ML Diagnostic Service - Micro-batching
+Coalesces concurrent single-row inference calls into one model pass
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class _PendingRow:
+    """A queued feature row and the future its caller is awaiting"""
+
+    __slots__ = ('row', 'future', 'enqueued_at')
+
+    def __init__(self, row: np.ndarray, future: asyncio.Future, enqueued_at: float):
+        self.row = row
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+class MicroBatcher:
+    """Queue concurrent scoring requests and score them in bounded batches
+
+    A batch is dispatched once it holds ``max_batch_size`` rows or once the
+    oldest queued row has waited ``max_wait_ms``, whichever comes first.
+    ``score_fn`` receives an (N, F) matrix and must return N results in order.
+    With ``max_queue_depth`` set, ``submit`` raises ``asyncio.QueueFull``
+    instead of queueing more rows than that.
+    """
+
+    def __init__(
+        self,
+        score_fn: Callable[[np.ndarray], Awaitable[List[Any]]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        max_concurrent_batches: int = 1,
+        max_queue_depth: int = 0,
+        name: str = "inference"
+    ):
+        self.score_fn = score_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.max_queue_depth = max(0, max_queue_depth)
+        self.name = name
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatch_slots: Optional[asyncio.Semaphore] = None
+        self._in_flight: set = set()
+
+        # Metrics
+        self.batches_dispatched = 0
+        self.rows_scored = 0
+        self.rows_cancelled = 0
+        self.rows_rejected = 0
+        self.batch_errors = 0
+        self.batch_size_histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.batch_size_histogram['+Inf'] = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self._recent_waits: deque = deque(maxlen=1024)
+        self._recent_batch_sizes: deque = deque(maxlen=1024)
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        """Start the background batching loop"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        self._dispatch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._worker = asyncio.create_task(self._run(), name=f"{self.name}-batcher")
+        logger.info(
+            f"Micro-batcher '{self.name}' started "
+            f"(max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+
+    async def stop(self):
+        """Stop the batching loop and fail anything still queued"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        while self._queue is not None and not self._queue.empty():
+            self._fail([self._queue.get_nowait()], RuntimeError("Micro-batcher stopped"))
+        logger.info(f"Micro-batcher '{self.name}' stopped")
+
+    async def submit(self, row) -> Any:
+        """Queue one feature row and wait for its scored result"""
+        row = np.asarray(row)
+        if not self.running:
+            # Not started (e.g. outside the app lifespan) - score the row on its own
+            return (await self.score_fn(row[np.newaxis, :]))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self._queue.put_nowait(_PendingRow(row, future, loop.time()))
+        except asyncio.QueueFull:
+            self.rows_rejected += 1
+            raise
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            batch = [first]
+            deadline = first.enqueued_at + self.max_wait
+
+            try:
+                while len(batch) < self.max_batch_size:
+                    # Take whatever is already queued before waiting for more
+                    if not self._queue.empty():
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+                await self._dispatch_slots.acquire()
+            except asyncio.CancelledError:
+                self._fail(batch, RuntimeError("Micro-batcher stopped"))
+                raise
+
+            task = asyncio.create_task(self._score_batch(batch, loop.time()))
+            self._in_flight.add(task)
+            task.add_done_callback(self._batch_done)
+
+    @staticmethod
+    def _fail(batch: List[_PendingRow], error: Exception):
+        for pending in batch:
+            if not pending.future.done():
+                pending.future.set_exception(error)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._dispatch_slots.release()
+
+    async def _score_batch(self, batch: List[_PendingRow], dispatched_at: float):
+        # Callers that went away while queued are dropped from the batch
+        live = [pending for pending in batch if not pending.future.done()]
+        self.rows_cancelled += len(batch) - len(live)
+        if not live:
+            return
+
+        self._record_batch(live, dispatched_at)
+
+        try:
+            results = await self.score_fn(np.stack([pending.row for pending in live]))
+            if len(results) != len(live):
+                raise RuntimeError(f"score_fn returned {len(results)} results for {len(live)} rows")
+        except Exception as e:
+            self.batch_errors += 1
+            logger.error(f"Micro-batcher '{self.name}' failed to score batch of {len(live)}: {e}")
+            self._fail(live, e)
+            return
+
+        for pending, result in zip(live, results):
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+    def _record_batch(self, live: List[_PendingRow], dispatched_at: float):
+        size = len(live)
+        self.batches_dispatched += 1
+        self.rows_scored += size
+        self._recent_batch_sizes.append(size)
+
+        bucket = next((b for b in BATCH_SIZE_BUCKETS if size <= b), '+Inf')
+        self.batch_size_histogram[bucket] += 1
+
+        for pending in live:
+            wait = dispatched_at - pending.enqueued_at
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+            self._recent_waits.append(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch size and queue wait metrics for tuning"""
+        waits_ms = np.array(self._recent_waits) * 1000.0 if self._recent_waits else np.zeros(1)
+        return {
+            'running': self.running,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_queue_depth': self.max_queue_depth,
+            'batches_in_flight': len(self._in_flight),
+            'batches_dispatched': self.batches_dispatched,
+            'rows_scored': self.rows_scored,
+            'rows_cancelled': self.rows_cancelled,
+            'rows_rejected': self.rows_rejected,
+            'batch_errors': self.batch_errors,
+            'mean_batch_size': self.rows_scored / self.batches_dispatched if self.batches_dispatched else 0.0,
+            'recent_mean_batch_size': float(np.mean(self._recent_batch_sizes)) if self._recent_batch_sizes else 0.0,
+            'batch_size_histogram': {str(k): v for k, v in self.batch_size_histogram.items()},
+            'queue_wait_ms': {
+                'mean': self.queue_wait_total * 1000.0 / self.rows_scored if self.rows_scored else 0.0,
+                'p50': float(np.percentile(waits_ms, 50)),
+                'p95': float(np.percentile(waits_ms, 95)),
+                'p99': float(np.percentile(waits_ms, 99)),
+                'max': self.queue_wait_max * 1000.0
+            }
+        }
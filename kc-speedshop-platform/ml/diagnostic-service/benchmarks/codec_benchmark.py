@@ -0,0 +1,132 @@
+"""
+KC Speedshop ML Diagnostic Service - Telemetry codec benchmark
+Compression ratio and throughput of telemetry_codec on synthetic drive cycles
+
+Usage:
+    python benchmarks/codec_benchmark.py [--days 7] [--hz 5] [--jitter-ms 3]
+        [--max-decode-seconds 1]
+
+Generates one vehicle's history as repeated urban/highway/idle drive cycles
+with sensor noise, timestamp jitter and dropped samples, then encodes and
+decodes every PID. Exits non-zero if decoding the whole history takes longer
+than --max-decode-seconds.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+from telemetry_codec import (  # noqa: E402
+    compression_stats,
+    decode_timestamps,
+    decode_values,
+    encode_timestamps,
+    encode_values
+)
+
+# (phase, seconds, target speed km/h)
+DRIVE_CYCLE = (
+    ('idle', 120, 0),
+    ('urban', 900, 40),
+    ('highway', 1500, 100),
+    ('urban', 600, 35),
+    ('idle', 300, 0),
+    ('parked', 3600, None)
+)
+
+def synthetic_history(days: float, hz: float, jitter_ms: int, seed: int = 7):
+    """Timestamps (ms) and PID columns for one vehicle, parked gaps included"""
+    rng = np.random.default_rng(seed)
+    period_ms = int(round(1000 / hz))
+    timestamp_parts, speed_parts = [], []
+    clock_ms = 1_700_000_000_000
+    end_ms = clock_ms + int(days * 86400 * 1000)
+
+    while clock_ms < end_ms:
+        for _, seconds, target in DRIVE_CYCLE:
+            if target is None:
+                clock_ms += seconds * 1000  # nothing is logged while parked
+                continue
+            rows = int(seconds * hz)
+            timestamp_parts.append(clock_ms + np.arange(rows, dtype=np.int64) * period_ms)
+            # Speed drifts around the phase target like real traffic
+            drift = np.cumsum(rng.normal(0, 0.4, rows))
+            speed_parts.append(np.clip(target + drift - np.linspace(0, drift[-1], rows), 0, None))
+            clock_ms += rows * period_ms
+
+    timestamps = np.concatenate(timestamp_parts)
+    timestamps += rng.integers(-jitter_ms, jitter_ms + 1, len(timestamps)) if jitter_ms else 0
+    timestamps = np.maximum.accumulate(timestamps)
+    speed = np.concatenate(speed_parts)
+    rows = len(timestamps)
+
+    rpm = np.where(speed < 1, 800, 1200 + speed * 22) + rng.normal(0, 30, rows)
+    columns = {
+        'SPEED': np.round(speed),  # OBD reports whole km/h
+        'RPM': np.round(rpm * 4) / 4,  # and quarter RPM
+        'ENGINE_LOAD': np.clip(20 + speed * 0.35 + rng.normal(0, 3, rows), 0, 100),
+        'THROTTLE_POS': np.clip(12 + speed * 0.25 + rng.normal(0, 2, rows), 0, 100),
+        'COOLANT_TEMP': np.round(np.minimum(90, 20 + np.arange(rows) / hz / 8) % 91),
+        'INTAKE_TEMP': np.round(25 + speed * 0.05),
+        'FUEL_PRESSURE': np.full(rows, 380.0),
+        'O2_SENSOR_1': 0.45 + 0.4 * np.sin(np.arange(rows) / 3) + rng.normal(0, 0.02, rows)
+    }
+    # Adapters drop a few samples; the store keeps those as NaN
+    dropped = rng.random(rows) < 0.002
+    for values in columns.values():
+        values[dropped] = np.nan
+    return timestamps, {pid: values.astype(np.float32) for pid, values in columns.items()}
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Telemetry codec benchmark")
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--hz', type=float, default=5)
+    parser.add_argument('--jitter-ms', type=int, default=3)
+    parser.add_argument('--max-decode-seconds', type=float, default=None)
+    args = parser.parse_args()
+
+    timestamps, columns = synthetic_history(args.days, args.hz, args.jitter_ms)
+    rows = len(timestamps)
+    print(f"{rows} rows ({args.days:g} days at {args.hz:g} Hz, jitter ±{args.jitter_ms} ms), {len(columns)} PIDs")
+    print(f"{'series':<14} {'ratio':>7} {'bits/sample':>12} {'encode MB/s':>12} {'decode MB/s':>12} {'decode ms':>10}")
+
+    series = [('timestamp', timestamps, encode_timestamps, decode_timestamps)]
+    series += [(pid, values, encode_values, decode_values) for pid, values in columns.items()]
+
+    total_raw = total_encoded = 0
+    total_decode = 0.0
+    for name, values, encode, decode in series:
+        encoded, encode_seconds = timed(encode, values)
+        decoded, decode_seconds = timed(decode, encoded)
+        if not np.array_equal(decoded.view(np.uint8), values.view(np.uint8)):
+            print(f"FAIL: {name} did not round-trip")
+            return 1
+        ratio, bits = compression_stats(values.nbytes, len(encoded), rows)
+        megabytes = values.nbytes / 1e6
+        print(f"{name:<14} {ratio:>6.1f}x {bits:>12.2f} {megabytes / encode_seconds:>12.0f} "
+              f"{megabytes / decode_seconds:>12.0f} {decode_seconds * 1000:>10.1f}")
+        total_raw += values.nbytes
+        total_encoded += len(encoded)
+        total_decode += decode_seconds
+
+    print(f"total: {total_raw / 1e6:.1f} MB -> {total_encoded / 1e6:.1f} MB "
+          f"({total_raw / total_encoded:.1f}x), full history decoded in {total_decode * 1000:.0f} ms")
+
+    if args.max_decode_seconds is not None and total_decode > args.max_decode_seconds:
+        print(f"FAIL: decode took {total_decode:.2f}s, budget {args.max_decode_seconds}s")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+KC Speedshop ML Diagnostic Service - Startup benchmark
+Measures import, model-load and first-request latency in fresh interpreters
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5] [--backend numpy]
+        [--max-import-seconds 2] [--max-ready-seconds 10]
+
+Each run starts a new Python process so module caches do not hide import
+cost. Exits non-zero if a median exceeds one of the given budgets, so it can
+gate CI against startup regressions.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('tensorflow', 'pandas', 'sklearn', 'redis')
+
+SAMPLE_REQUEST = {
+    'vehicle_id': 'benchmark-vehicle',
+    'vin': '1HGCM82633A004352',
+    'obd_data': {'RPM': 2450, 'SPEED': 62, 'ENGINE_LOAD': 48, 'COOLANT_TEMP': 91, 'DTC_CODES': []},
+    'symptoms': [],
+    'make': 'Honda',
+    'model': 'Accord',
+    'year': 2003
+}
+
+def measure_once() -> dict:
+    """Runs inside a fresh interpreter"""
+    process_started = time.perf_counter()
+    sys.path.insert(0, SERVICE_DIR)
+
+    started = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - started
+
+    from fastapi.testclient import TestClient
+
+    headers = {'Authorization': 'Bearer benchmark'}
+    started = time.perf_counter()
+    with TestClient(main.app) as client:
+        lifespan_seconds = time.perf_counter() - started
+        model_load_seconds = main.model_registry.active.load_seconds if main.model_registry.active else None
+
+        started = time.perf_counter()
+        response = client.post('/diagnostic/analyze', json=SAMPLE_REQUEST, headers=headers)
+        first_request_seconds = time.perf_counter() - started
+        response.raise_for_status()
+
+        started = time.perf_counter()
+        client.post('/diagnostic/analyze', json=SAMPLE_REQUEST, headers=headers).raise_for_status()
+        warm_request_seconds = time.perf_counter() - started
+
+        backend = main.model_registry.backend
+
+    return {
+        'backend': backend,
+        'import_seconds': import_seconds,
+        'lifespan_startup_seconds': lifespan_seconds,
+        'model_load_seconds': model_load_seconds,
+        'first_request_seconds': first_request_seconds,
+        'warm_request_seconds': warm_request_seconds,
+        'ready_seconds': import_seconds + lifespan_seconds + first_request_seconds,
+        'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+        'process_seconds': time.perf_counter() - process_started
+    }
+
+def run_child(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child'],
+        env=env,
+        cwd=SERVICE_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    # The measurement is the last line; anything before it is service logging
+    return json.loads(output.strip().splitlines()[-1])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Diagnostic service startup benchmark")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--backend', choices=('tensorflow', 'numpy'), default=None,
+                        help="INFERENCE_BACKEND for the measured processes (default: environment)")
+    parser.add_argument('--max-import-seconds', type=float, default=None)
+    parser.add_argument('--max-ready-seconds', type=float, default=None)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_once()))
+        return 0
+
+    env = dict(os.environ)
+    env.setdefault('MODEL_REGISTRY_POLL_SECONDS', '0')
+    if args.backend:
+        env['INFERENCE_BACKEND'] = args.backend
+
+    runs = [run_child(env) for _ in range(args.runs)]
+    metrics = ('import_seconds', 'lifespan_startup_seconds', 'model_load_seconds',
+               'first_request_seconds', 'warm_request_seconds', 'ready_seconds')
+
+    print(f"backend: {runs[0]['backend']}, runs: {len(runs)}")
+    print(f"heavy modules loaded: {', '.join(runs[0]['heavy_modules_loaded']) or 'none'}")
+    medians = {}
+    for metric in metrics:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        if not values:
+            continue
+        medians[metric] = statistics.median(values)
+        print(f"{metric:<26} median {medians[metric] * 1000:9.1f} ms   "
+              f"min {min(values) * 1000:9.1f} ms   max {max(values) * 1000:9.1f} ms")
+
+    failed = False
+    if args.max_import_seconds is not None and medians['import_seconds'] > args.max_import_seconds:
+        print(f"FAIL: import median {medians['import_seconds']:.2f}s exceeds {args.max_import_seconds}s")
+        failed = True
+    if args.max_ready_seconds is not None and medians['ready_seconds'] > args.max_ready_seconds:
+        print(f"FAIL: ready median {medians['ready_seconds']:.2f}s exceeds {args.max_ready_seconds}s")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+KC Speedshop ML Diagnostic Service - Caching
+Content-addressed cache for X.AI analyses with LRU + TTL eviction
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_CACHE_BACKEND = os.getenv("ANALYSIS_CACHE_BACKEND", "memory")  # memory | redis | none
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "10000"))
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+# OBD values are rounded to this many significant digits before hashing; three
+# keep coolant to 1 degree and RPM to 10 rpm, finer than any rule threshold step
+ANALYSIS_CACHE_SIGNIFICANT_DIGITS = int(os.getenv("ANALYSIS_CACHE_SIGNIFICANT_DIGITS", "3"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+CACHE_KEY_VERSION = "v3"
+
+def _round_significant(value: float, digits: int) -> float:
+    if value == 0 or not math.isfinite(value):
+        return value
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+def _canonical_value(value: Any, digits: int) -> Any:
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return _round_significant(float(value), digits)
+    if isinstance(value, str):
+        return value.strip().upper()
+    if isinstance(value, (list, tuple, set)):
+        # DTC lists and similar are order-insensitive
+        return sorted((_canonical_value(item, digits) for item in value), key=json.dumps)
+    if isinstance(value, dict):
+        return {str(k).strip().upper(): _canonical_value(v, digits) for k, v in sorted(value.items())}
+    return str(value)
+
+def make_analysis_cache_key(
+    diagnostic_data: Dict[str, Any],
+    significant_digits: int = ANALYSIS_CACHE_SIGNIFICANT_DIGITS
+) -> str:
+    """Hash the canonicalised prompt inputs of an X.AI analysis
+
+    Make/model/engine are case-folded, OBD keys are sorted and their numeric values
+    rounded, and symptoms are normalised into a sorted set, so near-identical
+    diagnostics for the same vehicle map to the same key. The ids of the rules
+    that fired are part of the key, so snapshots on either side of a rule
+    threshold never share an analysis, however close their values round.
+    """
+    symptoms = sorted({
+        " ".join(str(symptom).lower().split())
+        for symptom in diagnostic_data.get('symptoms', [])
+        if str(symptom).strip()
+    })
+    canonical = {
+        'make': str(diagnostic_data.get('make', '')).strip().lower(),
+        'model': str(diagnostic_data.get('model', '')).strip().lower(),
+        'engine': str(diagnostic_data.get('engine') or '').strip().lower(),
+        'year': diagnostic_data.get('year'),
+        'obd_data': _canonical_value(diagnostic_data.get('obd_data', {}), significant_digits),
+        'symptoms': symptoms,
+        'rules_fired': sorted(set(diagnostic_data.get('rules_fired') or ()))
+    }
+    digest = hashlib.sha256(
+        json.dumps(canonical, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+    return f"xai:{CACHE_KEY_VERSION}:{digest}"
+
+class MemoryTTLCache:
+    """In-process LRU cache with per-entry TTL
+
+    A named cache reports its lookups to Prometheus as ``cache=<name>``.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES,
+        ttl: float = ANALYSIS_CACHE_TTL_SECONDS,
+        name: Optional[str] = None
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.name = name
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+        self._hit_counter = CACHE_LOOKUPS.labels(name, 'hit') if name else None
+        self._miss_counter = CACHE_LOOKUPS.labels(name, 'miss') if name else None
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._lookup(key)
+        if self._hit_counter is not None:
+            (self._miss_counter if value is None else self._hit_counter).inc()
+        return value
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'memory',
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+class RedisTTLCache:
+    """Redis-backed cache shared by all workers
+
+    Entries expire through Redis TTLs; size-based eviction is left to the
+    server's maxmemory-policy (allkeys-lru is recommended).
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = ANALYSIS_CACHE_TTL_SECONDS):
+        import redis.asyncio as redis_asyncio
+
+        self.url = url
+        self.ttl = ttl
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._redis.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self._redis.set(key, json.dumps(value), ex=max(1, int(self.ttl if ttl is None else ttl)))
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    async def close(self):
+        await self._redis.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'redis', 'url': self.url, 'ttl_seconds': self.ttl}
+
+class AnalysisCache:
+    """Hit/miss-counting cache facade over a memory or Redis backend
+
+    Concurrent misses for the same key share one computation, so a burst of
+    identical diagnostics makes a single upstream call.
+    """
+
+    def __init__(self, backend: Optional[Any], name: str = 'analysis'):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._hit_counter = CACHE_LOOKUPS.labels(name, 'hit')
+        self._miss_counter = CACHE_LOOKUPS.labels(name, 'miss')
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get(self, key: str) -> Optional[Any]:
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+            if asyncio.iscoroutine(value):
+                value = await value
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Analysis cache read failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+            self._miss_counter.inc()
+        else:
+            self.hits += 1
+            self._hit_counter.inc()
+        return value
+
+    async def set(self, key: str, value: Any):
+        if self.backend is None or value is None:
+            return
+        try:
+            result = self.backend.set(key, value)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Analysis cache write failed: {e}")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """Return the cached value or compute, cache and return it (None is not cached)"""
+        if self.backend is None:
+            return await compute()
+
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                # The leading caller was cancelled, not us - compute on our own
+                if not in_flight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await compute()
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await compute()
+            await self.set(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters see the exception; make sure it is not reported as unretrieved
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def close(self):
+        close = getattr(self.backend, 'close', None)
+        if close is not None:
+            await close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        stats = {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'in_flight': len(self._in_flight)
+        }
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+def create_analysis_cache(backend: str = ANALYSIS_CACHE_BACKEND) -> AnalysisCache:
+    """Build the analysis cache configured by ANALYSIS_CACHE_BACKEND"""
+    if backend == "none":
+        return AnalysisCache(None)
+    if backend == "redis":
+        try:
+            return AnalysisCache(RedisTTLCache())
+        except ImportError:
+            logger.warning("ANALYSIS_CACHE_BACKEND=redis but the redis package is not installed - using memory cache")
+    elif backend != "memory":
+        logger.warning(f"Unknown ANALYSIS_CACHE_BACKEND '{backend}' - using memory cache")
+    return AnalysisCache(MemoryTTLCache())
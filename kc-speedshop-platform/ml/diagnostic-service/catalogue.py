@@ -0,0 +1,214 @@
+"""
+KC Speedshop ML Diagnostic Service - Catalogue change feeds
+Keyset-paginated reads of changed rows from the marketplace tables
+
+In-memory indexes over ``parts``, ``inventory_items``, ``competitor_prices``
+and ``workshop_bays`` read each table in full once, then only the rows whose
+change column (``updated_at``, or ``last_checked`` for competitor prices)
+moved past the last one seen. Pages are ordered by (change column, id), so a
+page boundary never splits rows with equal timestamps. Each read starts
+CATALOGUE_SYNC_OVERLAP_SECONDS before the last timestamp seen, so rows of
+transactions that committed late are not missed; consumers apply rows as
+upserts and re-reading one is harmless.
+
+CATALOGUE_DATABASE_URL selects the backend like DATABASE_URL does:
+``sqlite:///path/to.db`` (stand-in for local runs and tests) or
+``postgresql://...`` (Supabase).
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from persistence import DATABASE_URL
+
+CATALOGUE_DATABASE_URL = os.getenv("CATALOGUE_DATABASE_URL", DATABASE_URL)
+CATALOGUE_SYNC_PAGE_SIZE = int(os.getenv("CATALOGUE_SYNC_PAGE_SIZE", "5000"))
+# Re-read this much before the last change seen, for transactions that committed late
+CATALOGUE_SYNC_OVERLAP_SECONDS = float(os.getenv("CATALOGUE_SYNC_OVERLAP_SECONDS", "5"))
+
+# Sorts before every row id, for cursors that carry only a timestamp
+NIL_ID = '00000000-0000-0000-0000-000000000000'
+
+# (change column value, id) of the last row read
+Cursor = Tuple[str, str]
+
+class TableFeed:
+    """Columns of one table to read, and the column that moves when a row changes
+
+    ``casts`` are Postgres expressions for columns that need one (uuids as
+    text, numerics as floats); the change column is always read as naive
+    UTC ISO text.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        columns: Sequence[str],
+        change_column: str = 'updated_at',
+        casts: Optional[Dict[str, str]] = None
+    ):
+        if 'id' not in columns or change_column not in columns:
+            raise ValueError(f"Feed of {table} must read id and {change_column}")
+        self.table = table
+        self.columns = tuple(columns)
+        self.change_column = change_column
+        self.casts = {'id': 'id::text', **(casts or {})}
+
+    def postgres_select(self) -> str:
+        expressions = [
+            f"to_char({column} AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US')"
+            if column == self.change_column else self.casts.get(column, column)
+            for column in self.columns
+        ]
+        return f"SELECT {', '.join(expressions)} FROM {self.table}"
+
+def rewind(timestamp: str, seconds: float) -> str:
+    """A change-column cursor moved back by some seconds, as naive UTC"""
+    try:
+        moment = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return timestamp
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+class SQLiteCatalogue:
+    """Reads catalogue tables from sqlite (stand-in for Postgres in local runs and tests)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"sqlite:///{self.path}"
+
+    def changed_rows(self, feed: TableFeed, cursor: Optional[Cursor], limit: int) -> List[Dict[str, Any]]:
+        """Rows ordered by (change column, id), strictly after a cursor; none if the table is missing"""
+        sql = f"SELECT {', '.join(feed.columns)} FROM {feed.table}"
+        params: List[Any] = []
+        if cursor is not None:
+            sql += f" WHERE ({feed.change_column}, id) > (?, ?)"
+            params.extend(cursor)
+        sql += f" ORDER BY {feed.change_column}, id LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            if self._conn is None:
+                if not os.path.exists(self.path):
+                    return []
+                self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            if self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (feed.table,)
+            ).fetchone() is None:
+                return []
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(feed.columns, row)) for row in rows]
+
+    def ids(self, feed: TableFeed) -> Optional[List[str]]:
+        """Every row id of a table; None if the table is missing"""
+        with self._lock:
+            if self._conn is None:
+                if not os.path.exists(self.path):
+                    return None
+                self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            if self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (feed.table,)
+            ).fetchone() is None:
+                return None
+            rows = self._conn.execute(f"SELECT id FROM {feed.table}").fetchall()
+        return [str(row[0]) for row in rows]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+class PostgresCatalogue:
+    """Reads catalogue tables over psycopg2 with a read-only session"""
+
+    def __init__(self, dsn: str):
+        import psycopg2
+
+        self._psycopg2 = psycopg2
+        self.dsn = dsn
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return "postgresql"
+
+    def changed_rows(self, feed: TableFeed, cursor: Optional[Cursor], limit: int) -> List[Dict[str, Any]]:
+        """Rows ordered by (change column, id), strictly after a cursor"""
+        sql = feed.postgres_select()
+        params: List[Any] = []
+        if cursor is not None:
+            sql += f" WHERE ({feed.change_column}, id) > (%s::timestamp AT TIME ZONE 'UTC', %s::uuid)"
+            params.extend(cursor)
+        sql += f" ORDER BY {feed.change_column}, id LIMIT %s"
+        params.append(limit)
+        with self._lock:
+            if self._conn is None or self._conn.closed:
+                self._conn = self._psycopg2.connect(self.dsn)
+                self._conn.set_session(readonly=True, autocommit=True)
+            with self._conn.cursor() as db_cursor:
+                db_cursor.execute(sql, params)
+                rows = db_cursor.fetchall()
+        return [dict(zip(feed.columns, row)) for row in rows]
+
+    def ids(self, feed: TableFeed) -> Optional[List[str]]:
+        """Every row id of a table"""
+        with self._lock:
+            if self._conn is None or self._conn.closed:
+                self._conn = self._psycopg2.connect(self.dsn)
+                self._conn.set_session(readonly=True, autocommit=True)
+            with self._conn.cursor() as db_cursor:
+                db_cursor.execute(f"SELECT id::text FROM {feed.table}")
+                rows = db_cursor.fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+def create_catalogue(database_url: str = CATALOGUE_DATABASE_URL):
+    """Build the catalogue reader for a DATABASE_URL"""
+    if database_url.startswith("sqlite:///"):
+        return SQLiteCatalogue(database_url[len("sqlite:///"):])
+    if database_url.startswith(("postgres://", "postgresql://")):
+        return PostgresCatalogue(database_url)
+    raise ValueError(f"Unsupported DATABASE_URL scheme: {database_url.split(':', 1)[0]}")
+
+class FeedReader:
+    """One consumer's position in a table's change feed"""
+
+    def __init__(self, feed: TableFeed, page_size: int = CATALOGUE_SYNC_PAGE_SIZE):
+        self.feed = feed
+        self.page_size = page_size
+        self.cursor: Optional[Cursor] = None
+
+    def read(self, catalogue, full: bool = False) -> List[Dict[str, Any]]:
+        """Every row (full) or the rows changed since the last read; blocking"""
+        cursor = None
+        if not full and self.cursor is not None:
+            cursor = (rewind(self.cursor[0], CATALOGUE_SYNC_OVERLAP_SECONDS), NIL_ID)
+        rows: List[Dict[str, Any]] = []
+        while True:
+            page = catalogue.changed_rows(self.feed, cursor, self.page_size)
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+            cursor = (page[-1][self.feed.change_column], page[-1]['id'])
+
+        change_column = self.feed.change_column
+        if rows:
+            last = max(rows, key=lambda row: (row[change_column] or '', str(row['id'])))
+            position = (last[change_column] or '', str(last['id']))
+            if full or self.cursor is None or position > self.cursor:
+                self.cursor = position
+        return rows
@@ -0,0 +1,515 @@
+"""
+KC Speedshop ML Diagnostic Service - Cost estimation
+Repair cost estimates from in-memory price distributions and workshop labour rates
+
+Every NZD price the marketplace knows for a part - its list price in
+``parts``, supplier cost plus markup in ``inventory_items`` and the prices
+in ``competitor_prices`` - goes into the sorted price list of the part's
+category. ``workshop_bays.hourly_rate`` of bays that are not unavailable
+forms the labour rate list. A repair type (the system of a trouble code, or
+``inspection``/``maintenance``) names a part category and a range of labour
+hours, so its estimate is read off the lists without touching the database:
+
+    min    = low labour hours  x low rate     + low part price
+    median = mid labour hours  x median rate  + median part price
+    max    = high labour hours x high rate    + high part price
+
+"Low" and "high" are the COST_LOW_QUANTILE and COST_HIGH_QUANTILE of a list
+(0 and 1 give the plain minimum and maximum). Estimates of several repairs
+add up; the sum of medians stands in for the median of the sum.
+
+The lists are loaded in full at startup and then updated every
+COST_REFRESH_SECONDS from the rows that changed since the last refresh.
+Deleted rows leave no change behind, so every COST_RECONCILE_SECONDS a
+refresh also reads the tables' ids and drops the prices and rates of rows
+that are gone; the full reload every COST_FULL_RELOAD_SECONDS rebuilds
+everything.
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from catalogue import FeedReader, TableFeed, create_catalogue
+from parts_fitment import SYSTEM_CATEGORIES, normalize_category
+
+logger = logging.getLogger(__name__)
+
+COST_CURRENCY = os.getenv("COST_CURRENCY", "NZD")
+COST_REFRESH_SECONDS = float(os.getenv("COST_REFRESH_SECONDS", "300"))
+COST_FULL_RELOAD_SECONDS = float(os.getenv("COST_FULL_RELOAD_SECONDS", "21600"))
+# Id-set check for deleted rows (0 disables it)
+COST_RECONCILE_SECONDS = float(os.getenv("COST_RECONCILE_SECONDS", "900"))
+COST_LOW_QUANTILE = float(os.getenv("COST_LOW_QUANTILE", "0.1"))
+COST_HIGH_QUANTILE = float(os.getenv("COST_HIGH_QUANTILE", "0.9"))
+# Hourly rate used until workshop bays are loaded
+COST_DEFAULT_LABOUR_RATE = float(os.getenv("COST_DEFAULT_LABOUR_RATE", "120"))
+# Markup of inventory items that have none
+DEFAULT_MARKUP_PERCENTAGE = 50.0
+
+PARTS_PRICE_FEED = TableFeed(
+    'parts',
+    ('id', 'category', 'price', 'currency', 'updated_at'),
+    casts={'price': 'price::float8'}
+)
+INVENTORY_FEED = TableFeed(
+    'inventory_items',
+    ('id', 'part_id', 'cost_price', 'markup_percentage', 'updated_at'),
+    casts={
+        'part_id': 'part_id::text',
+        'cost_price': 'cost_price::float8',
+        'markup_percentage': 'markup_percentage::float8'
+    }
+)
+COMPETITOR_FEED = TableFeed(
+    'competitor_prices',
+    ('id', 'part_id', 'price', 'currency', 'last_checked'),
+    change_column='last_checked',
+    casts={'part_id': 'part_id::text', 'price': 'price::float8'}
+)
+WORKSHOP_BAYS_FEED = TableFeed(
+    'workshop_bays',
+    ('id', 'hourly_rate', 'currency', 'status', 'updated_at'),
+    casts={'hourly_rate': 'hourly_rate::float8'}
+)
+
+# Labour hours (low, high) of a repair per trouble code system
+LABOUR_HOURS = {
+    'air metering': (0.5, 1.5),
+    'body': (1.0, 4.0),
+    'brakes': (1.0, 3.0),
+    'chassis': (1.0, 4.0),
+    'climate': (1.0, 3.0),
+    'cooling': (1.0, 4.0),
+    'diesel': (1.0, 4.0),
+    'electrical': (0.5, 3.0),
+    'emissions': (1.0, 3.0),
+    'engine': (2.0, 8.0),
+    'engine control module': (1.0, 3.0),
+    'evaporative emissions': (0.5, 2.0),
+    'forced induction': (2.0, 6.0),
+    'fuel and air metering': (0.5, 2.0),
+    'fuel injection': (1.0, 3.0),
+    'fuel system': (1.0, 3.0),
+    'fuel trim': (0.5, 2.0),
+    'hybrid propulsion': (2.0, 6.0),
+    'ignition': (0.5, 2.0),
+    'lubrication': (1.0, 3.0),
+    'manufacturer specific': (1.0, 3.0),
+    'network': (1.0, 3.0),
+    'oxygen sensors': (0.5, 1.5),
+    'powertrain': (1.0, 4.0),
+    'restraints': (1.0, 3.0),
+    'speed and idle control': (0.5, 2.0),
+    'throttle': (0.5, 2.0),
+    'transmission': (2.0, 8.0),
+    'variable valve timing': (1.0, 4.0),
+    # Repairs without a trouble code: labour only
+    'inspection': (0.5, 1.0),
+    'maintenance': (1.0, 2.5)
+}
+
+# Repair type of a rule of the OBD rule engine
+RULE_REPAIR_TYPES = {
+    'engine_overheating': 'cooling',
+    'severe_overheating': 'cooling',
+    'sustained_overheating': 'cooling',
+    'thermostat_stuck_open': 'cooling',
+    'intake_heat_soak': 'forced induction',
+    'idle_instability': 'speed and idle control',
+    'low_fuel_pressure_under_load': 'fuel system',
+    'maf_implausible': 'air metering',
+    'o2_sensor_stuck': 'oxygen sensors'
+}
+
+# (source table, row id)
+SourceKey = Tuple[str, str]
+
+class PriceDistribution:
+    """Sorted multiset of prices; quantiles are an index away"""
+
+    __slots__ = ('_prices',)
+
+    def __init__(self, prices: Iterable[float] = ()):
+        self._prices: List[float] = sorted(prices)
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def add(self, price: float, keep_sorted: bool = True):
+        if keep_sorted:
+            bisect.insort(self._prices, price)
+        else:
+            self._prices.append(price)
+
+    def sort(self):
+        self._prices.sort()
+
+    def remove(self, price: float):
+        index = bisect.bisect_left(self._prices, price)
+        if index < len(self._prices) and self._prices[index] == price:
+            del self._prices[index]
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Linearly interpolated quantile, None when empty"""
+        if not self._prices:
+            return None
+        position = q * (len(self._prices) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(self._prices) - 1)
+        return self._prices[lower] + (self._prices[upper] - self._prices[lower]) * (position - lower)
+
+    def summary(self) -> Dict[str, Any]:
+        if not self._prices:
+            return {'count': 0, 'min': None, 'median': None, 'max': None}
+        return {
+            'count': len(self._prices),
+            'min': round(self._prices[0], 2),
+            'median': round(self.quantile(0.5), 2),
+            'max': round(self._prices[-1], 2)
+        }
+
+def _number(value: Any) -> Optional[float]:
+    """A finite float, or None; NaN would break the sorted price lists"""
+    try:
+        number = float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+    return number if number is not None and math.isfinite(number) else None
+
+class CostIndex:
+    """Price distributions per part category plus the labour rate distribution
+
+    Each price is remembered with the row it came from, so a changed row
+    replaces its old price in its category's list instead of adding to it,
+    and a part moving category takes its prices along.
+    """
+
+    def __init__(
+        self,
+        catalogue=None,
+        refresh_seconds: float = COST_REFRESH_SECONDS,
+        full_reload_seconds: float = COST_FULL_RELOAD_SECONDS,
+        reconcile_seconds: float = COST_RECONCILE_SECONDS
+    ):
+        self.catalogue = catalogue
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.reconcile_seconds = reconcile_seconds
+
+        self._part_categories: Dict[str, str] = {}
+        self._part_prices: Dict[str, Dict[SourceKey, float]] = {}
+        self._source_parts: Dict[SourceKey, str] = {}
+        self._categories: Dict[str, PriceDistribution] = {}
+        self._bay_rates: Dict[str, float] = {}
+        self._labour = PriceDistribution()
+        # While a full load runs, prices are appended and sorted once at the end
+        self._bulk = False
+        self._feeds = {
+            feed.table: FeedReader(feed)
+            for feed in (PARTS_PRICE_FEED, INVENTORY_FEED, COMPETITOR_FEED, WORKSHOP_BAYS_FEED)
+        }
+        self._last_full_load: Optional[float] = None
+        self._last_reconcile: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        # Metrics
+        self.estimates = 0
+        self.full_loads = 0
+        self.refreshes = 0
+        self.rows_applied = 0
+        self.rows_removed = 0
+        self.reconciles = 0
+        self.skipped_rows = 0
+        self.refresh_errors = 0
+
+    @classmethod
+    def from_environment(cls) -> "CostIndex":
+        return cls(create_catalogue())
+
+    def _distribution(self, category: str) -> PriceDistribution:
+        distribution = self._categories.get(category)
+        if distribution is None:
+            distribution = self._categories[category] = PriceDistribution()
+        return distribution
+
+    def _set_price(self, source: SourceKey, part_id: Optional[str], price: Optional[float]):
+        """Replace the price a source row gives a part (None removes it)"""
+        previous_part = self._source_parts.pop(source, None)
+        if previous_part is not None:
+            old_price = self._part_prices[previous_part].pop(source)
+            category = self._part_categories.get(previous_part)
+            if category is not None:
+                self._categories[category].remove(old_price)
+            if not self._part_prices[previous_part]:
+                del self._part_prices[previous_part]
+        if part_id is None or price is None or price <= 0:
+            return
+        self._source_parts[source] = part_id
+        self._part_prices.setdefault(part_id, {})[source] = price
+        category = self._part_categories.get(part_id)
+        if category is not None:
+            self._distribution(category).add(price, keep_sorted=not self._bulk)
+
+    def _set_category(self, part_id: str, category: str):
+        previous = self._part_categories.get(part_id)
+        if previous == category:
+            return
+        prices = self._part_prices.get(part_id, {}).values()
+        if previous is not None:
+            for price in prices:
+                self._categories[previous].remove(price)
+        self._part_categories[part_id] = category
+        distribution = self._distribution(category)
+        for price in prices:
+            distribution.add(price, keep_sorted=not self._bulk)
+
+    def upsert_part(self, row: Dict[str, Any]):
+        part_id = str(row['id'])
+        self._set_category(part_id, normalize_category(row.get('category')))
+        in_currency = (row.get('currency') or COST_CURRENCY) == COST_CURRENCY
+        if not in_currency:
+            self.skipped_rows += 1
+        self._set_price(('parts', part_id), part_id, _number(row.get('price')) if in_currency else None)
+
+    def upsert_inventory_item(self, row: Dict[str, Any]):
+        cost_price = _number(row.get('cost_price'))
+        markup = _number(row.get('markup_percentage'))
+        price = cost_price * (1 + (DEFAULT_MARKUP_PERCENTAGE if markup is None else markup) / 100) if cost_price else None
+        part_id = str(row['part_id']) if row.get('part_id') else None
+        self._set_price(('inventory_items', str(row['id'])), part_id, price)
+
+    def upsert_competitor_price(self, row: Dict[str, Any]):
+        in_currency = (row.get('currency') or COST_CURRENCY) == COST_CURRENCY
+        if not in_currency:
+            self.skipped_rows += 1
+        part_id = str(row['part_id']) if row.get('part_id') else None
+        self._set_price(('competitor_prices', str(row['id'])), part_id, _number(row.get('price')) if in_currency else None)
+
+    def upsert_workshop_bay(self, row: Dict[str, Any]):
+        bay_id = str(row['id'])
+        previous = self._bay_rates.pop(bay_id, None)
+        if previous is not None:
+            self._labour.remove(previous)
+        rate = _number(row.get('hourly_rate'))
+        if rate is None or rate <= 0 or row.get('status') == 'unavailable':
+            return
+        if (row.get('currency') or COST_CURRENCY) != COST_CURRENCY:
+            self.skipped_rows += 1
+            return
+        self._bay_rates[bay_id] = rate
+        self._labour.add(rate, keep_sorted=not self._bulk)
+
+    def delete_part(self, part_id: str):
+        """Forget a deleted part; prices other rows still give it leave its category"""
+        self._set_price(('parts', part_id), None, None)
+        category = self._part_categories.pop(part_id, None)
+        if category is not None:
+            for price in self._part_prices.get(part_id, {}).values():
+                self._categories[category].remove(price)
+
+    def delete_workshop_bay(self, bay_id: str):
+        rate = self._bay_rates.pop(bay_id, None)
+        if rate is not None:
+            self._labour.remove(rate)
+
+    def remove_missing(self, ids: Dict[str, Optional[List[str]]]) -> int:
+        """Drop everything from rows not among their table's ids (None = table missing, left alone)"""
+        removed = 0
+        for table, table_ids in ids.items():
+            if table_ids is None:
+                continue
+            existing = set(table_ids)
+            if table == 'parts':
+                gone = [part_id for part_id in self._part_categories if part_id not in existing]
+                for part_id in gone:
+                    self.delete_part(part_id)
+            elif table == 'workshop_bays':
+                gone = [bay_id for bay_id in self._bay_rates if bay_id not in existing]
+                for bay_id in gone:
+                    self.delete_workshop_bay(bay_id)
+            else:
+                gone = [source for source in self._source_parts if source[0] == table and source[1] not in existing]
+                for source in gone:
+                    self._set_price(source, None, None)
+            removed += len(gone)
+        self.rows_removed += removed
+        return removed
+
+    def apply(self, table: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """Apply changed rows of one table"""
+        upsert = {
+            'parts': self.upsert_part,
+            'inventory_items': self.upsert_inventory_item,
+            'competitor_prices': self.upsert_competitor_price,
+            'workshop_bays': self.upsert_workshop_bay
+        }[table]
+        count = 0
+        for row in rows:
+            upsert(row)
+            count += 1
+        self.rows_applied += count
+        return count
+
+    def load(self, tables: Dict[str, List[Dict[str, Any]]]) -> Dict[str, int]:
+        """Replace every distribution with full reads of the price tables"""
+        self._part_categories, self._part_prices, self._source_parts = {}, {}, {}
+        self._categories, self._bay_rates = {}, {}
+        self._labour = PriceDistribution()
+        self._bulk = True
+        try:
+            counts = {table: self.apply(table, rows) for table, rows in tables.items()}
+        finally:
+            self._bulk = False
+            for distribution in (*self._categories.values(), self._labour):
+                distribution.sort()
+        self.full_loads += 1
+        return counts
+
+    def labour_rates(self) -> Tuple[float, float, float]:
+        """(low, median, high) hourly rate"""
+        if not self._labour:
+            return (COST_DEFAULT_LABOUR_RATE,) * 3
+        return (
+            self._labour.quantile(COST_LOW_QUANTILE),
+            self._labour.quantile(0.5),
+            self._labour.quantile(COST_HIGH_QUANTILE)
+        )
+
+    def part_prices(self, category: Optional[str]) -> Optional[Tuple[float, float, float]]:
+        """(low, median, high) price of a part category, None without prices"""
+        distribution = self._categories.get(normalize_category(category)) if category else None
+        if not distribution:
+            return None
+        return (
+            distribution.quantile(COST_LOW_QUANTILE),
+            distribution.quantile(0.5),
+            distribution.quantile(COST_HIGH_QUANTILE)
+        )
+
+    def estimate_repair(self, repair_type: str) -> Dict[str, Any]:
+        """Cost range of one repair type"""
+        hours_low, hours_high = LABOUR_HOURS.get(repair_type, LABOUR_HOURS['inspection'])
+        hours = (hours_low, (hours_low + hours_high) / 2, hours_high)
+        rates = self.labour_rates()
+        category = SYSTEM_CATEGORIES.get(repair_type)
+        parts = self.part_prices(category) or (0.0, 0.0, 0.0)
+        low, median, high = (hour * rate + part for hour, rate, part in zip(hours, rates, parts))
+        return {
+            'repair_type': repair_type,
+            'part_category': category,
+            'parts_priced': bool(self._categories.get(category)) if category else False,
+            'labour_hours': [hours_low, hours_high],
+            'min': round(low, 2),
+            'median': round(median, 2),
+            'max': round(high, 2)
+        }
+
+    def estimate(self, repair_types: Iterable[str]) -> Dict[str, Any]:
+        """Summed cost range of several repairs, with the per-repair breakdown"""
+        self.estimates += 1
+        repairs = [self.estimate_repair(repair_type) for repair_type in dict.fromkeys(repair_types)]
+        return {
+            'min': round(sum(repair['min'] for repair in repairs), 2),
+            'median': round(sum(repair['median'] for repair in repairs), 2),
+            'max': round(sum(repair['max'] for repair in repairs), 2),
+            'currency': COST_CURRENCY,
+            'repairs': repairs
+        }
+
+    def _read(self, full: bool) -> Dict[str, List[Dict[str, Any]]]:
+        return {table: feed.read(self.catalogue, full) for table, feed in self._feeds.items()}
+
+    def _read_ids(self) -> Dict[str, Optional[List[str]]]:
+        return {table: self.catalogue.ids(feed.feed) for table, feed in self._feeds.items()}
+
+    async def refresh(self, full: bool = False) -> Dict[str, int]:
+        """Apply rows changed since the last refresh, or reload everything; returns rows per table
+
+        An incremental refresh also drops deleted rows when the id-set check is due.
+        """
+        if self.catalogue is None:
+            return {}
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            full = full or self._last_full_load is None or (
+                self.full_reload_seconds > 0 and loop.time() - self._last_full_load >= self.full_reload_seconds
+            )
+            changes = await asyncio.to_thread(self._read, full)
+            # Parts come first, so prices of new parts land in their category straight away
+            if full:
+                counts = self.load(changes)
+                self._last_full_load = self._last_reconcile = loop.time()
+                logger.info(
+                    f"Loaded {sum(len(distribution) for distribution in self._categories.values())} prices in "
+                    f"{len(self._categories)} part categories and {len(self._bay_rates)} labour rates "
+                    f"from {self.catalogue.name}"
+                )
+            else:
+                counts = {table: self.apply(table, rows) for table, rows in changes.items()}
+                if self.reconcile_seconds > 0 and loop.time() - self._last_reconcile >= self.reconcile_seconds:
+                    self.remove_missing(await asyncio.to_thread(self._read_ids))
+                    self._last_reconcile = loop.time()
+                    self.reconciles += 1
+            self.refreshes += 1
+            return counts
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.error(f"Cost index refresh failed: {e}")
+
+    async def start(self):
+        """Load the price tables, then keep applying changes in the background"""
+        try:
+            await self.refresh(full=True)
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.error(f"Failed to load price tables, cost estimates use the default labour rate only: {e}")
+        if self._task is None and self.catalogue is not None and self.refresh_seconds > 0:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.catalogue is not None:
+            self.catalogue.close()
+
+    def distributions(self) -> Dict[str, Any]:
+        """min/median/max of every part category and of the labour rates"""
+        return {
+            'currency': COST_CURRENCY,
+            'part_categories': {
+                category: distribution.summary()
+                for category, distribution in sorted(self._categories.items()) if distribution
+            },
+            'labour_rates': self._labour.summary()
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'catalogue': self.catalogue.name if self.catalogue is not None else None,
+            'parts': len(self._part_categories),
+            'prices': sum(len(distribution) for distribution in self._categories.values()),
+            'categories': sum(1 for distribution in self._categories.values() if distribution),
+            'labour_rates': len(self._bay_rates),
+            'cursors': {table: feed.cursor[0] if feed.cursor else None for table, feed in self._feeds.items()},
+            'estimates': self.estimates,
+            'full_loads': self.full_loads,
+            'refreshes': self.refreshes,
+            'rows_applied': self.rows_applied,
+            'rows_removed': self.rows_removed,
+            'reconciles': self.reconciles,
+            'skipped_rows': self.skipped_rows,
+            'refresh_errors': self.refresh_errors
+        }
@@ -0,0 +1,244 @@
+"""
+KC Speedshop ML Diagnostic Service - DTC knowledge base
+Local descriptions, systems, severities and causes of OBD-II trouble codes
+
+The database is a tab-separated file (DTC_DATABASE_PATH, optionally gzipped)
+with one code per line::
+
+    code    make    severity    system    description    causes
+
+``make`` is empty for generic SAE codes and names the manufacturer for
+manufacturer-specific ones (P1xxx and friends mean different things on
+different makes). ``severity`` is an urgency level (low, medium, high,
+critical). ``causes`` are separated by ``;``. A code ending in ``x``
+(``P03xx``, ``P030x``) describes a whole family and answers for codes of
+that family that have no entry of their own.
+
+Codes are held in a dict for exact lookups and in sorted arrays per make,
+so a prefix query (every ``P03`` code) is two bisections and a slice.
+"""
+
+import bisect
+import gzip
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DTC_DATABASE_PATH = os.getenv(
+    "DTC_DATABASE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "dtc_codes.tsv")
+)
+
+# Urgency levels, least to most urgent
+DTC_SEVERITIES = ('low', 'medium', 'high', 'critical')
+
+# Confidence of an issue by how the code was matched
+MATCH_CONFIDENCE = {'exact': 0.95, 'family': 0.6, 'unknown': 0.5}
+
+# Severity of a well-formed code that is in no family either
+UNKNOWN_SEVERITY = 'medium'
+
+DTC_PATTERN = re.compile(r'^[PBCU][0-3][0-9A-F]{3}$')
+
+GENERIC = ''
+
+class DTCError(ValueError):
+    """Malformed DTC database entry"""
+
+def normalize_code(code: str) -> str:
+    return str(code).strip().upper()
+
+def normalize_make(make: Optional[str]) -> str:
+    return make.strip().lower() if make else GENERIC
+
+class DTCEntry:
+    """One code (or code family) of the database"""
+
+    __slots__ = ('code', 'make', 'severity', 'system', 'description', 'causes')
+
+    def __init__(self, code: str, make: str, severity: str, system: str, description: str, causes: Sequence[str]):
+        if severity not in DTC_SEVERITIES:
+            raise DTCError(f"DTC {code}: unknown severity {severity!r}")
+        self.code = code
+        self.make = make
+        self.severity = severity
+        self.system = system
+        self.description = description
+        self.causes = tuple(causes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'code': self.code,
+            'make': self.make or None,
+            'severity': self.severity,
+            'system': self.system,
+            'description': self.description,
+            'causes': list(self.causes)
+        }
+
+class DTCKnowledgeBase:
+    """Exact, family and prefix lookups over the DTC database"""
+
+    def __init__(self, entries: Iterable[DTCEntry], source: str = "<table>"):
+        self.source = source
+        self._exact: Dict[Tuple[str, str], DTCEntry] = {}
+        self._families: Dict[Tuple[str, str], DTCEntry] = {}
+        for entry in entries:
+            family = entry.code.rstrip('X')
+            if family != entry.code and DTC_PATTERN.match(family.ljust(5, '0')):
+                self._families[(family, entry.make)] = entry
+            elif DTC_PATTERN.match(entry.code):
+                self._exact[(entry.code, entry.make)] = entry
+            else:
+                raise DTCError(f"Malformed DTC {entry.code!r}")
+
+        # Sorted code arrays per make for prefix scans
+        self._sorted: Dict[str, Tuple[List[str], List[DTCEntry]]] = {}
+        for (code, make), entry in sorted(self._exact.items()):
+            codes, sorted_entries = self._sorted.setdefault(make, ([], []))
+            codes.append(code)
+            sorted_entries.append(entry)
+        self._family_lengths = sorted({len(prefix) for prefix, _ in self._families}, reverse=True)
+
+        # Metrics
+        self.lookups = 0
+        self.exact_hits = 0
+        self.family_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_file(cls, path: str = DTC_DATABASE_PATH) -> "DTCKnowledgeBase":
+        opener = gzip.open if path.endswith('.gz') else open
+        entries = []
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.rstrip('\n')
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split('\t')
+                if len(fields) != 6:
+                    raise DTCError(f"{path}:{line_number}: expected 6 fields, got {len(fields)}")
+                code, make, severity, system, description, causes = fields
+                entries.append(DTCEntry(
+                    normalize_code(code),
+                    normalize_make(make),
+                    severity,
+                    system,
+                    description,
+                    [cause.strip() for cause in causes.split(';') if cause.strip()]
+                ))
+        knowledge = cls(entries, source=path)
+        logger.info(
+            f"Loaded {len(knowledge._exact)} DTCs and {len(knowledge._families)} code families from {path}"
+        )
+        return knowledge
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def entry(self, code: str, make: Optional[str] = None) -> Optional[DTCEntry]:
+        """Entry of a code itself, manufacturer-specific first (no family fallback)"""
+        code = normalize_code(code)
+        make = normalize_make(make)
+        if make:
+            entry = self._exact.get((code, make))
+            if entry is not None:
+                return entry
+        return self._exact.get((code, GENERIC))
+
+    def family(self, code: str, make: Optional[str] = None) -> Optional[DTCEntry]:
+        """Most specific family entry covering a code"""
+        code = normalize_code(code)
+        make = normalize_make(make)
+        for length in self._family_lengths:
+            prefix = code[:length]
+            if make:
+                entry = self._families.get((prefix, make))
+                if entry is not None:
+                    return entry
+            entry = self._families.get((prefix, GENERIC))
+            if entry is not None:
+                return entry
+        return None
+
+    def lookup(self, code: str, make: Optional[str] = None) -> Dict[str, Any]:
+        """Description of a code, falling back to its family
+
+        ``match`` says how the code was resolved: ``exact``, ``family`` or
+        ``unknown``.
+        """
+        self.lookups += 1
+        code = normalize_code(code)
+        entry = self.entry(code, make)
+        if entry is not None:
+            self.exact_hits += 1
+            return {**entry.to_dict(), 'match': 'exact'}
+
+        entry = self.family(code, make) if DTC_PATTERN.match(code) else None
+        if entry is not None:
+            self.family_hits += 1
+            return {
+                **entry.to_dict(),
+                'code': code,
+                'description': f"{entry.description} (unlisted code)",
+                'match': 'family'
+            }
+
+        self.misses += 1
+        return {
+            'code': code,
+            'make': None,
+            'severity': UNKNOWN_SEVERITY,
+            'system': 'unknown',
+            'description': 'Unrecognised diagnostic code' if DTC_PATTERN.match(code) else 'Malformed diagnostic code',
+            'causes': [],
+            'match': 'unknown'
+        }
+
+    def describe(self, codes: Sequence[str], make: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lookups for a list of codes, duplicates dropped"""
+        return [self.lookup(code, make) for code in dict.fromkeys(normalize_code(code) for code in codes)]
+
+    def covers(self, codes: Sequence[str], make: Optional[str] = None) -> bool:
+        """Whether every code has an entry of its own"""
+        return all(self.entry(code, make) is not None for code in codes)
+
+    def prefix(self, prefix: str, make: Optional[str] = None, limit: Optional[int] = None) -> List[DTCEntry]:
+        """All listed codes starting with a prefix (``P03``, ``P03xx``), in code order
+
+        With a make, its own entries replace generic ones with the same code.
+        """
+        prefix = normalize_code(prefix).rstrip('X')
+        make = normalize_make(make)
+        matches = {entry.code: entry for entry in self._scan(GENERIC, prefix)}
+        if make:
+            matches.update((entry.code, entry) for entry in self._scan(make, prefix))
+        entries = [matches[code] for code in sorted(matches)] if make else list(matches.values())
+        return entries[:limit] if limit is not None else entries
+
+    def _scan(self, make: str, prefix: str) -> List[DTCEntry]:
+        codes, entries = self._sorted.get(make, ((), ()))
+        start = bisect.bisect_left(codes, prefix)
+        end = bisect.bisect_left(codes, prefix + '\uffff', start)
+        return entries[start:end]
+
+    @staticmethod
+    def most_severe(findings: Iterable[Dict[str, Any]]) -> Optional[str]:
+        """Highest severity among lookup results"""
+        ranks = [DTC_SEVERITIES.index(finding['severity']) for finding in findings]
+        return DTC_SEVERITIES[max(ranks)] if ranks else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'source': self.source,
+            'codes': len(self._exact),
+            'families': len(self._families),
+            'makes': sorted(make for make in self._sorted if make),
+            'lookups': self.lookups,
+            'exact_hits': self.exact_hits,
+            'family_hits': self.family_hits,
+            'misses': self.misses
+        }
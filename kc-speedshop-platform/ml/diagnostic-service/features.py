@@ -0,0 +1,118 @@
+"""
+KC Speedshop ML Diagnostic Service - Feature extraction
+Compiled OBD feature schema writing straight into float32 arrays
+"""
+
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+# Width of the engine_diagnostics model input; unmapped columns stay zero
+NUM_FEATURES = 20
+
+# Standard OBD-II PIDs in model column order
+OBD_FEATURE_PIDS = (
+    'RPM',            # engine_rpm
+    'SPEED',          # vehicle_speed
+    'THROTTLE_POS',   # throttle_position
+    'ENGINE_LOAD',    # engine_load
+    'COOLANT_TEMP',   # coolant_temp
+    'INTAKE_TEMP',    # intake_temp
+    'FUEL_PRESSURE',  # fuel_pressure
+    'MAF',            # maf_airflow
+    'O2_SENSOR'       # o2_sensor
+)
+
+class FeatureSchema:
+    """Maps PID names to fixed column indices of a model input row
+
+    The mapping is resolved once; extraction only does dict lookups and
+    writes into a preallocated row or (N, width) matrix. Non-numeric and
+    missing values are written as 0.0.
+    """
+
+    def __init__(self, pids: Sequence[str], width: int = NUM_FEATURES, dtype=np.float32):
+        if len(pids) > width:
+            raise ValueError(f"{len(pids)} PIDs do not fit into {width} feature columns")
+        if len(set(pids)) != len(pids):
+            raise ValueError("Feature schema PIDs must be unique")
+        self.pids = tuple(pids)
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.columns: Dict[str, int] = {pid: index for index, pid in enumerate(self.pids)}
+        self._items = tuple(self.columns.items())
+
+    def column(self, pid: str) -> int:
+        """Column index of a PID"""
+        return self.columns[pid]
+
+    def empty(self, rows: Optional[int] = None) -> np.ndarray:
+        """A zeroed row, or an (N, width) matrix when rows is given"""
+        shape = self.width if rows is None else (rows, self.width)
+        return np.zeros(shape, dtype=self.dtype)
+
+    def extract_row(self, obd_data: Mapping[str, Any], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Write one OBD snapshot into a (width,) row"""
+        if out is None:
+            out = np.zeros(self.width, dtype=self.dtype)
+        else:
+            out[:] = 0
+        for pid, index in self._items:
+            value = obd_data.get(pid)
+            if isinstance(value, (int, float)):
+                out[index] = value
+        return out
+
+    def extract_matrix(self, obd_batch: Sequence[Mapping[str, Any]], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Convert N OBD snapshots into an (N, width) matrix in one call
+
+        Each PID column is filled with a single fromiter pass over the batch
+        rather than writing element by element.
+        """
+        rows = len(obd_batch)
+        if out is None:
+            out = np.zeros((rows, self.width), dtype=self.dtype)
+        else:
+            if out.shape != (rows, self.width):
+                raise ValueError(f"Output matrix has shape {out.shape}, expected {(rows, self.width)}")
+            out[:, len(self.pids):] = 0
+
+        for pid, index in self._items:
+            out[:, index] = np.fromiter(
+                (
+                    value if isinstance(value := obd_data.get(pid), (int, float)) else 0.0
+                    for obd_data in obd_batch
+                ),
+                dtype=self.dtype,
+                count=rows
+            )
+        return out
+
+    def extract_columns(
+        self,
+        columns: Mapping[str, np.ndarray],
+        rows: int,
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Convert per-PID arrays (e.g. recorded telemetry) into an (N, width) matrix
+
+        Absent PIDs and NaN samples become 0.0, as a missing key does in
+        extract_row, so history rows score exactly like live snapshots.
+        """
+        if out is None:
+            out = np.zeros((rows, self.width), dtype=self.dtype)
+        else:
+            if out.shape != (rows, self.width):
+                raise ValueError(f"Output matrix has shape {out.shape}, expected {(rows, self.width)}")
+            out[:] = 0
+
+        for pid, index in self._items:
+            values = columns.get(pid)
+            if values is not None:
+                column = out[:, index]
+                column[:] = values
+                column[np.isnan(column)] = 0.0
+        return out
+
+# Schema of the engine_diagnostics model
+ENGINE_FEATURE_SCHEMA = FeatureSchema(OBD_FEATURE_PIDS, width=NUM_FEATURES)
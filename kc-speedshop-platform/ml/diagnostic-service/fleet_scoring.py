@@ -0,0 +1,486 @@
+"""
+KC Speedshop ML Diagnostic Service - Fleet scoring
+Predictive-maintenance re-scoring of every vehicle from its recorded telemetry
+
+Usage:
+    python fleet_scoring.py [--window-hours 24] [--workers 8] [--top 20]
+        [--output data/fleet_scores/manual.json]
+
+Vehicles are split into shards and scored by a spawn-based process pool.
+Each worker loads the engine_diagnostics version that was active when the
+run started, memory-maps the telemetry segments itself and scores rows in
+large batches with the same feature schema and model pass as
+analyze_obd_data. Per-vehicle aggregates are reduced with bincount, so no
+per-row Python work is done. Shards are small and handed out on demand,
+which keeps all workers busy when vehicles differ in size.
+
+The service runs the same job nightly (FLEET_SCORING_HOUR_UTC) and serves
+the latest ranking. Under several uvicorn workers only the one holding the
+scheduler lock in FLEET_SCORING_OUTPUT_DIR runs the schedule (another takes
+over if it exits), and a run lock keeps manual refreshes from overlapping.
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import IO, Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from features import ENGINE_FEATURE_SCHEMA
+from model_registry import (
+    DIAGNOSTIC_CLASSES,
+    INFERENCE_BACKEND,
+    MODEL_REGISTRY_DIR,
+    ModelBundle,
+    ModelRegistry
+)
+from telemetry_store import TELEMETRY_STORE_DIR, TelemetryStore
+
+logger = logging.getLogger(__name__)
+
+FLEET_SCORING_WINDOW_HOURS = float(os.getenv("FLEET_SCORING_WINDOW_HOURS", "24"))
+FLEET_SCORING_WORKERS = int(os.getenv("FLEET_SCORING_WORKERS", "0"))  # 0 = one per CPU
+FLEET_SCORING_SHARD_VEHICLES = int(os.getenv("FLEET_SCORING_SHARD_VEHICLES", "16"))
+FLEET_SCORING_BATCH_ROWS = int(os.getenv("FLEET_SCORING_BATCH_ROWS", "131072"))
+# UTC hour of the nightly run (negative disables the schedule)
+FLEET_SCORING_HOUR_UTC = int(os.getenv("FLEET_SCORING_HOUR_UTC", "2"))
+FLEET_SCORING_OUTPUT_DIR = os.getenv("FLEET_SCORING_OUTPUT_DIR", "data/fleet_scores")
+
+LATEST_FILE = "latest.json"
+SCHEDULER_LOCK_FILE = ".scheduler.lock"
+RUN_LOCK_FILE = ".run.lock"
+
+# Each worker is one core's worth of work; multithreaded BLAS would oversubscribe
+WORKER_THREAD_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
+
+# Share of rows predicted critical / maintenance_required that sets each urgency level
+CRITICAL_SHARE_THRESHOLD = 0.05
+HIGH_MAINTENANCE_SHARE_THRESHOLD = 0.5
+MEDIUM_MAINTENANCE_SHARE_THRESHOLD = 0.1
+
+URGENCY_ORDER = {'critical': 3, 'high': 2, 'medium': 1, 'low': 0}
+
+MAINTENANCE_CLASS = DIAGNOSTIC_CLASSES.index('maintenance_required')
+CRITICAL_CLASS = DIAGNOSTIC_CLASSES.index('critical')
+
+class FleetScoringError(Exception):
+    """Raised when the fleet cannot be scored (e.g. no published model)"""
+
+# Per-process worker state, set by _init_worker
+_bundle: Optional[ModelBundle] = None
+_store: Optional[TelemetryStore] = None
+
+def _init_worker(store_root: str, model_root: str, backend: str, version: str):
+    global _bundle, _store
+    _bundle = ModelRegistry(root=model_root, backend=backend).load_version(version)
+    _store = TelemetryStore(root=store_root)
+
+def _init_pool_worker(store_root: str, model_root: str, backend: str, version: str):
+    # Only this worker's environment is touched; TensorFlow reads it when the model loads
+    for name in WORKER_THREAD_ENV:
+        os.environ.setdefault(name, "1")
+    try:
+        from threadpoolctl import threadpool_limits
+        # NumPy's BLAS is already loaded, so its pool is resized in place
+        threadpool_limits(limits=1)
+    except ImportError:
+        pass
+    _init_worker(store_root, model_root, backend, version)
+
+def try_lock(path: str) -> Optional[IO]:
+    """Open and exclusively flock a file, or None if another process holds it"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def urgency_level(critical_share: float, maintenance_share: float) -> str:
+    if critical_share >= CRITICAL_SHARE_THRESHOLD:
+        return 'critical'
+    if critical_share > 0 or maintenance_share >= HIGH_MAINTENANCE_SHARE_THRESHOLD:
+        return 'high'
+    if maintenance_share >= MEDIUM_MAINTENANCE_SHARE_THRESHOLD:
+        return 'medium'
+    return 'low'
+
+class _ShardAccumulator:
+    """Per-vehicle sums over every scored row of a shard"""
+
+    def __init__(self, vehicles: int, batch_rows: int):
+        classes = len(DIAGNOSTIC_CLASSES)
+        self.probability_sums = np.zeros((vehicles, classes), dtype=np.float64)
+        self.class_counts = np.zeros((vehicles, classes), dtype=np.int64)
+        self.peak_critical = np.zeros(vehicles, dtype=np.float64)
+        self.rows = np.zeros(vehicles, dtype=np.int64)
+        self.matrix = ENGINE_FEATURE_SCHEMA.empty(batch_rows)
+        self.owners = np.empty(batch_rows, dtype=np.intp)
+        self.filled = 0
+        self.model_seconds = 0.0
+
+    def add(self, vehicle: int, columns: Dict[str, np.ndarray], rows: int):
+        ENGINE_FEATURE_SCHEMA.extract_columns(columns, rows, out=self.matrix[self.filled:self.filled + rows])
+        self.owners[self.filled:self.filled + rows] = vehicle
+        self.filled += rows
+
+    def score(self):
+        """Score the buffered rows in one model pass and fold them into the sums"""
+        if not self.filled:
+            return
+        started = time.perf_counter()
+        probabilities = _bundle.predict(self.matrix[:self.filled])
+        self.model_seconds += time.perf_counter() - started
+        owners = self.owners[:self.filled]
+        vehicles = len(self.rows)
+        predicted = np.argmax(probabilities, axis=1)
+        for index in range(len(DIAGNOSTIC_CLASSES)):
+            self.probability_sums[:, index] += np.bincount(owners, weights=probabilities[:, index], minlength=vehicles)
+            self.class_counts[:, index] += np.bincount(owners[predicted == index], minlength=vehicles)
+        np.maximum.at(self.peak_critical, owners, probabilities[:, CRITICAL_CLASS])
+        self.rows += np.bincount(owners, minlength=vehicles)
+        self.filled = 0
+
+def score_shard(vehicle_ids: Sequence[str], start: float, end: float, batch_rows: int) -> Dict[str, Any]:
+    """Score every recorded frame of some vehicles in [start, end); runs in a worker"""
+    started = time.perf_counter()
+    accumulator = _ShardAccumulator(len(vehicle_ids), batch_rows)
+    first_ms: List[Optional[int]] = [None] * len(vehicle_ids)
+    last_ms: List[Optional[int]] = [None] * len(vehicle_ids)
+
+    for vehicle, vehicle_id in enumerate(vehicle_ids):
+        history = _store.read(vehicle_id, start, end)
+        for chunk in history.chunks:
+            if first_ms[vehicle] is None:
+                first_ms[vehicle] = int(chunk.timestamps[0])
+            last_ms[vehicle] = int(chunk.timestamps[-1])
+            # Split chunks so every model pass sees a full batch
+            position = 0
+            while position < len(chunk):
+                rows = min(len(chunk) - position, batch_rows - accumulator.filled)
+                accumulator.add(
+                    vehicle,
+                    {pid: values[position:position + rows] for pid, values in chunk.columns.items()},
+                    rows
+                )
+                position += rows
+                if accumulator.filled == batch_rows:
+                    accumulator.score()
+    accumulator.score()
+
+    vehicles = []
+    for vehicle, vehicle_id in enumerate(vehicle_ids):
+        rows = int(accumulator.rows[vehicle])
+        if not rows:
+            continue
+        mean_probabilities = accumulator.probability_sums[vehicle] / rows
+        shares = accumulator.class_counts[vehicle] / rows
+        vehicles.append({
+            'vehicle_id': vehicle_id,
+            'rows': rows,
+            'first_timestamp_ms': first_ms[vehicle],
+            'last_timestamp_ms': last_ms[vehicle],
+            'prediction': DIAGNOSTIC_CLASSES[int(np.argmax(mean_probabilities))],
+            'mean_probabilities': dict(zip(DIAGNOSTIC_CLASSES, mean_probabilities.round(6).tolist())),
+            'class_shares': dict(zip(DIAGNOSTIC_CLASSES, shares.round(6).tolist())),
+            'peak_critical_probability': round(float(accumulator.peak_critical[vehicle]), 6),
+            # Expected severity per row: maintenance counts half, critical in full
+            'urgency_score': round(float(0.5 * mean_probabilities[MAINTENANCE_CLASS] + mean_probabilities[CRITICAL_CLASS]), 6),
+            'urgency_level': urgency_level(float(shares[CRITICAL_CLASS]), float(shares[MAINTENANCE_CLASS]))
+        })
+
+    return {
+        'vehicles': vehicles,
+        'rows': int(accumulator.rows.sum()),
+        'seconds': time.perf_counter() - started,
+        'model_seconds': accumulator.model_seconds
+    }
+
+def rank_vehicles(vehicles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Most urgent first: by urgency level, then urgency score"""
+    ranked = sorted(
+        vehicles,
+        key=lambda vehicle: (URGENCY_ORDER[vehicle['urgency_level']], vehicle['urgency_score']),
+        reverse=True
+    )
+    for rank, vehicle in enumerate(ranked, start=1):
+        vehicle['rank'] = rank
+    return ranked
+
+def _score_in_pool(shards, start: float, end: float, batch_rows: int, workers: int, initargs) -> List[Dict[str, Any]]:
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_pool_worker,
+        initargs=initargs
+    ) as pool:
+        futures = [pool.submit(score_shard, shard, start, end, batch_rows) for shard in shards]
+        return [future.result() for future in futures]
+
+def run_fleet_scoring(
+    store_root: str = TELEMETRY_STORE_DIR,
+    window_hours: float = FLEET_SCORING_WINDOW_HOURS,
+    workers: int = FLEET_SCORING_WORKERS,
+    shard_vehicles: int = FLEET_SCORING_SHARD_VEHICLES,
+    batch_rows: int = FLEET_SCORING_BATCH_ROWS,
+    model_root: str = MODEL_REGISTRY_DIR,
+    backend: str = INFERENCE_BACKEND,
+    end: Optional[float] = None
+) -> Dict[str, Any]:
+    """Score every vehicle's telemetry of the last window_hours and rank the fleet"""
+    started = time.perf_counter()
+    registry = ModelRegistry(root=model_root, backend=backend)
+    version = registry.resolve_active_version()
+    if version is None:
+        # Workers would each build a different random placeholder
+        raise FleetScoringError(f"No engine_diagnostics version published under {registry.model_dir}")
+
+    end = time.time() if end is None else end
+    start = end - window_hours * 3600
+    vehicle_ids = TelemetryStore(root=store_root).vehicles()
+    shard_vehicles = max(1, shard_vehicles)
+    shards = [vehicle_ids[i:i + shard_vehicles] for i in range(0, len(vehicle_ids), shard_vehicles)]
+    workers = min(workers or os.cpu_count() or 1, max(1, len(shards)))
+    initargs = (store_root, model_root, backend, version)
+
+    if workers == 1:
+        _init_worker(*initargs)
+        results = [score_shard(shard, start, end, batch_rows) for shard in shards]
+    else:
+        results = _score_in_pool(shards, start, end, batch_rows, workers, initargs)
+
+    wall_seconds = time.perf_counter() - started
+    rows = sum(result['rows'] for result in results)
+    worker_seconds = sum(result['seconds'] for result in results)
+    ranked = rank_vehicles([vehicle for result in results for vehicle in result['vehicles']])
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'model_version': version,
+        'window_start': datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        'window_end': datetime.fromtimestamp(end, timezone.utc).isoformat(),
+        'vehicles_scored': len(ranked),
+        'vehicles_without_data': len(vehicle_ids) - len(ranked),
+        'rows': rows,
+        'workers': workers,
+        'shards': len(shards),
+        'wall_seconds': round(wall_seconds, 3),
+        'rows_per_second': round(rows / wall_seconds, 1) if wall_seconds else 0.0,
+        'rows_per_worker_second': round(rows / worker_seconds, 1) if worker_seconds else 0.0,
+        'model_seconds': round(sum(result['model_seconds'] for result in results), 3),
+        'urgency_counts': {
+            level: sum(1 for vehicle in ranked if vehicle['urgency_level'] == level) for level in URGENCY_ORDER
+        },
+        'ranking': ranked
+    }
+
+def write_report(report: Dict[str, Any], output_dir: str = FLEET_SCORING_OUTPUT_DIR, path: Optional[str] = None) -> str:
+    """Write a report (and latest.json, when written to output_dir) atomically"""
+    if path is None:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        path = os.path.join(output_dir, f"fleet-{stamp}.json")
+        targets = [path, os.path.join(output_dir, LATEST_FILE)]
+    else:
+        targets = [path]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for target in targets:
+        tmp_path = f"{target}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+        os.replace(tmp_path, target)
+    return path
+
+class FleetScoringJob:
+    """Nightly fleet re-scoring inside the service"""
+
+    def __init__(
+        self,
+        telemetry_store: TelemetryStore,
+        hour_utc: int = FLEET_SCORING_HOUR_UTC,
+        output_dir: str = FLEET_SCORING_OUTPUT_DIR,
+        model_root: str = MODEL_REGISTRY_DIR,
+        backend: str = INFERENCE_BACKEND
+    ):
+        self.telemetry_store = telemetry_store
+        self.hour_utc = hour_utc
+        self.output_dir = output_dir
+        self.model_root = model_root
+        self.backend = backend
+        self._task: Optional[asyncio.Task] = None
+        self._running: Optional[asyncio.Task] = None
+        self._latest: Optional[Dict[str, Any]] = None
+        self._scheduler_lock: Optional[IO] = None
+
+        # Metrics
+        self.runs_completed = 0
+        self.runs_failed = 0
+        self.last_error: Optional[str] = None
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """Most recent report, from this process or the last written latest.json"""
+        if self._latest is None:
+            try:
+                with open(os.path.join(self.output_dir, LATEST_FILE), encoding='utf-8') as f:
+                    self._latest = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+        return self._latest
+
+    @property
+    def running(self) -> bool:
+        return self._running is not None and not self._running.done()
+
+    def trigger(self) -> bool:
+        """Start a run now unless one is in progress; returns whether one was started"""
+        if self.running:
+            return False
+        self._running = asyncio.create_task(self.run())
+        return True
+
+    def _score_exclusively(self) -> Optional[Dict[str, Any]]:
+        """Score and write a report unless another process is already scoring; blocking"""
+        lock_file = try_lock(os.path.join(self.output_dir, RUN_LOCK_FILE))
+        if lock_file is None:
+            return None
+        with lock_file:
+            report = run_fleet_scoring(
+                store_root=self.telemetry_store.root,
+                model_root=self.model_root,
+                backend=self.backend
+            )
+            write_report(report, self.output_dir)
+        return report
+
+    async def run(self) -> Optional[Dict[str, Any]]:
+        # Buffered frames are only visible to the workers once written
+        await asyncio.to_thread(self.telemetry_store.flush)
+        try:
+            report = await asyncio.to_thread(self._score_exclusively)
+        except Exception as e:
+            self.runs_failed += 1
+            self.last_error = str(e)
+            logger.error(f"Fleet scoring failed: {e}")
+            return None
+        if report is None:
+            logger.info("Fleet scoring already running in another process, skipping")
+            return None
+        self._latest = report
+        self.runs_completed += 1
+        logger.info(
+            f"Fleet scoring scored {report['vehicles_scored']} vehicles, {report['rows']} rows "
+            f"in {report['wall_seconds']}s ({report['rows_per_second']:.0f} rows/s, {report['workers']} workers)"
+        )
+        return report
+
+    def seconds_until_next_run(self, now: Optional[datetime] = None) -> float:
+        now = now or datetime.now(timezone.utc)
+        next_run = now.replace(hour=self.hour_utc, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def start(self):
+        if self.hour_utc < 0 or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._schedule())
+        logger.info(f"Fleet scoring scheduled daily at {self.hour_utc:02d}:00 UTC")
+
+    async def stop(self):
+        for task in (self._task, self._running):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        if self._scheduler_lock is not None:
+            self._scheduler_lock.close()
+            self._scheduler_lock = None
+
+    @property
+    def scheduler(self) -> bool:
+        """Whether this process runs the nightly schedule"""
+        return self._scheduler_lock is not None
+
+    async def _schedule(self):
+        while True:
+            await asyncio.sleep(self.seconds_until_next_run())
+            # Every worker wakes up; the scheduler lock holder runs, the others
+            # keep retrying so one takes over if it exits
+            if self._scheduler_lock is None:
+                self._scheduler_lock = try_lock(os.path.join(self.output_dir, SCHEDULER_LOCK_FILE))
+            if self._scheduler_lock is None or not self.trigger():
+                continue
+            await asyncio.shield(self._running)
+
+    def stats(self) -> Dict[str, Any]:
+        latest = self.latest()
+        return {
+            'schedule_hour_utc': self.hour_utc if self.hour_utc >= 0 else None,
+            'scheduler': self.scheduler,
+            'running': self.running,
+            'runs_completed': self.runs_completed,
+            'runs_failed': self.runs_failed,
+            'last_error': self.last_error,
+            'last_run': {
+                key: latest[key] for key in (
+                    'generated_at', 'model_version', 'vehicles_scored', 'rows',
+                    'workers', 'wall_seconds', 'rows_per_second', 'urgency_counts'
+                )
+            } if latest else None
+        }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-score every vehicle from recorded telemetry")
+    parser.add_argument('--store', default=TELEMETRY_STORE_DIR, help="Telemetry store root")
+    parser.add_argument('--models', default=MODEL_REGISTRY_DIR, help="Model registry root")
+    parser.add_argument('--backend', choices=('tensorflow', 'numpy'), default=INFERENCE_BACKEND)
+    parser.add_argument('--window-hours', type=float, default=FLEET_SCORING_WINDOW_HOURS)
+    parser.add_argument('--workers', type=int, default=FLEET_SCORING_WORKERS, help="0 = one per CPU")
+    parser.add_argument('--shard-vehicles', type=int, default=FLEET_SCORING_SHARD_VEHICLES)
+    parser.add_argument('--batch-rows', type=int, default=FLEET_SCORING_BATCH_ROWS)
+    parser.add_argument('--top', type=int, default=20, help="Vehicles to print")
+    parser.add_argument('--output', default=None, help=f"Report path (default: a new file in {FLEET_SCORING_OUTPUT_DIR})")
+    args = parser.parse_args(argv)
+
+    try:
+        report = run_fleet_scoring(
+            store_root=args.store,
+            window_hours=args.window_hours,
+            workers=args.workers,
+            shard_vehicles=args.shard_vehicles,
+            batch_rows=args.batch_rows,
+            model_root=args.models,
+            backend=args.backend
+        )
+    except FleetScoringError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    path = write_report(report, path=args.output)
+
+    print(f"model {report['model_version']}, {report['vehicles_scored']} vehicles, {report['rows']} rows, "
+          f"{report['workers']} workers, {report['wall_seconds']:.2f}s")
+    print(f"throughput: {report['rows_per_second']:.0f} rows/s overall, "
+          f"{report['rows_per_worker_second']:.0f} rows/s per worker")
+    print(f"urgency: {', '.join(f'{level} {count}' for level, count in report['urgency_counts'].items())}")
+    for vehicle in report['ranking'][:args.top]:
+        print(f"{vehicle['rank']:>4}. {vehicle['vehicle_id']:<24} {vehicle['urgency_level']:<9} "
+              f"score {vehicle['urgency_score']:.3f}  critical rows {vehicle['class_shares']['critical']:.1%}  "
+              f"rows {vehicle['rows']}")
+    print(f"report: {path}")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+KC Speedshop ML Diagnostic Service - Inference executor
+Runs CPU-bound model work off the asyncio event loop
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_MODES = ('thread', 'process')
+
+def _ping() -> bool:
+    return True
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference executor already has max_pending jobs queued"""
+
+class InferenceExecutor:
+    """Bounded thread or process pool for model inference
+
+    In ``process`` mode every worker runs ``initializer`` once at start-up so
+    models are preloaded before the first job arrives, and submitted callables
+    must be picklable module-level functions.
+    """
+
+    def __init__(
+        self,
+        mode: str = "thread",
+        max_workers: int = 1,
+        max_pending: int = 32,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: Tuple = ()
+    ):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown inference executor mode '{mode}', expected one of {EXECUTOR_MODES}")
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.initializer = initializer
+        self.initargs = initargs
+
+        self._pool: Optional[Executor] = None
+        self._pending = 0
+
+        # Metrics
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.jobs_cancelled = 0
+        self.jobs_rejected = 0
+
+    def start(self):
+        """Create the worker pool"""
+        if self._pool is not None:
+            return
+        if self.mode == "process":
+            # spawn avoids forking a process that already holds TensorFlow state
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+                initargs=self.initargs
+            )
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference"
+            )
+        logger.info(f"Inference executor started (mode={self.mode}, workers={self.max_workers}, max_pending={self.max_pending})")
+
+    async def warm_up(self):
+        """Start the workers now so process-mode model loading happens before traffic"""
+        if self._pool is None:
+            self.start()
+        await asyncio.wrap_future(self._pool.submit(_ping))
+
+    async def shutdown(self):
+        """Stop accepting work and wait for running jobs to finish"""
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        await asyncio.get_running_loop().run_in_executor(None, lambda: pool.shutdown(wait=True, cancel_futures=True))
+        logger.info("Inference executor stopped")
+
+    async def restart(self):
+        """Replace the pool, e.g. so process workers pick up newly loaded models
+
+        New jobs go to the fresh pool as soon as it is created; jobs already
+        submitted to the old pool still run to completion there.
+        """
+        old_pool, self._pool = self._pool, None
+        await self.warm_up()
+        if old_pool is not None:
+            await asyncio.get_running_loop().run_in_executor(None, lambda: old_pool.shutdown(wait=True))
+        logger.info("Inference executor restarted")
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(*args) on the pool, rejecting work beyond max_pending
+
+        Cancelling the awaiting coroutine cancels the job if it has not
+        started yet; a job that is already running is left to finish and
+        its result discarded.
+        """
+        if self._pool is None:
+            self.start()
+        if self._pending >= self.max_pending:
+            self.jobs_rejected += 1
+            raise InferenceQueueFull(f"Inference queue is full ({self._pending} pending jobs)")
+
+        self._pending += 1
+        try:
+            job = self._pool.submit(fn, *args)
+        except Exception:
+            self._pending -= 1
+            raise
+        try:
+            result = await asyncio.wrap_future(job)
+            self.jobs_completed += 1
+            return result
+        except asyncio.CancelledError:
+            job.cancel()
+            self.jobs_cancelled += 1
+            raise
+        except Exception:
+            self.jobs_failed += 1
+            raise
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Executor occupancy and job counters"""
+        return {
+            'mode': self.mode,
+            'workers': self.max_workers,
+            'running': self._pool is not None,
+            'pending_jobs': self._pending,
+            'max_pending': self.max_pending,
+            'jobs_completed': self.jobs_completed,
+            'jobs_failed': self.jobs_failed,
+            'jobs_cancelled': self.jobs_cancelled,
+            'jobs_rejected': self.jobs_rejected
+        }
@@ -6,23 +6,48 @@ FastAPI-based service for automotive diagnostics with X.AI integration
 import os
 import json
 import asyncio
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, AsyncIterator, Tuple
 from datetime import datetime, timedelta
 import logging
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field
-import httpx
+from pydantic import BaseModel, Field, ValidationError, model_validator
 import numpy as np
-import pandas as pd
-import tensorflow as tf
-from sklearn.preprocessing import StandardScaler
 import uvicorn
 
+from batching import MicroBatcher
+from inference import InferenceExecutor, InferenceQueueFull
+from xai_client import XAIClient
+from caching import MemoryTTLCache, create_analysis_cache, make_analysis_cache_key
+from cost_estimation import LABOUR_HOURS, RULE_REPAIR_TYPES, CostIndex
+from dtc_knowledge import MATCH_CONFIDENCE, DTCKnowledgeBase
+from features import ENGINE_FEATURE_SCHEMA
+from fleet_scoring import URGENCY_ORDER, FleetScoringJob
+from metrics import (
+    METRICS_PATH,
+    XAI_TIMEOUTS,
+    InFlightMiddleware,
+    mark_process_dead,
+    record_model_version,
+    render_metrics,
+    stage_timer
+)
+from model_registry import ModelBundle
+from parts_fitment import PARTS_RECOMMENDATION_LIMIT, RULE_CATEGORIES, SYSTEM_CATEGORIES, PartsFitmentIndex
+from rule_engine import RuleEngine
+from scoring import load_ml_models_sync, ml_model_label, ml_models, model_registry, score_feature_matrix
+from recall_index import RECALL_RESULT_LIMIT, RecallIndex
+from persistence import HISTORY_PAGE_MAX, WriteBehindStore, decode_cursor, new_diagnosis_id
+from telemetry import TelemetryHub
+from telemetry_rollup import RAW_TIER, ROLLUP_STATS, TelemetryRollups
+from telemetry_store import TelemetryStore
+from vin_decoder import VINDecoder
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -30,16 +55,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Model years accepted for a vehicle, given or decoded from the VIN
+VEHICLE_YEAR_MIN = 1980
+VEHICLE_YEAR_MAX = 2030
+
 # Pydantic models
 class DiagnosticRequest(BaseModel):
     vehicle_id: str = Field(..., description="Unique vehicle identifier")
     vin: str = Field(..., description="Vehicle Identification Number")
     obd_data: Dict[str, Any] = Field(..., description="OBD2 diagnostic data")
     symptoms: List[str] = Field(default=[], description="Reported symptoms")
-    make: str = Field(..., description="Vehicle make")
-    model: str = Field(..., description="Vehicle model")
-    year: int = Field(..., ge=1980, le=2030, description="Vehicle year")
+    make: Optional[str] = Field(None, description="Vehicle make (decoded from the VIN if omitted)")
+    model: Optional[str] = Field(None, description="Vehicle model (decoded from the VIN if omitted)")
+    year: Optional[int] = Field(
+        None, ge=VEHICLE_YEAR_MIN, le=VEHICLE_YEAR_MAX, description="Vehicle year (decoded from the VIN if omitted)"
+    )
+    engine: Optional[str] = Field(None, description="Engine (decoded from the VIN if omitted)")
     mileage: Optional[int] = Field(None, description="Vehicle mileage")
+    
+    def fill_from_vin(self, decoder: VINDecoder) -> "DiagnosticRequest":
+        """Fill omitted vehicle fields from the local VIN tables; ValueError if they stay incomplete"""
+        if self.make and self.model and self.year and self.engine:
+            return self
+        decoded = decoder.decode(self.vin)
+        self.make = self.make or decoded['make']
+        self.model = self.model or decoded['model']
+        self.year = self.year or decoded['year']
+        self.engine = self.engine or decoded['engine']
+        missing = [field for field in ('make', 'model', 'year') if not getattr(self, field)]
+        if missing:
+            reason = "; ".join(decoded['errors']) or "not in the local VIN tables"
+            raise ValueError(f"{', '.join(missing)} not given and VIN {decoded['vin']} could not be decoded ({reason})")
+        if not VEHICLE_YEAR_MIN <= self.year <= VEHICLE_YEAR_MAX:
+            raise ValueError(f"VIN {decoded['vin']} decodes to year {self.year}, outside {VEHICLE_YEAR_MIN}-{VEHICLE_YEAR_MAX}")
+        return self
+    
+    @model_validator(mode='wrap')
+    @classmethod
+    def time_validation(cls, data: Any, handler) -> "DiagnosticRequest":
+        """Observe the validation stage"""
+        with stage_timer('validation'):
+            return handler(data)
 
 class DiagnosticResult(BaseModel):
     vehicle_id: str
@@ -48,10 +104,37 @@ class DiagnosticResult(BaseModel):
     primary_issues: List[Dict[str, Any]]
     recommendations: List[Dict[str, Any]]
     confidence_score: float = Field(..., ge=0.0, le=1.0)
-    estimated_cost: Optional[Dict[str, float]] = None
-    urgency_level: str = Field(..., regex="^(low|medium|high|critical)$")
+    estimated_cost: Optional[Dict[str, Any]] = None
+    urgency_level: str = Field(..., pattern="^(low|medium|high|critical)$")
     ai_analysis: Optional[str] = None
+    ai_analysis_status: str = Field("unavailable", pattern="^(complete|pending|unavailable)$")
     next_maintenance: Optional[datetime] = None
+    recalls: List[Dict[str, Any]] = Field(default=[], description="Recall campaigns covering the vehicle")
+
+class BatchDiagnosticRequest(BaseModel):
+    # Items are validated one by one so a single bad payload cannot fail the batch
+    requests: List[Dict[str, Any]] = Field(..., description="Diagnostic requests to score in one pass")
+
+class VINBatchRequest(BaseModel):
+    vins: List[str] = Field(..., description="VINs to decode, e.g. a fleet import")
+    remote: bool = Field(False, description="Complete VINs the local tables cannot decode with the remote decoder")
+
+class BatchItemResult(BaseModel):
+    index: int
+    vehicle_id: Optional[str] = None
+    result: Optional[DiagnosticResult] = None
+    error: Optional[str] = None
+
+class BatchDiagnosticResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+
+class DiagnosticHistoryPage(BaseModel):
+    vehicle_id: str
+    results: List[DiagnosticResult]
+    next_cursor: Optional[str] = None
 
 class HealthCheck(BaseModel):
     status: str
@@ -59,9 +142,47 @@ class HealthCheck(BaseModel):
     version: str
     uptime: float
 
-# Global variables for ML models
-ml_models = {}
-scaler = None
+# Upper bound on the number of requests accepted by /diagnostic/analyze-batch
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "5000"))
+# Upper bound on the number of VINs accepted by /vin/decode-batch
+VIN_BATCH_MAX_SIZE = int(os.getenv("VIN_BATCH_MAX_SIZE", "100000"))
+
+# Micro-batching of concurrent analyze_obd_data calls
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "64"))
+INFERENCE_BATCH_MAX_WAIT_MS = float(os.getenv("INFERENCE_BATCH_MAX_WAIT_MS", "5"))
+INFERENCE_QUEUE_MAX_ROWS = int(os.getenv("INFERENCE_QUEUE_MAX_ROWS", "4096"))
+
+# Executor for CPU-bound model work ("thread" or "process")
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_MAX_PENDING_JOBS = int(os.getenv("INFERENCE_MAX_PENDING_JOBS", "32"))
+
+# Critical rule verdicts are returned without waiting for the model
+RULES_SHORT_CIRCUIT = os.getenv("RULES_SHORT_CIRCUIT", "true").lower() in ("1", "true", "yes")
+
+# Requests whose DTCs are all in the local database and that report no
+# symptoms are answered without calling X.AI
+XAI_SKIP_KNOWN_DTCS = os.getenv("XAI_SKIP_KNOWN_DTCS", "true").lower() in ("1", "true", "yes")
+
+# Per-stage deadlines of the analysis pipeline, measured from request start
+ML_STAGE_DEADLINE_SECONDS = float(os.getenv("ML_STAGE_DEADLINE_SECONDS", "5"))
+XAI_STAGE_DEADLINE_SECONDS = float(os.getenv("XAI_STAGE_DEADLINE_SECONDS", "8"))
+
+# How often long-running handlers check whether the client is still connected
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.25"))
+
+# Read-through caches for stored diagnoses and vehicle history pages
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+# The first page changes with every new diagnosis; later pages only list older results
+HISTORY_FIRST_PAGE_TTL_SECONDS = float(os.getenv("HISTORY_FIRST_PAGE_TTL_SECONDS", "5"))
+HISTORY_PAGE_TTL_SECONDS = float(os.getenv("HISTORY_PAGE_TTL_SECONDS", "60"))
+
+# Upper bound on rows returned by one telemetry history query
+TELEMETRY_QUERY_MAX_ROWS = int(os.getenv("TELEMETRY_QUERY_MAX_ROWS", "100000"))
+
+# X.AI chat model used for the diagnostic narrative
+XAI_MODEL = os.getenv("XAI_MODEL", "grok-beta")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -69,9 +190,34 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting ML Diagnostic Service...")
     await load_ml_models()
+    await inference_executor.warm_up()
+    await diagnostic_manager.inference_batcher.start()
+    model_registry.start_watching(on_swap=on_model_swap)
+    await diagnostic_manager.result_store.start()
+    await telemetry_history.start()
+    await diagnostic_manager.recall_index.start()
+    await diagnostic_manager.parts_index.start()
+    await diagnostic_manager.cost_index.start()
+    fleet_scoring_job.start()
+    if diagnostic_manager.xai_api_key:
+        await diagnostic_manager.xai_client.start()
     yield
     # Shutdown
     logger.info("Shutting down ML Diagnostic Service...")
+    await model_registry.stop_watching()
+    await diagnostic_manager.inference_batcher.stop()
+    await inference_executor.shutdown()
+    await diagnostic_manager.cancel_pending_ai_stages()
+    await diagnostic_manager.result_store.stop()
+    await fleet_scoring_job.stop()
+    await telemetry_history.stop()
+    await diagnostic_manager.recall_index.stop()
+    await diagnostic_manager.parts_index.stop()
+    await diagnostic_manager.cost_index.stop()
+    await diagnostic_manager.xai_client.aclose()
+    await diagnostic_manager.vin_decoder.aclose()
+    await diagnostic_manager.analysis_cache.close()
+    mark_process_dead()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -98,6 +244,9 @@ app.add_middleware(
 # Trusted host middleware
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 
+# In-flight request gauge for /metrics
+app.add_middleware(InFlightMiddleware)
+
 class DiagnosticServiceManager:
     """Main service manager for ML diagnostics"""
     
@@ -106,12 +255,73 @@ class DiagnosticServiceManager:
         self.rapidapi_key = os.getenv("RAPIDAPI_KEY")
         self.hedera_client = None
         self.startup_time = datetime.utcnow()
+        self.xai_client = XAIClient(api_key=self.xai_api_key)
+        self.analysis_cache = create_analysis_cache()
+        self.result_store = WriteBehindStore()
+        self.result_cache = MemoryTTLCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS, name="result")
+        self.history_cache = MemoryTTLCache(RESULT_CACHE_MAX_ENTRIES, HISTORY_PAGE_TTL_SECONDS, name="history")
+        self._history_limits: set = set()
+        self._pending_ai_stages: set = set()
+        self.rule_engine = self._load_rule_engine()
+        self.dtc_knowledge = self._load_dtc_knowledge()
+        self.vin_decoder = self._load_vin_decoder()
+        self.recall_index = RecallIndex()
+        self.parts_index = self._load_parts_index()
+        self.cost_index = self._load_cost_index()
+        self.inference_batcher = MicroBatcher(
+            self._score_batch,
+            max_batch_size=INFERENCE_BATCH_MAX_SIZE,
+            max_wait_ms=INFERENCE_BATCH_MAX_WAIT_MS,
+            max_concurrent_batches=INFERENCE_WORKERS,
+            max_queue_depth=INFERENCE_QUEUE_MAX_ROWS,
+            name="engine_diagnostics"
+        )
         
         if not self.xai_api_key:
             logger.warning("XAI_API_KEY not configured - AI analysis will be limited")
         if not self.rapidapi_key:
             logger.warning("RAPIDAPI_KEY not configured - external data sources unavailable")
     
+    @staticmethod
+    def _load_rule_engine() -> RuleEngine:
+        try:
+            return RuleEngine.from_file()
+        except Exception as e:
+            logger.error(f"Failed to load OBD rules, rule-based analysis disabled: {e}")
+            return RuleEngine([], source="unavailable")
+    
+    @staticmethod
+    def _load_dtc_knowledge() -> DTCKnowledgeBase:
+        try:
+            return DTCKnowledgeBase.from_file()
+        except Exception as e:
+            logger.error(f"Failed to load DTC database, trouble codes will not be described: {e}")
+            return DTCKnowledgeBase([], source="unavailable")
+    
+    @staticmethod
+    def _load_vin_decoder() -> VINDecoder:
+        try:
+            return VINDecoder.from_file()
+        except Exception as e:
+            logger.error(f"Failed to load VIN tables, VINs will only be decoded remotely: {e}")
+            return VINDecoder({}, source="unavailable")
+    
+    @staticmethod
+    def _load_parts_index() -> PartsFitmentIndex:
+        try:
+            return PartsFitmentIndex.from_environment()
+        except Exception as e:
+            logger.error(f"Failed to set up the parts fitment index, recommendations will not name parts: {e}")
+            return PartsFitmentIndex()
+    
+    @staticmethod
+    def _load_cost_index() -> CostIndex:
+        try:
+            return CostIndex.from_environment()
+        except Exception as e:
+            logger.error(f"Failed to set up the cost index, estimates use the default labour rate only: {e}")
+            return CostIndex()
+    
     async def initialize_hedera_client(self):
         """Initialize Hedera blockchain client for data verification"""
         try:
@@ -120,168 +330,360 @@ class DiagnosticServiceManager:
         except Exception as e:
             logger.error(f"Failed to initialize Hedera client: {e}")
     
-    async def analyze_obd_data(self, obd_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Analyze OBD2 data using ML models"""
+    async def run_analysis_stages(self, request: DiagnosticRequest) -> Tuple[Dict[str, Any], Optional[str], str]:
+        """Run ML scoring and LLM analysis concurrently under per-stage deadlines
+        
+        Returns the OBD analysis, the AI analysis and its status. An LLM call
+        that misses its deadline keeps running in the background so its answer
+        still reaches the analysis cache, and is reported as pending.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        ai_stage = asyncio.create_task(self.get_xai_analysis(self._xai_input(request)))
+        
+        try:
+            try:
+                obd_analysis = await asyncio.wait_for(
+                    self.analyze_obd_data(request.obd_data, vehicle_context(request)),
+                    timeout=ML_STAGE_DEADLINE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"ML stage missed its {ML_STAGE_DEADLINE_SECONDS}s deadline for vehicle {request.vehicle_id}")
+                obd_analysis = self._rule_based_analysis(request.obd_data, vehicle_context(request))
+            
+            remaining = started + XAI_STAGE_DEADLINE_SECONDS - loop.time()
+            done, _ = await asyncio.wait({ai_stage}, timeout=max(0.0, remaining))
+        except BaseException:
+            ai_stage.cancel()
+            raise
+        
+        if ai_stage in done:
+            ai_analysis = ai_stage.result()
+            return obd_analysis, ai_analysis, 'complete' if ai_analysis else 'unavailable'
+        
+        logger.info(f"AI stage missed its {XAI_STAGE_DEADLINE_SECONDS}s deadline for vehicle {request.vehicle_id}, returning ML result")
+        XAI_TIMEOUTS.labels('deadline').inc()
+        self._pending_ai_stages.add(ai_stage)
+        ai_stage.add_done_callback(self._pending_ai_stages.discard)
+        return obd_analysis, None, 'pending'
+    
+    async def cancel_pending_ai_stages(self):
+        """Cancel LLM calls still running past their deadline (on shutdown)"""
+        for ai_stage in list(self._pending_ai_stages):
+            ai_stage.cancel()
+        if self._pending_ai_stages:
+            await asyncio.gather(*self._pending_ai_stages, return_exceptions=True)
+    
+    async def get_stored_result(self, diagnosis_id: str) -> Optional[DiagnosticResult]:
+        """Read-through cached lookup of a stored diagnosis"""
+        result = self.result_cache.get(diagnosis_id)
+        if result is None:
+            data = await self.result_store.fetch_result(diagnosis_id)
+            if data is None:
+                return None
+            result = DiagnosticResult(**data)
+            self.result_cache.set(diagnosis_id, result)
+        return result
+    
+    async def get_vehicle_history(self, vehicle_id: str, cursor: Optional[str], limit: int) -> DiagnosticHistoryPage:
+        """Read-through cached page of a vehicle's diagnoses, newest first"""
+        key = f"{vehicle_id}|{cursor or ''}|{limit}"
+        page = self.history_cache.get(key)
+        if page is None:
+            results, next_cursor = await self.result_store.list_vehicle_results(vehicle_id, cursor, limit)
+            page = DiagnosticHistoryPage(
+                vehicle_id=vehicle_id,
+                results=[DiagnosticResult(**data) for data in results],
+                next_cursor=next_cursor
+            )
+            self._history_limits.add(limit)
+            self.history_cache.set(key, page, ttl=HISTORY_PAGE_TTL_SECONDS if cursor else HISTORY_FIRST_PAGE_TTL_SECONDS)
+        return page
+    
+    def invalidate_vehicle_history(self, vehicle_id: str):
+        """Drop cached first pages of a vehicle after a new diagnosis is stored"""
+        for limit in self._history_limits:
+            self.history_cache.delete(f"{vehicle_id}||{limit}")
+    
+    def _xai_input(self, request: DiagnosticRequest) -> Dict[str, Any]:
+        """Prompt inputs for the X.AI analysis of a request, with the rules its snapshot fires (for the cache key)"""
+        return {
+            'make': request.make,
+            'model': request.model,
+            'year': request.year,
+            'engine': request.engine,
+            'obd_data': request.obd_data,
+            'symptoms': request.symptoms,
+            'rules_fired': self.rule_engine.evaluate(request.obd_data, vehicle_context(request))['rules_fired']
+        }
+    
+    async def analyze_obd_data(self, obd_data: Dict[str, Any], vehicle: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Analyze OBD2 data using the rule engine and ML models
+        
+        Rules run first; a critical rule verdict is returned straight away
+        when RULES_SHORT_CIRCUIT is set. Otherwise the model verdict is
+        returned with the rules that fired attached.
+        """
+        rule_analysis = self._rule_based_analysis(obd_data, vehicle)
+        if RULES_SHORT_CIRCUIT and rule_analysis['prediction'] == 'critical':
+            return rule_analysis
+        
         try:
             # Convert OBD data to features for ML model
             features = self._extract_features_from_obd(obd_data)
             
             # Predict using loaded ML model
-            if 'engine_diagnostics' in ml_models and scaler:
-                scaled_features = scaler.transform([features])
-                prediction = ml_models['engine_diagnostics'].predict(scaled_features)[0]
-                confidence = float(np.max(ml_models['engine_diagnostics'].predict_proba(scaled_features)))
-                
-                return {
-                    'prediction': prediction,
-                    'confidence': confidence,
-                    'features_analyzed': len(features)
-                }
+            if 'engine_diagnostics' in ml_models:
+                # Concurrent callers are coalesced into a single model pass
+                return with_rule_findings(await self.inference_batcher.submit(features), rule_analysis)
             else:
                 # Fallback analysis
-                return self._basic_obd_analysis(obd_data)
+                return rule_analysis
                 
+        except (InferenceQueueFull, asyncio.QueueFull):
+            # Overload is surfaced to the caller rather than masked by the fallback
+            raise
         except Exception as e:
             logger.error(f"Error analyzing OBD data: {e}")
-            return self._basic_obd_analysis(obd_data)
+            return rule_analysis
     
-    def _extract_features_from_obd(self, obd_data: Dict[str, Any]) -> List[float]:
-        """Extract numerical features from OBD data"""
-        features = []
+    async def analyze_obd_batch(
+        self,
+        obd_batch: List[Dict[str, Any]],
+        vehicles: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """Analyze many OBD2 snapshots with one rule pass and a single scaling and inference pass"""
+        analyses: List[Optional[Dict[str, Any]]] = [None] * len(obd_batch)
+        rule_analyses = self._rule_based_analysis_batch(obd_batch, vehicles)
         
-        # Standard OBD-II PIDs
-        feature_mappings = {
-            'engine_rpm': 'RPM',
-            'vehicle_speed': 'SPEED',
-            'throttle_position': 'THROTTLE_POS',
-            'engine_load': 'ENGINE_LOAD',
-            'coolant_temp': 'COOLANT_TEMP',
-            'intake_temp': 'INTAKE_TEMP',
-            'fuel_pressure': 'FUEL_PRESSURE',
-            'maf_airflow': 'MAF',
-            'o2_sensor': 'O2_SENSOR'
-        }
+        try:
+            with stage_timer('feature_extraction'):
+                rows = ENGINE_FEATURE_SCHEMA.extract_matrix(obd_batch)
+            row_positions = list(range(len(obd_batch)))
+        except Exception as e:
+            # Fall back to per-item extraction so one bad snapshot is isolated
+            logger.error(f"Error extracting batch feature matrix, retrying per item: {e}")
+            rows = ENGINE_FEATURE_SCHEMA.empty(len(obd_batch))
+            row_positions = []
+            for position, obd_data in enumerate(obd_batch):
+                try:
+                    ENGINE_FEATURE_SCHEMA.extract_row(obd_data, out=rows[len(row_positions)])
+                    row_positions.append(position)
+                except Exception as e:
+                    logger.error(f"Error extracting features for batch item {position}: {e}")
+                    analyses[position] = rule_analyses[position]
+            rows = rows[:len(row_positions)]
         
-        for key, obd_key in feature_mappings.items():
-            value = obd_data.get(obd_key, 0)
-            if isinstance(value, (int, float)):
-                features.append(float(value))
-            else:
-                features.append(0.0)
+        if len(rows) and 'engine_diagnostics' in ml_models:
+            try:
+                scored = await inference_executor.run(score_feature_matrix, rows)
+                for position, analysis in zip(row_positions, scored):
+                    analyses[position] = with_rule_findings(analysis, rule_analyses[position])
+            except InferenceQueueFull:
+                raise
+            except Exception as e:
+                logger.error(f"Error scoring OBD batch of {len(rows)} rows: {e}")
         
-        # Ensure we have a fixed number of features
-        while len(features) < 20:
-            features.append(0.0)
+        # Anything not scored by the model, or critical by rule, gets the rule verdict
+        for position, rule_analysis in enumerate(rule_analyses):
+            if analyses[position] is None or (RULES_SHORT_CIRCUIT and rule_analysis['prediction'] == 'critical'):
+                analyses[position] = rule_analysis
         
-        return features[:20]  # Limit to 20 features
+        return analyses
     
-    def _basic_obd_analysis(self, obd_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Basic rule-based OBD analysis as fallback"""
-        issues = []
-        confidence = 0.7
-        
-        # Check for common issues
-        if obd_data.get('COOLANT_TEMP', 0) > 100:
-            issues.append("Engine overheating detected")
+    async def _score_batch(self, feature_matrix: np.ndarray) -> List[Dict[str, Any]]:
+        """Scoring callback used by the inference micro-batcher"""
+        return await inference_executor.run(score_feature_matrix, feature_matrix)
+    
+    @stage_timer('feature_extraction')
+    def _extract_features_from_obd(self, obd_data: Dict[str, Any]) -> np.ndarray:
+        """Extract numerical features from OBD data into a float32 row"""
+        return ENGINE_FEATURE_SCHEMA.extract_row(obd_data)
+    
+    def _rule_based_analysis(self, obd_data: Dict[str, Any], vehicle: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Rule-engine verdict for one snapshot (also the fallback when the model is unavailable)"""
+        return self._rule_based_analysis_batch([obd_data], None if vehicle is None else [vehicle])[0]
+    
+    def _rule_based_analysis_batch(
+        self,
+        obd_batch: List[Dict[str, Any]],
+        vehicles: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """Rule-engine verdicts for a batch in one vectorized pass"""
+        analyses = self.rule_engine.evaluate_batch(obd_batch, vehicles)
+        for position, (obd_data, analysis) in enumerate(zip(obd_batch, analyses)):
+            dtc_codes = obd_data.get('DTC_CODES') or []
+            if dtc_codes:
+                make = vehicles[position].get('make') if vehicles else None
+                findings = self.dtc_knowledge.describe(dtc_codes, make)
+                analysis['issues'].extend([f"{finding['code']}: {finding['description']}" for finding in findings])
+                if DTCKnowledgeBase.most_severe(findings) == 'critical':
+                    analysis['prediction'] = 'critical'
+                elif analysis['prediction'] == 'normal':
+                    analysis['prediction'] = 'maintenance_required'
+        return analyses
+    
+    def answered_locally(self, diagnostic_data: Dict[str, Any]) -> bool:
+        """Whether the local DTC database already explains a request, so X.AI is not needed"""
+        dtc_codes = (diagnostic_data.get('obd_data') or {}).get('DTC_CODES') or []
+        return (
+            XAI_SKIP_KNOWN_DTCS
+            and bool(dtc_codes)
+            and not diagnostic_data.get('symptoms')
+            and self.dtc_knowledge.covers(dtc_codes, diagnostic_data.get('make'))
+        )
+    
+    async def get_xai_analysis(self, diagnostic_data: Dict[str, Any]) -> Optional[str]:
+        """Get AI analysis from X.AI Grok"""
+        if not self.xai_api_key or self.answered_locally(diagnostic_data):
+            return None
         
-        if obd_data.get('RPM', 0) > 6000:
-            issues.append("High RPM detected")
+        # Identical vehicle/DTC/near-identical OBD inputs are answered from cache
+        cache_key = make_analysis_cache_key(diagnostic_data)
+        return await self.analysis_cache.get_or_compute(
+            cache_key,
+            lambda: self._request_xai_analysis(diagnostic_data)
+        )
+    
+    def _xai_payload(self, diagnostic_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the X.AI chat completion request for a diagnostic"""
+        vehicle = f"{diagnostic_data.get('make')} {diagnostic_data.get('model')} {diagnostic_data.get('year')}"
+        if diagnostic_data.get('engine'):
+            vehicle += f" ({diagnostic_data['engine']})"
+        prompt = f"""
+        Analyze this automotive diagnostic data and provide expert insights:
         
-        if obd_data.get('ENGINE_LOAD', 0) > 90:
-            issues.append("High engine load")
+        Vehicle: {vehicle}
+        OBD Data: {json.dumps(diagnostic_data.get('obd_data', {}), indent=2)}
+        Symptoms: {', '.join(diagnostic_data.get('symptoms', []))}
         
-        dtc_codes = obd_data.get('DTC_CODES', [])
-        if dtc_codes:
-            issues.extend([f"Diagnostic code: {code}" for code in dtc_codes])
+        Please provide:
+        1. Likely root causes
+        2. Recommended actions
+        3. Urgency assessment
+        4. Cost estimation range
+        """
         
         return {
-            'prediction': 'maintenance_required' if issues else 'normal',
-            'confidence': confidence,
-            'issues': issues
+            "model": XAI_MODEL,
+            "messages": [
+                {"role": "system", "content": "You are an expert automotive diagnostic technician with 20+ years of experience."},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": 1000,
+            "temperature": 0.3
         }
     
-    async def get_xai_analysis(self, diagnostic_data: Dict[str, Any]) -> Optional[str]:
-        """Get AI analysis from X.AI Grok"""
-        if not self.xai_api_key:
-            return None
-        
+    async def _request_xai_analysis(self, diagnostic_data: Dict[str, Any]) -> Optional[str]:
+        """Call the X.AI chat completions API"""
         try:
-            prompt = f"""
-            Analyze this automotive diagnostic data and provide expert insights:
-            
-            Vehicle: {diagnostic_data.get('make')} {diagnostic_data.get('model')} {diagnostic_data.get('year')}
-            OBD Data: {json.dumps(diagnostic_data.get('obd_data', {}), indent=2)}
-            Symptoms: {', '.join(diagnostic_data.get('symptoms', []))}
+            response = await self.xai_client.post_chat_completion(self._xai_payload(diagnostic_data))
             
-            Please provide:
-            1. Likely root causes
-            2. Recommended actions
-            3. Urgency assessment
-            4. Cost estimation range
-            """
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.x.ai/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.xai_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "grok-beta",
-                        "messages": [
-                            {"role": "system", "content": "You are an expert automotive diagnostic technician with 20+ years of experience."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        "max_tokens": 1000,
-                        "temperature": 0.3
-                    },
-                    timeout=30.0
-                )
+            if response.status_code == 200:
+                result = response.json()
+                return result['choices'][0]['message']['content']
+            else:
+                logger.error(f"X.AI API error: {response.status_code}")
+                return None
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    return result['choices'][0]['message']['content']
-                else:
-                    logger.error(f"X.AI API error: {response.status_code}")
-                    return None
-                    
         except Exception as e:
             logger.error(f"Error getting X.AI analysis: {e}")
             return None
+    
+    async def stream_xai_analysis(self, diagnostic_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream AI analysis from X.AI Grok token by token
+        
+        A cached analysis is replayed as a single chunk; a freshly streamed
+        one is cached once the stream completes.
+        """
+        if not self.xai_api_key or self.answered_locally(diagnostic_data):
+            return
+        
+        cache_key = make_analysis_cache_key(diagnostic_data)
+        cached = await self.analysis_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        async for chunk in self.xai_client.stream_chat_completion(self._xai_payload(diagnostic_data)):
+            chunks.append(chunk)
+            yield chunk
+        
+        if chunks:
+            await self.analysis_cache.set(cache_key, "".join(chunks))
 
 # Service manager instance
 diagnostic_manager = DiagnosticServiceManager()
 
+# Live OBD telemetry sessions, scored through the same micro-batched model path
+# and recorded in the columnar history store with 1m/1h/1d rollups
+telemetry_store = TelemetryStore()
+telemetry_history = TelemetryRollups(telemetry_store)
+telemetry_hub = TelemetryHub(
+    score_fn=diagnostic_manager.analyze_obd_data,
+    history_store=telemetry_history,
+    rule_engine=diagnostic_manager.rule_engine
+)
+
+# Nightly predictive-maintenance ranking of the whole fleet from recorded telemetry
+fleet_scoring_job = FleetScoringJob(telemetry_store, model_root=model_registry.root, backend=model_registry.backend)
+
 async def load_ml_models():
-    """Load pre-trained ML models"""
-    global ml_models, scaler
-    
+    """Load pre-trained ML models and export the version this worker serves"""
+    bundle = await asyncio.to_thread(load_ml_models_sync)
+    if bundle is not None:
+        record_model_version(bundle)
+
+async def on_model_swap(bundle: ModelBundle):
+    """Serve a newly activated model version"""
+    ml_models['engine_diagnostics'] = bundle
+    record_model_version(bundle)
+    if inference_executor.mode == "process":
+        # Worker processes hold their own copy; start fresh ones on the new version
+        await inference_executor.restart()
+
+# Inference executor; process workers preload their own copy of the models
+inference_executor = InferenceExecutor(
+    mode=INFERENCE_EXECUTOR,
+    max_workers=INFERENCE_WORKERS,
+    max_pending=INFERENCE_MAX_PENDING_JOBS,
+    initializer=load_ml_models_sync if INFERENCE_EXECUTOR == "process" else None
+)
+
+def vehicle_context(request: DiagnosticRequest) -> Dict[str, Any]:
+    """Vehicle fields used to scope rules"""
+    return {'make': request.make, 'model': request.model, 'year': request.year}
+
+def with_rule_findings(analysis: Dict[str, Any], rule_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Model verdict plus the issues and rules that fired for the same snapshot"""
+    return {**analysis, 'issues': rule_analysis['issues'], 'rules_fired': rule_analysis['rules_fired']}
+
+async def run_until_disconnect(http_request: Request, awaitable):
+    """Await a coroutine, cancelling it if the client disconnects first"""
+    task = asyncio.ensure_future(awaitable)
     try:
-        # Load models (placeholder - in production, load actual trained models)
-        logger.info("Loading ML models...")
-        
-        # Create a simple model for demonstration
-        model = tf.keras.Sequential([
-            tf.keras.layers.Dense(64, activation='relu', input_shape=(20,)),
-            tf.keras.layers.Dropout(0.3),
-            tf.keras.layers.Dense(32, activation='relu'),
-            tf.keras.layers.Dense(3, activation='softmax')  # normal, maintenance, critical
-        ])
-        
-        model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
-        ml_models['engine_diagnostics'] = model
-        
-        # Initialize scaler
-        scaler = StandardScaler()
-        # Fit with dummy data (in production, use real training data)
-        dummy_data = np.random.normal(0, 1, (100, 20))
-        scaler.fit(dummy_data)
-        
-        logger.info(f"Loaded {len(ml_models)} ML models successfully")
-        
-    except Exception as e:
-        logger.error(f"Error loading ML models: {e}")
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info(f"Client disconnected from {http_request.url.path}, cancelling work")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+def get_vin_decoder() -> VINDecoder:
+    return diagnostic_manager.vin_decoder
+
+def vin_filled_request(request: DiagnosticRequest, decoder: VINDecoder = Depends(get_vin_decoder)) -> DiagnosticRequest:
+    """The request body with vehicle fields it omits decoded from its VIN (422 when they cannot be)"""
+    try:
+        return request.fill_from_vin(decoder)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 async def verify_auth_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token (placeholder implementation)"""
@@ -292,6 +694,156 @@ async def verify_auth_token(credentials: HTTPAuthorizationCredentials = Depends(
     # For now, accept any token
     return credentials.credentials
 
+@stage_timer('result_assembly')
+def build_diagnostic_result(
+    request: DiagnosticRequest,
+    diagnosis_id: str,
+    obd_analysis: Dict[str, Any],
+    ai_analysis: Optional[str],
+    ai_analysis_status: str = "unavailable"
+) -> DiagnosticResult:
+    """Assemble a DiagnosticResult from OBD and AI analysis outputs"""
+    # Determine issues and recommendations
+    primary_issues = []
+    recommendations = []
+    urgency_level = "low"
+    # Repairs the findings call for, priced at the end
+    repair_types: Dict[str, None] = {}
+    
+    if obd_analysis.get('prediction') == 'critical':
+        repair_types['inspection'] = None
+        urgency_level = "critical"
+        primary_issues.append({
+            'type': 'engine_failure',
+            'description': 'Critical engine condition detected',
+            'confidence': obd_analysis.get('confidence', 0.8)
+        })
+        recommendations.append({
+            'action': 'immediate_inspection',
+            'description': 'Schedule immediate professional inspection',
+            'priority': 'high'
+        })
+    elif obd_analysis.get('prediction') == 'maintenance_required':
+        urgency_level = "medium"
+        repair_types['maintenance'] = None
+        primary_issues.append({
+            'type': 'maintenance_due',
+            'description': 'Vehicle requires maintenance',
+            'confidence': obd_analysis.get('confidence', 0.7)
+        })
+        recommendations.append({
+            'action': 'schedule_maintenance',
+            'description': 'Schedule routine maintenance',
+            'priority': 'medium'
+        })
+    
+    # Part categories the findings point at, in the order they were found
+    part_categories: Dict[str, None] = {}
+    
+    # Findings of the rule engine, one issue per rule that fired
+    for rule_id, description in zip(obd_analysis.get('rules_fired', []), obd_analysis.get('issues', [])):
+        if rule_id in RULE_CATEGORIES:
+            part_categories[RULE_CATEGORIES[rule_id]] = None
+        if rule_id in RULE_REPAIR_TYPES:
+            repair_types[RULE_REPAIR_TYPES[rule_id]] = None
+        primary_issues.append({
+            'type': rule_id,
+            'description': description,
+            'confidence': obd_analysis.get('confidence', 0.7),
+            'source': 'rules'
+        })
+    
+    # Trouble codes described from the local DTC database
+    dtc_codes = request.obd_data.get('DTC_CODES') or []
+    if dtc_codes:
+        findings = diagnostic_manager.dtc_knowledge.describe(dtc_codes, request.make)
+        for finding in findings:
+            primary_issues.append({
+                'type': 'diagnostic_trouble_code',
+                'code': finding['code'],
+                'description': finding['description'],
+                'system': finding['system'],
+                'severity': finding['severity'],
+                'causes': finding['causes'],
+                'confidence': MATCH_CONFIDENCE[finding['match']],
+                'source': 'dtc_database'
+            })
+            if finding['system'] in SYSTEM_CATEGORIES:
+                part_categories[SYSTEM_CATEGORIES[finding['system']]] = None
+            repair_types[finding['system'] if finding['system'] in LABOUR_HOURS else 'inspection'] = None
+        dtc_urgency = DTCKnowledgeBase.most_severe(findings)
+        if URGENCY_ORDER[dtc_urgency] > URGENCY_ORDER[urgency_level]:
+            urgency_level = dtc_urgency
+        recommendations.append({
+            'action': 'inspect_trouble_codes',
+            'description': f"Inspect {', '.join(sorted({finding['system'] for finding in findings}))} ({', '.join(finding['code'] for finding in findings)})",
+            'priority': 'high' if URGENCY_ORDER[dtc_urgency] >= URGENCY_ORDER['high'] else 'medium'
+        })
+    
+    # Recall campaigns covering the vehicle, served from the in-memory index
+    recalls = [
+        {
+            'campaign': recall['campaign'],
+            'report_date': recall['report_date'],
+            'components': recall['components'],
+            'summary': recall['summary'],
+            'remedy': recall['remedy']
+        }
+        for recall in diagnostic_manager.recall_index.lookup(request.make, request.model, request.year, limit=RECALL_RESULT_LIMIT)
+    ]
+    if recalls:
+        recommendations.append({
+            'action': 'check_recalls',
+            'description': f"{len(recalls)} recall campaign(s) cover this vehicle; confirm with the dealer whether the remedy was applied",
+            'priority': 'medium'
+        })
+    
+    # In-stock parts that fit the vehicle, from the in-memory fitment index
+    for category in part_categories:
+        parts = diagnostic_manager.parts_index.lookup(
+            request.make, request.model, request.year, category, limit=PARTS_RECOMMENDATION_LIMIT
+        )
+        if parts:
+            recommendations.append({
+                'action': 'fit_parts',
+                'category': category,
+                'description': f"In-stock {category} parts that fit this {request.year} {request.make} {request.model}",
+                'priority': 'high' if URGENCY_ORDER[urgency_level] >= URGENCY_ORDER['high'] else 'medium',
+                'parts': [
+                    {field: part[field] for field in ('id', 'name', 'brand', 'part_number', 'price', 'currency', 'fitment')}
+                    for part in parts
+                ]
+            })
+    
+    # Repair cost range from the in-memory price and labour rate distributions
+    estimated_cost = diagnostic_manager.cost_index.estimate(repair_types or ['inspection'])
+    
+    # Calculate next maintenance
+    next_maintenance = datetime.utcnow() + timedelta(days=90)
+    
+    result = DiagnosticResult(
+        vehicle_id=request.vehicle_id,
+        diagnosis_id=diagnosis_id,
+        timestamp=datetime.utcnow(),
+        primary_issues=primary_issues,
+        recommendations=recommendations,
+        confidence_score=obd_analysis.get('confidence', 0.75),
+        estimated_cost=estimated_cost,
+        urgency_level=urgency_level,
+        ai_analysis=ai_analysis,
+        ai_analysis_status=ai_analysis_status,
+        next_maintenance=next_maintenance,
+        recalls=recalls
+    )
+    
+    return result
+
+@app.get(METRICS_PATH, include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint (unauthenticated, like /health)"""
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
+
 @app.get("/health", response_model=HealthCheck)
 async def health_check():
     """Health check endpoint"""
@@ -306,124 +858,578 @@ async def health_check():
 
 @app.post("/diagnostic/analyze", response_model=DiagnosticResult)
 async def analyze_vehicle(
-    request: DiagnosticRequest,
-    background_tasks: BackgroundTasks,
+    http_request: Request,
+    request: DiagnosticRequest = Depends(vin_filled_request),
     token: str = Depends(verify_auth_token)
 ):
     """Perform comprehensive vehicle diagnostic analysis"""
     try:
         logger.info(f"Starting diagnostic analysis for vehicle {request.vehicle_id}")
         
-        # Generate unique diagnosis ID
-        diagnosis_id = f"diag_{request.vehicle_id}_{int(datetime.utcnow().timestamp())}"
-        
-        # Analyze OBD data
-        obd_analysis = await diagnostic_manager.analyze_obd_data(request.obd_data)
-        
-        # Get AI analysis
-        ai_analysis = await diagnostic_manager.get_xai_analysis({
-            'make': request.make,
-            'model': request.model,
-            'year': request.year,
-            'obd_data': request.obd_data,
-            'symptoms': request.symptoms
-        })
-        
-        # Determine issues and recommendations
-        primary_issues = []
-        recommendations = []
-        urgency_level = "low"
-        
-        if obd_analysis.get('prediction') == 'critical':
-            urgency_level = "critical"
-            primary_issues.append({
-                'type': 'engine_failure',
-                'description': 'Critical engine condition detected',
-                'confidence': obd_analysis.get('confidence', 0.8)
-            })
-            recommendations.append({
-                'action': 'immediate_inspection',
-                'description': 'Schedule immediate professional inspection',
-                'priority': 'high'
-            })
-        elif obd_analysis.get('prediction') == 'maintenance_required':
-            urgency_level = "medium"
-            primary_issues.append({
-                'type': 'maintenance_due',
-                'description': 'Vehicle requires maintenance',
-                'confidence': obd_analysis.get('confidence', 0.7)
-            })
-            recommendations.append({
-                'action': 'schedule_maintenance',
-                'description': 'Schedule routine maintenance',
-                'priority': 'medium'
-            })
-        
-        # Calculate estimated costs (placeholder)
-        estimated_cost = {
-            'min': 100.0,
-            'max': 500.0,
-            'currency': 'USD'
-        }
-        
-        # Calculate next maintenance
-        next_maintenance = datetime.utcnow() + timedelta(days=90)
+        # Generate unique, time-sortable diagnosis ID
+        diagnosis_id = new_diagnosis_id()
         
-        result = DiagnosticResult(
-            vehicle_id=request.vehicle_id,
-            diagnosis_id=diagnosis_id,
-            timestamp=datetime.utcnow(),
-            primary_issues=primary_issues,
-            recommendations=recommendations,
-            confidence_score=obd_analysis.get('confidence', 0.75),
-            estimated_cost=estimated_cost,
-            urgency_level=urgency_level,
-            ai_analysis=ai_analysis,
-            next_maintenance=next_maintenance
+        # ML scoring and AI analysis run concurrently (abandoned if the client goes away)
+        obd_analysis, ai_analysis, ai_analysis_status = await run_until_disconnect(
+            http_request,
+            diagnostic_manager.run_analysis_stages(request)
         )
         
-        # Schedule background task to store results
-        background_tasks.add_task(store_diagnostic_result, result)
+        result = build_diagnostic_result(request, diagnosis_id, obd_analysis, ai_analysis, ai_analysis_status)
+        
+        # Appended to the write-ahead log before responding; the DB write is batched
+        store_diagnostic_results([(request, result)])
         
         logger.info(f"Diagnostic analysis completed for vehicle {request.vehicle_id}")
         return result
         
+    except HTTPException:
+        raise
+    except (InferenceQueueFull, asyncio.QueueFull):
+        logger.warning(f"Inference queue full, rejecting diagnostic analysis for vehicle {request.vehicle_id}")
+        raise HTTPException(status_code=503, detail="Inference capacity exhausted, retry shortly", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Error during diagnostic analysis: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during analysis")
 
-@app.get("/diagnostic/{diagnosis_id}")
+def format_sse(event: str, data: Any) -> str:
+    """Encode one server-sent event"""
+    payload = data if isinstance(data, str) else json.dumps(data)
+    lines = "".join(f"data: {line}\n" for line in payload.split("\n"))
+    return f"event: {event}\n{lines}\n"
+
+@app.post("/diagnostic/analyze/stream")
+async def analyze_vehicle_stream(
+    request: DiagnosticRequest = Depends(vin_filled_request),
+    token: str = Depends(verify_auth_token)
+):
+    """Stream a diagnostic: the ML verdict first, then the AI narrative as server-sent events
+    
+    Events: ``verdict`` (DiagnosticResult JSON), ``token`` ({"text": ...}) per
+    narrative chunk, then ``done`` or ``error``.
+    """
+    logger.info(f"Starting streaming diagnostic analysis for vehicle {request.vehicle_id}")
+    
+    diagnosis_id = new_diagnosis_id()
+    
+    try:
+        obd_analysis = await asyncio.wait_for(
+            diagnostic_manager.analyze_obd_data(request.obd_data, vehicle_context(request)),
+            timeout=ML_STAGE_DEADLINE_SECONDS
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"ML stage missed its {ML_STAGE_DEADLINE_SECONDS}s deadline for vehicle {request.vehicle_id}")
+        obd_analysis = diagnostic_manager._rule_based_analysis(request.obd_data, vehicle_context(request))
+    except (InferenceQueueFull, asyncio.QueueFull):
+        logger.warning(f"Inference queue full, rejecting streaming analysis for vehicle {request.vehicle_id}")
+        raise HTTPException(status_code=503, detail="Inference capacity exhausted, retry shortly", headers={"Retry-After": "1"})
+    
+    xai_input = diagnostic_manager._xai_input(request)
+    ai_analysis_status = "pending" if diagnostic_manager.xai_api_key and not diagnostic_manager.answered_locally(xai_input) else "unavailable"
+    result = build_diagnostic_result(request, diagnosis_id, obd_analysis, None, ai_analysis_status)
+    
+    async def event_stream():
+        # The verdict goes out before the LLM is even contacted
+        yield format_sse("verdict", result.model_dump_json())
+        
+        chunks = []
+        try:
+            async for chunk in diagnostic_manager.stream_xai_analysis(xai_input):
+                chunks.append(chunk)
+                yield format_sse("token", {"text": chunk})
+            result.ai_analysis = "".join(chunks) or None
+            result.ai_analysis_status = "complete" if chunks else "unavailable"
+            yield format_sse("done", {"diagnosis_id": diagnosis_id, "ai_analysis_status": result.ai_analysis_status})
+        except Exception as e:
+            logger.error(f"Error streaming X.AI analysis for {diagnosis_id}: {e}")
+            result.ai_analysis = "".join(chunks) or None
+            result.ai_analysis_status = "unavailable"
+            yield format_sse("error", {"diagnosis_id": diagnosis_id, "detail": "AI analysis stream failed"})
+        
+        store_diagnostic_results([(request, result)])
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/diagnostic/analyze-batch", response_model=BatchDiagnosticResponse)
+async def analyze_vehicle_batch(
+    batch: BatchDiagnosticRequest,
+    http_request: Request,
+    decoder: VINDecoder = Depends(get_vin_decoder),
+    token: str = Depends(verify_auth_token)
+):
+    """Score a fleet of OBD snapshots in a single vectorized model pass"""
+    if len(batch.requests) > BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(batch.requests)} exceeds the limit of {BATCH_MAX_SIZE} requests"
+        )
+    
+    logger.info(f"Starting batch diagnostic analysis for {len(batch.requests)} vehicles")
+    
+    items = [BatchItemResult(index=index) for index in range(len(batch.requests))]
+    valid_requests: List[DiagnosticRequest] = []
+    valid_indices: List[int] = []
+    
+    # Validate each payload on its own so one bad item does not fail the batch
+    for index, payload in enumerate(batch.requests):
+        items[index].vehicle_id = payload.get('vehicle_id') if isinstance(payload.get('vehicle_id'), str) else None
+        try:
+            valid_requests.append(DiagnosticRequest(**payload).fill_from_vin(decoder))
+            valid_indices.append(index)
+        except ValidationError as e:
+            items[index].error = f"Invalid request: {e.errors()}"
+        except ValueError as e:
+            items[index].error = f"Invalid request: {e}"
+    
+    try:
+        obd_analyses = await run_until_disconnect(
+            http_request,
+            diagnostic_manager.analyze_obd_batch(
+                [r.obd_data for r in valid_requests],
+                [vehicle_context(r) for r in valid_requests]
+            )
+        )
+    except InferenceQueueFull:
+        logger.warning(f"Inference queue full, rejecting batch of {len(batch.requests)}")
+        raise HTTPException(status_code=503, detail="Inference capacity exhausted, retry shortly", headers={"Retry-After": "1"})
+    stored = []
+    
+    for index, request, obd_analysis in zip(valid_indices, valid_requests, obd_analyses):
+        try:
+            diagnosis_id = new_diagnosis_id()
+            result = build_diagnostic_result(request, diagnosis_id, obd_analysis, ai_analysis=None)
+            items[index].result = result
+            stored.append((request, result))
+        except Exception as e:
+            logger.error(f"Error building diagnostic result for batch item {index}: {e}")
+            items[index].error = "Internal error while building diagnostic result"
+    
+    # One WAL write for the whole batch
+    store_diagnostic_results(stored)
+    
+    succeeded = sum(1 for item in items if item.result is not None)
+    logger.info(f"Batch diagnostic analysis completed: {succeeded}/{len(items)} succeeded")
+    
+    return BatchDiagnosticResponse(
+        total=len(items),
+        succeeded=succeeded,
+        failed=len(items) - succeeded,
+        results=items
+    )
+
+@app.get("/diagnostic/{diagnosis_id}", response_model=DiagnosticResult)
 async def get_diagnostic_result(
     diagnosis_id: str,
     token: str = Depends(verify_auth_token)
 ):
     """Retrieve diagnostic result by ID"""
-    # Placeholder implementation - in production, retrieve from database
-    return {"message": f"Diagnostic result for {diagnosis_id} would be retrieved from database"}
+    try:
+        result = await diagnostic_manager.get_stored_result(diagnosis_id)
+    except Exception as e:
+        logger.error(f"Error retrieving diagnostic result {diagnosis_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error during retrieval")
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Diagnostic result {diagnosis_id} not found")
+    return result
+
+@app.get("/vehicles/{vehicle_id}/diagnostics", response_model=DiagnosticHistoryPage)
+async def get_vehicle_diagnostics(
+    vehicle_id: str,
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(20, ge=1, le=HISTORY_PAGE_MAX),
+    token: str = Depends(verify_auth_token)
+):
+    """List a vehicle's diagnostic results, newest first, with keyset pagination"""
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    try:
+        return await diagnostic_manager.get_vehicle_history(vehicle_id, cursor, limit)
+    except Exception as e:
+        logger.error(f"Error listing diagnostics for vehicle {vehicle_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error during retrieval")
 
 @app.get("/models/status")
 async def get_model_status(token: str = Depends(verify_auth_token)):
     """Get status of loaded ML models"""
     return {
         "models_loaded": list(ml_models.keys()),
-        "scaler_initialized": scaler is not None,
-        "total_models": len(ml_models)
+        "scaler_initialized": bool(ml_models),
+        "total_models": len(ml_models),
+        "registry": model_registry.status(),
+        "batching": diagnostic_manager.inference_batcher.stats(),
+        "executor": inference_executor.stats(),
+        "rules": diagnostic_manager.rule_engine.stats(),
+        "dtc_database": diagnostic_manager.dtc_knowledge.stats(),
+        "vin_decoder": diagnostic_manager.vin_decoder.stats()
+    }
+
+@app.post("/models/reload")
+async def reload_models(token: str = Depends(verify_auth_token)):
+    """Check the registry now and hot-swap to the active model version"""
+    swapped = await model_registry.reload(on_swap=on_model_swap)
+    if model_registry.last_error:
+        raise HTTPException(status_code=500, detail=f"Model reload failed: {model_registry.last_error}")
+    return {
+        "swapped": swapped,
+        "active": model_registry.active.describe() if model_registry.active else None
+    }
+
+@app.websocket("/telemetry/{vehicle_id}/ws")
+async def telemetry_stream(websocket: WebSocket, vehicle_id: str):
+    """Ingest live OBD frames; scores are pushed back on window boundaries, new DTCs and rules that start firing
+    
+    Authenticate with an ``Authorization: Bearer`` header or a ``token`` query
+    parameter (browsers cannot set WebSocket headers). Optional ``make``,
+    ``model`` and ``year`` query parameters scope the rules to the vehicle.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    token = websocket.query_params.get("token")
+    if not token and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):]
+    if not token:
+        # In production, implement proper JWT verification
+        await websocket.close(code=1008, reason="Missing bearer token")
+        return
+    
+    params = websocket.query_params
+    year = params.get("year")
+    vehicle = {
+        'make': params.get("make"),
+        'model': params.get("model"),
+        'year': int(year) if year and year.isdigit() else None
     }
+    await telemetry_hub.serve(websocket, vehicle_id, vehicle if any(vehicle.values()) else None)
 
-async def store_diagnostic_result(result: DiagnosticResult):
-    """Store diagnostic result (background task)"""
+@app.get("/vehicles/{vehicle_id}/telemetry")
+async def get_vehicle_telemetry(
+    vehicle_id: str,
+    start: float = Query(..., description="Range start, unix seconds (inclusive)"),
+    end: float = Query(..., description="Range end, unix seconds (exclusive)"),
+    pids: Optional[str] = Query(None, description="Comma-separated PIDs (default: all)"),
+    resolution: Optional[float] = Query(
+        None, gt=0, description="Desired bucket width in seconds; served from the coarsest rollup tier that fits"
+    ),
+    token: str = Depends(verify_auth_token)
+):
+    """Read a vehicle's recorded OBD telemetry for a time range
+    
+    Without ``resolution`` every raw frame is returned. With it, the response
+    holds min/max/mean/count/last per bucket from a rollup tier, or from raw
+    frames when no tier is fine enough.
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    selected = [pid.strip() for pid in pids.split(",") if pid.strip()] if pids else None
+    if selected:
+        unknown = [pid for pid in selected if pid not in telemetry_store.pids]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown PIDs: {', '.join(unknown)}")
+    
+    # Cold segments are decoded and rollups merged on first read; keep that off the event loop
+    if resolution is not None and telemetry_history.plan(start, end, resolution)[0] != RAW_TIER:
+        return await asyncio.to_thread(read_telemetry_rollup, vehicle_id, start, end, resolution, selected)
+    return await asyncio.to_thread(read_telemetry_frames, vehicle_id, start, end, selected)
+
+def read_telemetry_rollup(
+    vehicle_id: str,
+    start: float,
+    end: float,
+    resolution: float,
+    selected: Optional[List[str]]
+) -> Dict[str, Any]:
+    """Rollup buckets of a vehicle's telemetry as a JSON response body; blocking"""
+    rollup = telemetry_history.query(vehicle_id, start, end, resolution, selected)
+    columns = {}
+    for pid in rollup.pids:
+        columns[pid] = {}
+        for stat in ROLLUP_STATS:
+            values = rollup.stat(pid, stat)[:TELEMETRY_QUERY_MAX_ROWS]
+            columns[pid][stat] = [None if value != value else value for value in values.tolist()]
+    return {
+        "vehicle_id": vehicle_id,
+        "tier": rollup.tier,
+        "resolution_seconds": rollup.resolution_ms / 1000,
+        "rows": min(len(rollup), TELEMETRY_QUERY_MAX_ROWS),
+        "truncated": len(rollup) > TELEMETRY_QUERY_MAX_ROWS,
+        "timestamps_ms": rollup.timestamps[:TELEMETRY_QUERY_MAX_ROWS].tolist(),
+        "columns": columns
+    }
+
+def read_telemetry_frames(vehicle_id: str, start: float, end: float, selected: Optional[List[str]]) -> Dict[str, Any]:
+    """Raw frames of a vehicle's telemetry as a JSON response body; blocking"""
+    # One row past the limit tells whether the range was truncated
+    history = telemetry_store.read(vehicle_id, start, end, selected, limit=TELEMETRY_QUERY_MAX_ROWS + 1)
+    rows = len(history)
+    truncated = rows > TELEMETRY_QUERY_MAX_ROWS
+    timestamps = history.timestamps()[:TELEMETRY_QUERY_MAX_ROWS]
+    columns = {}
+    for pid in history.pids:
+        values = history.column(pid)[:TELEMETRY_QUERY_MAX_ROWS]
+        # NaN (PID not reported) is not valid JSON
+        columns[pid] = [None if value != value else value for value in values.tolist()]
+    
+    return {
+        "vehicle_id": vehicle_id,
+        "rows": min(rows, TELEMETRY_QUERY_MAX_ROWS),
+        "tier": RAW_TIER,
+        "truncated": truncated,
+        "timestamps_ms": timestamps.tolist(),
+        "columns": columns
+    }
+
+@app.get("/vin/{vin}")
+async def decode_vin(
+    vin: str,
+    remote: bool = Query(True, description="Fall back to the remote decoder if the local tables are incomplete"),
+    token: str = Depends(verify_auth_token)
+):
+    """Decode a VIN into make, model, year, engine and plant"""
+    decoded = await diagnostic_manager.vin_decoder.resolve(vin, remote=remote)
+    if not decoded['valid']:
+        raise HTTPException(status_code=422, detail="; ".join(decoded['errors']))
+    return decoded
+
+@app.post("/vin/decode-batch")
+async def decode_vin_batch(batch: VINBatchRequest, token: str = Depends(verify_auth_token)):
+    """Decode many VINs at once; invalid VINs are reported per item"""
+    if len(batch.vins) > VIN_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(batch.vins)} exceeds the limit of {VIN_BATCH_MAX_SIZE} VINs"
+        )
+    results = await diagnostic_manager.vin_decoder.resolve_many(batch.vins, remote=batch.remote)
+    return {
+        "total": len(results),
+        "decoded": sum(1 for result in results if result['complete']),
+        "invalid": sum(1 for result in results if not result['valid']),
+        "results": results
+    }
+
+@app.get("/dtc")
+async def search_trouble_codes(
+    prefix: str = Query(..., min_length=1, max_length=5, description="Code prefix, e.g. P03 or P03xx"),
+    make: Optional[str] = Query(None, description="Include this manufacturer's specific codes"),
+    limit: int = Query(100, ge=1, le=1000),
+    token: str = Depends(verify_auth_token)
+):
+    """List the trouble codes of the local DTC database starting with a prefix"""
+    entries = diagnostic_manager.dtc_knowledge.prefix(prefix, make, limit=limit)
+    return {"prefix": prefix.upper(), "codes": [entry.to_dict() for entry in entries]}
+
+@app.get("/dtc/{code}")
+async def get_trouble_code(
+    code: str,
+    make: Optional[str] = Query(None, description="Vehicle make, for manufacturer-specific codes"),
+    token: str = Depends(verify_auth_token)
+):
+    """Describe a trouble code from the local DTC database"""
+    finding = diagnostic_manager.dtc_knowledge.lookup(code, make)
+    if finding['match'] == 'unknown':
+        raise HTTPException(status_code=404, detail=f"{finding['description']}: {finding['code']}")
+    return finding
+
+@app.get("/vehicles/{vehicle_id}/telemetry/rules")
+async def check_vehicle_telemetry_rules(
+    vehicle_id: str,
+    start: float = Query(..., description="Range start, unix seconds (inclusive)"),
+    end: float = Query(..., description="Range end, unix seconds (exclusive)"),
+    make: Optional[str] = Query(None),
+    model: Optional[str] = Query(None),
+    year: Optional[int] = Query(None),
+    token: str = Depends(verify_auth_token)
+):
+    """Evaluate the OBD rules, including duration rules, over a recorded telemetry window"""
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    
+    rule_engine = diagnostic_manager.rule_engine
+    pids = [pid for pid in rule_engine.pids if pid in telemetry_store.pids]
+    vehicle = {'make': make, 'model': model, 'year': year} if make or model or year else None
+    
+    def evaluate() -> Dict[str, Any]:
+        history = telemetry_store.read(vehicle_id, start, end, pids)
+        return rule_engine.evaluate_window(history.timestamps(), {pid: history.column(pid) for pid in pids}, vehicle)
+    
+    verdict = await asyncio.to_thread(evaluate)
+    return {"vehicle_id": vehicle_id, **verdict}
+
+@app.get("/recalls")
+async def get_recalls(
+    make: str = Query(..., description="Vehicle make"),
+    model: str = Query(..., description="Vehicle model"),
+    year: Optional[int] = Query(None, description="Model year (all years if omitted)"),
+    limit: int = Query(100, ge=1, le=1000),
+    token: str = Depends(verify_auth_token)
+):
+    """Recall campaigns covering a make, model and model year, newest first"""
+    recalls = diagnostic_manager.recall_index.lookup(make, model, year, limit=limit)
+    return {"make": make, "model": model, "year": year, "recalls": recalls}
+
+@app.post("/recalls/refresh")
+async def refresh_recalls(token: str = Depends(verify_auth_token)):
+    """Apply new recall deltas (or a new dump) now instead of waiting for the next refresh"""
+    changes = await diagnostic_manager.recall_index.refresh()
+    return {**changes, "status": diagnostic_manager.recall_index.stats()}
+
+@app.get("/recalls/status")
+async def get_recall_status(token: str = Depends(verify_auth_token)):
+    """Recall index size and refresh counters"""
+    return diagnostic_manager.recall_index.stats()
+
+@app.get("/parts/compatible")
+async def get_compatible_parts(
+    make: str = Query(..., description="Vehicle make"),
+    model: str = Query(..., description="Vehicle model"),
+    year: Optional[int] = Query(None, description="Model year (all years if omitted)"),
+    category: Optional[str] = Query(None, description="Part category (all categories if omitted)"),
+    universal: bool = Query(True, description="Include universal-fitment parts"),
+    limit: int = Query(50, ge=1, le=1000),
+    token: str = Depends(verify_auth_token)
+):
+    """In-stock parts that fit a vehicle, vehicle-specific first, cheapest first"""
+    parts = diagnostic_manager.parts_index.lookup(make, model, year, category, limit=limit, universal=universal)
+    return {"make": make, "model": model, "year": year, "category": category, "parts": parts}
+
+@app.post("/parts/changes")
+async def apply_parts_change(payload: Dict[str, Any], token: str = Depends(verify_auth_token)):
+    """Apply a Supabase database webhook for the parts table without waiting for the next sync"""
     try:
-        # In production, store to database and blockchain
-        logger.info(f"Storing diagnostic result {result.diagnosis_id}")
-        
-        # Placeholder for database storage
-        # await database.store_diagnostic(result)
+        operation = diagnostic_manager.parts_index.apply_webhook(payload)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid parts change: {e}")
+    return {"applied": operation, "parts": len(diagnostic_manager.parts_index)}
+
+@app.post("/parts/sync")
+async def sync_parts(
+    full: bool = Query(False, description="Reload the whole catalogue"),
+    token: str = Depends(verify_auth_token)
+):
+    """Apply catalogue changes now instead of waiting for the next sync"""
+    changes = await diagnostic_manager.parts_index.sync(full=full)
+    return {**changes, "status": diagnostic_manager.parts_index.stats()}
+
+@app.get("/parts/status")
+async def get_parts_status(token: str = Depends(verify_auth_token)):
+    """Parts fitment index size and sync counters"""
+    return diagnostic_manager.parts_index.stats()
+
+@app.get("/costs/estimate")
+async def get_cost_estimate(
+    repair_type: List[str] = Query(..., description="Trouble code system (ignition, cooling, ...), inspection or maintenance"),
+    token: str = Depends(verify_auth_token)
+):
+    """Cost range of one or more repairs, from the in-memory price distributions"""
+    unknown = [name for name in repair_type if name not in LABOUR_HOURS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown repair types: {', '.join(unknown)}")
+    return diagnostic_manager.cost_index.estimate(repair_type)
+
+@app.get("/costs/distributions")
+async def get_cost_distributions(token: str = Depends(verify_auth_token)):
+    """min/median/max price per part category and of workshop labour rates"""
+    return diagnostic_manager.cost_index.distributions()
+
+@app.post("/costs/refresh")
+async def refresh_costs(
+    full: bool = Query(False, description="Reload every price table"),
+    token: str = Depends(verify_auth_token)
+):
+    """Apply price and labour rate changes now instead of waiting for the next refresh"""
+    changes = await diagnostic_manager.cost_index.refresh(full=full)
+    return {"rows_changed": changes, "status": diagnostic_manager.cost_index.stats()}
+
+@app.get("/costs/status")
+async def get_cost_status(token: str = Depends(verify_auth_token)):
+    """Cost index size and refresh counters"""
+    return diagnostic_manager.cost_index.stats()
+
+@app.get("/telemetry/status")
+async def get_telemetry_status(token: str = Depends(verify_auth_token)):
+    """Get live telemetry ingestion and history store status"""
+    return {
+        **telemetry_hub.stats(),
+        "history_store": telemetry_store.stats(),
+        "rollups": telemetry_history.stats()
+    }
+
+@app.get("/fleet/rankings")
+async def get_fleet_rankings(
+    limit: int = Query(50, ge=1, le=10000),
+    urgency: Optional[str] = Query(None, pattern="^(low|medium|high|critical)$", description="Minimum urgency level"),
+    token: str = Depends(verify_auth_token)
+):
+    """Most urgent vehicles from the latest fleet scoring run"""
+    report = fleet_scoring_job.latest()
+    if report is None:
+        raise HTTPException(status_code=404, detail="No fleet scoring run has completed yet")
+    
+    ranking = report['ranking']
+    if urgency:
+        ranking = [vehicle for vehicle in ranking if URGENCY_ORDER[vehicle['urgency_level']] >= URGENCY_ORDER[urgency]]
+    return {
+        **{key: value for key, value in report.items() if key != 'ranking'},
+        'ranking': ranking[:limit]
+    }
+
+@app.post("/fleet/rankings/refresh", status_code=202)
+async def refresh_fleet_rankings(token: str = Depends(verify_auth_token)):
+    """Start a fleet scoring run now"""
+    started = fleet_scoring_job.trigger()
+    return {"started": started, **fleet_scoring_job.stats()}
+
+@app.get("/fleet/status")
+async def get_fleet_status(token: str = Depends(verify_auth_token)):
+    """Get fleet scoring schedule and last run status"""
+    return fleet_scoring_job.stats()
+
+@app.get("/persistence/status")
+async def get_persistence_status(token: str = Depends(verify_auth_token)):
+    """Get write-behind persistence and result cache status"""
+    return {
+        **diagnostic_manager.result_store.stats(),
+        "result_cache": diagnostic_manager.result_cache.stats(),
+        "history_cache": diagnostic_manager.history_cache.stats()
+    }
+
+@app.get("/xai/status")
+async def get_xai_status(token: str = Depends(verify_auth_token)):
+    """Get X.AI connection pool status"""
+    return {
+        "configured": diagnostic_manager.xai_api_key is not None,
+        "pool": diagnostic_manager.xai_client.pool_stats(),
+        "cache": diagnostic_manager.analysis_cache.stats()
+    }
+
+@stage_timer('persistence')
+def store_diagnostic_results(entries: List[Tuple[DiagnosticRequest, DiagnosticResult]]):
+    """Queue diagnostic results for the database via the write-ahead log"""
+    try:
+        records = [
+            {
+                'request': request.model_dump(mode='json'),
+                'result': result.model_dump(mode='json'),
+                'ai_model': XAI_MODEL if result.ai_analysis else ml_model_label()
+            }
+            for request, result in entries
+        ]
+        diagnostic_manager.result_store.append(records)
+        for vehicle_id in {request.vehicle_id for request, _ in entries}:
+            diagnostic_manager.invalidate_vehicle_history(vehicle_id)
         
         # Placeholder for blockchain storage
         # await hedera_service.store_diagnostic_hash(result)
         
     except Exception as e:
-        logger.error(f"Error storing diagnostic result: {e}")
+        logger.error(f"Error storing diagnostic results: {e}")
 
 if __name__ == "__main__":
     uvicorn.run(
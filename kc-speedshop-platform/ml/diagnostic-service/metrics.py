@@ -0,0 +1,160 @@
+"""
+KC Speedshop ML Diagnostic Service - Prometheus metrics
+Pipeline stage latencies, batch sizes, cache and X.AI counters for /metrics
+
+Under ``uvicorn --workers 4`` each worker is its own process with its own
+counters, and a scrape lands on whichever worker accepts it. When
+PROMETHEUS_MULTIPROC_DIR is set, every process (inference pool workers
+included) writes its samples to memory-mapped files in that directory and
+/metrics aggregates the files of all of them. The directory must be emptied
+before the workers start (the Dockerfile does this), or samples of a previous
+run are exported again. Without it the default in-process registry is used,
+which is right for a single worker.
+
+Cache hit ratio is derived at query time, e.g.
+``sum by (cache) (rate(kc_ml_cache_lookups_total{result="hit"}[5m]))
+/ sum by (cache) (rate(kc_ml_cache_lookups_total[5m]))``.
+"""
+
+import os
+from typing import Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+if PROMETHEUS_MULTIPROC_DIR:
+    # prometheus_client opens its value files as each metric is created
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+METRICS_PATH = "/metrics"
+
+PIPELINE_STAGES = (
+    'validation',
+    'feature_extraction',
+    'scaling',
+    'inference',
+    'xai_call',
+    'result_assembly',
+    'persistence'
+)
+
+# Local stages take microseconds to milliseconds; the X.AI call takes seconds
+STAGE_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 5000)
+
+XAI_ERROR_REASONS = ('http_status', 'transport')
+XAI_TIMEOUT_KINDS = ('pool', 'request', 'deadline')
+
+STAGE_SECONDS = Histogram(
+    'kc_ml_stage_duration_seconds',
+    'Latency of one diagnostic pipeline stage',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+INFERENCE_BATCH_ROWS = Histogram(
+    'kc_ml_inference_batch_rows',
+    'Feature rows scored per model pass',
+    buckets=BATCH_SIZE_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    'kc_ml_cache_lookups',
+    'Cache lookups by cache and outcome',
+    ['cache', 'result']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'kc_ml_http_requests_in_flight',
+    'HTTP requests being served',
+    multiprocess_mode='livesum'
+)
+XAI_ERRORS = Counter(
+    'kc_ml_xai_errors',
+    'Failed X.AI calls other than timeouts, by reason',
+    ['reason']
+)
+XAI_TIMEOUTS = Counter(
+    'kc_ml_xai_timeouts',
+    'X.AI calls that timed out: waiting for a pooled connection, on the wire, or past the stage deadline',
+    ['kind']
+)
+MODEL_INFO = Gauge(
+    'kc_ml_model_info',
+    'Diagnostic model version being served (1) or retired (0)',
+    ['model', 'version', 'backend'],
+    multiprocess_mode='livemax'
+)
+
+# Children looked up once, so timing a stage is a dict lookup
+STAGE_TIMERS = {stage: STAGE_SECONDS.labels(stage) for stage in PIPELINE_STAGES}
+
+# Export failure series at zero before the first failure, so rate() sees the step
+for reason in XAI_ERROR_REASONS:
+    XAI_ERRORS.labels(reason)
+for kind in XAI_TIMEOUT_KINDS:
+    XAI_TIMEOUTS.labels(kind)
+
+# Labels of the model version this process serves
+_served_model: Optional[Tuple[str, str, str]] = None
+
+def stage_timer(stage: str):
+    """Context manager / decorator observing the duration of a pipeline stage"""
+    return STAGE_TIMERS[stage].time()
+
+def record_model_version(bundle):
+    """Mark a model bundle as served by this process and its predecessor as retired
+
+    Called by the uvicorn worker only; inference pool workers never set the
+    gauge, since no one marks them dead when a model swap retires them.
+    """
+    global _served_model
+    labels = (bundle.name, bundle.version, bundle.backend)
+    if _served_model is not None and _served_model != labels:
+        MODEL_INFO.labels(*_served_model).set(0)
+    MODEL_INFO.labels(*labels).set(1)
+    _served_model = labels
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Exposition-format body and content type for a scrape"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead():
+    """Drop this process's live gauges from the multiprocess aggregate (on shutdown)"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+class InFlightMiddleware:
+    """ASGI middleware counting HTTP requests in flight
+
+    A plain ASGI wrapper rather than an ``@app.middleware`` function, so a
+    streamed response counts until its last chunk is sent. Scrapes of
+    /metrics are not counted.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] == METRICS_PATH:
+            await self.app(scope, receive, send)
+            return
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
@@ -0,0 +1,480 @@
+"""
+KC Speedshop ML Diagnostic Service - Model registry
+Versioned model + scaler artifacts with checksum verification and hot reload
+
+Layout under MODEL_REGISTRY_DIR (the /app/models directory created by the Dockerfile):
+
+    engine_diagnostics/
+        ACTIVE                  optional, pins the served version
+        <version>/
+            manifest.json       version metadata and sha256 of every artifact
+            model.keras
+            scaler.npz
+            weights.npz         NumPy export with the scaler folded in
+
+Without an ACTIVE file the newest version (by name) is served. With
+INFERENCE_BACKEND=numpy only weights.npz is loaded and TensorFlow is never
+imported.
+
+Usage:
+    python model_registry.py bootstrap [--if-empty]
+    python model_registry.py list
+    python model_registry.py activate <version>
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from numpy_backend import DenseNumpyModel, verify_against_keras
+
+logger = logging.getLogger(__name__)
+
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "/app/models")
+MODEL_REGISTRY_POLL_SECONDS = float(os.getenv("MODEL_REGISTRY_POLL_SECONDS", "30"))
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "tensorflow")  # tensorflow | numpy
+
+INFERENCE_BACKENDS = ('tensorflow', 'numpy')
+
+MANIFEST_FILE = "manifest.json"
+ACTIVE_FILE = "ACTIVE"
+MODEL_FILE = "model.keras"
+SCALER_FILE = "scaler.npz"
+WEIGHTS_FILE = "weights.npz"
+
+# Output classes of the engine_diagnostics model, in softmax column order
+DIAGNOSTIC_CLASSES = ['normal', 'maintenance_required', 'critical']
+
+class ModelArtifactError(Exception):
+    """Raised when a model version is missing, incomplete or fails verification"""
+
+class ArrayScaler:
+    """StandardScaler equivalent rebuilt from stored mean/scale arrays"""
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray):
+        self.mean_ = np.asarray(mean, dtype=np.float32)
+        self.scale_ = np.asarray(scale, dtype=np.float32)
+        # Match StandardScaler: constant features are left unscaled
+        self.scale_ = np.where(self.scale_ == 0, 1.0, self.scale_).astype(np.float32)
+
+    def transform(self, features) -> np.ndarray:
+        return (np.asarray(features, dtype=np.float32) - self.mean_) / self.scale_
+
+    @classmethod
+    def fit(cls, data: np.ndarray) -> "ArrayScaler":
+        return cls(np.mean(data, axis=0), np.std(data, axis=0))
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            np.savez(f, mean=self.mean_, scale=self.scale_)
+
+    @classmethod
+    def load(cls, path: str) -> "ArrayScaler":
+        with np.load(path) as arrays:
+            return cls(arrays['mean'], arrays['scale'])
+
+class ModelBundle:
+    """A loaded model version: model, scaler and provenance
+
+    ``scaler`` is None when the backend has the scaling folded into the model.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        version: str,
+        model: Any,
+        scaler: Optional[ArrayScaler],
+        manifest: Dict[str, Any],
+        load_seconds: float,
+        source: str = "registry",
+        backend: str = "tensorflow"
+    ):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.scaler = scaler
+        self.backend = backend
+        self.manifest = manifest
+        self.load_seconds = load_seconds
+        self.source = source
+        self.loaded_at = datetime.utcnow()
+
+    def scale(self, feature_matrix: np.ndarray) -> np.ndarray:
+        """Standardise raw features (a no-op when the scaler is folded into the model)"""
+        # The NumPy backend has the scaler folded into its first layer
+        return self.scaler.transform(feature_matrix) if self.scaler is not None else feature_matrix
+
+    def infer(self, scaled_features: np.ndarray) -> np.ndarray:
+        """Class probabilities for already-scaled features"""
+        return np.asarray(self.model.predict_on_batch(scaled_features))
+
+    def predict(self, feature_matrix: np.ndarray) -> np.ndarray:
+        """Class probabilities for an (N, features) matrix in one model pass"""
+        return self.infer(self.scale(feature_matrix))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'version': self.version,
+            'source': self.source,
+            'backend': self.backend,
+            'scaler': 'separate' if self.scaler is not None else 'folded',
+            'framework': self.manifest.get('framework'),
+            'created_at': self.manifest.get('created_at'),
+            'loaded_at': self.loaded_at.isoformat(),
+            'load_seconds': round(self.load_seconds, 4)
+        }
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def build_demo_model(num_features: int = 20):
+    """Untrained 20->64->32->3 engine_diagnostics network (placeholder until a trained model is published)"""
+    import tensorflow as tf
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Dense(64, activation='relu', input_shape=(num_features,)),
+        tf.keras.layers.Dropout(0.3),
+        tf.keras.layers.Dense(32, activation='relu'),
+        tf.keras.layers.Dense(3, activation='softmax')  # normal, maintenance, critical
+    ])
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+def build_demo_scaler(num_features: int = 20) -> ArrayScaler:
+    # Fit with dummy data (in production, use real training data)
+    return ArrayScaler.fit(np.random.normal(0, 1, (100, num_features)))
+
+def build_demo_numpy_model(num_features: int = 20) -> DenseNumpyModel:
+    """Placeholder network for the NumPy backend, built without TensorFlow"""
+    return DenseNumpyModel.random([num_features, 64, 32, 3], ['relu', 'relu', 'softmax'])
+
+def build_bootstrap_bundle(backend: str, num_features: int = 20, name: str = "engine_diagnostics") -> ModelBundle:
+    """Placeholder bundle served while no version has been published"""
+    started = time.perf_counter()
+    if backend == "numpy":
+        model, scaler = build_demo_numpy_model(num_features), None
+    else:
+        model, scaler = build_demo_model(num_features), build_demo_scaler(num_features)
+    return ModelBundle(
+        name=name,
+        version='bootstrap',
+        model=model,
+        scaler=scaler,
+        manifest={'framework': 'keras'},
+        load_seconds=time.perf_counter() - started,
+        source='bootstrap',
+        backend=backend
+    )
+
+def _load_keras_model(path: str):
+    import tensorflow as tf
+
+    return tf.keras.models.load_model(path, compile=False)
+
+class ModelRegistry:
+    """Loads versioned artifacts and hot-swaps the active ModelBundle
+
+    Swaps replace a single reference, so a request that already picked up
+    the previous bundle finishes on it while new requests see the new one.
+    """
+
+    def __init__(self, root: str = MODEL_REGISTRY_DIR, name: str = "engine_diagnostics", backend: str = INFERENCE_BACKEND):
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}")
+        self.root = root
+        self.name = name
+        self.backend = backend
+        self.active: Optional[ModelBundle] = None
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+        self.history: deque = deque(maxlen=20)
+        self._watcher: Optional[asyncio.Task] = None
+        self._reload_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def model_dir(self) -> str:
+        return os.path.join(self.root, self.name)
+
+    def list_versions(self) -> List[str]:
+        """Published versions, oldest first"""
+        if not os.path.isdir(self.model_dir):
+            return []
+        return sorted(
+            entry for entry in os.listdir(self.model_dir)
+            if os.path.isfile(os.path.join(self.model_dir, entry, MANIFEST_FILE))
+        )
+
+    def resolve_active_version(self) -> Optional[str]:
+        """Version pinned by ACTIVE, else the newest published version"""
+        active_path = os.path.join(self.model_dir, ACTIVE_FILE)
+        if os.path.isfile(active_path):
+            with open(active_path) as f:
+                pinned = f.read().strip()
+            if pinned:
+                return pinned
+        versions = self.list_versions()
+        return versions[-1] if versions else None
+
+    def load_version(self, version: str) -> ModelBundle:
+        """Load and checksum-verify one version"""
+        started = time.perf_counter()
+        version_dir = os.path.join(self.model_dir, version)
+        manifest_path = os.path.join(version_dir, MANIFEST_FILE)
+        if not os.path.isfile(manifest_path):
+            raise ModelArtifactError(f"Model version '{version}' has no {MANIFEST_FILE}")
+
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        # Every artifact the loader opens must be covered by a checksum
+        files = manifest.get('files', {})
+        unlisted = [filename for filename in self._artifacts(files) if filename not in files]
+        if unlisted:
+            raise ModelArtifactError(f"Manifest of model version '{version}' has no checksum for {', '.join(unlisted)}")
+
+        for filename, expected in files.items():
+            path = os.path.join(version_dir, filename)
+            if not os.path.exists(path):
+                raise ModelArtifactError(f"Model version '{version}' is missing {filename}")
+            actual = sha256_file(path)
+            if actual != expected:
+                raise ModelArtifactError(f"Checksum mismatch for {version}/{filename}: expected {expected}, got {actual}")
+
+        framework = manifest.get('framework', 'keras')
+        if framework != 'keras':
+            raise ModelArtifactError(f"Unsupported model framework '{framework}' in version '{version}'")
+
+        if self.backend == "numpy":
+            model, scaler = self._load_numpy_backend(version, version_dir, manifest)
+        else:
+            model = _load_keras_model(os.path.join(version_dir, MODEL_FILE))
+            scaler = ArrayScaler.load(os.path.join(version_dir, SCALER_FILE))
+
+        return ModelBundle(
+            self.name, version, model, scaler, manifest,
+            time.perf_counter() - started, backend=self.backend
+        )
+
+    def _artifacts(self, files: Dict[str, str]) -> List[str]:
+        """Files load_version opens for this backend"""
+        if self.backend == "numpy" and WEIGHTS_FILE in files:
+            return [WEIGHTS_FILE]
+        return [MODEL_FILE, SCALER_FILE]
+
+    def _load_numpy_backend(self, version: str, version_dir: str, manifest: Dict[str, Any]):
+        if WEIGHTS_FILE in manifest.get('files', {}):
+            return DenseNumpyModel.load(os.path.join(version_dir, WEIGHTS_FILE)), None
+
+        # Versions published before the NumPy export existed need TensorFlow once
+        logger.warning(f"Model version '{version}' has no {WEIGHTS_FILE}, exporting it from {MODEL_FILE}")
+        scaler = ArrayScaler.load(os.path.join(version_dir, SCALER_FILE))
+        keras_model = _load_keras_model(os.path.join(version_dir, MODEL_FILE))
+        return DenseNumpyModel.from_keras(keras_model, scaler.mean_, scaler.scale_), None
+
+    def load_active(self) -> Optional[ModelBundle]:
+        """Load the version that should be served, or None if nothing is published"""
+        version = self.resolve_active_version()
+        return self.load_version(version) if version else None
+
+    def publish(
+        self,
+        model: Any,
+        scaler: ArrayScaler,
+        version: Optional[str] = None,
+        activate: bool = False,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Write a new version atomically (temp directory + rename)"""
+        version = version or datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        os.makedirs(self.model_dir, exist_ok=True)
+        final_dir = os.path.join(self.model_dir, version)
+        if os.path.exists(final_dir):
+            raise ModelArtifactError(f"Model version '{version}' already exists")
+
+        staging_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=self.model_dir)
+        try:
+            model.save(os.path.join(staging_dir, MODEL_FILE))
+            scaler.save(os.path.join(staging_dir, SCALER_FILE))
+            numpy_export = self._export_numpy_weights(model, scaler, staging_dir)
+
+            manifest = {
+                'name': self.name,
+                'version': version,
+                'framework': 'keras',
+                'created_at': datetime.utcnow().isoformat(),
+                'files': {
+                    filename: sha256_file(os.path.join(staging_dir, filename))
+                    for filename in sorted(os.listdir(staging_dir))
+                },
+                'numpy_export': numpy_export,
+                **(metadata or {})
+            }
+            # The manifest is written last so a half-written version is never listed
+            with open(os.path.join(staging_dir, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f, indent=2)
+
+            os.rename(staging_dir, final_dir)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        if activate:
+            self.activate(version)
+        logger.info(f"Published model {self.name} version {version}")
+        return version
+
+    @staticmethod
+    def _export_numpy_weights(model: Any, scaler: ArrayScaler, staging_dir: str) -> Dict[str, Any]:
+        """Write weights.npz and check it against the Keras model's outputs"""
+        try:
+            numpy_model = DenseNumpyModel.from_keras(model, scaler.mean_, scaler.scale_)
+            max_error = verify_against_keras(numpy_model, model, scaler.mean_, scaler.scale_)
+        except ValueError as e:
+            logger.warning(f"Skipping NumPy export: {e}")
+            return {'exported': False, 'reason': str(e)}
+        numpy_model.save(os.path.join(staging_dir, WEIGHTS_FILE))
+        return {'exported': True, 'layer_sizes': numpy_model.layer_sizes, 'max_abs_error': max_error}
+
+    def activate(self, version: str):
+        """Pin the served version (picked up by running services on their next poll)"""
+        if version not in self.list_versions():
+            raise ModelArtifactError(f"Unknown model version '{version}'")
+        active_path = os.path.join(self.model_dir, ACTIVE_FILE)
+        staging_path = f"{active_path}.tmp"
+        with open(staging_path, 'w') as f:
+            f.write(version)
+        os.replace(staging_path, active_path)
+
+    async def reload(
+        self,
+        force: bool = False,
+        on_swap: Optional[Callable[[ModelBundle], Awaitable[None]]] = None
+    ) -> bool:
+        """Load the active version off the event loop and swap it in if it changed"""
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+
+        async with self._reload_lock:
+            version = self.resolve_active_version()
+            if version is None:
+                return False
+            if not force and self.active is not None and self.active.version == version:
+                return False
+
+            try:
+                bundle = await asyncio.to_thread(self.load_version, version)
+            except Exception as e:
+                self.reload_errors += 1
+                self.last_error = str(e)
+                logger.error(f"Failed to load model {self.name} version {version}: {e}")
+                return False
+
+            previous = self.active
+            self.active = bundle
+            self.last_error = None
+            self.history.append({
+                'version': bundle.version,
+                'previous_version': previous.version if previous else None,
+                'swapped_at': bundle.loaded_at.isoformat(),
+                'load_seconds': round(bundle.load_seconds, 4)
+            })
+            logger.info(
+                f"Model {self.name} swapped to version {bundle.version} "
+                f"(was {previous.version if previous else 'none'}, loaded in {bundle.load_seconds:.2f}s)"
+            )
+
+            if on_swap is not None:
+                await on_swap(bundle)
+            return True
+
+    def start_watching(
+        self,
+        interval: float = MODEL_REGISTRY_POLL_SECONDS,
+        on_swap: Optional[Callable[[ModelBundle], Awaitable[None]]] = None
+    ):
+        """Poll the registry for a new active version every interval seconds"""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        async def watch():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.reload(on_swap=on_swap)
+                except Exception as e:
+                    logger.error(f"Model registry poll failed: {e}")
+
+        self._watcher = asyncio.create_task(watch(), name=f"{self.name}-registry-watcher")
+
+    async def stop_watching(self):
+        if self._watcher is None:
+            return
+        self._watcher.cancel()
+        try:
+            await self._watcher
+        except asyncio.CancelledError:
+            pass
+        self._watcher = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'root': self.model_dir,
+            'active': self.active.describe() if self.active else None,
+            'published_versions': self.list_versions(),
+            'pinned_version': self.resolve_active_version(),
+            'watching': self._watcher is not None,
+            'reload_errors': self.reload_errors,
+            'last_error': self.last_error,
+            'history': list(self.history)
+        }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage engine_diagnostics model artifacts")
+    parser.add_argument("--root", default=MODEL_REGISTRY_DIR, help="Registry root directory")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    bootstrap = subcommands.add_parser("bootstrap", help="Publish the placeholder demo model")
+    bootstrap.add_argument("--if-empty", action="store_true", help="Do nothing if a version already exists")
+    bootstrap.add_argument("--version", default=None)
+    subcommands.add_parser("list", help="List published versions")
+    activate = subcommands.add_parser("activate", help="Pin the served version")
+    activate.add_argument("version")
+
+    args = parser.parse_args(argv)
+    registry = ModelRegistry(root=args.root)
+
+    if args.command == "bootstrap":
+        if args.if_empty and registry.list_versions():
+            print(f"Registry already has versions: {', '.join(registry.list_versions())}")
+            return 0
+        print(registry.publish(build_demo_model(), build_demo_scaler(), version=args.version))
+    elif args.command == "list":
+        active = registry.resolve_active_version()
+        for version in registry.list_versions():
+            print(f"{'*' if version == active else ' '} {version}")
+    elif args.command == "activate":
+        registry.activate(args.version)
+        print(f"Activated {args.version}")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
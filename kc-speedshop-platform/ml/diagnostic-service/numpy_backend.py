@@ -0,0 +1,170 @@
+"""
+KC Speedshop ML Diagnostic Service - NumPy inference backend
+Runs the dense engine_diagnostics network with NumPy matmuls, without TensorFlow
+
+The StandardScaler step is folded into the first layer:
+    ((x - mean) / scale) @ W + b  ==  x @ (W / scale[:, None]) + (b - (mean / scale) @ W)
+so a forward pass is one matmul per layer on raw feature rows.
+"""
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SUPPORTED_ACTIVATIONS = ('linear', 'relu', 'softmax')
+
+# Largest acceptable |numpy - keras| difference in output probabilities
+DEFAULT_TOLERANCE = 1e-5
+
+def _relu(x: np.ndarray) -> np.ndarray:
+    return np.maximum(x, 0, out=x)
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    x -= x.max(axis=-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=-1, keepdims=True)
+    return x
+
+_ACTIVATIONS = {'linear': lambda x: x, 'relu': _relu, 'softmax': _softmax}
+
+class DenseNumpyModel:
+    """Stack of dense layers evaluated with float32 NumPy matmuls
+
+    Exposes ``predict_on_batch`` so it is a drop-in for the Keras model in
+    score_feature_matrix; single rows are scored as a (1, F) batch.
+    """
+
+    def __init__(self, layers: Sequence[Tuple[np.ndarray, np.ndarray, str]], scaler_folded: bool = False):
+        if not layers:
+            raise ValueError("DenseNumpyModel needs at least one layer")
+        self.layers: List[Tuple[np.ndarray, np.ndarray, str]] = []
+        for weights, bias, activation in layers:
+            if activation not in SUPPORTED_ACTIVATIONS:
+                raise ValueError(f"Unsupported activation '{activation}'")
+            self.layers.append((
+                np.ascontiguousarray(weights, dtype=np.float32),
+                np.ascontiguousarray(bias, dtype=np.float32),
+                activation
+            ))
+        self.scaler_folded = scaler_folded
+
+    @property
+    def input_width(self) -> int:
+        return self.layers[0][0].shape[0]
+
+    @property
+    def layer_sizes(self) -> List[int]:
+        return [self.input_width] + [weights.shape[1] for weights, _, _ in self.layers]
+
+    @classmethod
+    def from_keras(
+        cls,
+        model: Any,
+        mean: Optional[np.ndarray] = None,
+        scale: Optional[np.ndarray] = None
+    ) -> "DenseNumpyModel":
+        """Export Dense layer weights once (Dropout is a no-op at inference)"""
+        layers = []
+        for layer in model.layers:
+            weights = layer.get_weights()
+            if not weights:
+                continue
+            if len(weights) != 2:
+                raise ValueError(f"Layer '{getattr(layer, 'name', layer)}' is not a dense layer with bias")
+            activation = getattr(layer.activation, '__name__', str(layer.activation))
+            layers.append((weights[0], weights[1], activation))
+
+        numpy_model = cls(layers)
+        if mean is not None and scale is not None:
+            numpy_model = numpy_model.fold_scaler(mean, scale)
+        return numpy_model
+
+    @classmethod
+    def random(cls, layer_sizes: Sequence[int], activations: Sequence[str], seed: Optional[int] = None) -> "DenseNumpyModel":
+        """Glorot-uniform initialised network (placeholder when no artifacts exist)"""
+        rng = np.random.default_rng(seed)
+        layers = []
+        for fan_in, fan_out, activation in zip(layer_sizes[:-1], layer_sizes[1:], activations):
+            limit = np.sqrt(6.0 / (fan_in + fan_out))
+            layers.append((rng.uniform(-limit, limit, (fan_in, fan_out)), np.zeros(fan_out), activation))
+        return cls(layers)
+
+    def fold_scaler(self, mean: np.ndarray, scale: np.ndarray) -> "DenseNumpyModel":
+        """Return a copy whose first layer applies (x - mean) / scale itself"""
+        if self.scaler_folded:
+            raise ValueError("Scaler is already folded into this model")
+        mean = np.asarray(mean, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        scale = np.where(scale == 0, 1.0, scale)
+
+        weights, bias, activation = self.layers[0]
+        folded_weights = weights.astype(np.float64) / scale[:, np.newaxis]
+        folded_bias = bias.astype(np.float64) - (mean / scale) @ weights.astype(np.float64)
+        return DenseNumpyModel(
+            [(folded_weights, folded_bias, activation)] + self.layers[1:],
+            scaler_folded=True
+        )
+
+    def predict_on_batch(self, features) -> np.ndarray:
+        """Forward pass over an (N, F) matrix"""
+        x = np.asarray(features, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[np.newaxis, :]
+        for weights, bias, activation in self.layers:
+            x = x @ weights
+            x += bias
+            x = _ACTIVATIONS[activation](x)
+        return x
+
+    def predict_row(self, features) -> np.ndarray:
+        """Forward pass for a single (F,) row"""
+        return self.predict_on_batch(np.asarray(features)[np.newaxis, :])[0]
+
+    def save(self, path: str):
+        arrays = {'scaler_folded': np.array(self.scaler_folded)}
+        for index, (weights, bias, activation) in enumerate(self.layers):
+            arrays[f'w{index}'] = weights
+            arrays[f'b{index}'] = bias
+            arrays[f'a{index}'] = np.array(activation)
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "DenseNumpyModel":
+        with np.load(path) as arrays:
+            layers = []
+            index = 0
+            while f'w{index}' in arrays:
+                layers.append((arrays[f'w{index}'], arrays[f'b{index}'], str(arrays[f'a{index}'])))
+                index += 1
+            return cls(layers, scaler_folded=bool(arrays['scaler_folded']))
+
+def verify_against_keras(
+    numpy_model: DenseNumpyModel,
+    keras_model: Any,
+    mean: np.ndarray,
+    scale: np.ndarray,
+    samples: int = 512,
+    tolerance: float = DEFAULT_TOLERANCE,
+    seed: int = 0
+) -> float:
+    """Compare outputs with the TF model on random rows; returns the max abs error
+
+    Raises ValueError if the two backends disagree by more than tolerance.
+    """
+    rng = np.random.default_rng(seed)
+    mean = np.asarray(mean, dtype=np.float32)
+    scale = np.asarray(scale, dtype=np.float32)
+    raw = (rng.normal(0.0, 2.0, (samples, numpy_model.input_width)) * scale + mean).astype(np.float32)
+
+    safe_scale = np.where(scale == 0, 1.0, scale)
+    expected = np.asarray(keras_model.predict_on_batch((raw - mean) / safe_scale), dtype=np.float64)
+    inputs = raw if numpy_model.scaler_folded else (raw - mean) / safe_scale
+
+    batched = numpy_model.predict_on_batch(inputs).astype(np.float64)
+    single = np.stack([numpy_model.predict_row(row) for row in inputs[:16]]).astype(np.float64)
+
+    max_error = float(max(np.max(np.abs(batched - expected)), np.max(np.abs(single - expected[:16]))))
+    if max_error > tolerance:
+        raise ValueError(f"NumPy backend deviates from TensorFlow by {max_error:.3g} (tolerance {tolerance:.1g})")
+    return max_error
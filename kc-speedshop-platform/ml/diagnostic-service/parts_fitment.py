@@ -0,0 +1,502 @@
+"""
+KC Speedshop ML Diagnostic Service - Parts fitment index
+In-memory (make, model, year, category) index of in-stock parts
+
+The ``parts`` catalogue describes fitment as a jsonb array of free-text
+vehicles (``"Nissan Skyline R32-R34"``, ``"Honda Civic Type R FK8"``,
+``"Universal Fitment"``) or objects (``{"make": "Toyota", "model": "Supra",
+"year_from": 1993, "year_to": 2002}``). Each entry is parsed once into a
+make, a model and a model-year interval; a trailing chassis code is turned
+into years with the tables in knowledge/fitment_chassis.json, and an entry
+without one fits every year. Entries that name no known make (workshop
+features, bolt patterns) are skipped, except ``Universal ...`` which fits
+every vehicle.
+
+Only active parts with stock are indexed. The catalogue is read in full at
+startup and then polled every PARTS_SYNC_SECONDS for rows whose updated_at
+moved past the last one seen, so a sync touches only changed parts; parts
+going out of stock or inactive arrive this way. Deleted rows leave no
+updated_at behind, so every PARTS_RECONCILE_SECONDS a sync also reads the
+table's ids and drops indexed parts that are gone. Each uvicorn worker does
+this on its own, so a deletion reaches all of them within that interval;
+Supabase database webhooks (POST /parts/changes) only reach the worker that
+receives them.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from catalogue import FeedReader, TableFeed, create_catalogue
+
+logger = logging.getLogger(__name__)
+
+PARTS_CHASSIS_PATH = os.getenv(
+    "PARTS_CHASSIS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "fitment_chassis.json")
+)
+PARTS_SYNC_SECONDS = float(os.getenv("PARTS_SYNC_SECONDS", "30"))
+PARTS_FULL_RELOAD_SECONDS = float(os.getenv("PARTS_FULL_RELOAD_SECONDS", "21600"))
+# Id-set check for hard-deleted parts (0 disables it)
+PARTS_RECONCILE_SECONDS = float(os.getenv("PARTS_RECONCILE_SECONDS", "60"))
+# In-stock parts attached to each recommendation
+PARTS_RECOMMENDATION_LIMIT = int(os.getenv("PARTS_RECOMMENDATION_LIMIT", "3"))
+
+# Columns read from the parts table
+PARTS_FEED = TableFeed(
+    'parts',
+    ('id', 'name', 'brand', 'part_number', 'category', 'price', 'currency',
+     'stock_quantity', 'compatibility', 'status', 'updated_at'),
+    casts={'price': 'price::float8'}
+)
+
+# Part details returned with a lookup
+PART_FIELDS = ('id', 'name', 'brand', 'part_number', 'category', 'price', 'currency', 'stock_quantity')
+
+# Part category for the system of a trouble code
+SYSTEM_CATEGORIES = {
+    'air metering': 'engine',
+    'body': 'exterior',
+    'brakes': 'brakes',
+    'chassis': 'suspension',
+    'cooling': 'cooling',
+    'electrical': 'electronics',
+    'emissions': 'exhaust',
+    'engine': 'engine',
+    'engine control module': 'electronics',
+    'evaporative emissions': 'exhaust',
+    'forced induction': 'engine',
+    'fuel and air metering': 'engine',
+    'fuel injection': 'engine',
+    'fuel system': 'engine',
+    'fuel trim': 'engine',
+    'ignition': 'engine',
+    'lubrication': 'engine',
+    'network': 'electronics',
+    'oxygen sensors': 'exhaust',
+    'speed and idle control': 'engine',
+    'throttle': 'engine',
+    'variable valve timing': 'engine'
+}
+
+# Part category for a rule of the OBD rule engine
+RULE_CATEGORIES = {
+    'engine_overheating': 'cooling',
+    'severe_overheating': 'cooling',
+    'sustained_overheating': 'cooling',
+    'thermostat_stuck_open': 'cooling',
+    'intake_heat_soak': 'cooling',
+    'idle_instability': 'engine',
+    'low_fuel_pressure_under_load': 'engine',
+    'maf_implausible': 'engine',
+    'o2_sensor_stuck': 'exhaust'
+}
+
+ALL_YEARS = (0, 9999)
+UNIVERSAL = '*'
+
+# (first model year, last model year, part id)
+Interval = Tuple[int, int, str]
+# (make, model, category)
+FitmentKey = Tuple[str, str, str]
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]')
+_YEARS = re.compile(r'^\(?((?:19|20)\d\d)(?:-((?:19|20)\d\d)|(\+))?\)?$')
+
+def _key(text: Any) -> str:
+    return _NON_ALNUM.sub('', str(text).upper())
+
+def latest_model_year() -> int:
+    """Last year of open-ended fitments (2015+), kept short so lookups scan little"""
+    return datetime.utcnow().year + 1
+
+def normalize_category(category: Optional[str]) -> str:
+    return str(category).strip().lower() if category else ''
+
+class ChassisTables:
+    """Known makes, aliases and chassis code model years"""
+
+    def __init__(self, tables: Dict[str, Any]):
+        self.makes: Set[str] = set(tables.get('makes', ()))
+        self.make_aliases: Dict[str, str] = tables.get('make_aliases', {})
+        self.model_aliases: Dict[str, Dict[str, str]] = tables.get('model_aliases', {})
+        self.chassis: Dict[str, Dict[str, Tuple[int, int]]] = {
+            make: {code: tuple(years) for code, years in codes.items()}
+            for make, codes in tables.get('chassis', {}).items()
+        }
+
+    @classmethod
+    def from_file(cls, path: str = PARTS_CHASSIS_PATH) -> "ChassisTables":
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def make(self, text: Any) -> Optional[str]:
+        """Index key of a make, or None if it is not a known make"""
+        key = _key(text)
+        key = self.make_aliases.get(key, key)
+        return key if key in self.makes else None
+
+    def model(self, make: str, words: Sequence[str]) -> str:
+        """Index key of a model: upper-case alphanumeric words, aliases expanded"""
+        model = ' '.join(word for word in (_key(word) for word in words) if word)
+        aliases = self.model_aliases.get(make, {})
+        for alias, target in aliases.items():
+            if model == alias or model.startswith(alias + ' '):
+                return target + model[len(alias):]
+        return model
+
+    def years(self, make: str, qualifier: str) -> Optional[Tuple[int, int]]:
+        """Model years of a trailing qualifier (1993-2002, 2015+, R32, R32-R34), or None"""
+        match = _YEARS.match(qualifier)
+        if match:
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else latest_model_year() if match.group(3) else first
+            return (first, last) if first <= last else None
+        codes = self.chassis.get(make)
+        if not codes:
+            return None
+        spans = [codes.get(_key(code)) for code in qualifier.split('-')]
+        if not spans or None in spans:
+            return None
+        return min(span[0] for span in spans), max(span[1] for span in spans)
+
+    def parse(self, entry: Any) -> Optional[Tuple[str, str, int, int]]:
+        """(make, model, first year, last year) of one compatibility entry, or None"""
+        if isinstance(entry, dict):
+            make = self.make(entry.get('make', ''))
+            if make is None:
+                return None
+            model = self.model(make, str(entry.get('model') or '').split())
+            if not entry.get('year_from') and not entry.get('year_to'):
+                return make, model, *ALL_YEARS
+            try:
+                first = int(entry.get('year_from') or entry['year_to'])
+                last = int(entry.get('year_to') or latest_model_year())
+            except (TypeError, ValueError):
+                return None  # e.g. "year_from": "late 90s"
+            return (make, model, first, last) if first <= last else None
+
+        words = str(entry).split()
+        if not words:
+            return None
+        if _key(words[0]) == 'UNIVERSAL':
+            return UNIVERSAL, '', *ALL_YEARS
+        # Two-word makes (Land Rover, Alfa Romeo) before one-word ones
+        make = self.make(''.join(words[:2])) if len(words) > 1 else None
+        if make is not None:
+            words = words[2:]
+        else:
+            make = self.make(words[0])
+            if make is None:
+                return None
+            words = words[1:]
+        years = self.years(make, words[-1]) if len(words) > 1 else None
+        if years is not None:
+            words = words[:-1]
+        elif words and _YEARS.match(words[-1]):
+            years, words = self.years(make, words[-1]), words[:-1]
+        return (make, self.model(make, words), *(years or ALL_YEARS))
+
+def part_in_stock(row: Dict[str, Any]) -> bool:
+    return (row.get('status') or 'active') == 'active' and (row.get('stock_quantity') or 0) > 0
+
+def _compatibility(value: Any) -> List[Any]:
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    return value if isinstance(value, list) else []
+
+class PartsFitmentIndex:
+    """Interval index of in-stock parts per make, model and category
+
+    Each (make, model, category) holds its parts' year intervals sorted by
+    first year; a lookup bisects to the intervals starting within the
+    longest span before the year and keeps those ending at or after it.
+    Parts that fit every year sit in a plain list beside the intervals.
+    A changed part is removed from the keys it was in and inserted into its
+    new ones, leaving the rest of the index untouched.
+    """
+
+    def __init__(
+        self,
+        catalogue=None,
+        chassis: Optional[ChassisTables] = None,
+        sync_seconds: float = PARTS_SYNC_SECONDS,
+        full_reload_seconds: float = PARTS_FULL_RELOAD_SECONDS,
+        reconcile_seconds: float = PARTS_RECONCILE_SECONDS
+    ):
+        self.catalogue = catalogue
+        self.chassis = chassis if chassis is not None else ChassisTables({})
+        self.sync_seconds = sync_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.reconcile_seconds = reconcile_seconds
+
+        self._parts: Dict[str, Dict[str, Any]] = {}
+        self._intervals: Dict[FitmentKey, List[Interval]] = {}
+        self._starts: Dict[FitmentKey, List[int]] = {}
+        # Longest interval per key bounds how far back a lookup scans; it only grows
+        self._max_span: Dict[FitmentKey, int] = {}
+        self._any_year: Dict[FitmentKey, List[str]] = {}
+        self._categories: Dict[Tuple[str, str], Set[str]] = {}
+        self._part_keys: Dict[str, List[Tuple[FitmentKey, int, int]]] = {}
+        self._feed = FeedReader(PARTS_FEED)
+        self._last_full_load: Optional[float] = None
+        self._last_reconcile: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        # Metrics
+        self.lookups = 0
+        self.full_loads = 0
+        self.syncs = 0
+        self.upserts = 0
+        self.deletes = 0
+        self.reconciles = 0
+        self.unparsed_entries = 0
+        self.sync_errors = 0
+
+    @classmethod
+    def from_environment(cls) -> "PartsFitmentIndex":
+        return cls(create_catalogue(), ChassisTables.from_file())
+
+    def __len__(self) -> int:
+        return len(self._parts)
+
+    def _insert(self, key: FitmentKey, first: int, last: int, part_id: str):
+        if (first, last) == ALL_YEARS:
+            self._any_year.setdefault(key, []).append(part_id)
+        else:
+            intervals = self._intervals.setdefault(key, [])
+            starts = self._starts.setdefault(key, [])
+            position = bisect.bisect_right(starts, first)
+            intervals.insert(position, (first, last, part_id))
+            starts.insert(position, first)
+            self._max_span[key] = max(self._max_span.get(key, 0), last - first)
+        self._categories.setdefault(key[:2], set()).add(key[2])
+
+    def _discard(self, key: FitmentKey, first: int, last: int, part_id: str):
+        if (first, last) == ALL_YEARS:
+            self._any_year[key].remove(part_id)
+            if not self._any_year[key]:
+                del self._any_year[key]
+        else:
+            intervals = self._intervals[key]
+            starts = self._starts[key]
+            position = intervals.index((first, last, part_id), bisect.bisect_left(starts, first))
+            del intervals[position]
+            del starts[position]
+            if not intervals:
+                del self._intervals[key], self._starts[key], self._max_span[key]
+        if key not in self._intervals and key not in self._any_year:
+            categories = self._categories[key[:2]]
+            categories.discard(key[2])
+            if not categories:
+                del self._categories[key[:2]]
+
+    def _unindex(self, part_id: str) -> bool:
+        for key, first, last in self._part_keys.pop(part_id, ()):
+            self._discard(key, first, last, part_id)
+        return self._parts.pop(part_id, None) is not None
+
+    def delete(self, part_id: str):
+        """Remove a part from every key it fits"""
+        if self._unindex(str(part_id)):
+            self.deletes += 1
+
+    def upsert(self, row: Dict[str, Any]):
+        """Index a changed parts row; parts out of stock or inactive are removed"""
+        part_id = str(row['id'])
+        self._unindex(part_id)
+        if not part_in_stock(row):
+            return
+        category = normalize_category(row.get('category'))
+        fitments = []
+        for entry in _compatibility(row.get('compatibility')):
+            parsed = self.chassis.parse(entry)
+            if parsed is None:
+                self.unparsed_entries += 1
+                continue
+            make, model, first, last = parsed
+            fitments.append(((make, model, category), first, last))
+        fitments = list(dict.fromkeys(fitments))
+        for key, first, last in fitments:
+            self._insert(key, first, last, part_id)
+        self._part_keys[part_id] = fitments
+        self._parts[part_id] = {
+            **{field: row.get(field) for field in PART_FIELDS},
+            'id': part_id,
+            'category': category,
+            'price': float(row['price']) if row.get('price') is not None else None
+        }
+        self.upserts += 1
+
+    def load(self, rows: Iterable[Dict[str, Any]]):
+        """Replace the whole index with a full read of the catalogue"""
+        self._parts, self._part_keys, self._categories = {}, {}, {}
+        self._intervals, self._starts, self._max_span, self._any_year = {}, {}, {}, {}
+        for row in rows:
+            self.upsert(row)
+        self.full_loads += 1
+
+    def _matches(self, key: FitmentKey, year: Optional[int]) -> List[str]:
+        intervals = self._intervals.get(key, [])
+        if year is None:
+            matches = [interval[2] for interval in intervals]
+        elif intervals:
+            starts = self._starts[key]
+            begin = bisect.bisect_left(starts, year - self._max_span[key])
+            end = bisect.bisect_right(starts, year, begin)
+            matches = [interval[2] for interval in intervals[begin:end] if interval[1] >= year]
+        else:
+            matches = []
+        matches.extend(self._any_year.get(key, ()))
+        return matches
+
+    def _group_matches(self, group: Tuple[str, str], category: str, year: Optional[int]) -> List[str]:
+        categories = (category,) if category else self._categories.get(group, ())
+        return [part_id for group_category in categories for part_id in self._matches((*group, group_category), year)]
+
+    def _price_order(self, part_id: str) -> Tuple[bool, float, str]:
+        price = self._parts[part_id]['price']
+        return price is None, price or 0.0, part_id
+
+    def lookup(
+        self,
+        make: Optional[str],
+        model: Optional[str],
+        year: Optional[int],
+        category: Optional[str] = None,
+        limit: Optional[int] = None,
+        universal: bool = True
+    ) -> List[Dict[str, Any]]:
+        """In-stock parts that fit a vehicle, cheapest first
+
+        Parts listed for a model also fit its trims ("Civic" parts fit a
+        "Civic Type R"), and parts listed for the make alone fit all of its
+        models. Universal parts follow the vehicle-specific ones.
+        """
+        self.lookups += 1
+        category = normalize_category(category)
+        vehicle: Dict[str, None] = {}
+        make_key = self.chassis.make(make) if make else None
+        if make_key is not None:
+            words = self.chassis.model(make_key, str(model or '').split()).split()
+            for length in range(len(words), -1, -1):
+                vehicle.update(dict.fromkeys(self._group_matches((make_key, ' '.join(words[:length])), category, year)))
+        matches = [(part_id, 'vehicle') for part_id in sorted(vehicle, key=self._price_order)]
+        if universal:
+            universal_ids = dict.fromkeys(self._group_matches((UNIVERSAL, ''), category, year))
+            matches.extend(
+                (part_id, 'universal')
+                for part_id in sorted(universal_ids, key=self._price_order) if part_id not in vehicle
+            )
+        if limit is not None:
+            matches = matches[:limit]
+        return [{**self._parts[part_id], 'fitment': fitment} for part_id, fitment in matches]
+
+    def apply_webhook(self, payload: Dict[str, Any]) -> str:
+        """Apply a Supabase database webhook (INSERT, UPDATE or DELETE on parts)"""
+        operation = str(payload.get('type', '')).upper()
+        if payload.get('table', 'parts') != 'parts':
+            raise ValueError(f"Webhook for table {payload.get('table')!r}, expected 'parts'")
+        if operation in ('INSERT', 'UPDATE'):
+            self.upsert(payload['record'])
+        elif operation == 'DELETE':
+            self.delete(payload['old_record']['id'])
+        else:
+            raise ValueError(f"Unknown webhook type {operation!r}")
+        return operation
+
+    async def _reconcile(self) -> int:
+        """Drop indexed parts whose rows were deleted; returns how many"""
+        ids = await asyncio.to_thread(self.catalogue.ids, PARTS_FEED)
+        if ids is None:
+            return 0
+        existing = set(ids)
+        gone = [part_id for part_id in self._parts if part_id not in existing]
+        for part_id in gone:
+            self.delete(part_id)
+        self.reconciles += 1
+        return len(gone)
+
+    async def sync(self, full: bool = False) -> Dict[str, int]:
+        """Apply catalogue rows changed since the last sync, or reload everything
+
+        An incremental sync also drops deleted parts when the id-set check is due.
+        """
+        if self.catalogue is None:
+            return {'full_reload': 0, 'parts_changed': 0, 'parts_removed': 0}
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            full = full or self._last_full_load is None or (
+                self.full_reload_seconds > 0 and loop.time() - self._last_full_load >= self.full_reload_seconds
+            )
+            rows = await asyncio.to_thread(self._feed.read, self.catalogue, full)
+            removed = 0
+            if full:
+                self.load(rows)
+                self._last_full_load = self._last_reconcile = loop.time()
+                logger.info(
+                    f"Loaded {len(self._parts)} in-stock parts for {len(self._categories)} models "
+                    f"from {self.catalogue.name}"
+                )
+            else:
+                for row in rows:
+                    self.upsert(row)
+                if self.reconcile_seconds > 0 and loop.time() - self._last_reconcile >= self.reconcile_seconds:
+                    removed = await self._reconcile()
+                    self._last_reconcile = loop.time()
+            self.syncs += 1
+            return {'full_reload': int(full), 'parts_changed': len(rows), 'parts_removed': removed}
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            try:
+                await self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                logger.error(f"Parts fitment sync failed: {e}")
+
+    async def start(self):
+        """Load the catalogue, then keep applying changes in the background"""
+        try:
+            await self.sync(full=True)
+        except Exception as e:
+            self.sync_errors += 1
+            logger.error(f"Failed to load the parts catalogue, recommendations will not name parts: {e}")
+        if self._task is None and self.catalogue is not None and self.sync_seconds > 0:
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.catalogue is not None:
+            self.catalogue.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'catalogue': self.catalogue.name if self.catalogue is not None else None,
+            'parts': len(self._parts),
+            'models': len(self._categories),
+            'intervals': sum(len(intervals) for intervals in self._intervals.values()),
+            'any_year_entries': sum(len(parts) for parts in self._any_year.values()),
+            'cursor': self._feed.cursor[0] if self._feed.cursor else None,
+            'lookups': self.lookups,
+            'full_loads': self.full_loads,
+            'syncs': self.syncs,
+            'upserts': self.upserts,
+            'deletes': self.deletes,
+            'reconciles': self.reconciles,
+            'unparsed_entries': self.unparsed_entries,
+            'sync_errors': self.sync_errors
+        }
@@ -0,0 +1,714 @@
+"""
+KC Speedshop ML Diagnostic Service - Persistence
+Write-behind storage of diagnostic results: local write-ahead log, batched database flush
+
+Results are appended to a per-process WAL segment (one JSON line each) before
+the response is returned, then written to ``diagnostic_scans`` and
+``ai_interpretations`` in multi-row inserts once ``PERSISTENCE_FLUSH_MAX_ROWS``
+records are buffered or ``PERSISTENCE_FLUSH_INTERVAL_SECONDS`` has passed. A
+segment is deleted only after its rows are committed. Segments left behind
+by a crashed worker are unlocked, so they are replayed by the next worker that
+starts or by a running worker's periodic recovery scan. Row ids are derived
+from the diagnosis id, so replaying a segment that was already partly written
+does not duplicate rows.
+
+The same backends serve reads: a diagnosis by id, and a vehicle's history
+paged newest-first over the (vehicle_key, scan_timestamp, id) index.
+Records still waiting in the WAL are merged into reads (read-your-writes).
+
+DATABASE_URL selects the backend: ``sqlite:///path/to.db`` (stand-in for
+local runs and tests) or ``postgresql://...`` (Supabase).
+"""
+
+import asyncio
+import base64
+import fcntl
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///data/diagnostics.db")
+PERSISTENCE_WAL_DIR = os.getenv("PERSISTENCE_WAL_DIR", "data/wal")
+PERSISTENCE_FLUSH_MAX_ROWS = int(os.getenv("PERSISTENCE_FLUSH_MAX_ROWS", "500"))
+PERSISTENCE_FLUSH_INTERVAL_SECONDS = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL_SECONDS", "1.0"))
+PERSISTENCE_RECOVERY_INTERVAL_SECONDS = float(os.getenv("PERSISTENCE_RECOVERY_INTERVAL_SECONDS", "60"))
+# "always" fsyncs every append (survives power loss); "flush" fsyncs each
+# segment when it is sealed (survives process crashes between flushes)
+PERSISTENCE_WAL_FSYNC = os.getenv("PERSISTENCE_WAL_FSYNC", "flush")
+
+# Namespace for deterministic row ids (uuid5 of the diagnosis id)
+DIAGNOSTIC_ROW_NAMESPACE = uuid.UUID("8f0b5c1e-2d4a-4c8e-9a61-5b7f3e2d1c90")
+
+WAL_SEGMENT_PREFIX = "wal-"
+WAL_SEGMENT_SUFFIX = ".log"
+DEAD_LETTER_FILE = "rejected.log"
+
+SCAN_COLUMNS = ('id', 'vehicle_id', 'vehicle_key', 'vin', 'trouble_codes', 'raw_data', 'scan_timestamp', 'status')
+INTERPRETATION_COLUMNS = (
+    'id', 'diagnostic_scan_id', 'interpretation', 'confidence_score', 'urgency_level',
+    'estimated_cost_min', 'estimated_cost_max', 'currency', 'possible_causes',
+    'recommendations', 'ai_model', 'created_at'
+)
+JSON_COLUMNS = ('trouble_codes', 'raw_data', 'possible_causes', 'recommendations')
+
+# Mirrors supabase/migrations for the SQLite stand-in
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diagnostic_scans (
+  id text PRIMARY KEY,
+  user_id text,
+  vehicle_id text,
+  vehicle_key text,
+  vin text NOT NULL,
+  trouble_codes text DEFAULT '[]',
+  raw_data text DEFAULT '{}',
+  scan_timestamp text DEFAULT CURRENT_TIMESTAMP,
+  status text DEFAULT 'completed',
+  created_at text DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS ai_interpretations (
+  id text PRIMARY KEY,
+  diagnostic_scan_id text REFERENCES diagnostic_scans(id) ON DELETE CASCADE,
+  interpretation text NOT NULL,
+  confidence_score integer DEFAULT 0,
+  urgency_level text DEFAULT 'medium',
+  estimated_cost_min real,
+  estimated_cost_max real,
+  currency text DEFAULT 'NZD',
+  possible_causes text DEFAULT '[]',
+  recommendations text DEFAULT '[]',
+  ai_model text DEFAULT 'grok-3-latest',
+  created_at text DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+SQLITE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_diagnostic_scans_vehicle_key_timestamp
+  ON diagnostic_scans (vehicle_key, scan_timestamp DESC, id DESC);
+"""
+
+# Each page lists one more row than requested to learn whether another page exists
+HISTORY_PAGE_MAX = 100
+
+_uuid7_lock = threading.Lock()
+_uuid7_last = (0, 0)
+
+def new_diagnosis_id() -> str:
+    """Time-sortable, collision-free diagnosis id: ``diag_`` + a UUIDv7
+
+    48 bits of Unix milliseconds, a 12-bit counter that keeps ids from one
+    process strictly increasing within a millisecond, and 62 random bits
+    so concurrent workers do not collide.
+    """
+    global _uuid7_last
+    with _uuid7_lock:
+        millis = time.time_ns() // 1_000_000
+        last_millis, counter = _uuid7_last
+        if millis <= last_millis:
+            millis, counter = last_millis, counter + 1
+            if counter > 0xFFF:
+                millis, counter = last_millis + 1, 0
+        else:
+            counter = secrets.randbits(8)
+        _uuid7_last = (millis, counter)
+    value = (millis << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | secrets.randbits(62)
+    return f"diag_{uuid.UUID(int=value)}"
+
+def normalize_timestamp(value: Any) -> str:
+    """ISO-8601 (naive UTC) with fixed microsecond precision, so strings sort in time order"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return value.isoformat(timespec='microseconds')
+
+def encode_cursor(position: Tuple[str, str]) -> str:
+    """Opaque keyset cursor for a (scan_timestamp, id) position"""
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor"""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return normalize_timestamp(timestamp), str(uuid.UUID(row_id))
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def scan_row_id(diagnosis_id: str) -> str:
+    """Deterministic diagnostic_scans.id for a diagnosis"""
+    return str(uuid.uuid5(DIAGNOSTIC_ROW_NAMESPACE, diagnosis_id))
+
+def interpretation_row_id(diagnosis_id: str) -> str:
+    """Deterministic ai_interpretations.id for a diagnosis"""
+    return str(uuid.uuid5(DIAGNOSTIC_ROW_NAMESPACE, f"{diagnosis_id}:interpretation"))
+
+def _as_uuid(value: Any) -> Optional[str]:
+    # vehicles.id is a uuid; free-form vehicle ids are kept in raw_data only
+    try:
+        return str(uuid.UUID(str(value)))
+    except (TypeError, ValueError):
+        return None
+
+def record_to_rows(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Map a WAL record onto one diagnostic_scans and one ai_interpretations row"""
+    request = record['request']
+    result = record['result']
+    diagnosis_id = result['diagnosis_id']
+    scan_id = scan_row_id(diagnosis_id)
+    cost = result.get('estimated_cost') or {}
+
+    issues = result.get('primary_issues') or []
+    interpretation = result.get('ai_analysis') or (
+        "; ".join(issue.get('description', '') for issue in issues) or "No issues detected"
+    )
+
+    scan = {
+        'id': scan_id,
+        'vehicle_id': _as_uuid(request.get('vehicle_id')),
+        'vehicle_key': request.get('vehicle_id'),
+        'vin': request.get('vin') or '',
+        'trouble_codes': (request.get('obd_data') or {}).get('DTC_CODES') or [],
+        # The full request and result are kept so a diagnosis can be served back as-is
+        'raw_data': {'diagnosis_id': diagnosis_id, 'request': request, 'result': result},
+        'scan_timestamp': normalize_timestamp(result['timestamp']),
+        'status': 'completed'
+    }
+    interpretation_row = {
+        'id': interpretation_row_id(diagnosis_id),
+        'diagnostic_scan_id': scan_id,
+        'interpretation': interpretation,
+        'confidence_score': int(round(float(result.get('confidence_score', 0.0)) * 100)),
+        'urgency_level': result.get('urgency_level', 'medium'),
+        'estimated_cost_min': cost.get('min'),
+        'estimated_cost_max': cost.get('max'),
+        'currency': cost.get('currency', 'NZD'),
+        'possible_causes': issues,
+        'recommendations': result.get('recommendations') or [],
+        'ai_model': record.get('ai_model'),
+        'created_at': result.get('timestamp')
+    }
+    return scan, interpretation_row
+
+class SQLiteBackend:
+    """sqlite3 storage (stand-in for Postgres in local runs and tests)"""
+
+    data_errors = (sqlite3.IntegrityError, sqlite3.DataError, ValueError, TypeError, KeyError)
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"sqlite:///{self.path}"
+
+    def _open(self) -> sqlite3.Connection:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SQLITE_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(diagnostic_scans)")}
+        if 'vehicle_key' not in columns:
+            conn.execute("ALTER TABLE diagnostic_scans ADD COLUMN vehicle_key text")
+        conn.executescript(SQLITE_INDEXES)
+        return conn
+
+    def connect(self) -> sqlite3.Connection:
+        # Only the flusher uses this connection, one batch at a time
+        if self._conn is None:
+            self._conn = self._open()
+        return self._conn
+
+    def write_batch(self, records: Sequence[Dict[str, Any]]):
+        """Insert all rows of a batch in a single transaction"""
+        scans, interpretations = _rows_for(records, encode_json=json.dumps)
+        conn = self.connect()
+        with conn:
+            for table, columns, rows in (
+                ('diagnostic_scans', SCAN_COLUMNS, scans),
+                ('ai_interpretations', INTERPRETATION_COLUMNS, interpretations)
+            ):
+                placeholders = ", ".join("?" for _ in columns)
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                    rows
+                )
+
+    def fetch_scan(self, scan_id: str) -> Optional[Dict[str, Any]]:
+        """raw_data of one diagnostic_scans row"""
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = self._open()
+            row = self._read_conn.execute(
+                "SELECT raw_data FROM diagnostic_scans WHERE id = ?", (scan_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_vehicle_scans(
+        self,
+        vehicle_key: str,
+        before: Optional[Tuple[str, str]],
+        limit: int
+    ) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """(scan_timestamp, id, raw_data) rows of a vehicle, newest first, strictly after a cursor"""
+        sql = "SELECT scan_timestamp, id, raw_data FROM diagnostic_scans WHERE vehicle_key = ?"
+        params: List[Any] = [vehicle_key]
+        if before is not None:
+            sql += " AND (scan_timestamp, id) < (?, ?)"
+            params.extend(before)
+        sql += " ORDER BY scan_timestamp DESC, id DESC LIMIT ?"
+        params.append(limit)
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = self._open()
+            rows = self._read_conn.execute(sql, params).fetchall()
+        return [(timestamp, row_id, json.loads(raw_data)) for timestamp, row_id, raw_data in rows]
+
+    def close(self):
+        for conn in (self._conn, self._read_conn):
+            if conn is not None:
+                conn.close()
+        self._conn = None
+        self._read_conn = None
+
+class PostgresBackend:
+    """psycopg2 storage; writes are multi-row INSERT ... VALUES via execute_values"""
+
+    def __init__(self, dsn: str, page_size: int = 1000):
+        import psycopg2
+        import psycopg2.extras
+
+        self._psycopg2 = psycopg2
+        self._extras = psycopg2.extras
+        self.dsn = dsn
+        self.page_size = page_size
+        self.data_errors = (psycopg2.DataError, psycopg2.IntegrityError, ValueError, TypeError, KeyError)
+        self._conn = None
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return "postgresql"
+
+    def connect(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = self._psycopg2.connect(self.dsn)
+        return self._conn
+
+    def write_batch(self, records: Sequence[Dict[str, Any]]):
+        """Insert all rows of a batch in a single transaction"""
+        scans, interpretations = _rows_for(records, encode_json=self._extras.Json)
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                for table, columns, rows in (
+                    ('diagnostic_scans', SCAN_COLUMNS, scans),
+                    ('ai_interpretations', INTERPRETATION_COLUMNS, interpretations)
+                ):
+                    self._extras.execute_values(
+                        cursor,
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s ON CONFLICT (id) DO NOTHING",
+                        rows,
+                        page_size=self.page_size
+                    )
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+    def _read(self, sql: str, params: Sequence[Any]) -> List[tuple]:
+        with self._read_lock:
+            if self._read_conn is None or self._read_conn.closed:
+                self._read_conn = self._psycopg2.connect(self.dsn)
+                self._read_conn.set_session(readonly=True, autocommit=True)
+            with self._read_conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    def fetch_scan(self, scan_id: str) -> Optional[Dict[str, Any]]:
+        """raw_data of one diagnostic_scans row"""
+        rows = self._read("SELECT raw_data FROM diagnostic_scans WHERE id = %s", (scan_id,))
+        return rows[0][0] if rows else None
+
+    def list_vehicle_scans(
+        self,
+        vehicle_key: str,
+        before: Optional[Tuple[str, str]],
+        limit: int
+    ) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """(scan_timestamp, id, raw_data) rows of a vehicle, newest first, strictly after a cursor"""
+        sql = (
+            "SELECT to_char(scan_timestamp AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US'), id::text, raw_data "
+            "FROM diagnostic_scans WHERE vehicle_key = %s"
+        )
+        params: List[Any] = [vehicle_key]
+        if before is not None:
+            sql += " AND (scan_timestamp, id) < (%s::timestamp AT TIME ZONE 'UTC', %s::uuid)"
+            params.extend(before)
+        sql += " ORDER BY scan_timestamp DESC, id DESC LIMIT %s"
+        params.append(limit)
+        return [tuple(row) for row in self._read(sql, params)]
+
+    def close(self):
+        for conn in (self._conn, self._read_conn):
+            if conn is not None:
+                conn.close()
+        self._conn = None
+        self._read_conn = None
+
+def _rows_for(records: Sequence[Dict[str, Any]], encode_json) -> Tuple[List[tuple], List[tuple]]:
+    scans, interpretations = [], []
+    for record in records:
+        scan, interpretation = record_to_rows(record)
+        scans.append(tuple(encode_json(scan[c]) if c in JSON_COLUMNS else scan[c] for c in SCAN_COLUMNS))
+        interpretations.append(tuple(
+            encode_json(interpretation[c]) if c in JSON_COLUMNS else interpretation[c]
+            for c in INTERPRETATION_COLUMNS
+        ))
+    return scans, interpretations
+
+def _diagnosis_id(record: Dict[str, Any]) -> Optional[str]:
+    return (record.get('result') or {}).get('diagnosis_id')
+
+def create_backend(database_url: str = DATABASE_URL):
+    """Build the writer for a DATABASE_URL"""
+    if database_url.startswith("sqlite:///"):
+        return SQLiteBackend(database_url[len("sqlite:///"):])
+    if database_url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackend(database_url)
+    raise ValueError(f"Unsupported DATABASE_URL scheme: {database_url.split(':', 1)[0]}")
+
+class WALSegment:
+    """One append-only JSON-lines file, flock'ed by the process that owns it"""
+
+    def __init__(self, path: str, records: Optional[List[Dict[str, Any]]] = None):
+        self.path = path
+        self.records: List[Dict[str, Any]] = records if records is not None else []
+        self._file = None
+
+    @classmethod
+    def create(cls, directory: str) -> "WALSegment":
+        name = f"{WAL_SEGMENT_PREFIX}{time.time_ns():020d}-{os.getpid()}{WAL_SEGMENT_SUFFIX}"
+        segment = cls(os.path.join(directory, name))
+        segment._file = open(segment.path, 'a', encoding='utf-8')
+        fcntl.flock(segment._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return segment
+
+    @classmethod
+    def claim(cls, path: str) -> Optional["WALSegment"]:
+        """Lock and load a segment left behind by a dead process, or None if it is owned"""
+        try:
+            handle = open(path, 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+
+        records = []
+        for line_number, line in enumerate(handle, start=1):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn final line is a write interrupted by the crash
+                logger.warning(f"Skipping unreadable WAL line {line_number} in {os.path.basename(path)}")
+        segment = cls(path, records)
+        segment._file = handle
+        return segment
+
+    def append(self, records: Sequence[Dict[str, Any]], fsync: bool = False):
+        self._file.write("".join(json.dumps(record, separators=(',', ':')) + "\n" for record in records))
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        self.records.extend(records)
+
+    def seal(self, fsync: bool = True):
+        if fsync and self._file is not None and not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def release(self, delete: bool):
+        """Close the segment, deleting it once its records are committed"""
+        if delete:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class WriteBehindStore:
+    """Appends results to the WAL and flushes them to the database in batches"""
+
+    def __init__(
+        self,
+        backend=None,
+        wal_dir: str = PERSISTENCE_WAL_DIR,
+        flush_max_rows: int = PERSISTENCE_FLUSH_MAX_ROWS,
+        flush_interval: float = PERSISTENCE_FLUSH_INTERVAL_SECONDS,
+        recovery_interval: float = PERSISTENCE_RECOVERY_INTERVAL_SECONDS,
+        fsync_mode: str = PERSISTENCE_WAL_FSYNC
+    ):
+        self.backend = backend if backend is not None else create_backend()
+        self.wal_dir = wal_dir
+        self.flush_max_rows = flush_max_rows
+        self.flush_interval = flush_interval
+        self.recovery_interval = recovery_interval
+        self.fsync_mode = fsync_mode
+
+        self._active: Optional[WALSegment] = None
+        self._sealed: List[WALSegment] = []
+        # diagnosis_id -> record for everything not yet committed (read-your-writes)
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_recovery = 0.0
+
+        # Metrics
+        self.appended = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.recovered = 0
+        self.dead_lettered = 0
+        self.last_flush_seconds: Optional[float] = None
+        self.last_flush_rows = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending_rows(self) -> int:
+        active = len(self._active.records) if self._active else 0
+        return active + sum(len(segment.records) for segment in self._sealed)
+
+    async def start(self):
+        """Replay orphaned WAL segments and start the flush loop"""
+        if self.running:
+            return
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.recover()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Write-behind persistence started (backend={self.backend.name}, wal_dir={self.wal_dir}, "
+            f"flush_max_rows={self.flush_max_rows}, flush_interval={self.flush_interval}s)"
+        )
+        if self.pending_rows:
+            self._flush_requested.set()
+
+    async def stop(self):
+        """Flush what is buffered; anything left stays in the WAL for the next start"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final persistence flush failed, {self.pending_rows} rows remain in the WAL: {e}")
+        for segment in self._sealed + ([self._active] if self._active else []):
+            segment.release(delete=False)
+        self._sealed = []
+        self._active = None
+        self._pending.clear()
+        await asyncio.to_thread(self.backend.close)
+
+    def append(self, records: Sequence[Dict[str, Any]]):
+        """Durably queue records for the database (a buffered file write, no DB round-trip)"""
+        if not records:
+            return
+        if self._active is None:
+            os.makedirs(self.wal_dir, exist_ok=True)
+            self._active = WALSegment.create(self.wal_dir)
+        self._active.append(records, fsync=self.fsync_mode == "always")
+        self._index_pending(records)
+        self.appended += len(records)
+        if self._flush_requested is not None and self.pending_rows >= self.flush_max_rows:
+            self._flush_requested.set()
+
+    def recover(self) -> int:
+        """Claim segments whose owning process has exited"""
+        self._last_recovery = time.monotonic()
+        try:
+            names = sorted(os.listdir(self.wal_dir))
+        except FileNotFoundError:
+            return 0
+
+        owned = {segment.path for segment in self._sealed}
+        if self._active is not None:
+            owned.add(self._active.path)
+        recovered = 0
+        for name in names:
+            path = os.path.join(self.wal_dir, name)
+            if not (name.startswith(WAL_SEGMENT_PREFIX) and name.endswith(WAL_SEGMENT_SUFFIX)) or path in owned:
+                continue
+            segment = WALSegment.claim(path)
+            if segment is None:
+                continue
+            self._sealed.append(segment)
+            self._index_pending(segment.records)
+            recovered += len(segment.records)
+
+        if recovered:
+            self.recovered += recovered
+            logger.info(f"Recovered {recovered} unflushed diagnostic results from the WAL")
+        return recovered
+
+    async def flush(self) -> int:
+        """Write every sealed segment to the database, oldest first"""
+        async with self._flush_lock or asyncio.Lock():
+            if self._active is not None and self._active.records:
+                self._active.seal(fsync=self.fsync_mode != "never")
+                self._sealed.append(self._active)
+                self._active = None
+
+            written = 0
+            while self._sealed:
+                segment = self._sealed[0]
+                if segment.records:
+                    started = time.perf_counter()
+                    await asyncio.to_thread(self._write_segment, segment)
+                    self.last_flush_seconds = time.perf_counter() - started
+                    self.last_flush_rows = len(segment.records)
+                    self.flushes += 1
+                    self.flushed += len(segment.records)
+                    written += len(segment.records)
+                segment.release(delete=True)
+                self._sealed.pop(0)
+                for record in segment.records:
+                    self._pending.pop(_diagnosis_id(record), None)
+            return written
+
+    def _index_pending(self, records: Sequence[Dict[str, Any]]):
+        for record in records:
+            diagnosis_id = _diagnosis_id(record)
+            if diagnosis_id:
+                self._pending[diagnosis_id] = record
+
+    async def fetch_result(self, diagnosis_id: str) -> Optional[Dict[str, Any]]:
+        """Stored DiagnosticResult data for a diagnosis, including ones still in the WAL"""
+        # Pending first: a segment leaves the index only after its commit
+        record = self._pending.get(diagnosis_id)
+        if record is not None:
+            return record['result']
+        raw_data = await asyncio.to_thread(self.backend.fetch_scan, scan_row_id(diagnosis_id))
+        return raw_data.get('result') if raw_data else None
+
+    async def list_vehicle_results(
+        self,
+        vehicle_id: str,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of a vehicle's results, newest first, and the cursor of the next page
+
+        Raises ValueError for a malformed cursor.
+        """
+        before = decode_cursor(cursor) if cursor else None
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+
+        # Snapshot pending rows before querying so a concurrent flush cannot hide them
+        entries: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+        for record in list(self._pending.values()):
+            if record['request'].get('vehicle_id') != vehicle_id:
+                continue
+            position = (normalize_timestamp(record['result']['timestamp']), scan_row_id(_diagnosis_id(record)))
+            if before is None or position < before:
+                entries[position[1]] = (*position, record['result'])
+
+        rows = await asyncio.to_thread(self.backend.list_vehicle_scans, vehicle_id, before, limit + 1)
+        for timestamp, row_id, raw_data in rows:
+            entries.setdefault(row_id, (timestamp, row_id, raw_data['result']))
+
+        ordered = sorted(entries.values(), key=lambda entry: (entry[0], entry[1]), reverse=True)
+        page = ordered[:limit]
+        next_cursor = encode_cursor((page[-1][0], page[-1][1])) if len(ordered) > limit else None
+        return [entry[2] for entry in page], next_cursor
+
+    def _write_segment(self, segment: WALSegment):
+        try:
+            self.backend.write_batch(segment.records)
+        except self.backend.data_errors as e:
+            # A bad row must not block the rest of the batch: write rows one
+            # by one and set aside the ones the database rejects
+            logger.error(f"Batch insert of {len(segment.records)} rows rejected, retrying row by row: {e}")
+            for record in segment.records:
+                try:
+                    self.backend.write_batch([record])
+                except self.backend.data_errors as row_error:
+                    self._dead_letter(record, row_error)
+
+    def _dead_letter(self, record: Dict[str, Any], error: Exception):
+        self.dead_lettered += 1
+        diagnosis_id = _diagnosis_id(record)
+        logger.error(f"Diagnostic result {diagnosis_id} rejected by the database, moved to {DEAD_LETTER_FILE}: {error}")
+        with open(os.path.join(self.wal_dir, DEAD_LETTER_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'error': str(error), 'record': record}, separators=(',', ':')) + "\n")
+
+    async def _run(self):
+        backoff = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+
+            if time.monotonic() - self._last_recovery >= self.recovery_interval:
+                self.recover()
+
+            try:
+                await self.flush()
+                self.last_error = None
+                backoff = self.flush_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Database unavailable: rows stay in the WAL, retry with backoff
+                self.flush_failures += 1
+                self.last_error = str(e)
+                backoff = min(max(backoff * 2, self.flush_interval), 30.0)
+                logger.error(f"Persistence flush failed ({self.pending_rows} rows pending), retrying in {backoff:.1f}s: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.backend.name,
+            'running': self.running,
+            'wal_dir': self.wal_dir,
+            'pending_rows': self.pending_rows,
+            'sealed_segments': len(self._sealed),
+            'appended': self.appended,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'flush_failures': self.flush_failures,
+            'recovered': self.recovered,
+            'dead_lettered': self.dead_lettered,
+            'last_flush_rows': self.last_flush_rows,
+            'last_flush_seconds': self.last_flush_seconds,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,393 @@
+"""
+KC Speedshop ML Diagnostic Service - Recall index
+In-memory (make, model, model year) index of safety recall campaigns
+
+The index is bulk-loaded from the NHTSA recall flat file (FLAT_RCL.txt,
+tab-separated, optionally zipped or gzipped; RECALL_DUMP_PATH). The dump
+has one row per campaign, make, model and model year. On load these rows
+are folded into model-year intervals per (make, model). Campaign texts are
+stored once, however many vehicles a campaign covers.
+
+Deltas are JSON-lines files in RECALL_DELTA_DIR, applied in file name order::
+
+    {"op": "upsert", "campaign": "23V123000", "make": "HONDA", "model": "CR-V",
+     "years": [2017, 2018, 2019], "component": "...", "summary": "...",
+     "consequence": "...", "remedy": "...", "report_date": "20230301"}
+    {"op": "delete", "campaign": "23V123000"}
+
+An upsert replaces the campaign's entries for that make and model; a delete
+removes the campaign (or only its entries for a given make/model). Deltas
+newer than the dump are applied at startup and picked up every
+RECALL_REFRESH_SECONDS without rebuilding the index; a new dump triggers a
+full reload.
+"""
+
+import asyncio
+import bisect
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import zipfile
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+RECALL_DUMP_PATH = os.getenv("RECALL_DUMP_PATH", "data/recalls/FLAT_RCL.txt")
+RECALL_DELTA_DIR = os.getenv("RECALL_DELTA_DIR", "data/recalls/deltas")
+RECALL_REFRESH_SECONDS = float(os.getenv("RECALL_REFRESH_SECONDS", "3600"))
+# Most recent campaigns attached to a diagnostic result
+RECALL_RESULT_LIMIT = int(os.getenv("RECALL_RESULT_LIMIT", "20"))
+
+# Columns of FLAT_RCL.txt used by the index (0-based)
+FLAT_CAMPNO = 1
+FLAT_MAKE = 2
+FLAT_MODEL = 3
+FLAT_YEAR = 4
+FLAT_COMPONENT = 6
+FLAT_MANUFACTURER = 7
+FLAT_POTENTIALLY_AFFECTED = 11
+FLAT_REPORT_DATE = 15
+FLAT_SUMMARY = 19
+FLAT_CONSEQUENCE = 20
+FLAT_REMEDY = 21
+FLAT_MIN_COLUMNS = 22
+
+# Campaign details a delta upsert may change
+CAMPAIGN_FIELDS = ('manufacturer', 'summary', 'consequence', 'remedy', 'report_date', 'potentially_affected')
+
+# Model year the dump uses for "unknown"; such recalls match every year
+UNKNOWN_YEAR = 9999
+ALL_YEARS = (0, UNKNOWN_YEAR)
+
+# (first model year, last model year, campaign)
+Interval = Tuple[int, int, str]
+VehicleKey = Tuple[str, str]
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]')
+
+def vehicle_key(make: str, model: str) -> VehicleKey:
+    """Index key of a make/model; "CR-V", "Cr V" and "CRV" are the same vehicle"""
+    return _NON_ALNUM.sub('', str(make).upper()), _NON_ALNUM.sub('', str(model).upper())
+
+def year_intervals(years: Iterable[int]) -> List[Tuple[int, int]]:
+    """Fold model years into contiguous (first, last) intervals"""
+    intervals: List[Tuple[int, int]] = []
+    for year in sorted(set(years)):
+        if year == UNKNOWN_YEAR:
+            return [ALL_YEARS]
+        if intervals and year == intervals[-1][1] + 1:
+            intervals[-1] = (intervals[-1][0], year)
+        else:
+            intervals.append((year, year))
+    return intervals
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path.endswith('.zip'):
+        archive = zipfile.ZipFile(path)
+        member = next(name for name in archive.namelist() if name.lower().endswith('.txt'))
+        return io.TextIOWrapper(archive.open(member), encoding='utf-8', errors='replace')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def read_flat_file(path: str) -> Tuple[Dict[str, Dict[str, Any]], Dict[Tuple[str, VehicleKey], Set[int]]]:
+    """Campaign details and the model years of each (campaign, vehicle) from a dump"""
+    campaigns: Dict[str, Dict[str, Any]] = {}
+    years: Dict[Tuple[str, VehicleKey], Set[int]] = {}
+    with _open_text(path) as f:
+        for line in f:
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) < FLAT_MIN_COLUMNS:
+                continue
+            campaign = fields[FLAT_CAMPNO].strip()
+            year = _int_or_none(fields[FLAT_YEAR])
+            if not campaign or year is None:
+                continue
+            details = campaigns.get(campaign)
+            if details is None:
+                details = campaigns[campaign] = {
+                    'campaign': campaign,
+                    'manufacturer': fields[FLAT_MANUFACTURER].strip(),
+                    'components': [],
+                    'summary': fields[FLAT_SUMMARY].strip(),
+                    'consequence': fields[FLAT_CONSEQUENCE].strip(),
+                    'remedy': fields[FLAT_REMEDY].strip(),
+                    'report_date': fields[FLAT_REPORT_DATE].strip(),
+                    'potentially_affected': _int_or_none(fields[FLAT_POTENTIALLY_AFFECTED])
+                }
+            component = fields[FLAT_COMPONENT].strip()
+            if component and component not in details['components']:
+                details['components'].append(component)
+            years.setdefault((campaign, vehicle_key(fields[FLAT_MAKE], fields[FLAT_MODEL])), set()).add(year)
+    return campaigns, years
+
+def read_delta(path: str) -> List[Dict[str, Any]]:
+    with _open_text(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class RecallIndex:
+    """Interval index of recall campaigns per make and model
+
+    Each (make, model) holds its intervals sorted by first model year, so a
+    lookup bisects to the intervals starting at or before the year and keeps
+    those ending at or after it. Deltas touch only the keys they name.
+    """
+
+    def __init__(
+        self,
+        dump_path: str = RECALL_DUMP_PATH,
+        delta_dir: str = RECALL_DELTA_DIR,
+        refresh_seconds: float = RECALL_REFRESH_SECONDS
+    ):
+        self.dump_path = dump_path
+        self.delta_dir = delta_dir
+        self.refresh_seconds = refresh_seconds
+
+        self._campaigns: Dict[str, Dict[str, Any]] = {}
+        self._intervals: Dict[VehicleKey, List[Interval]] = {}
+        self._starts: Dict[VehicleKey, List[int]] = {}
+        # Longest dated interval per key bounds how far back a lookup scans
+        self._max_span: Dict[VehicleKey, int] = {}
+        # Campaigns of unknown model year match every year
+        self._any_year: Dict[VehicleKey, List[str]] = {}
+        self._campaign_keys: Dict[str, Set[VehicleKey]] = {}
+        self._dump_mtime: Optional[float] = None
+        self._applied_deltas: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        # Metrics
+        self.lookups = 0
+        self.dump_loads = 0
+        self.deltas_applied = 0
+        self.upserts = 0
+        self.deletes = 0
+        self.refresh_errors = 0
+
+    def __len__(self) -> int:
+        return len(self._campaigns)
+
+    def _index_key(self, key: VehicleKey, intervals: List[Interval]):
+        """Install a key's intervals, sorted by first year, with its longest span"""
+        dated = sorted(interval for interval in intervals if interval[:2] != ALL_YEARS)
+        any_year = [interval[2] for interval in intervals if interval[:2] == ALL_YEARS]
+        for index in (self._intervals, self._starts, self._max_span, self._any_year):
+            index.pop(key, None)
+        if dated:
+            self._intervals[key] = dated
+            self._starts[key] = [interval[0] for interval in dated]
+            self._max_span[key] = max(last - first for first, last, _ in dated)
+        if any_year:
+            self._any_year[key] = any_year
+
+    def _key_intervals(self, key: VehicleKey) -> List[Interval]:
+        return self._intervals.get(key, []) + [(*ALL_YEARS, campaign) for campaign in self._any_year.get(key, ())]
+
+    def _remove(self, key: VehicleKey, campaign: str, drop_details: bool = True):
+        self._index_key(key, [interval for interval in self._key_intervals(key) if interval[2] != campaign])
+        keys = self._campaign_keys.get(campaign)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._campaign_keys[campaign]
+                if drop_details:
+                    self._campaigns.pop(campaign, None)
+
+    def load(self, campaigns: Dict[str, Dict[str, Any]], years: Dict[Tuple[str, VehicleKey], Set[int]]):
+        """Replace the whole index with a parsed dump"""
+        by_key: Dict[VehicleKey, List[Interval]] = {}
+        campaign_keys: Dict[str, Set[VehicleKey]] = {}
+        for (campaign, key), campaign_years in years.items():
+            by_key.setdefault(key, []).extend(
+                (first_year, last_year, campaign) for first_year, last_year in year_intervals(campaign_years)
+            )
+            campaign_keys.setdefault(campaign, set()).add(key)
+
+        self._campaigns = campaigns
+        self._campaign_keys = campaign_keys
+        self._intervals, self._starts, self._max_span, self._any_year = {}, {}, {}, {}
+        for key, intervals in by_key.items():
+            self._index_key(key, intervals)
+        self.dump_loads += 1
+
+    def upsert(self, record: Dict[str, Any]):
+        """Replace a campaign's entries for one make and model"""
+        campaign = str(record['campaign']).strip()
+        key = vehicle_key(record['make'], record['model'])
+        if key in self._campaign_keys.get(campaign, ()):
+            self._remove(key, campaign, drop_details=False)
+        details = self._campaigns.setdefault(campaign, {
+            'campaign': campaign,
+            'manufacturer': None,
+            'components': [],
+            'summary': '',
+            'consequence': '',
+            'remedy': '',
+            'report_date': '',
+            'potentially_affected': None
+        })
+        for field in CAMPAIGN_FIELDS:
+            if field in record:
+                details[field] = record[field]
+        if record.get('component') and record['component'] not in details['components']:
+            details['components'].append(record['component'])
+        self._index_key(key, self._key_intervals(key) + [
+            (first_year, last_year, campaign)
+            for first_year, last_year in year_intervals(record.get('years') or [UNKNOWN_YEAR])
+        ])
+        self._campaign_keys.setdefault(campaign, set()).add(key)
+        self.upserts += 1
+
+    def delete(self, campaign: str, make: Optional[str] = None, model: Optional[str] = None):
+        """Remove a campaign, or only its entries for one make and model"""
+        campaign = str(campaign).strip()
+        keys = list(self._campaign_keys.get(campaign, ()))
+        if make is not None and model is not None:
+            keys = [key for key in keys if key == vehicle_key(make, model)]
+        for key in keys:
+            self._remove(key, campaign)
+        self.deletes += 1
+
+    def apply(self, operations: Sequence[Dict[str, Any]]) -> int:
+        """Apply parsed delta operations in order"""
+        for operation in operations:
+            op = operation.get('op')
+            if op == 'upsert':
+                self.upsert(operation)
+            elif op == 'delete':
+                self.delete(operation['campaign'], operation.get('make'), operation.get('model'))
+            else:
+                raise ValueError(f"Unknown recall delta operation {op!r}")
+        return len(operations)
+
+    def lookup(
+        self,
+        make: Optional[str],
+        model: Optional[str],
+        year: Optional[int],
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Campaigns covering a vehicle, most recent report first"""
+        self.lookups += 1
+        if not make or not model:
+            return []
+        key = vehicle_key(make, model)
+        intervals = self._intervals.get(key, [])
+        if year is None:
+            matches = [interval[2] for interval in intervals]
+        elif intervals:
+            # Only intervals starting within max_span years before the year can cover it
+            starts = self._starts[key]
+            begin = bisect.bisect_left(starts, year - self._max_span[key])
+            end = bisect.bisect_right(starts, year, begin)
+            matches = [interval[2] for interval in intervals[begin:end] if interval[1] >= year]
+        else:
+            matches = []
+        matches.extend(self._any_year.get(key, ()))
+        if not matches:
+            return []
+
+        campaigns = [self._campaigns[campaign] for campaign in dict.fromkeys(matches) if campaign in self._campaigns]
+        campaigns.sort(key=lambda campaign: campaign['report_date'] or '', reverse=True)
+        return [
+            {**campaign, 'components': list(campaign['components'])}
+            for campaign in (campaigns[:limit] if limit is not None else campaigns)
+        ]
+
+    def _pending_deltas(self) -> List[str]:
+        try:
+            names = sorted(os.listdir(self.delta_dir))
+        except FileNotFoundError:
+            return []
+        pending = []
+        for name in names:
+            path = os.path.join(self.delta_dir, name)
+            if name in self._applied_deltas or not os.path.isfile(path):
+                continue
+            # Deltas the current dump already contains are skipped
+            if self._dump_mtime is not None and os.path.getmtime(path) <= self._dump_mtime:
+                self._applied_deltas.add(name)
+                continue
+            pending.append(name)
+        return pending
+
+    async def refresh(self) -> Dict[str, int]:
+        """Reload a changed dump, then apply new delta files; returns what changed"""
+        async with self._lock:
+            reloaded = 0
+            try:
+                dump_mtime = os.path.getmtime(self.dump_path)
+            except FileNotFoundError:
+                dump_mtime = None
+            if dump_mtime is not None and dump_mtime != self._dump_mtime:
+                campaigns, years = await asyncio.to_thread(read_flat_file, self.dump_path)
+                self.load(campaigns, years)
+                self._dump_mtime = dump_mtime
+                self._applied_deltas.clear()
+                reloaded = 1
+                logger.info(
+                    f"Loaded {len(self._campaigns)} recall campaigns for {len(self._intervals)} models "
+                    f"from {self.dump_path}"
+                )
+
+            applied = 0
+            for name in self._pending_deltas():
+                operations = await asyncio.to_thread(read_delta, os.path.join(self.delta_dir, name))
+                self.apply(operations)
+                self._applied_deltas.add(name)
+                self.deltas_applied += 1
+                applied += 1
+                logger.info(f"Applied recall delta {name} ({len(operations)} operations)")
+            return {'dump_reloaded': reloaded, 'deltas_applied': applied}
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.error(f"Recall index refresh failed: {e}")
+
+    async def start(self):
+        """Load the dump and pending deltas, then keep refreshing in the background"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.error(f"Failed to load recall data, recalls will not be attached: {e}")
+        if self._dump_mtime is None and not self._campaigns:
+            logger.warning(f"No recall dump at {self.dump_path} - recall index is empty until one is provided")
+        if self._task is None and self.refresh_seconds > 0:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'dump_path': self.dump_path,
+            'delta_dir': self.delta_dir,
+            'campaigns': len(self._campaigns),
+            'models': len(self._intervals.keys() | self._any_year.keys()),
+            'intervals': sum(len(intervals) for intervals in self._intervals.values()),
+            'any_year_entries': sum(len(campaigns) for campaigns in self._any_year.values()),
+            'lookups': self.lookups,
+            'dump_loads': self.dump_loads,
+            'deltas_applied': self.deltas_applied,
+            'upserts': self.upserts,
+            'deletes': self.deletes,
+            'refresh_errors': self.refresh_errors
+        }
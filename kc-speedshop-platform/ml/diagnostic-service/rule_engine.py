@@ -0,0 +1,380 @@
+"""
+KC Speedshop ML Diagnostic Service - Rule engine
+Declarative OBD rules compiled to NumPy boolean expressions
+
+Rules are loaded from a JSON table (RULES_PATH)::
+
+    {"id": "engine_overheating", "description": "Engine overheating detected",
+     "severity": "maintenance_required", "confidence": 0.7,
+     "when": {"pid": "COOLANT_TEMP", "gt": 100},
+     "duration_seconds": 30,
+     "scope": {"make": "Mazda", "model": "RX-8", "years": [2003, 2012]}}
+
+``when`` is a PID comparison (gt, ge, lt, le, eq, ne, or between / outside
+an inclusive [low, high] range) or an ``all`` / ``any`` / ``not``
+combination of conditions. A missing or non-numeric PID never satisfies a
+comparison. A rule with ``duration_seconds`` only fires on a telemetry
+window, once its condition has held continuously for that long. A rule with
+a ``scope`` applies only to matching vehicles and, for those vehicles,
+replaces the unscoped rules with the same id.
+
+Each condition is compiled once into a function of an (N, PIDs) float32
+matrix, so a whole batch or telemetry window is evaluated with one array
+expression per rule. Live telemetry advances one frame at a time, where array
+setup would cost more than the comparisons, so each condition also gets a
+scalar twin over a plain list of PID values (see RuleTracker).
+"""
+
+import json
+import logging
+import math
+import operator
+import os
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from model_registry import DIAGNOSTIC_CLASSES
+
+logger = logging.getLogger(__name__)
+
+RULES_PATH = os.getenv("RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules", "obd_rules.json"))
+
+# Confidence of a verdict when no rule fired
+DEFAULT_RULE_CONFIDENCE = 0.7
+
+COMPARISONS: Dict[str, Callable[[np.ndarray, float], np.ndarray]] = {
+    'gt': np.greater,
+    'ge': np.greater_equal,
+    'lt': np.less,
+    'le': np.less_equal,
+    'eq': np.equal,
+    'ne': lambda values, threshold: (values != threshold) & ~np.isnan(values)
+}
+
+SCALAR_COMPARISONS: Dict[str, Callable[[float, float], bool]] = {
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'lt': operator.lt,
+    'le': operator.le,
+    'eq': operator.eq,
+    'ne': lambda value, threshold: value != threshold and not math.isnan(value)
+}
+
+Condition = Callable[[np.ndarray], np.ndarray]
+RowCondition = Callable[[Sequence[float]], bool]
+
+class RuleError(ValueError):
+    """Raised for a malformed rule table"""
+
+def _condition_pids(condition: Mapping[str, Any]) -> List[str]:
+    """PIDs a ``when`` clause refers to"""
+    if 'all' in condition or 'any' in condition:
+        return [pid for part in condition.get('all', condition.get('any')) for pid in _condition_pids(part)]
+    if 'not' in condition:
+        return _condition_pids(condition['not'])
+    return [condition['pid']] if condition.get('pid') is not None else []
+
+def _compile_condition(condition: Mapping[str, Any], columns: Dict[str, int], rule_id: str) -> Condition:
+    """Turn one ``when`` clause into a function of the PID matrix"""
+    if 'all' in condition or 'any' in condition:
+        conjunction = 'all' in condition
+        parts = [_compile_condition(part, columns, rule_id) for part in condition.get('all', condition.get('any'))]
+        if not parts:
+            raise RuleError(f"Rule '{rule_id}' has an empty combination")
+
+        def combined(matrix: np.ndarray) -> np.ndarray:
+            result = parts[0](matrix)
+            for part in parts[1:]:
+                result = (result & part(matrix)) if conjunction else (result | part(matrix))
+            return result
+        return combined
+    if 'not' in condition:
+        inner = _compile_condition(condition['not'], columns, rule_id)
+        # Negation must not turn a missing PID into a match
+        referenced = [columns[pid] for pid in _condition_pids(condition['not'])]
+        return lambda matrix: ~inner(matrix) & ~np.isnan(matrix[:, referenced]).any(axis=1)
+
+    pid = condition.get('pid')
+    if pid is None:
+        raise RuleError(f"Rule '{rule_id}' has a condition without 'pid', 'all', 'any' or 'not'")
+    column = columns.setdefault(pid, len(columns))
+    if 'between' in condition or 'outside' in condition:
+        low, high = (float(bound) for bound in condition.get('between', condition.get('outside')))
+        if 'between' in condition:
+            return lambda matrix: (matrix[:, column] >= low) & (matrix[:, column] <= high)
+        return lambda matrix: (matrix[:, column] < low) | (matrix[:, column] > high)
+    operators = [op for op in COMPARISONS if op in condition]
+    if len(operators) != 1:
+        raise RuleError(f"Rule '{rule_id}' needs exactly one comparison for {pid}, got {operators or 'none'}")
+    compare, threshold = COMPARISONS[operators[0]], float(condition[operators[0]])
+    return lambda matrix: compare(matrix[:, column], threshold)
+
+def _compile_row_condition(condition: Mapping[str, Any], columns: Dict[str, int]) -> RowCondition:
+    """Scalar twin of a compiled ``when`` clause, over one row of PID values (NaN = missing)
+
+    Runs after _compile_condition, which has validated the clause and assigned the columns.
+    """
+    if 'all' in condition or 'any' in condition:
+        parts = [_compile_row_condition(part, columns) for part in condition.get('all', condition.get('any'))]
+        if 'all' in condition:
+            return lambda row: all(part(row) for part in parts)
+        return lambda row: any(part(row) for part in parts)
+    if 'not' in condition:
+        inner = _compile_row_condition(condition['not'], columns)
+        referenced = [columns[pid] for pid in _condition_pids(condition['not'])]
+        return lambda row: not inner(row) and not any(math.isnan(row[column]) for column in referenced)
+
+    column = columns[condition['pid']]
+    if 'between' in condition or 'outside' in condition:
+        low, high = (float(bound) for bound in condition.get('between', condition.get('outside')))
+        if 'between' in condition:
+            return lambda row: low <= row[column] <= high
+        return lambda row: row[column] < low or row[column] > high
+    op = next(op for op in SCALAR_COMPARISONS if op in condition)
+    compare, threshold = SCALAR_COMPARISONS[op], float(condition[op])
+    return lambda row: compare(row[column], threshold)
+
+class Rule:
+    """One compiled rule"""
+
+    __slots__ = (
+        'id', 'description', 'severity', 'confidence', 'duration_ms', 'make', 'model', 'years', 'condition', 'row_condition'
+    )
+
+    def __init__(self, spec: Mapping[str, Any], columns: Dict[str, int]):
+        self.id = spec['id']
+        self.description = spec.get('description', self.id)
+        self.severity = spec.get('severity', 'maintenance_required')
+        if self.severity not in DIAGNOSTIC_CLASSES[1:]:
+            raise RuleError(f"Rule '{self.id}' has unknown severity '{self.severity}'")
+        self.confidence = float(spec.get('confidence', DEFAULT_RULE_CONFIDENCE))
+        self.duration_ms = int(float(spec.get('duration_seconds', 0)) * 1000)
+        scope = spec.get('scope') or {}
+        self.make = scope['make'].lower() if scope.get('make') else None
+        self.model = scope['model'].lower() if scope.get('model') else None
+        self.years = tuple(scope['years']) if scope.get('years') else None
+        self.condition = _compile_condition(spec['when'], columns, self.id)
+        self.row_condition = _compile_row_condition(spec['when'], columns)
+
+    @property
+    def scoped(self) -> bool:
+        return self.make is not None or self.model is not None or self.years is not None
+
+def _sustained(mask: np.ndarray, timestamps_ms: np.ndarray, duration_ms: int) -> np.ndarray:
+    """Rows where mask has held continuously for at least duration_ms"""
+    if not len(mask):
+        return mask
+    index = np.arange(len(mask))
+    run_starts = mask & ~np.concatenate(([False], mask[:-1]))
+    run_start = np.maximum.accumulate(np.where(run_starts, index, 0))
+    return mask & (timestamps_ms - timestamps_ms[run_start] >= duration_ms)
+
+class RuleEngine:
+    """Evaluates a compiled rule table over OBD snapshots or telemetry windows"""
+
+    def __init__(self, specs: Sequence[Mapping[str, Any]], source: str = "<table>"):
+        self.source = source
+        self.columns: Dict[str, int] = {}
+        self.rules: List[Rule] = [Rule(spec, self.columns) for spec in specs]
+        self.pids = tuple(self.columns)
+        self.severity_rank = np.array([DIAGNOSTIC_CLASSES.index(rule.severity) for rule in self.rules], dtype=np.int8)
+        self.confidences = np.array([rule.confidence for rule in self.rules])
+        self.durations = np.array([rule.duration_ms for rule in self.rules], dtype=np.int64)
+        # Unscoped rules, and per rule id the scoped variants that replace them
+        self._unscoped = np.array([not rule.scoped for rule in self.rules], dtype=bool)
+        self._variants: Dict[str, List[int]] = {}
+        self._bases: Dict[str, List[int]] = {}
+        for index, rule in enumerate(self.rules):
+            (self._variants if rule.scoped else self._bases).setdefault(rule.id, []).append(index)
+
+        # Metrics
+        self.rows_evaluated = 0
+        self.windows_evaluated = 0
+
+    @classmethod
+    def from_file(cls, path: str = RULES_PATH) -> "RuleEngine":
+        with open(path, encoding='utf-8') as f:
+            table = json.load(f)
+        engine = cls(table['rules'], source=path)
+        logger.info(f"Loaded {len(engine.rules)} OBD rules over {len(engine.pids)} PIDs from {path}")
+        return engine
+
+    def matrix(self, obd_batch: Sequence[Mapping[str, Any]]) -> np.ndarray:
+        """(N, PIDs) float32 matrix of the PIDs the rules reference; NaN where missing"""
+        rows = len(obd_batch)
+        if rows == 1:
+            # Single snapshots (the low-latency path) skip the per-column iterators
+            obd_data = obd_batch[0]
+            return np.array(
+                [[value if isinstance(value := obd_data.get(pid), (int, float)) else np.nan for pid in self.pids]],
+                dtype=np.float32
+            )
+        matrix = np.empty((rows, len(self.pids)), dtype=np.float32)
+        for pid, index in self.columns.items():
+            matrix[:, index] = np.fromiter(
+                (
+                    value if isinstance(value := obd_data.get(pid), (int, float)) else np.nan
+                    for obd_data in obd_batch
+                ),
+                dtype=np.float32,
+                count=rows
+            )
+        return matrix
+
+    def applicable(self, rows: int, vehicles: Optional[Sequence[Optional[Mapping[str, Any]]]] = None) -> np.ndarray:
+        """(N, rules) mask of the rules in scope for each row's vehicle"""
+        mask = np.zeros((rows, len(self.rules)), dtype=bool)
+        mask[:, self._unscoped] = True
+        if vehicles is None or not self._variants:
+            return mask
+
+        makes = np.array([str((vehicle or {}).get('make') or '').lower() for vehicle in vehicles], dtype=object)
+        models = np.array([str((vehicle or {}).get('model') or '').lower() for vehicle in vehicles], dtype=object)
+        years = np.array([(vehicle or {}).get('year') or 0 for vehicle in vehicles], dtype=np.int64)
+        for rule_id, variants in self._variants.items():
+            replaced = np.zeros(rows, dtype=bool)
+            for index in variants:
+                rule = self.rules[index]
+                in_scope = np.ones(rows, dtype=bool)
+                if rule.make is not None:
+                    in_scope &= makes == rule.make
+                if rule.model is not None:
+                    in_scope &= models == rule.model
+                if rule.years is not None:
+                    in_scope &= (years >= rule.years[0]) & (years <= rule.years[-1])
+                mask[:, index] = in_scope
+                replaced |= in_scope
+            # Scoped-only ids have no unscoped rule to replace
+            for base_index in self._bases.get(rule_id, ()):
+                mask[:, base_index] &= ~replaced
+        return mask
+
+    def fired(self, matrix: np.ndarray, applicable: np.ndarray, timestamps_ms: Optional[np.ndarray] = None) -> np.ndarray:
+        """(N, rules) mask of fired rules
+
+        Without timestamps the rows are independent snapshots and rules with
+        a duration cannot fire.
+        """
+        fired = np.zeros(applicable.shape, dtype=bool)
+        in_scope = applicable.any(axis=0).tolist()
+        for index, rule in enumerate(self.rules):
+            if not in_scope[index] or (rule.duration_ms and timestamps_ms is None):
+                continue
+            condition = rule.condition(matrix) & applicable[:, index]
+            if rule.duration_ms:
+                condition = _sustained(condition, timestamps_ms, rule.duration_ms)
+            fired[:, index] = condition
+        return fired
+
+    def _verdicts(self, fired: np.ndarray) -> List[Dict[str, Any]]:
+        """Verdict dicts for an (N, rules) fired mask, reduced column-wise before the per-row loop"""
+        ranks = np.where(fired, self.severity_rank, 0)
+        worst = ranks.max(axis=1, initial=0)
+        # Confidence of the most confident rule at the worst severity
+        confidence = np.where(fired & (ranks == worst[:, np.newaxis]), self.confidences, 0.0).max(axis=1, initial=0.0)
+        confidence[worst == 0] = DEFAULT_RULE_CONFIDENCE
+        rows, indices = np.nonzero(fired)
+        bounds = np.searchsorted(rows, np.arange(len(fired) + 1)).tolist()
+        indices = indices.tolist()
+        return [
+            {
+                'prediction': DIAGNOSTIC_CLASSES[rank],
+                'confidence': row_confidence,
+                'issues': [self.rules[index].description for index in indices[bounds[row]:bounds[row + 1]]],
+                'rules_fired': [self.rules[index].id for index in indices[bounds[row]:bounds[row + 1]]],
+                'source': 'rules'
+            }
+            for row, (rank, row_confidence) in enumerate(zip(worst.tolist(), confidence.tolist()))
+        ]
+
+    def evaluate_batch(
+        self,
+        obd_batch: Sequence[Mapping[str, Any]],
+        vehicles: Optional[Sequence[Optional[Mapping[str, Any]]]] = None
+    ) -> List[Dict[str, Any]]:
+        """One verdict per snapshot: worst severity fired, its confidence, and the rules that fired"""
+        fired = self.fired(self.matrix(obd_batch), self.applicable(len(obd_batch), vehicles))
+        self.rows_evaluated += len(obd_batch)
+        return self._verdicts(fired)
+
+    def evaluate(self, obd_data: Mapping[str, Any], vehicle: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+        return self.evaluate_batch([obd_data], None if vehicle is None else [vehicle])[0]
+
+    def evaluate_window(
+        self,
+        timestamps_ms: np.ndarray,
+        columns: Mapping[str, np.ndarray],
+        vehicle: Optional[Mapping[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Evaluate a time-ordered telemetry window (PID -> values, NaN = missing) in one pass
+
+        The verdict covers every rule that fired anywhere in the window, with
+        the first and last time it fired and on how many rows.
+        """
+        rows = len(timestamps_ms)
+        matrix = np.full((rows, len(self.pids)), np.nan, dtype=np.float32)
+        for pid, index in self.columns.items():
+            if pid in columns:
+                matrix[:, index] = columns[pid]
+        applicable = self.applicable(rows, None if vehicle is None else [vehicle] * rows)
+        fired = self.fired(matrix, applicable, np.asarray(timestamps_ms, dtype=np.int64))
+        self.rows_evaluated += rows
+        self.windows_evaluated += 1
+
+        verdict = self._verdicts(fired.any(axis=0, keepdims=True))[0]
+        verdict['rows'] = rows
+        verdict['firings'] = [
+            {
+                'rule': self.rules[index].id,
+                'severity': self.rules[index].severity,
+                'rows': int(fired[:, index].sum()),
+                'first_timestamp_ms': int(timestamps_ms[np.argmax(fired[:, index])]),
+                'last_timestamp_ms': int(timestamps_ms[rows - 1 - np.argmax(fired[::-1, index])])
+            }
+            for index in np.flatnonzero(fired.any(axis=0))
+        ]
+        return verdict
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'source': self.source,
+            'rules': len(self.rules),
+            'scoped_rules': int((~self._unscoped).sum()),
+            'pids': list(self.pids),
+            'rows_evaluated': self.rows_evaluated,
+            'windows_evaluated': self.windows_evaluated
+        }
+
+class RuleTracker:
+    """Rules firing on one vehicle's live frame stream, advanced a frame at a time
+
+    Each rule remembers when its condition started holding, so a duration
+    rule fires once that is long enough ago without re-scanning a window.
+    """
+
+    def __init__(self, engine: RuleEngine, vehicle: Optional[Mapping[str, Any]] = None):
+        self.engine = engine
+        applicable = engine.applicable(1, None if vehicle is None else [vehicle])[0]
+        self._rules = [rule for rule, in_scope in zip(engine.rules, applicable.tolist()) if in_scope]
+        # Rule -> timestamp (ms) its condition started holding
+        self._since: Dict[Rule, int] = {}
+        self._firing: List[Rule] = []
+
+    def update(self, timestamp_ms: int, values: Sequence[float]) -> List[str]:
+        """Apply one frame (a value per engine PID, NaN = missing); returns the ids of rules that started firing"""
+        firing, started = [], []
+        for rule in self._rules:
+            if not rule.row_condition(values):
+                self._since.pop(rule, None)
+                continue
+            if timestamp_ms - self._since.setdefault(rule, timestamp_ms) >= rule.duration_ms:
+                firing.append(rule)
+                if rule not in self._firing:
+                    started.append(rule.id)
+        self._firing = firing
+        return list(dict.fromkeys(started))
+
+    def active(self) -> List[str]:
+        """Ids of the rules firing on the latest frame"""
+        return list(dict.fromkeys(rule.id for rule in self._firing))
@@ -0,0 +1,81 @@
+"""
+KC Speedshop ML Diagnostic Service - Model scoring
+The active engine_diagnostics model and the batch scoring function
+
+Kept apart from main.py so ``INFERENCE_EXECUTOR=process`` workers, which
+unpickle ``score_feature_matrix`` and preload models with
+``load_ml_models_sync``, import only the registry, the feature schema and
+the metrics - not the FastAPI app, the stores and the indexes.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from features import NUM_FEATURES
+from metrics import INFERENCE_BATCH_ROWS, stage_timer
+from model_registry import DIAGNOSTIC_CLASSES, ModelBundle, ModelRegistry, build_bootstrap_bundle
+
+logger = logging.getLogger(__name__)
+
+# Global variables for ML models (name -> active ModelBundle)
+ml_models: Dict[str, ModelBundle] = {}
+model_registry = ModelRegistry()
+
+def load_ml_models_sync() -> Optional[ModelBundle]:
+    """Load pre-trained ML models (also used to preload inference worker processes)
+
+    Returns the loaded bundle. The served model version is not recorded here:
+    pool workers come and go with model swaps, and a retired worker's model
+    info would otherwise stay in the multiprocess metrics.
+    """
+    try:
+        logger.info("Loading ML models...")
+
+        bundle = model_registry.load_active()
+        if bundle is None:
+            # Nothing published yet - fall back to the untrained placeholder model
+            logger.warning(f"No model artifacts under {model_registry.model_dir}, building placeholder model")
+            bundle = build_bootstrap_bundle(model_registry.backend, NUM_FEATURES)
+
+        model_registry.active = bundle
+        ml_models['engine_diagnostics'] = bundle
+
+        logger.info(f"Loaded {len(ml_models)} ML models successfully (engine_diagnostics {bundle.version})")
+        return bundle
+
+    except Exception as e:
+        logger.error(f"Error loading ML models: {e}")
+        return None
+
+def ml_model_label() -> str:
+    """Name and version of the active diagnostic model, e.g. engine_diagnostics:v002"""
+    bundle = model_registry.active
+    return f"{bundle.name}:{bundle.version}" if bundle else "rule_based"
+
+def score_feature_matrix(feature_matrix: np.ndarray) -> List[Dict[str, Any]]:
+    """Scale and score an (N, 20) feature matrix in one model pass"""
+    # Read the bundle once so a concurrent hot swap cannot mix model and scaler versions
+    bundle = ml_models['engine_diagnostics']
+    INFERENCE_BATCH_ROWS.observe(len(feature_matrix))
+    if bundle.scaler is not None:
+        with stage_timer('scaling'):
+            scaled_features = bundle.scale(feature_matrix)
+    else:
+        # Folded into the model's first layer, so scaling is timed as inference
+        scaled_features = feature_matrix
+    with stage_timer('inference'):
+        probabilities = bundle.infer(scaled_features)
+    class_indices = np.argmax(probabilities, axis=1)
+    confidences = np.max(probabilities, axis=1)
+
+    return [
+        {
+            'prediction': DIAGNOSTIC_CLASSES[int(class_index)],
+            'confidence': float(confidence),
+            'features_analyzed': feature_matrix.shape[1],
+            'model_version': bundle.version
+        }
+        for class_index, confidence in zip(class_indices, confidences)
+    ]
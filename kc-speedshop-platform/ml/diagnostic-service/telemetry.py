@@ -0,0 +1,495 @@
+"""
+KC Speedshop ML Diagnostic Service - Live telemetry
+WebSocket OBD frame ingestion with O(1) rolling-window features per vehicle
+
+Each vehicle keeps a fixed-length window of recent frames. Running sums of
+x, x², t·x (per PID) and t, t² make the mean, variance and least-squares
+slope an O(1) update per frame: add the new sample, subtract the evicted one.
+The model is only scored when a window's worth of new frames has arrived, a
+new DTC is reported or an OBD rule starts firing, not on every frame. Rules
+come from the same RuleEngine table as the snapshot fallback, scoped to the
+vehicle the connection names; duration rules fire once their condition has
+held for long enough on the stream.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+
+from caching import MemoryTTLCache
+from features import OBD_FEATURE_PIDS
+from rule_engine import RuleEngine, RuleTracker
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_WINDOW_FRAMES = int(os.getenv("TELEMETRY_WINDOW_FRAMES", "50"))
+TELEMETRY_MAX_SESSIONS = int(os.getenv("TELEMETRY_MAX_SESSIONS", "1000"))
+# Idle sessions keep their window this long so a reconnecting dongle resumes
+TELEMETRY_SESSION_IDLE_SECONDS = float(os.getenv("TELEMETRY_SESSION_IDLE_SECONDS", "300"))
+# Frames buffered per connection between the socket reader and the feature updater
+TELEMETRY_QUEUE_MAX_FRAMES = int(os.getenv("TELEMETRY_QUEUE_MAX_FRAMES", "256"))
+# Messages buffered per connection for a client that is slow to read them
+TELEMETRY_SEND_QUEUE_MAX = int(os.getenv("TELEMETRY_SEND_QUEUE_MAX", "32"))
+TELEMETRY_MAX_FRAME_BYTES = int(os.getenv("TELEMETRY_MAX_FRAME_BYTES", "16384"))
+
+# Running sums drift with float rounding; rebuild them from the window this often
+RESYNC_EVERY_WINDOWS = 64
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def validate_frame(frame: Mapping[str, Any], pids: Sequence[str] = OBD_FEATURE_PIDS):
+    """Raise ValueError for a frame whose timestamp or PID values are not finite numbers
+
+    One NaN or infinity would otherwise stay in the window's running sums
+    until the next resync, and a NaN timestamp cannot be stored.
+    """
+    if 't' in frame and not (_is_number(frame['t']) and math.isfinite(frame['t'])):
+        raise ValueError("'t' must be a finite number of unix seconds")
+    values = frame.get('pids')
+    if not isinstance(values, Mapping):
+        values = frame
+    for pid in pids:
+        value = values.get(pid)
+        if value is None:
+            continue
+        if isinstance(value, bool) or (isinstance(value, (int, float)) and not math.isfinite(value)):
+            raise ValueError(f"{pid} must be a finite number")
+
+class RollingWindow:
+    """Fixed-length window over (timestamp, PID vector) samples with O(1) statistics"""
+
+    def __init__(self, pids: Sequence[str], size: int = TELEMETRY_WINDOW_FRAMES):
+        if size < 2:
+            raise ValueError("Rolling window needs at least two frames")
+        self.pids = tuple(pids)
+        self.size = size
+        self.columns = {pid: index for index, pid in enumerate(self.pids)}
+
+        self._values = np.zeros((size, len(self.pids)), dtype=np.float64)
+        self._times = np.zeros(size, dtype=np.float64)
+        self._head = 0
+        self.count = 0
+        self._origin: Optional[float] = None
+        self._updates = 0
+
+        self._sum_x = np.zeros(len(self.pids))
+        self._sum_xx = np.zeros(len(self.pids))
+        self._sum_tx = np.zeros(len(self.pids))
+        self._sum_t = 0.0
+        self._sum_tt = 0.0
+
+    def push(self, timestamp: float, values: np.ndarray):
+        """Add one sample, evicting the oldest once the window is full"""
+        if self._origin is None:
+            self._origin = timestamp
+        # Times relative to the first sample keep t² small
+        t = timestamp - self._origin
+
+        if self.count == self.size:
+            old_t = self._times[self._head]
+            old_x = self._values[self._head]
+            self._sum_x -= old_x
+            self._sum_xx -= old_x * old_x
+            self._sum_tx -= old_t * old_x
+            self._sum_t -= old_t
+            self._sum_tt -= old_t * old_t
+        else:
+            self.count += 1
+
+        self._values[self._head] = values
+        self._times[self._head] = t
+        self._sum_x += values
+        self._sum_xx += values * values
+        self._sum_tx += t * values
+        self._sum_t += t
+        self._sum_tt += t * t
+        self._head = (self._head + 1) % self.size
+
+        self._updates += 1
+        if self._updates % (self.size * RESYNC_EVERY_WINDOWS) == 0:
+            self._resync()
+
+    def _resync(self):
+        values = self._values[:self.count] if self.count < self.size else self._values
+        times = self._times[:self.count] if self.count < self.size else self._times
+        self._sum_x = values.sum(axis=0)
+        self._sum_xx = (values * values).sum(axis=0)
+        self._sum_tx = (times[:, np.newaxis] * values).sum(axis=0)
+        self._sum_t = float(times.sum())
+        self._sum_tt = float((times * times).sum())
+
+    def mean(self) -> np.ndarray:
+        if not self.count:
+            return np.zeros(len(self.pids))
+        return self._sum_x / self.count
+
+    def variance(self) -> np.ndarray:
+        """Population variance per PID"""
+        if not self.count:
+            return np.zeros(len(self.pids))
+        mean = self._sum_x / self.count
+        return np.maximum(self._sum_xx / self.count - mean * mean, 0.0)
+
+    def slope(self) -> np.ndarray:
+        """Least-squares slope per PID, in units per second"""
+        n = self.count
+        denominator = n * self._sum_tt - self._sum_t * self._sum_t
+        if n < 2 or denominator <= 1e-12:
+            return np.zeros(len(self.pids))
+        return (n * self._sum_tx - self._sum_t * self._sum_x) / denominator
+
+    def features(self) -> Dict[str, Dict[str, float]]:
+        """{pid: {'mean', 'variance', 'slope'}} for the current window"""
+        mean, variance, slope = self.mean(), self.variance(), self.slope()
+        return {
+            pid: {
+                'mean': float(mean[index]),
+                'variance': float(variance[index]),
+                'slope': float(slope[index])
+            }
+            for pid, index in self.columns.items()
+        }
+
+class TelemetrySession:
+    """Per-vehicle rolling state and scoring triggers"""
+
+    def __init__(
+        self,
+        vehicle_id: str,
+        pids: Sequence[str] = OBD_FEATURE_PIDS,
+        window_size: int = TELEMETRY_WINDOW_FRAMES,
+        rule_engine: Optional[RuleEngine] = None,
+        vehicle: Optional[Mapping[str, Any]] = None
+    ):
+        self.vehicle_id = vehicle_id
+        self.window = RollingWindow(pids, window_size)
+        self.rule_engine = rule_engine
+        # Missing PIDs carry their last reported value forward
+        self._last = np.zeros(len(self.window.pids))
+        # The latest frame as reported (NaN = PID missing), for the history store
+        self.last_raw = np.full(len(self.window.pids), np.nan)
+        self.last_timestamp = 0.0
+        # Rule PIDs also carry forward, but stay NaN until first reported
+        self._rule_values = [math.nan] * (len(rule_engine.pids) if rule_engine else 0)
+        self.pids = tuple(dict.fromkeys(self.window.pids + (rule_engine.pids if rule_engine else ())))
+        self.vehicle: Optional[Dict[str, Any]] = None
+        self._rules: Optional[RuleTracker] = None
+        self.set_vehicle(vehicle)
+        self.dtc_codes: List[str] = []
+
+        self.frames = 0
+        self.frames_since_score = 0
+        self.scores = 0
+        self.last_score: Optional[Dict[str, Any]] = None
+        self.connected = False
+
+    def set_vehicle(self, vehicle: Optional[Mapping[str, Any]]):
+        """Scope the rules to a vehicle (make, model, year); rule state restarts when it changes"""
+        vehicle = dict(vehicle) if vehicle else None
+        if self.rule_engine is not None and (self._rules is None or vehicle != self.vehicle):
+            self._rules = RuleTracker(self.rule_engine, vehicle)
+        self.vehicle = vehicle
+
+    def ingest(self, frame: Mapping[str, Any]) -> Optional[str]:
+        """Apply one frame; returns the scoring trigger, if any
+
+        A frame is ``{"t": <unix seconds>, "pids": {...}, "dtc_codes": [...]}``
+        or a flat ``{PID: value}`` mapping timestamped on arrival.
+        """
+        timestamp = frame.get('t')
+        if not _is_number(timestamp) or not math.isfinite(timestamp):
+            timestamp = time.time()
+        pids = frame.get('pids')
+        if not isinstance(pids, Mapping):
+            pids = frame
+
+        values = self._last
+        raw = self.last_raw
+        raw.fill(np.nan)
+        for pid, index in self.window.columns.items():
+            value = pids.get(pid)
+            if _is_number(value) and math.isfinite(value):
+                values[index] = value
+                raw[index] = value
+        self.last_timestamp = float(timestamp)
+        self.window.push(self.last_timestamp, values)
+        self.frames += 1
+        self.frames_since_score += 1
+
+        trigger = None
+        if self._rules is not None:
+            for pid, index in self.rule_engine.columns.items():
+                value = pids.get(pid)
+                if _is_number(value) and math.isfinite(value):
+                    self._rule_values[index] = float(value)
+            started = self._rules.update(int(round(self.last_timestamp * 1000)), self._rule_values)
+            if started:
+                trigger = f"rule:{started[0]}"
+
+        dtc_codes = frame.get('dtc_codes', pids.get('DTC_CODES'))
+        if isinstance(dtc_codes, list):
+            new_codes = [str(code) for code in dtc_codes if str(code) not in self.dtc_codes]
+            self.dtc_codes = [str(code) for code in dtc_codes]
+            if new_codes:
+                trigger = trigger or "dtc"
+
+        if trigger is None and self.frames_since_score >= self.window.size:
+            trigger = "window"
+        return trigger
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Window means as an OBD snapshot for the diagnostic model (starts a new scoring window)"""
+        self.frames_since_score = 0
+        mean = self.window.mean()
+        snapshot: Dict[str, Any] = {pid: float(mean[index]) for pid, index in self.window.columns.items()}
+        snapshot['DTC_CODES'] = list(self.dtc_codes)
+        return snapshot
+
+    def mark_scored(self, analysis: Dict[str, Any]):
+        self.scores += 1
+        self.last_score = analysis
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'vehicle_id': self.vehicle_id,
+            'connected': self.connected,
+            'frames': self.frames,
+            'window_frames': self.window.count,
+            'scores': self.scores,
+            'active_rules': self._rules.active() if self._rules is not None else []
+        }
+
+class TelemetryHub:
+    """Owns telemetry sessions and pumps WebSocket connections
+
+    Each connection has a reader task feeding a bounded frame queue and a
+    writer task draining a bounded send queue. When either fills up, the
+    oldest entry is dropped and counted; memory per connection stays fixed
+    however slow the dongle's network or the client's reads are.
+    """
+
+    def __init__(
+        self,
+        score_fn: Callable[[Dict[str, Any], Optional[Dict[str, Any]]], Awaitable[Dict[str, Any]]],
+        history_store=None,
+        rule_engine: Optional[RuleEngine] = None,
+        max_sessions: int = TELEMETRY_MAX_SESSIONS,
+        window_size: int = TELEMETRY_WINDOW_FRAMES,
+        idle_seconds: float = TELEMETRY_SESSION_IDLE_SECONDS,
+        queue_max_frames: int = TELEMETRY_QUEUE_MAX_FRAMES,
+        send_queue_max: int = TELEMETRY_SEND_QUEUE_MAX
+    ):
+        self.score_fn = score_fn
+        # Optional TelemetryStore receiving every accepted frame
+        self.history_store = history_store
+        # Rules whose firing triggers scoring, evaluated on every frame
+        self.rule_engine = rule_engine
+        self.max_sessions = max_sessions
+        self.window_size = window_size
+        self.queue_max_frames = queue_max_frames
+        self.send_queue_max = send_queue_max
+        self._active: Dict[str, TelemetrySession] = {}
+        self._idle = MemoryTTLCache(max_entries=max_sessions, ttl=idle_seconds)
+
+        # Metrics
+        self.connections_total = 0
+        self.connections_rejected = 0
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.frames_invalid = 0
+        self.messages_dropped = 0
+        self.scores_total = 0
+        self.scores_coalesced = 0
+        self.score_errors = 0
+        self.history_errors = 0
+
+    def _open_session(self, vehicle_id: str, vehicle: Optional[Mapping[str, Any]]) -> Optional[TelemetrySession]:
+        if vehicle_id in self._active or len(self._active) >= self.max_sessions:
+            return None
+        session = self._idle.get(vehicle_id)
+        if session is None:
+            session = TelemetrySession(
+                vehicle_id, window_size=self.window_size, rule_engine=self.rule_engine, vehicle=vehicle
+            )
+        else:
+            self._idle.delete(vehicle_id)
+            session.set_vehicle(vehicle)
+        session.connected = True
+        self._active[vehicle_id] = session
+        return session
+
+    def _close_session(self, session: TelemetrySession):
+        session.connected = False
+        self._active.pop(session.vehicle_id, None)
+        self._idle.set(session.vehicle_id, session)
+
+    @staticmethod
+    def _put_dropping_oldest(queue: asyncio.Queue, item: Any) -> bool:
+        """Enqueue, discarding the oldest item when full; returns True if one was dropped"""
+        dropped = False
+        if queue.full():
+            queue.get_nowait()
+            dropped = True
+        queue.put_nowait(item)
+        return dropped
+
+    async def serve(self, websocket: WebSocket, vehicle_id: str, vehicle: Optional[Mapping[str, Any]] = None):
+        """Handle one telemetry connection until the client disconnects
+
+        ``vehicle`` (make, model, year) scopes the rules and the model call.
+        """
+        await websocket.accept()
+        session = self._open_session(vehicle_id, vehicle)
+        if session is None:
+            self.connections_rejected += 1
+            reason = "vehicle already streaming" if vehicle_id in self._active else "too many telemetry sessions"
+            await websocket.close(code=1013, reason=reason)
+            return
+
+        self.connections_total += 1
+        logger.info(f"Telemetry session opened for vehicle {vehicle_id}")
+        frames: asyncio.Queue = asyncio.Queue(maxsize=self.queue_max_frames)
+        outbox: asyncio.Queue = asyncio.Queue(maxsize=self.send_queue_max)
+
+        tasks = [
+            asyncio.create_task(self._read(websocket, session, frames, outbox)),
+            asyncio.create_task(self._process(session, frames, outbox)),
+            asyncio.create_task(self._write(websocket, outbox))
+        ]
+        try:
+            # The reader ends on disconnect; the others only end on error
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            failed = [task for task in done if not task.cancelled() and task.exception() is not None]
+            if failed and tasks[0] not in done:
+                # Without its processor or writer the connection would hang open, so close it
+                logger.error(f"Telemetry session for vehicle {vehicle_id} failed: {failed[0].exception()!r}")
+                try:
+                    await websocket.close(code=1011, reason="telemetry session failed")
+                except Exception:
+                    pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._close_session(session)
+            logger.info(f"Telemetry session closed for vehicle {vehicle_id} after {session.frames} frames")
+
+    async def _read(self, websocket: WebSocket, session: TelemetrySession, frames: asyncio.Queue, outbox: asyncio.Queue):
+        try:
+            while True:
+                text = await websocket.receive_text()
+                self.frames_received += 1
+                try:
+                    if len(text) > TELEMETRY_MAX_FRAME_BYTES:
+                        raise ValueError(f"frame exceeds {TELEMETRY_MAX_FRAME_BYTES} bytes")
+                    frame = json.loads(text)
+                    if not isinstance(frame, dict):
+                        raise ValueError("frame must be a JSON object")
+                    validate_frame(frame, session.pids)
+                except ValueError as e:
+                    self.frames_invalid += 1
+                    self._send(outbox, {'type': 'error', 'detail': f"Invalid frame: {e}"})
+                    continue
+                if self._put_dropping_oldest(frames, frame):
+                    self.frames_dropped += 1
+        except WebSocketDisconnect:
+            pass
+
+    async def _process(self, session: TelemetrySession, frames: asyncio.Queue, outbox: asyncio.Queue):
+        scoring: Optional[asyncio.Task] = None
+        deferred: Optional[str] = None
+        history_failed = False
+
+        def start(trigger: str):
+            nonlocal scoring
+            scoring = asyncio.create_task(self._score(session, trigger, outbox))
+            scoring.add_done_callback(finished)
+
+        def finished(task: asyncio.Task):
+            nonlocal deferred
+            # Triggers that arrived mid-call are answered with one fresh score
+            if deferred is not None and not task.cancelled():
+                trigger, deferred = deferred, None
+                start(trigger)
+
+        try:
+            while True:
+                frame = await frames.get()
+                trigger = session.ingest(frame)
+                if self.history_store is not None:
+                    try:
+                        self.history_store.append(session.vehicle_id, session.last_timestamp, session.last_raw)
+                    except Exception as e:
+                        # Live scoring goes on without history; logged once per session
+                        self.history_errors += 1
+                        if not history_failed:
+                            history_failed = True
+                            logger.error(f"Telemetry history append failed for vehicle {session.vehicle_id}: {e}")
+                if trigger is None:
+                    continue
+                if scoring is not None and not scoring.done():
+                    # One model call per session at a time
+                    self.scores_coalesced += 1
+                    if deferred is None or deferred == "window":
+                        deferred = trigger
+                    continue
+                start(trigger)
+        finally:
+            deferred = None
+            if scoring is not None:
+                scoring.cancel()
+
+    async def _score(self, session: TelemetrySession, trigger: str, outbox: asyncio.Queue):
+        snapshot = session.snapshot()
+        try:
+            analysis = await self.score_fn(snapshot, session.vehicle)
+        except Exception as e:
+            self.score_errors += 1
+            logger.error(f"Telemetry scoring failed for vehicle {session.vehicle_id}: {e}")
+            self._send(outbox, {'type': 'error', 'detail': "Scoring failed"})
+            return
+        session.mark_scored(analysis)
+        self.scores_total += 1
+        self._send(outbox, {
+            'type': 'score',
+            'vehicle_id': session.vehicle_id,
+            'trigger': trigger,
+            'frames': session.frames,
+            'analysis': analysis,
+            'features': session.window.features()
+        })
+
+    def _send(self, outbox: asyncio.Queue, message: Dict[str, Any]):
+        if self._put_dropping_oldest(outbox, message):
+            self.messages_dropped += 1
+
+    async def _write(self, websocket: WebSocket, outbox: asyncio.Queue):
+        while True:
+            message = await outbox.get()
+            await websocket.send_text(json.dumps(message, default=str))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active_sessions': len(self._active),
+            'idle_sessions': len(self._idle),
+            'max_sessions': self.max_sessions,
+            'window_frames': self.window_size,
+            'connections_total': self.connections_total,
+            'connections_rejected': self.connections_rejected,
+            'frames_received': self.frames_received,
+            'frames_dropped': self.frames_dropped,
+            'frames_invalid': self.frames_invalid,
+            'messages_dropped': self.messages_dropped,
+            'scores_total': self.scores_total,
+            'scores_coalesced': self.scores_coalesced,
+            'score_errors': self.score_errors,
+            'history_errors': self.history_errors
+        }
@@ -0,0 +1,330 @@
+"""
+KC Speedshop ML Diagnostic Service - Telemetry rollups
+Tiered 1-minute / 1-hour / 1-day aggregates of OBD history for long-range queries
+
+Each tier is a TelemetryStore of its own under TELEMETRY_ROLLUP_DIR, with one
+row per bucket (timestamp = bucket start) and five columns per PID::
+
+    <PID>.min  <PID>.max  <PID>.mean  <PID>.count  <PID>.last
+
+so tiers get the same segments, compaction, compression and retention as raw
+history. Aggregates are maintained incrementally: every recorded frame
+updates the open 1-minute bucket, and a closed bucket is written to its tier
+and folded into the next coarser one. Open buckets are served as partial rows,
+so queries are current to the last frame.
+
+Rows that share a bucket (an open bucket written at shutdown and continued
+after a restart) are merged when read.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from telemetry_store import TelemetryRange, TelemetryStore
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_ROLLUP_DIR = os.getenv("TELEMETRY_ROLLUP_DIR", "data/telemetry_rollups")
+# Closed buckets are buffered and written to their tier at this interval
+TELEMETRY_ROLLUP_FLUSH_SECONDS = float(os.getenv("TELEMETRY_ROLLUP_FLUSH_SECONDS", "300"))
+# Per-tier retention in seconds (0 keeps everything)
+TELEMETRY_ROLLUP_RETENTION_SECONDS = {
+    '1m': float(os.getenv("TELEMETRY_ROLLUP_1M_RETENTION_SECONDS", str(180 * 86400))),
+    '1h': float(os.getenv("TELEMETRY_ROLLUP_1H_RETENTION_SECONDS", str(5 * 365 * 86400))),
+    '1d': float(os.getenv("TELEMETRY_ROLLUP_1D_RETENTION_SECONDS", "0"))
+}
+
+# (name, bucket width in milliseconds), finest first
+ROLLUP_TIERS: Tuple[Tuple[str, int], ...] = (('1m', 60_000), ('1h', 3_600_000), ('1d', 86_400_000))
+ROLLUP_STATS = ('min', 'max', 'mean', 'count', 'last')
+RAW_TIER = 'raw'
+
+def rollup_column(pid: str, stat: str) -> str:
+    return f"{pid}.{stat}"
+
+class RollupBucket:
+    """Running min/max/sum/count/last of every PID over one bucket"""
+
+    __slots__ = ('start_ms', 'count', 'total', 'minimum', 'maximum', 'last')
+
+    def __init__(self, start_ms: int, pid_count: int):
+        self.start_ms = start_ms
+        self.count = np.zeros(pid_count, dtype=np.int64)
+        self.total = np.zeros(pid_count, dtype=np.float64)
+        self.minimum = np.full(pid_count, np.nan, dtype=np.float64)
+        self.maximum = np.full(pid_count, np.nan, dtype=np.float64)
+        self.last = np.full(pid_count, np.nan, dtype=np.float64)
+
+    def add(self, values: np.ndarray):
+        """Add one frame (NaN = PID not reported)"""
+        reported = ~np.isnan(values)
+        self.count += reported
+        self.total += np.where(reported, values, 0.0)
+        # fmin/fmax ignore NaN on either side
+        np.fmin(self.minimum, values, out=self.minimum)
+        np.fmax(self.maximum, values, out=self.maximum)
+        np.copyto(self.last, values, where=reported)
+
+    def merge(self, other: "RollupBucket"):
+        """Fold a finer, later bucket into this one"""
+        self.count += other.count
+        self.total += other.total
+        np.fmin(self.minimum, other.minimum, out=self.minimum)
+        np.fmax(self.maximum, other.maximum, out=self.maximum)
+        np.copyto(self.last, other.last, where=other.count > 0)
+
+    def row(self) -> np.ndarray:
+        """Tier columns in store order: the five stats of each PID in turn"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(self.count > 0, self.total / self.count, np.nan)
+        return np.stack((self.minimum, self.maximum, mean, self.count, self.last), axis=1).ravel()
+
+def merge_bucket_rows(timestamps: np.ndarray, columns: Dict[str, np.ndarray], pids: Sequence[str]):
+    """Combine rows with equal bucket timestamps (rows must be time-ordered)"""
+    if len(timestamps) < 2 or np.all(timestamps[1:] != timestamps[:-1]):
+        return timestamps, columns
+    starts = np.flatnonzero(np.concatenate(([True], timestamps[1:] != timestamps[:-1])))
+    merged = {}
+    for pid in pids:
+        count = columns[rollup_column(pid, 'count')]
+        mean = columns[rollup_column(pid, 'mean')]
+        last = columns[rollup_column(pid, 'last')]
+        counts = np.add.reduceat(np.nan_to_num(count), starts)
+        totals = np.add.reduceat(np.nan_to_num(mean * count), starts)
+        # Latest row in each bucket that reported the PID
+        reported = np.where(~np.isnan(last), np.arange(len(last)), -1)
+        latest = np.maximum.reduceat(reported, starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            merged[rollup_column(pid, 'mean')] = np.where(counts > 0, totals / counts, np.nan).astype(np.float32)
+        merged[rollup_column(pid, 'min')] = np.fmin.reduceat(columns[rollup_column(pid, 'min')], starts)
+        merged[rollup_column(pid, 'max')] = np.fmax.reduceat(columns[rollup_column(pid, 'max')], starts)
+        merged[rollup_column(pid, 'count')] = counts.astype(np.float32)
+        merged[rollup_column(pid, 'last')] = np.where(latest >= 0, last[np.maximum(latest, 0)], np.nan).astype(np.float32)
+    return timestamps[starts], merged
+
+class RollupResult:
+    """Bucketed aggregates for a time range from one tier"""
+
+    def __init__(self, vehicle_id: str, tier: str, resolution_ms: int, pids: Sequence[str],
+                 timestamps: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.vehicle_id = vehicle_id
+        self.tier = tier
+        self.resolution_ms = resolution_ms
+        self.pids = tuple(pids)
+        self.timestamps = timestamps
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def stat(self, pid: str, stat: str) -> np.ndarray:
+        return self.columns[rollup_column(pid, stat)]
+
+class TelemetryRollups:
+    """Raw OBD history plus incrementally maintained rollup tiers
+
+    Stands in for the raw store as the telemetry hub's history store:
+    ``append`` records the frame and updates the open buckets.
+    """
+
+    def __init__(
+        self,
+        raw_store: TelemetryStore,
+        root: str = TELEMETRY_ROLLUP_DIR,
+        tiers: Sequence[Tuple[str, int]] = ROLLUP_TIERS,
+        flush_seconds: float = TELEMETRY_ROLLUP_FLUSH_SECONDS,
+        retention: Optional[Dict[str, float]] = None
+    ):
+        self.raw_store = raw_store
+        self.pids = raw_store.pids
+        self.tiers = tuple(tiers)
+        retention = {**TELEMETRY_ROLLUP_RETENTION_SECONDS, **(retention or {})}
+        columns = [rollup_column(pid, stat) for pid in self.pids for stat in ROLLUP_STATS]
+        self.stores: Dict[str, TelemetryStore] = {
+            name: TelemetryStore(
+                root=os.path.join(root, name),
+                pids=columns,
+                # A day of buckets per segment at most; small ones are compacted
+                segment_rows=max(1, min(raw_store.segment_rows, 86_400_000 // width)),
+                flush_seconds=flush_seconds,
+                retention_seconds=retention.get(name, 0)
+            )
+            for name, width in self.tiers
+        }
+        # Open buckets per vehicle, one per tier
+        self._open: Dict[str, List[Optional[RollupBucket]]] = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.frames_rolled_up = 0
+        self.buckets_closed = {name: 0 for name, _ in self.tiers}
+        self.queries_by_tier: Dict[str, int] = {RAW_TIER: 0, **{name: 0 for name, _ in self.tiers}}
+
+    # Ingest
+
+    def append(self, vehicle_id: str, timestamp: float, values: np.ndarray) -> bool:
+        """Record a raw frame and fold it into the open 1-minute bucket"""
+        if not self.raw_store.append(vehicle_id, timestamp, values):
+            return False
+        timestamp_ms = int(round(timestamp * 1000))
+        with self._lock:
+            buckets = self._open.setdefault(vehicle_id, [None] * len(self.tiers))
+            _, width = self.tiers[0]
+            start_ms = timestamp_ms - timestamp_ms % width
+            if buckets[0] is not None and buckets[0].start_ms != start_ms:
+                self._close(vehicle_id, buckets, 0)
+            if buckets[0] is None:
+                buckets[0] = RollupBucket(start_ms, len(self.pids))
+            buckets[0].add(np.asarray(values, dtype=np.float64))
+            self.frames_rolled_up += 1
+        return True
+
+    def _close(self, vehicle_id: str, buckets: List[Optional[RollupBucket]], level: int):
+        """Write a finished bucket and fold it into the next tier, closing that too if it ended"""
+        bucket = buckets[level]
+        buckets[level] = None
+        name, _ = self.tiers[level]
+        self.stores[name].append(vehicle_id, bucket.start_ms / 1000, bucket.row())
+        self.buckets_closed[name] += 1
+        if level + 1 == len(self.tiers):
+            return
+        _, coarser_width = self.tiers[level + 1]
+        coarser_start = bucket.start_ms - bucket.start_ms % coarser_width
+        if buckets[level + 1] is not None and buckets[level + 1].start_ms != coarser_start:
+            self._close(vehicle_id, buckets, level + 1)
+        if buckets[level + 1] is None:
+            buckets[level + 1] = RollupBucket(coarser_start, len(self.pids))
+        buckets[level + 1].merge(bucket)
+
+    def _partials(self, vehicle_id: str, level: int) -> List[RollupBucket]:
+        """The vehicle's open buckets at a tier, built from it and the finer open buckets
+
+        Usually one; two just after a boundary, while the finer bucket that
+        crossed it is still open.
+        """
+        with self._lock:
+            buckets = self._open.get(vehicle_id) or []
+            _, width = self.tiers[level]
+            partials: Dict[int, RollupBucket] = {}
+            for finer in range(level, -1, -1):
+                bucket = buckets[finer] if buckets else None
+                if bucket is None:
+                    continue
+                start_ms = bucket.start_ms - bucket.start_ms % width
+                if start_ms not in partials:
+                    partials[start_ms] = RollupBucket(start_ms, len(self.pids))
+                partials[start_ms].merge(bucket)
+            return [partials[start_ms] for start_ms in sorted(partials)]
+
+    # Queries
+
+    def plan(self, start: float, end: float, resolution: float) -> Tuple[str, int]:
+        """Pick the coarsest source whose buckets are no wider than resolution seconds
+
+        Falls back to the next coarser tier when the range starts before the
+        chosen source's retention window. Returns (tier, bucket width in ms);
+        the raw tier has width 0.
+        """
+        resolution_ms = resolution * 1000
+        candidates = [(RAW_TIER, 0, self.raw_store)] + [(name, width, self.stores[name]) for name, width in self.tiers]
+        chosen = 0
+        for index, (_, width, _) in enumerate(candidates):
+            if width <= resolution_ms:
+                chosen = index
+        for index in range(chosen, len(candidates)):
+            since = candidates[index][2].retained_since()
+            if since is None or start >= since:
+                chosen = index
+                break
+        else:
+            chosen = len(candidates) - 1
+        name, width, _ = candidates[chosen]
+        return name, width
+
+    def query(
+        self,
+        vehicle_id: str,
+        start: float,
+        end: float,
+        resolution: float,
+        pids: Optional[Sequence[str]] = None
+    ) -> RollupResult:
+        """Aggregates for start <= t < end from the tier chosen by plan()
+
+        Buckets are labelled by their start, so the first one may begin
+        before ``start``. A raw-tier result has one row per frame, with count
+        1 (or 0 for a NaN sample).
+        """
+        pids = tuple(pids) if pids else self.pids
+        tier, width = self.plan(start, end, resolution)
+        self.queries_by_tier[tier] += 1
+
+        if tier == RAW_TIER:
+            raw = self.raw_store.read(vehicle_id, start, end, pids)
+            columns = {}
+            for pid in pids:
+                values = raw.column(pid)
+                columns.update({rollup_column(pid, stat): values for stat in ('min', 'max', 'mean', 'last')})
+                columns[rollup_column(pid, 'count')] = (~np.isnan(values)).astype(np.float32)
+            return RollupResult(vehicle_id, tier, width, pids, raw.timestamps(), columns)
+
+        # Include the bucket that contains start
+        first_bucket_ms = int(start * 1000) // width * width
+        names = [rollup_column(pid, stat) for pid in pids for stat in ROLLUP_STATS]
+        stored: TelemetryRange = self.stores[tier].read(vehicle_id, first_bucket_ms / 1000, end, names)
+        timestamps = stored.timestamps()
+        columns = {name: stored.column(name) for name in names}
+
+        level = [name for name, _ in self.tiers].index(tier)
+        partials = [
+            partial for partial in self._partials(vehicle_id, level)
+            if first_bucket_ms <= partial.start_ms < end * 1000
+        ]
+        if partials:
+            rows = np.stack([partial.row() for partial in partials]).astype(np.float32)
+            position = {pid: index for index, pid in enumerate(self.pids)}
+            timestamps = np.concatenate((timestamps, [partial.start_ms for partial in partials]))
+            for pid in pids:
+                offset = position[pid] * len(ROLLUP_STATS)
+                for index, stat in enumerate(ROLLUP_STATS):
+                    name = rollup_column(pid, stat)
+                    columns[name] = np.concatenate((columns[name], rows[:, offset + index]))
+
+        timestamps, columns = merge_bucket_rows(timestamps, columns, pids)
+        return RollupResult(vehicle_id, tier, width, pids, timestamps, columns)
+
+    # Lifecycle
+
+    def close_open_buckets(self):
+        """Write every open bucket as a (partial) row, e.g. before shutdown"""
+        with self._lock:
+            for vehicle_id, buckets in self._open.items():
+                # Finest first, so each open bucket is folded into the coarser one before it is written
+                for level in range(len(buckets)):
+                    if buckets[level] is not None:
+                        self._close(vehicle_id, buckets, level)
+            self._open.clear()
+
+    async def start(self):
+        await self.raw_store.start()
+        for store in self.stores.values():
+            await store.start()
+
+    async def stop(self):
+        self.close_open_buckets()
+        for store in self.stores.values():
+            await store.stop()
+        await self.raw_store.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'open_vehicles': len(self._open),
+            'frames_rolled_up': self.frames_rolled_up,
+            'buckets_closed': dict(self.buckets_closed),
+            'queries_by_tier': dict(self.queries_by_tier),
+            'tiers': {name: self.stores[name].stats() for name, _ in self.tiers}
+        }
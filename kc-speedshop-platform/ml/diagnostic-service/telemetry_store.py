@@ -0,0 +1,647 @@
+"""
+KC Speedshop ML Diagnostic Service - Telemetry history store
+Append-only columnar OBD history: per-vehicle partitions of memory-mapped segments
+
+Layout under TELEMETRY_STORE_DIR::
+
+    <vehicle>/seg-<start_ms>-<end_ms>-<writer>/
+        meta.json          rows, time bounds, PIDs, segments it replaces
+        timestamp.i64      int64 milliseconds since the epoch, ascending
+        <PID>.f32          one float32 column per PID (NaN = not reported)
+
+Cold segments (see TELEMETRY_COMPRESS_AFTER_SECONDS) store the same columns
+as ``timestamp.gor`` and ``<PID>.gor``, compressed with telemetry_codec.
+
+Frames are buffered per vehicle and written as an immutable segment by the
+background flush once TELEMETRY_SEGMENT_ROWS rows are buffered or the buffer
+is older than TELEMETRY_FLUSH_SECONDS; appends never touch the disk.
+Segments are published by renaming a finished temporary directory, so
+readers never see a partial segment. Range reads
+binary-search the memory-mapped timestamp column of each overlapping segment
+and return NumPy views into the mapped files without copying.
+
+Background compaction merges runs of small segments into large ones, and
+rewrites segments that have gone cold in compressed form. The new segment
+lists the segments it replaces, so readers skip the originals until they are
+deleted. Compressed columns are decoded once per segment on first read.
+Segments whose newest frame falls outside the retention window are deleted.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from features import OBD_FEATURE_PIDS
+from telemetry_codec import decode_timestamps, decode_values, encode_timestamps, encode_values
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_STORE_DIR = os.getenv("TELEMETRY_STORE_DIR", "data/telemetry")
+TELEMETRY_SEGMENT_ROWS = int(os.getenv("TELEMETRY_SEGMENT_ROWS", "4096"))
+TELEMETRY_FLUSH_SECONDS = float(os.getenv("TELEMETRY_FLUSH_SECONDS", "10"))
+TELEMETRY_COMPACT_INTERVAL_SECONDS = float(os.getenv("TELEMETRY_COMPACT_INTERVAL_SECONDS", "300"))
+# Segments below this size are merged, into segments of up to the target size
+TELEMETRY_COMPACT_MIN_ROWS = int(os.getenv("TELEMETRY_COMPACT_MIN_ROWS", "65536"))
+TELEMETRY_COMPACT_TARGET_ROWS = int(os.getenv("TELEMETRY_COMPACT_TARGET_ROWS", "1048576"))
+# Segments whose newest frame is older than this are compressed by compaction (0 disables)
+TELEMETRY_COMPRESS_AFTER_SECONDS = float(os.getenv("TELEMETRY_COMPRESS_AFTER_SECONDS", "86400"))
+# Raw frames older than this are deleted, a whole segment at a time (0 keeps everything)
+TELEMETRY_RETENTION_SECONDS = float(os.getenv("TELEMETRY_RETENTION_SECONDS", str(30 * 86400)))
+
+TIMESTAMP_FILE = "timestamp.i64"
+COMPRESSED_TIMESTAMP_FILE = "timestamp.gor"
+META_FILE = "meta.json"
+LOCK_FILE = ".compact.lock"
+SEGMENT_PREFIX = "seg-"
+TMP_PREFIX = ".tmp-"
+
+TIMESTAMP_DTYPE = np.dtype('<i8')
+VALUE_DTYPE = np.dtype('<f4')
+
+# Segment encodings
+ENCODING_RAW = "raw"
+ENCODING_GORILLA = "gorilla"
+
+def _column_file(pid: str, encoding: str = ENCODING_RAW) -> str:
+    return f"{pid}.gor" if encoding == ENCODING_GORILLA else f"{pid}.f32"
+
+class TelemetryChunk:
+    """Rows of one segment (or the write buffer) inside a time range
+
+    ``timestamps`` and ``columns`` are views, not copies; they stay valid
+    after the segment is compacted away because the mapping (or, for a
+    compressed segment, the decoded array) keeps the data alive.
+    """
+
+    __slots__ = ('timestamps', 'columns')
+
+    def __init__(self, timestamps: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.timestamps = timestamps
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+class TelemetryRange:
+    """Result of a time-range read: ordered chunks of zero-copy views"""
+
+    def __init__(self, vehicle_id: str, pids: Sequence[str], chunks: List[TelemetryChunk]):
+        self.vehicle_id = vehicle_id
+        self.pids = tuple(pids)
+        self.chunks = chunks
+
+    def __len__(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def timestamps(self) -> np.ndarray:
+        """All timestamps as one array (a view when the range is a single chunk)"""
+        if len(self.chunks) == 1:
+            return self.chunks[0].timestamps
+        return np.concatenate([chunk.timestamps for chunk in self.chunks]) if self.chunks else np.empty(0, TIMESTAMP_DTYPE)
+
+    def column(self, pid: str) -> np.ndarray:
+        """All values of one PID as one array (a view when the range is a single chunk)"""
+        if len(self.chunks) == 1:
+            return self.chunks[0].columns[pid]
+        return np.concatenate([chunk.columns[pid] for chunk in self.chunks]) if self.chunks else np.empty(0, VALUE_DTYPE)
+
+class Segment:
+    """One immutable on-disk segment; columns are memory-mapped (or decoded) on first read"""
+
+    def __init__(self, path: str, meta: Dict[str, Any]):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.rows = int(meta['rows'])
+        self.start_ms = int(meta['start_ms'])
+        self.end_ms = int(meta['end_ms'])
+        self.pids = tuple(meta['pids'])
+        self.replaces = tuple(meta.get('replaces', ()))
+        self.encoding = meta.get('encoding', ENCODING_RAW)
+        self._maps: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def open(cls, path: str) -> Optional["Segment"]:
+        try:
+            with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+                return cls(path, json.load(f))
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _map(self, filename: str, dtype: np.dtype) -> np.ndarray:
+        array = self._maps.get(filename)
+        if array is None:
+            if self.rows == 0:
+                array = np.empty(0, dtype)
+            elif self.encoding == ENCODING_GORILLA:
+                with open(os.path.join(self.path, filename), 'rb') as f:
+                    data = f.read()
+                array = decode_timestamps(data) if dtype == TIMESTAMP_DTYPE else decode_values(data)
+            else:
+                array = np.memmap(os.path.join(self.path, filename), dtype=dtype, mode='r', shape=(self.rows,))
+            self._maps[filename] = array
+        return array
+
+    def timestamps(self) -> np.ndarray:
+        filename = COMPRESSED_TIMESTAMP_FILE if self.encoding == ENCODING_GORILLA else TIMESTAMP_FILE
+        return self._map(filename, TIMESTAMP_DTYPE)
+
+    def column(self, pid: str) -> np.ndarray:
+        if pid not in self.pids:
+            return np.full(self.rows, np.nan, dtype=VALUE_DTYPE)
+        return self._map(_column_file(pid, self.encoding), VALUE_DTYPE)
+
+    def slice(self, start_ms: int, end_ms: int, pids: Sequence[str]) -> Optional[TelemetryChunk]:
+        """Rows with start_ms <= t < end_ms"""
+        if end_ms <= self.start_ms or start_ms > self.end_ms:
+            return None
+        timestamps = self.timestamps()
+        lo = int(np.searchsorted(timestamps, start_ms, side='left'))
+        hi = int(np.searchsorted(timestamps, end_ms, side='left'))
+        if lo >= hi:
+            return None
+        return TelemetryChunk(timestamps[lo:hi], {pid: self.column(pid)[lo:hi] for pid in pids})
+
+def write_segment(
+    directory: str,
+    timestamps: np.ndarray,
+    columns: Dict[str, np.ndarray],
+    writer: str,
+    replaces: Sequence[str] = (),
+    compress: bool = False
+) -> str:
+    """Write columns into a new segment directory and publish it atomically"""
+    order = None
+    if len(timestamps) > 1 and np.any(np.diff(timestamps) < 0):
+        order = np.argsort(timestamps, kind='stable')
+    start_ms, end_ms = int(timestamps.min()), int(timestamps.max())
+    encoding = ENCODING_GORILLA if compress else ENCODING_RAW
+
+    name = f"{SEGMENT_PREFIX}{start_ms:015d}-{end_ms:015d}-{writer}"
+    tmp_path = os.path.join(directory, f"{TMP_PREFIX}{name}")
+    os.makedirs(tmp_path)
+    timestamps = (timestamps if order is None else timestamps[order]).astype(TIMESTAMP_DTYPE, copy=False)
+    if compress:
+        with open(os.path.join(tmp_path, COMPRESSED_TIMESTAMP_FILE), 'wb') as f:
+            f.write(encode_timestamps(timestamps))
+    else:
+        timestamps.tofile(os.path.join(tmp_path, TIMESTAMP_FILE))
+    for pid, values in columns.items():
+        values = (values if order is None else values[order]).astype(VALUE_DTYPE, copy=False)
+        if compress:
+            with open(os.path.join(tmp_path, _column_file(pid, encoding)), 'wb') as f:
+                f.write(encode_values(values))
+        else:
+            values.tofile(os.path.join(tmp_path, _column_file(pid)))
+    meta = {
+        'rows': int(len(timestamps)),
+        'start_ms': start_ms,
+        'end_ms': end_ms,
+        'pids': list(columns),
+        'replaces': list(replaces),
+        'encoding': encoding
+    }
+    with open(os.path.join(tmp_path, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    path = os.path.join(directory, name)
+    os.rename(tmp_path, path)
+    return path
+
+class ColumnBuffer:
+    """In-memory rows of a vehicle not yet written to a segment"""
+
+    def __init__(self, pids: Sequence[str], capacity: int):
+        self.pids = tuple(pids)
+        self.timestamps = np.empty(capacity, dtype=TIMESTAMP_DTYPE)
+        # Column-major so each PID is contiguous, like the segment files
+        self.values = np.empty((len(self.pids), capacity), dtype=VALUE_DTYPE)
+        self.rows = 0
+        self.created = time.monotonic()
+
+    @property
+    def full(self) -> bool:
+        return self.rows >= len(self.timestamps)
+
+    def append(self, timestamp_ms: int, values: np.ndarray):
+        self.timestamps[self.rows] = timestamp_ms
+        self.values[:, self.rows] = values
+        self.rows += 1
+
+    def chunk(self, start_ms: int, end_ms: int, pids: Sequence[str]) -> Optional[TelemetryChunk]:
+        timestamps = self.timestamps[:self.rows]
+        lo = int(np.searchsorted(timestamps, start_ms, side='left'))
+        hi = int(np.searchsorted(timestamps, end_ms, side='left'))
+        if lo >= hi:
+            return None
+        index = {pid: position for position, pid in enumerate(self.pids)}
+        return TelemetryChunk(
+            timestamps[lo:hi],
+            {
+                pid: self.values[index[pid], lo:hi] if pid in index else np.full(hi - lo, np.nan, dtype=VALUE_DTYPE)
+                for pid in pids
+            }
+        )
+
+class Partition:
+    """One vehicle's segments plus its write buffer"""
+
+    def __init__(self, vehicle_id: str, path: str, pids: Sequence[str], buffer_rows: int):
+        self.vehicle_id = vehicle_id
+        self.path = path
+        self.pids = tuple(pids)
+        self.buffer_rows = buffer_rows
+        self.lock = threading.Lock()
+        self.buffer = ColumnBuffer(self.pids, buffer_rows)
+        # Buffers handed to a writer thread stay readable until their segment exists
+        self.flushing: List[ColumnBuffer] = []
+        self.last_timestamp_ms: Optional[int] = None
+        self._segments: List[Segment] = []
+        self._listing_mtime: Optional[int] = None
+        self._listing_lock = threading.Lock()
+
+    def segments(self) -> List[Segment]:
+        """Live segments in time order, rescanning the directory when it changed"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._listing_lock:
+            if mtime == self._listing_mtime:
+                return self._segments
+            known = {segment.name: segment for segment in self._segments}
+            segments = []
+            for name in sorted(os.listdir(self.path)):
+                if not name.startswith(SEGMENT_PREFIX):
+                    continue
+                segment = known.get(name) or Segment.open(os.path.join(self.path, name))
+                if segment is not None:
+                    segments.append(segment)
+            replaced = {name for segment in segments for name in segment.replaces}
+            self._segments = [segment for segment in segments if segment.name not in replaced]
+            self._listing_mtime = mtime
+            return self._segments
+
+class TelemetryStore:
+    """Per-vehicle columnar OBD history with time-range reads"""
+
+    def __init__(
+        self,
+        root: str = TELEMETRY_STORE_DIR,
+        pids: Sequence[str] = OBD_FEATURE_PIDS,
+        segment_rows: int = TELEMETRY_SEGMENT_ROWS,
+        flush_seconds: float = TELEMETRY_FLUSH_SECONDS,
+        compact_interval: float = TELEMETRY_COMPACT_INTERVAL_SECONDS,
+        compact_min_rows: int = TELEMETRY_COMPACT_MIN_ROWS,
+        compact_target_rows: int = TELEMETRY_COMPACT_TARGET_ROWS,
+        compress_after: float = TELEMETRY_COMPRESS_AFTER_SECONDS,
+        retention_seconds: float = TELEMETRY_RETENTION_SECONDS
+    ):
+        self.root = root
+        self.pids = tuple(pids)
+        self.segment_rows = segment_rows
+        self.flush_seconds = flush_seconds
+        self.compact_interval = compact_interval
+        self.compact_min_rows = compact_min_rows
+        self.compact_target_rows = compact_target_rows
+        self.compress_after = compress_after
+        self.retention_seconds = retention_seconds
+        self.writer_id = f"{os.getpid()}{uuid.uuid4().hex[:8]}"
+
+        self._partitions: Dict[str, Partition] = {}
+        self._partitions_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._segment_counter = 0
+
+        # Metrics
+        self.rows_appended = 0
+        self.rows_rejected = 0
+        self.segments_written = 0
+        self.compactions = 0
+        self.segments_compacted = 0
+        self.segments_compressed = 0
+        self.segments_expired = 0
+        self.last_error: Optional[str] = None
+
+    # Partitions
+
+    def _partition(self, vehicle_id: str) -> Partition:
+        partition = self._partitions.get(vehicle_id)
+        if partition is None:
+            with self._partitions_lock:
+                partition = self._partitions.get(vehicle_id)
+                if partition is None:
+                    path = os.path.join(self.root, quote(vehicle_id, safe=''))
+                    partition = Partition(vehicle_id, path, self.pids, self.segment_rows)
+                    self._partitions[vehicle_id] = partition
+        return partition
+
+    def vehicles(self) -> List[str]:
+        """Vehicles with stored or buffered history"""
+        try:
+            names = {unquote(name) for name in os.listdir(self.root) if not name.startswith('.')}
+        except FileNotFoundError:
+            names = set()
+        return sorted(names | {vehicle_id for vehicle_id, p in self._partitions.items() if p.buffer.rows})
+
+    # Writes
+
+    def append(self, vehicle_id: str, timestamp: float, values: np.ndarray) -> bool:
+        """Buffer one frame (unix seconds, one value per store PID, NaN = missing)
+
+        Frames older than the vehicle's last stored frame are rejected so
+        every segment stays time-ordered. Returns False for a rejected frame.
+        """
+        timestamp_ms = int(round(timestamp * 1000))
+        partition = self._partition(vehicle_id)
+        with partition.lock:
+            if partition.last_timestamp_ms is not None and timestamp_ms < partition.last_timestamp_ms:
+                self.rows_rejected += 1
+                return False
+            partition.buffer.append(timestamp_ms, values)
+            partition.last_timestamp_ms = timestamp_ms
+            if partition.buffer.full:
+                partition.flushing.append(partition.buffer)
+                partition.buffer = ColumnBuffer(self.pids, self.segment_rows)
+        self.rows_appended += 1
+        return True
+
+    def _seal(self, partition: Partition):
+        """Swap in a fresh buffer; the old one is written by the next flush"""
+        with partition.lock:
+            if partition.buffer.rows:
+                partition.flushing.append(partition.buffer)
+                partition.buffer = ColumnBuffer(self.pids, self.segment_rows)
+
+    def _write_sealed(self, partition: Partition):
+        while True:
+            with partition.lock:
+                if not partition.flushing:
+                    return
+                buffer = partition.flushing[0]
+            try:
+                os.makedirs(partition.path, exist_ok=True)
+                self._segment_counter += 1
+                write_segment(
+                    partition.path,
+                    buffer.timestamps[:buffer.rows],
+                    {pid: buffer.values[index, :buffer.rows] for index, pid in enumerate(buffer.pids)},
+                    writer=f"{self.writer_id}-{self._segment_counter}"
+                )
+            except Exception as e:
+                # The buffer stays queued (and readable) for the next flush
+                self.last_error = str(e)
+                logger.error(f"Failed to write telemetry segment for vehicle {partition.vehicle_id}: {e}")
+                return
+            self.segments_written += 1
+            with partition.lock:
+                partition.flushing.pop(0)
+
+    def flush(self, max_age: Optional[float] = None) -> int:
+        """Write full buffers, and buffers older than max_age seconds (all buffers when None)"""
+        now = time.monotonic()
+        flushed = 0
+        for partition in list(self._partitions.values()):
+            buffer = partition.buffer
+            if buffer.rows and (max_age is None or now - buffer.created >= max_age):
+                self._seal(partition)
+            if partition.flushing:
+                self._write_sealed(partition)
+                flushed += 1
+        return flushed
+
+    # Reads
+
+    def read(
+        self,
+        vehicle_id: str,
+        start: float,
+        end: float,
+        pids: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
+    ) -> TelemetryRange:
+        """Frames with start <= t < end (unix seconds) as zero-copy views
+
+        With a limit only the first ``limit`` frames are returned, and
+        segments past them are not mapped or decoded.
+        """
+        pids = tuple(pids) if pids else self.pids
+        start_ms, end_ms = int(round(start * 1000)), int(round(end * 1000))
+        partition = self._partition(vehicle_id)
+
+        chunks: List[Tuple[int, TelemetryChunk]] = []
+        rows = 0
+        for attempt in range(2):
+            try:
+                for segment in partition.segments():
+                    if limit is not None and rows >= limit:
+                        break
+                    chunk = segment.slice(start_ms, end_ms, pids)
+                    if chunk is not None:
+                        chunks.append((segment.start_ms, chunk))
+                        rows += len(chunk)
+                break
+            except FileNotFoundError:
+                # Compacted away between listing and mapping; list again
+                chunks = []
+                rows = 0
+                partition._listing_mtime = None
+
+        # Buffered frames are newer than every segment, so they can only add past the limit
+        if limit is None or rows < limit:
+            with partition.lock:
+                buffers = partition.flushing + [partition.buffer]
+            for buffer in buffers:
+                chunk = buffer.chunk(start_ms, end_ms, pids)
+                if chunk is not None:
+                    chunks.append((int(chunk.timestamps[0]), chunk))
+
+        # A buffer being flushed may already be listed as a segment
+        ordered, seen = [], set()
+        remaining = limit
+        for start_key, chunk in sorted(chunks, key=lambda item: item[0]):
+            key = (start_key, int(chunk.timestamps[-1]), len(chunk))
+            if key in seen:
+                continue
+            seen.add(key)
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                if len(chunk) > remaining:
+                    chunk = TelemetryChunk(
+                        chunk.timestamps[:remaining],
+                        {pid: values[:remaining] for pid, values in chunk.columns.items()}
+                    )
+                remaining -= len(chunk)
+            ordered.append(chunk)
+        return TelemetryRange(vehicle_id, pids, ordered)
+
+    # Compaction
+
+    def compact_partition(self, partition: Partition) -> int:
+        """Merge runs of small adjacent segments and compress cold ones
+
+        Returns the number of segments rewritten.
+        """
+        os.makedirs(partition.path, exist_ok=True)
+        with open(os.path.join(partition.path, LOCK_FILE), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # another worker is compacting this vehicle
+
+            partition._listing_mtime = None
+            runs: List[List[Segment]] = []
+            run: List[Segment] = []
+            for segment in partition.segments():
+                if segment.rows < self.compact_min_rows and sum(s.rows for s in run) + segment.rows <= self.compact_target_rows:
+                    run.append(segment)
+                    continue
+                if len(run) > 1:
+                    runs.append(run)
+                run = [segment] if segment.rows < self.compact_min_rows else []
+            if len(run) > 1:
+                runs.append(run)
+
+            cold_before_ms = int((time.time() - self.compress_after) * 1000) if self.compress_after > 0 else None
+            if cold_before_ms is not None:
+                # Large segments are never merged, but still get compressed once cold
+                in_runs = {segment.name for run in runs for segment in run}
+                runs.extend(
+                    [segment] for segment in partition.segments()
+                    if segment.name not in in_runs and segment.encoding == ENCODING_RAW and segment.end_ms < cold_before_ms
+                )
+
+            merged = 0
+            for run in runs:
+                compress = cold_before_ms is not None and run[-1].end_ms < cold_before_ms
+                timestamps = np.concatenate([segment.timestamps() for segment in run])
+                columns = {
+                    pid: np.concatenate([segment.column(pid) for segment in run])
+                    for pid in dict.fromkeys(pid for segment in run for pid in segment.pids)
+                }
+                self._segment_counter += 1
+                write_segment(
+                    partition.path,
+                    timestamps,
+                    columns,
+                    writer=f"{self.writer_id}-{self._segment_counter}",
+                    replaces=[segment.name for segment in run],
+                    compress=compress
+                )
+                for segment in run:
+                    shutil.rmtree(segment.path, ignore_errors=True)
+                merged += len(run)
+                self.compactions += 1
+                if compress:
+                    self.segments_compressed += 1
+            self.segments_compacted += merged
+            return merged
+
+    def compact(self) -> int:
+        merged = 0
+        for vehicle_id in self.vehicles():
+            merged += self.compact_partition(self._partition(vehicle_id))
+        return merged
+
+    # Retention
+
+    def retained_since(self) -> Optional[float]:
+        """Oldest time (unix seconds) still guaranteed to be stored, None when nothing expires"""
+        return time.time() - self.retention_seconds if self.retention_seconds > 0 else None
+
+    def expire_partition(self, partition: Partition, before_ms: int) -> int:
+        """Delete segments whose newest frame is older than before_ms"""
+        if not os.path.isdir(partition.path):
+            return 0
+        with open(os.path.join(partition.path, LOCK_FILE), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # compaction in progress; expire on the next pass
+
+            partition._listing_mtime = None
+            expired = 0
+            for segment in partition.segments():
+                if segment.end_ms >= before_ms:
+                    break  # segments are in time order
+                shutil.rmtree(segment.path, ignore_errors=True)
+                expired += 1
+            self.segments_expired += expired
+            return expired
+
+    def expire(self) -> int:
+        since = self.retained_since()
+        if since is None:
+            return 0
+        before_ms = int(since * 1000)
+        return sum(self.expire_partition(self._partition(vehicle_id), before_ms) for vehicle_id in self.vehicles())
+
+    # Lifecycle
+
+    async def start(self):
+        """Start the background flush and compaction loop"""
+        if self._task is not None and not self._task.done():
+            return
+        os.makedirs(self.root, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Telemetry store started (root={self.root}, segment_rows={self.segment_rows}, "
+            f"flush_seconds={self.flush_seconds}, compact_interval={self.compact_interval}s, "
+            f"retention={self.retention_seconds or 'unlimited'}s)"
+        )
+
+    async def stop(self):
+        """Stop background work and write all buffered frames"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run(self):
+        last_compaction = time.monotonic()
+        while True:
+            await asyncio.sleep(min(self.flush_seconds, self.compact_interval))
+            try:
+                await asyncio.to_thread(self.flush, self.flush_seconds)
+                if time.monotonic() - last_compaction >= self.compact_interval:
+                    last_compaction = time.monotonic()
+                    merged = await asyncio.to_thread(self.compact)
+                    if merged:
+                        logger.info(f"Compacted {merged} telemetry segments")
+                    expired = await asyncio.to_thread(self.expire)
+                    if expired:
+                        logger.info(f"Expired {expired} telemetry segments past retention")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Telemetry store maintenance failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'root': self.root,
+            'partitions_open': len(self._partitions),
+            'buffered_rows': sum(p.buffer.rows for p in self._partitions.values()),
+            'rows_appended': self.rows_appended,
+            'rows_rejected': self.rows_rejected,
+            'segments_written': self.segments_written,
+            'compactions': self.compactions,
+            'segments_compacted': self.segments_compacted,
+            'segments_compressed': self.segments_compressed,
+            'segments_expired': self.segments_expired,
+            'retention_seconds': self.retention_seconds,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,107 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+
+class RecordingScorer:
+    """score_fn that records batch sizes and can be held until released"""
+
+    def __init__(self):
+        self.batches = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, matrix):
+        self.batches.append(len(matrix))
+        await self.release.wait()
+        return [float(row.sum()) for row in matrix]
+
+@pytest.mark.asyncio
+async def test_full_batches_dispatch_without_waiting():
+    scorer = RecordingScorer()
+    batcher = MicroBatcher(scorer, max_batch_size=4, max_wait_ms=10_000)
+    await batcher.start()
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.submit([i, 1.0]) for i in range(8))), 1)
+    finally:
+        await batcher.stop()
+
+    assert results == [i + 1.0 for i in range(8)]
+    assert scorer.batches == [4, 4]
+    assert batcher.stats()['batch_size_histogram']['4'] == 2
+
+@pytest.mark.asyncio
+async def test_partial_batch_dispatches_after_max_wait():
+    scorer = RecordingScorer()
+    batcher = MicroBatcher(scorer, max_batch_size=64, max_wait_ms=20)
+    await batcher.start()
+    try:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await asyncio.gather(*(batcher.submit([i]) for i in range(3)))
+        elapsed = loop.time() - started
+    finally:
+        await batcher.stop()
+
+    assert results == [0.0, 1.0, 2.0]
+    assert scorer.batches == [3]
+    assert 0.015 <= elapsed < 1
+
+@pytest.mark.asyncio
+async def test_submit_raises_queue_full_at_max_queue_depth():
+    scorer = RecordingScorer()
+    scorer.release.clear()
+    batcher = MicroBatcher(scorer, max_batch_size=1, max_wait_ms=0, max_queue_depth=2)
+    await batcher.start()
+    try:
+        # One row held by score_fn, one waiting for a dispatch slot and two queued
+        held = []
+        for i in range(4):
+            held.append(asyncio.create_task(batcher.submit([i])))
+            await asyncio.sleep(0.005)
+        assert scorer.batches == [1]
+
+        with pytest.raises(asyncio.QueueFull):
+            await batcher.submit([9])
+        assert batcher.rows_rejected == 1
+
+        scorer.release.set()
+        assert await asyncio.gather(*held) == [0.0, 1.0, 2.0, 3.0]
+    finally:
+        scorer.release.set()
+        await batcher.stop()
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_is_dropped_from_its_batch():
+    scorer = RecordingScorer()
+    batcher = MicroBatcher(scorer, max_batch_size=8, max_wait_ms=30)
+    await batcher.start()
+    try:
+        tasks = [asyncio.create_task(batcher.submit([i])) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks[1].cancel()
+        done = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await batcher.stop()
+
+    assert done[0] == 0.0 and done[2] == 2.0
+    assert isinstance(done[1], asyncio.CancelledError)
+    assert scorer.batches == [2]
+    assert batcher.rows_cancelled == 1
+    assert batcher.rows_scored == 2
+
+@pytest.mark.asyncio
+async def test_failed_batch_fails_every_row_and_stopped_batcher_scores_directly():
+    async def broken(matrix):
+        raise RuntimeError('model unavailable')
+
+    batcher = MicroBatcher(broken, max_batch_size=2, max_wait_ms=1)
+    await batcher.start()
+    results = await asyncio.gather(batcher.submit([1]), batcher.submit([2]), return_exceptions=True)
+    await batcher.stop()
+
+    assert [str(result) for result in results] == ['model unavailable'] * 2
+    assert batcher.batch_errors == 1
+    assert await MicroBatcher(RecordingScorer()).submit(np.array([1.0, 2.0])) == 3.0
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from caching import AnalysisCache, MemoryTTLCache, make_analysis_cache_key
+from rule_engine import RuleEngine
+
+RULES = RuleEngine.from_file()
+
+def diagnostic(obd_data, **fields):
+    return {
+        'make': 'Toyota', 'model': 'Hilux', 'year': 2016, 'engine': '2.8L 1GD-FTV',
+        'obd_data': obd_data, 'symptoms': [], **fields,
+        'rules_fired': RULES.evaluate(obd_data)['rules_fired']
+    }
+
+def test_key_ignores_case_order_and_rounding_noise():
+    first = diagnostic({'RPM': 2500.2, 'COOLANT_TEMP': 90.01, 'DTC_CODES': ['P0300', 'P0171']},
+                       symptoms=['Rough  idle', 'stalls'])
+    second = diagnostic({'DTC_CODES': ['P0171', 'P0300'], 'COOLANT_TEMP': 90.04, 'RPM': 2500.4},
+                        make='TOYOTA ', symptoms=['stalls', 'rough idle'])
+
+    assert make_analysis_cache_key(first) == make_analysis_cache_key(second)
+
+@pytest.mark.parametrize('below, above', [
+    ({'COOLANT_TEMP': 99.6, 'RPM': 5960}, {'COOLANT_TEMP': 104.9, 'RPM': 6049}),
+    ({'COOLANT_TEMP': 115}, {'COOLANT_TEMP': 124}),
+    ({'RPM': 5999.6}, {'RPM': 6000.4})
+])
+def test_snapshots_on_either_side_of_a_threshold_get_different_keys(below, above):
+    assert RULES.evaluate(below)['rules_fired'] != RULES.evaluate(above)['rules_fired']
+
+    assert make_analysis_cache_key(diagnostic(below)) != make_analysis_cache_key(diagnostic(above))
+
+def test_rule_verdict_separates_keys_even_when_values_round_together():
+    obd_data = {'RPM': 6000.4}
+
+    assert make_analysis_cache_key(diagnostic(obd_data)) != make_analysis_cache_key({**diagnostic(obd_data), 'rules_fired': []})
+
+@pytest.mark.parametrize('field, value', [('engine', '2.4L 2GD-FTV'), ('year', 2017), ('symptoms', ['smoke'])])
+def test_prompt_inputs_change_the_key(field, value):
+    obd_data = {'RPM': 2500}
+
+    assert make_analysis_cache_key(diagnostic(obd_data)) != make_analysis_cache_key(diagnostic(obd_data, **{field: value}))
+
+class SlowCompute:
+    """Compute callback that counts calls and blocks until released"""
+
+    def __init__(self, value='analysis'):
+        self.value = value
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.value
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_compute():
+    cache = AnalysisCache(MemoryTTLCache(max_entries=8, ttl=60), name='test')
+    compute = SlowCompute()
+
+    waiters = [asyncio.create_task(cache.get_or_compute('key', compute)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert cache.stats()['in_flight'] == 1
+    compute.release.set()
+
+    assert await asyncio.gather(*waiters) == ['analysis'] * 5
+    assert compute.calls == 1
+    assert await cache.get_or_compute('key', compute) == 'analysis'
+    assert compute.calls == 1
+    assert cache.stats()['in_flight'] == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_poison_followers():
+    cache = AnalysisCache(MemoryTTLCache(max_entries=8, ttl=60), name='test')
+    compute = SlowCompute()
+
+    leader = asyncio.create_task(cache.get_or_compute('key', compute))
+    await asyncio.sleep(0)
+    followers = [asyncio.create_task(cache.get_or_compute('key', compute)) for _ in range(2)]
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    compute.release.set()
+
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert await asyncio.gather(*followers) == ['analysis'] * 2
+    assert cache.stats()['in_flight'] == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_follower_leaves_the_leader_running():
+    cache = AnalysisCache(MemoryTTLCache(max_entries=8, ttl=60), name='test')
+    compute = SlowCompute()
+
+    leader = asyncio.create_task(cache.get_or_compute('key', compute))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(cache.get_or_compute('key', compute))
+    await asyncio.sleep(0)
+    follower.cancel()
+    compute.release.set()
+
+    with pytest.raises(asyncio.CancelledError):
+        await follower
+    assert await leader == 'analysis'
+    assert compute.calls == 1
+
+@pytest.mark.asyncio
+async def test_leader_failure_reaches_followers_and_is_not_cached():
+    cache = AnalysisCache(MemoryTTLCache(max_entries=8, ttl=60), name='test')
+    started = asyncio.Event()
+
+    async def broken():
+        started.set()
+        await asyncio.sleep(0.01)
+        raise RuntimeError('upstream down')
+
+    leader = asyncio.create_task(cache.get_or_compute('key', broken))
+    await started.wait()
+    follower = asyncio.create_task(cache.get_or_compute('key', broken))
+
+    results = await asyncio.gather(leader, follower, return_exceptions=True)
+    assert [str(result) for result in results] == ['upstream down'] * 2
+    retry = SlowCompute('recovered')
+    retry.release.set()
+    assert await cache.get_or_compute('key', retry) == 'recovered'
@@ -0,0 +1,175 @@
+import sqlite3
+
+import pytest
+
+from catalogue import SQLiteCatalogue
+from cost_estimation import COST_CURRENCY, COST_DEFAULT_LABOUR_RATE, CostIndex, PriceDistribution
+
+PARTS = [
+    {'id': 'pad-1', 'category': 'Brakes', 'price': 100.0},
+    {'id': 'pad-2', 'category': 'brakes', 'price': 200.0},
+    {'id': 'pump-1', 'category': 'cooling', 'price': 300.0}
+]
+
+@pytest.fixture
+def index():
+    cost_index = CostIndex(refresh_seconds=0)
+    cost_index.load({'parts': PARTS, 'inventory_items': [], 'competitor_prices': [], 'workshop_bays': []})
+    return cost_index
+
+def category(index, name):
+    return index.distributions()['part_categories'].get(name)
+
+def test_price_distribution_quantiles():
+    distribution = PriceDistribution([40.0, 10.0, 30.0, 20.0])
+
+    assert distribution.quantile(0) == 10.0
+    assert distribution.quantile(1) == 40.0
+    assert distribution.quantile(0.5) == 25.0
+    assert PriceDistribution().quantile(0.5) is None
+
+def test_price_distribution_removes_one_copy_of_a_price():
+    distribution = PriceDistribution([10.0, 20.0, 20.0])
+
+    distribution.remove(20.0)
+    distribution.remove(99.0)
+
+    assert distribution.summary() == {'count': 2, 'min': 10.0, 'median': 15.0, 'max': 20.0}
+
+def test_full_load_groups_prices_by_category(index):
+    assert category(index, 'brakes') == {'count': 2, 'min': 100.0, 'median': 150.0, 'max': 200.0}
+    assert category(index, 'cooling')['count'] == 1
+    assert index.stats()['prices'] == 3
+
+def test_changed_part_price_replaces_its_old_price(index):
+    index.apply('parts', [{'id': 'pad-1', 'category': 'brakes', 'price': 120.0}])
+    index.apply('parts', [{'id': 'pad-1', 'category': 'brakes', 'price': 140.0}])
+
+    assert category(index, 'brakes') == {'count': 2, 'min': 140.0, 'median': 170.0, 'max': 200.0}
+
+def test_part_moving_category_takes_all_its_prices_along(index):
+    index.apply('inventory_items', [{'id': 'inv-1', 'part_id': 'pad-2', 'cost_price': 100.0, 'markup_percentage': 20}])
+    index.apply('competitor_prices', [{'id': 'cp-1', 'part_id': 'pad-2', 'price': 180.0}])
+    assert category(index, 'brakes')['count'] == 4
+
+    index.apply('parts', [{'id': 'pad-2', 'category': 'suspension', 'price': 200.0}])
+
+    assert category(index, 'brakes')['count'] == 1
+    assert category(index, 'suspension') == {'count': 3, 'min': 120.0, 'median': 180.0, 'max': 200.0}
+
+def test_inventory_row_moving_to_another_part_moves_its_price(index):
+    index.apply('inventory_items', [{'id': 'inv-1', 'part_id': 'pad-1', 'cost_price': 100.0, 'markup_percentage': None}])
+    assert category(index, 'brakes')['max'] == 200.0
+    assert category(index, 'brakes')['count'] == 3
+
+    index.apply('inventory_items', [{'id': 'inv-1', 'part_id': 'pump-1', 'cost_price': 100.0, 'markup_percentage': 0}])
+
+    assert category(index, 'brakes')['count'] == 2
+    assert category(index, 'cooling') == {'count': 2, 'min': 100.0, 'median': 200.0, 'max': 300.0}
+
+def test_price_arriving_before_its_part_joins_the_category_later(index):
+    index.apply('competitor_prices', [{'id': 'cp-1', 'part_id': 'rotor-1', 'price': 90.0}])
+    assert category(index, 'brakes')['count'] == 2
+
+    index.apply('parts', [{'id': 'rotor-1', 'category': 'brakes', 'price': None}])
+
+    assert category(index, 'brakes') == {'count': 3, 'min': 90.0, 'median': 100.0, 'max': 200.0}
+
+@pytest.mark.parametrize('row', [
+    {'id': 'pad-1', 'category': 'brakes', 'price': 0},
+    {'id': 'pad-1', 'category': 'brakes', 'price': None},
+    {'id': 'pad-1', 'category': 'brakes', 'price': float('nan')},
+    {'id': 'pad-1', 'category': 'brakes', 'price': 'inf'},
+    {'id': 'pad-1', 'category': 'brakes', 'price': 100.0, 'currency': 'AUD' if COST_CURRENCY != 'AUD' else 'USD'}
+])
+def test_unusable_price_removes_the_old_one(index, row):
+    index.apply('parts', [row])
+
+    assert category(index, 'brakes') == {'count': 1, 'min': 200.0, 'median': 200.0, 'max': 200.0}
+
+def test_workshop_bay_rate_is_replaced_and_dropped_when_unavailable(index):
+    index.apply('workshop_bays', [{'id': 'bay-1', 'hourly_rate': 100.0}, {'id': 'bay-2', 'hourly_rate': 150.0}])
+    index.apply('workshop_bays', [{'id': 'bay-1', 'hourly_rate': 110.0}])
+    assert index.distributions()['labour_rates'] == {'count': 2, 'min': 110.0, 'median': 130.0, 'max': 150.0}
+
+    index.apply('workshop_bays', [{'id': 'bay-1', 'hourly_rate': 110.0, 'status': 'unavailable'}])
+
+    assert index.labour_rates() == (150.0, 150.0, 150.0)
+
+def test_estimate_uses_labour_and_category_prices():
+    index = CostIndex(refresh_seconds=0)
+    assert index.labour_rates() == (COST_DEFAULT_LABOUR_RATE,) * 3
+    index.apply('parts', [{'id': 'pump-1', 'category': 'cooling', 'price': 300.0}])
+    index.apply('workshop_bays', [{'id': 'bay-1', 'hourly_rate': 100.0}])
+
+    estimate = index.estimate(['cooling', 'inspection', 'cooling'])
+
+    cooling, inspection = estimate['repairs']
+    assert (cooling['min'], cooling['median'], cooling['max']) == (400.0, 550.0, 700.0)
+    assert cooling['parts_priced']
+    assert (inspection['min'], inspection['max']) == (50.0, 100.0)
+    assert inspection['part_category'] is None
+    assert (estimate['min'], estimate['max']) == (450.0, 800.0)
+
+def test_non_finite_inventory_and_labour_numbers_are_ignored(index):
+    index.apply('inventory_items', [{'id': 'inv-1', 'part_id': 'pad-1', 'cost_price': float('inf'), 'markup_percentage': 0}])
+    index.apply('inventory_items', [{'id': 'inv-2', 'part_id': 'pad-1', 'cost_price': 100.0, 'markup_percentage': float('nan')}])
+    index.apply('workshop_bays', [{'id': 'bay-1', 'hourly_rate': float('nan')}])
+
+    assert category(index, 'brakes') == {'count': 3, 'min': 100.0, 'median': 150.0, 'max': 200.0}
+    assert index.labour_rates() == (COST_DEFAULT_LABOUR_RATE,) * 3
+
+def test_remove_missing_drops_prices_of_deleted_rows(index):
+    index.apply('inventory_items', [{'id': 'inv-1', 'part_id': 'pad-2', 'cost_price': 100.0, 'markup_percentage': 0}])
+    index.apply('competitor_prices', [{'id': 'cp-1', 'part_id': 'pump-1', 'price': 280.0}])
+    index.apply('workshop_bays', [{'id': 'bay-1', 'hourly_rate': 100.0}, {'id': 'bay-2', 'hourly_rate': 150.0}])
+
+    removed = index.remove_missing({
+        'parts': ['pad-1', 'pump-1'],
+        'inventory_items': ['inv-1'],
+        'competitor_prices': [],
+        'workshop_bays': None
+    })
+
+    # pad-2 goes with its list price, and its inventory price leaves the category
+    assert removed == 2
+    assert category(index, 'brakes') == {'count': 1, 'min': 100.0, 'median': 100.0, 'max': 100.0}
+    assert category(index, 'cooling')['count'] == 1
+    assert index.distributions()['labour_rates']['count'] == 2
+
+    # The part coming back brings its remaining inventory price along
+    index.apply('parts', [{'id': 'pad-2', 'category': 'brakes', 'price': None}])
+    assert category(index, 'brakes')['count'] == 2
+
+def write_table(conn, table, columns, rows):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(columns)})")
+    conn.execute(f"DELETE FROM {table}")
+    conn.executemany(
+        f"INSERT INTO {table} VALUES ({', '.join('?' for _ in columns)})",
+        [tuple(row.get(column) for column in columns) for row in rows]
+    )
+    conn.commit()
+
+@pytest.mark.asyncio
+async def test_incremental_refresh_reconciles_deleted_rows(tmp_path):
+    path = str(tmp_path / 'catalogue.db')
+    conn = sqlite3.connect(path)
+    parts_columns = ('id', 'category', 'price', 'currency', 'updated_at')
+    bay_columns = ('id', 'hourly_rate', 'currency', 'status', 'updated_at')
+    write_table(conn, 'parts', parts_columns, [{**row, 'updated_at': '2026-10-01T00:00:00'} for row in PARTS])
+    write_table(conn, 'workshop_bays', bay_columns, [{'id': 'bay-1', 'hourly_rate': 100.0, 'updated_at': '2026-10-01'}])
+    index = CostIndex(SQLiteCatalogue(path), refresh_seconds=0, reconcile_seconds=0.001)
+    await index.refresh(full=True)
+    assert category(index, 'brakes')['count'] == 2
+
+    write_table(conn, 'parts', parts_columns, [{**row, 'updated_at': '2026-10-01T00:00:00'} for row in PARTS[1:]])
+    write_table(conn, 'workshop_bays', bay_columns, [])
+    index._last_reconcile -= 1
+    await index.refresh()
+
+    assert category(index, 'brakes') == {'count': 1, 'min': 200.0, 'median': 200.0, 'max': 200.0}
+    assert index.labour_rates() == (COST_DEFAULT_LABOUR_RATE,) * 3
+    assert index.stats()['rows_removed'] == 2
+    assert index.stats()['reconciles'] == 1
+    conn.close()
+    index.catalogue.close()
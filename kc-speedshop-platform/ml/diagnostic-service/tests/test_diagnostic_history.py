@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from persistence import SQLiteBackend, WriteBehindStore
+
+VEHICLE = {'vin': 'JF1GR89658L800001', 'make': 'Subaru', 'model': 'Impreza WRX', 'year': 2008, 'engine': 'EJ25'}
+
+def diagnosis(index, vehicle_id='veh-1'):
+    request = main.DiagnosticRequest(vehicle_id=vehicle_id, obd_data={'RPM': 800}, **VEHICLE)
+    result = main.DiagnosticResult(
+        vehicle_id=vehicle_id,
+        diagnosis_id=f'diag_{index}',
+        timestamp=datetime(2026, 10, 1) + timedelta(minutes=index),
+        primary_issues=[],
+        recommendations=[],
+        confidence_score=0.9,
+        urgency_level='low'
+    )
+    return request, result
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    manager = main.diagnostic_manager
+    store = WriteBehindStore(SQLiteBackend(str(tmp_path / 'diagnostics.db')), wal_dir=str(tmp_path / 'wal'))
+    monkeypatch.setattr(manager, 'result_store', store)
+    manager.history_cache.clear()
+    yield manager
+    manager.history_cache.clear()
+
+@pytest.mark.asyncio
+async def test_storing_a_diagnosis_invalidates_cached_first_pages(manager):
+    main.store_diagnostic_results([diagnosis(0), diagnosis(1)])
+    first = await manager.get_vehicle_history('veh-1', None, 1)
+    older = await manager.get_vehicle_history('veh-1', first.next_cursor, 1)
+    other = await manager.get_vehicle_history('veh-2', None, 5)
+    assert [result.diagnosis_id for result in first.results + older.results] == ['diag_1', 'diag_0']
+
+    main.store_diagnostic_results([diagnosis(2)])
+
+    fresh = await manager.get_vehicle_history('veh-1', None, 1)
+    assert [result.diagnosis_id for result in fresh.results] == ['diag_2']
+    assert [result.diagnosis_id for result in (await manager.get_vehicle_history('veh-1', None, 5)).results] == [
+        'diag_2', 'diag_1', 'diag_0'
+    ]
+    # Pages behind a cursor and other vehicles' pages stay cached
+    assert await manager.get_vehicle_history('veh-1', first.next_cursor, 1) is older
+    assert await manager.get_vehicle_history('veh-2', None, 5) is other
@@ -0,0 +1,52 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from test_vin_decoder import TABLES, with_check_digit
+from vin_decoder import VINDecoder
+
+MUSTANG_VIN = with_check_digit('1FA6P8TH0F5000001')
+# Year code F in a VDS range past 2030 decodes to 2035
+FUTURE_VIN = with_check_digit('1G1FB1RX05F000001')
+UNKNOWN_VIN = with_check_digit('2T1BR32E05C000001')
+
+@pytest.fixture
+def decoder():
+    tables = {**TABLES, 'vds': {**TABLES['vds'], '1G1': [['FB1', 'Camaro', None, 2031, 2039]]}}
+    return VINDecoder(tables, remote_enabled=False)
+
+def request(vin, **fields):
+    return main.DiagnosticRequest(vehicle_id='veh-1', vin=vin, obd_data={'RPM': 800}, **fields)
+
+def test_validation_does_not_touch_the_decoder(monkeypatch):
+    monkeypatch.setattr(main.diagnostic_manager, 'vin_decoder', None)
+
+    assert request(MUSTANG_VIN).make is None
+
+def test_fill_from_vin_keeps_given_fields(decoder):
+    filled = request(MUSTANG_VIN, engine='5.0L Coyote').fill_from_vin(decoder)
+
+    assert (filled.make, filled.model, filled.year, filled.engine) == ('Ford', 'Mustang', 2015, '5.0L Coyote')
+    assert request(MUSTANG_VIN, make='Ford', model='Mustang GT', year=2016).fill_from_vin(decoder).model == 'Mustang GT'
+
+@pytest.mark.parametrize('vin, error', [
+    (FUTURE_VIN, 'decodes to year 2035, outside 1980-2030'),
+    (UNKNOWN_VIN, 'make, model not given')
+])
+def test_fill_from_vin_rejects_unusable_decodes(decoder, vin, error):
+    with pytest.raises(ValueError, match=error):
+        request(vin).fill_from_vin(decoder)
+
+def test_analyze_endpoint_returns_422_for_an_out_of_range_decoded_year(decoder):
+    main.app.dependency_overrides[main.get_vin_decoder] = lambda: decoder
+    try:
+        response = TestClient(main.app).post(
+            '/diagnostic/analyze',
+            json={'vehicle_id': 'veh-1', 'vin': FUTURE_VIN, 'obd_data': {'RPM': 800}},
+            headers={'Authorization': 'Bearer test'}
+        )
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 422
+    assert 'outside 1980-2030' in response.json()['detail']
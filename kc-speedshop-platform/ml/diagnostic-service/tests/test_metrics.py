@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter: prometheus_client picks its mode at import time
+SCRAPE = textwrap.dedent('''
+    import asyncio
+    from types import SimpleNamespace
+
+    from fastapi.testclient import TestClient
+
+    import main
+    from inference import InferenceExecutor
+    from scoring import load_ml_models_sync, score_feature_matrix
+
+    async def serve_and_retire_pool():
+        pool = InferenceExecutor(mode='process', initializer=load_ml_models_sync)
+        await pool.warm_up()
+        await pool.run(score_feature_matrix, __import__('numpy').zeros((3, 20)))
+        await pool.shutdown()
+
+    asyncio.run(main.load_ml_models())
+    asyncio.run(serve_and_retire_pool())
+    asyncio.run(main.on_model_swap(SimpleNamespace(name='engine_diagnostics', version='v002', backend='numpy')))
+    print(TestClient(main.app).get('/metrics').text)
+''')
+
+def scrape(tmp_path):
+    env = {
+        **os.environ,
+        'PYTHONPATH': SERVICE_DIR,
+        'PROMETHEUS_MULTIPROC_DIR': str(tmp_path / 'prometheus'),
+        'MODEL_REGISTRY_DIR': str(tmp_path / 'models'),
+        'INFERENCE_BACKEND': 'numpy',
+        'INFERENCE_EXECUTOR': 'thread'
+    }
+    completed = subprocess.run(
+        [sys.executable, '-c', SCRAPE], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert completed.returncode == 0, completed.stderr
+    return completed.stdout
+
+def samples(body, name):
+    return {
+        line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+        for line in body.splitlines() if line.startswith(name + '{') or line.startswith(name + ' ')
+    }
+
+def test_multiprocess_scrape_exports_only_the_served_model_version(tmp_path):
+    body = scrape(tmp_path)
+
+    model_info = samples(body, 'kc_ml_model_info')
+    assert {series for series, value in model_info.items() if value == 1} == {
+        'kc_ml_model_info{backend="numpy",model="engine_diagnostics",version="v002"}'
+    }
+    # The pool worker's samples are aggregated into the scrape
+    assert samples(body, 'kc_ml_inference_batch_rows_sum') == {'kc_ml_inference_batch_rows_sum': 3.0}
+    assert samples(body, 'kc_ml_http_requests_in_flight') == {'kc_ml_http_requests_in_flight': 0.0}
@@ -0,0 +1,70 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from model_registry import (
+    MANIFEST_FILE, SCALER_FILE, WEIGHTS_FILE, ArrayScaler, ModelArtifactError, ModelRegistry, sha256_file
+)
+from numpy_backend import DenseNumpyModel
+
+def publish_files(registry, version, write, listed):
+    """Write artifacts into a version directory and a manifest checksumming only `listed` of them"""
+    version_dir = os.path.join(registry.model_dir, version)
+    os.makedirs(version_dir)
+    for filename, save in write.items():
+        save(os.path.join(version_dir, filename))
+    manifest = {
+        'name': registry.name,
+        'version': version,
+        'framework': 'keras',
+        'files': {filename: sha256_file(os.path.join(version_dir, filename)) for filename in listed}
+    }
+    with open(os.path.join(version_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    return version_dir
+
+def weights(path):
+    DenseNumpyModel.random([4, 8, 3], ['relu', 'softmax'], seed=1).save(path)
+
+def scaler(path):
+    ArrayScaler(np.zeros(4), np.ones(4)).save(path)
+
+def test_numpy_backend_loads_checksummed_weights(tmp_path):
+    registry = ModelRegistry(str(tmp_path), backend='numpy')
+    publish_files(registry, 'v001', {WEIGHTS_FILE: weights}, [WEIGHTS_FILE])
+
+    bundle = registry.load_active()
+
+    assert bundle.version == 'v001'
+    assert bundle.predict(np.zeros((2, 4))).shape == (2, 3)
+
+@pytest.mark.parametrize('backend, write, listed', [
+    # weights.npz on disk but not in the manifest: the Keras fallback artifacts are not listed either
+    ('numpy', {WEIGHTS_FILE: weights}, []),
+    ('numpy', {SCALER_FILE: scaler}, [SCALER_FILE]),
+    ('tensorflow', {WEIGHTS_FILE: weights, SCALER_FILE: scaler}, [WEIGHTS_FILE, SCALER_FILE])
+])
+def test_artifacts_missing_from_the_manifest_are_rejected(tmp_path, backend, write, listed):
+    registry = ModelRegistry(str(tmp_path), backend=backend)
+    publish_files(registry, 'v001', write, listed)
+
+    with pytest.raises(ModelArtifactError, match='has no checksum for'):
+        registry.load_version('v001')
+
+def test_tampered_artifact_is_rejected(tmp_path):
+    registry = ModelRegistry(str(tmp_path), backend='numpy')
+    version_dir = publish_files(registry, 'v001', {WEIGHTS_FILE: weights}, [WEIGHTS_FILE])
+    DenseNumpyModel.random([4, 8, 3], ['relu', 'softmax'], seed=2).save(os.path.join(version_dir, WEIGHTS_FILE))
+
+    with pytest.raises(ModelArtifactError, match='Checksum mismatch'):
+        registry.load_version('v001')
+
+def test_listed_but_missing_artifact_is_rejected(tmp_path):
+    registry = ModelRegistry(str(tmp_path), backend='numpy')
+    version_dir = publish_files(registry, 'v001', {WEIGHTS_FILE: weights}, [WEIGHTS_FILE])
+    os.remove(os.path.join(version_dir, WEIGHTS_FILE))
+
+    with pytest.raises(ModelArtifactError, match=f'missing {WEIGHTS_FILE}'):
+        registry.load_version('v001')
@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+from catalogue import SQLiteCatalogue
+from parts_fitment import ALL_YEARS, UNIVERSAL, ChassisTables, PartsFitmentIndex, latest_model_year
+
+@pytest.fixture(scope='module')
+def chassis():
+    return ChassisTables.from_file()
+
+@pytest.mark.parametrize('entry, expected', [
+    ('Nissan Skyline R32-R34', ('NISSAN', 'SKYLINE', 1989, 2002)),
+    ('Nissan Skyline R34', ('NISSAN', 'SKYLINE', 1998, 2002)),
+    ('BMW M3 E46', ('BMW', 'M3', 1998, 2006)),
+    ('Honda Civic Type R FK8', ('HONDA', 'CIVIC TYPE R', 2017, 2021)),
+    ('Land Rover Defender', ('LANDROVER', 'DEFENDER', *ALL_YEARS)),
+    ('Alfa Romeo Giulia 2016+', ('ALFAROMEO', 'GIULIA', 2016, latest_model_year())),
+    ('Toyota Supra (1993-2002)', ('TOYOTA', 'SUPRA', 1993, 2002)),
+    ('Mazda MX-5 1990', ('MAZDA', 'MX5', 1990, 1990)),
+    ('VW Golf R', ('VOLKSWAGEN', 'GOLF R', *ALL_YEARS)),
+    ('Subaru Impreza WRX', ('SUBARU', 'WRX', *ALL_YEARS)),
+    ('Mitsubishi Evo X', ('MITSUBISHI', 'LANCER EVOLUTION', 2007, 2016)),
+    ('Universal Fitment', (UNIVERSAL, '', *ALL_YEARS)),
+    ('Toyota Supra 2002-1993', ('TOYOTA', 'SUPRA', *ALL_YEARS)),
+    ('M12x1.5 wheel studs', None),
+    ('', None),
+    ({'make': 'Toyota', 'model': 'Supra', 'year_from': 1993, 'year_to': 2002}, ('TOYOTA', 'SUPRA', 1993, 2002)),
+    ({'make': 'Chevy', 'model': 'Camaro', 'year_from': '2016'}, ('CHEVROLET', 'CAMARO', 2016, latest_model_year())),
+    ({'make': 'Toyota', 'model': 'Supra', 'year_to': 1998}, ('TOYOTA', 'SUPRA', 1998, 1998)),
+    ({'make': 'Toyota', 'model': 'Supra'}, ('TOYOTA', 'SUPRA', *ALL_YEARS)),
+    ({'make': 'Toyota', 'model': 'Supra', 'year_from': 'late 90s'}, None),
+    ({'make': 'Toyota', 'model': 'Supra', 'year_from': 2002, 'year_to': 1993}, None),
+    ({'make': 'Toyota', 'model': 'Supra', 'year_from': [1993]}, None),
+    ({'make': 'Workshop', 'model': 'Special'}, None)
+])
+def test_parse_compatibility_entries(chassis, entry, expected):
+    assert chassis.parse(entry) == expected
+
+def part(part_id, compatibility, price=100.0, stock_quantity=5, category='Brakes', updated_at='2026-10-01T00:00:00'):
+    return {
+        'id': part_id, 'name': f'Part {part_id}', 'brand': 'KC', 'part_number': part_id, 'category': category,
+        'price': price, 'currency': 'AUD', 'stock_quantity': stock_quantity, 'compatibility': compatibility,
+        'status': 'active', 'updated_at': updated_at
+    }
+
+def ids(parts):
+    return [row['id'] for row in parts]
+
+@pytest.fixture
+def index(chassis):
+    fitment = PartsFitmentIndex(chassis=chassis)
+    fitment.load([
+        part('pad-1', ['Nissan Skyline R32-R34']),
+        part('pad-2', ['Nissan Skyline R34', 'Toyota Supra (1993-2002)'], price=80.0),
+        part('pad-3', ['Universal Fitment'], price=50.0)
+    ])
+    return fitment
+
+def test_lookup_matches_years_and_appends_universal_parts(index):
+    assert ids(index.lookup('Nissan', 'Skyline', 1990, 'brakes')) == ['pad-1', 'pad-3']
+    assert ids(index.lookup('Nissan', 'Skyline', 2000, 'brakes')) == ['pad-2', 'pad-1', 'pad-3']
+    assert ids(index.lookup('Nissan', 'Skyline', 2010, 'brakes', universal=False)) == []
+
+def test_non_numeric_years_are_counted_not_raised(index):
+    index.upsert(part('pad-4', [{'make': 'Toyota', 'model': 'Supra', 'year_from': 'late 90s'}, 'Toyota Supra']))
+
+    assert index.unparsed_entries == 1
+    assert 'pad-4' in ids(index.lookup('Toyota', 'Supra', 1995, 'brakes'))
+
+def test_upsert_then_out_of_stock_removes_the_part(index):
+    index.upsert(part('pad-1', ['Nissan Skyline R33'], price=120.0))
+    assert ids(index.lookup('Nissan', 'Skyline', 1990, 'brakes', universal=False)) == []
+    assert ids(index.lookup('Nissan', 'Skyline', 1996, 'brakes', universal=False)) == ['pad-1']
+
+    index.upsert(part('pad-1', ['Nissan Skyline R33'], stock_quantity=0))
+
+    assert ids(index.lookup('Nissan', 'Skyline', 1996, 'brakes', universal=False)) == []
+    assert len(index) == 2
+
+def test_webhook_delete_removes_the_part_everywhere(index):
+    assert index.apply_webhook({'type': 'DELETE', 'table': 'parts', 'old_record': {'id': 'pad-2'}}) == 'DELETE'
+
+    assert ids(index.lookup('Toyota', 'Supra', 1995, 'brakes', universal=False)) == []
+    assert ids(index.lookup('Nissan', 'Skyline', 2000, 'brakes', universal=False)) == ['pad-1']
+    assert index.deletes == 1
+    with pytest.raises(ValueError):
+        index.apply_webhook({'type': 'TRUNCATE', 'table': 'parts'})
+
+def write_parts(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS parts (id TEXT PRIMARY KEY, name TEXT, brand TEXT, part_number TEXT, "
+        "category TEXT, price REAL, currency TEXT, stock_quantity INTEGER, compatibility TEXT, status TEXT, "
+        "updated_at TEXT)"
+    )
+    conn.execute("DELETE FROM parts")
+    conn.executemany(
+        "INSERT INTO parts VALUES (:id, :name, :brand, :part_number, :category, :price, :currency, "
+        ":stock_quantity, :compatibility, :status, :updated_at)",
+        [{**row, 'compatibility': str(row['compatibility']).replace("'", '"')} for row in rows]
+    )
+    conn.commit()
+    conn.close()
+
+@pytest.mark.asyncio
+async def test_incremental_sync_reconciles_deleted_ids(tmp_path, chassis):
+    path = str(tmp_path / 'catalogue.db')
+    write_parts(path, [part('pad-1', ['Nissan Skyline R34']), part('pad-2', ['Nissan Skyline R34'])])
+    fitment = PartsFitmentIndex(SQLiteCatalogue(path), chassis, reconcile_seconds=0.001)
+    assert (await fitment.sync(full=True))['full_reload'] == 1
+
+    # A hard delete leaves no updated_at behind; only the id check sees it
+    write_parts(path, [part('pad-1', ['Nissan Skyline R34'])])
+    fitment._last_reconcile -= 1
+    result = await fitment.sync()
+
+    assert result == {'full_reload': 0, 'parts_changed': 1, 'parts_removed': 1}
+    assert ids(fitment.lookup('Nissan', 'Skyline', 2000, 'brakes')) == ['pad-1']
+    assert fitment.stats()['reconciles'] == 1
+    fitment.catalogue.close()
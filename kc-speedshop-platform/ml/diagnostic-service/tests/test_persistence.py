@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from persistence import (
+    DEAD_LETTER_FILE,
+    SQLiteBackend,
+    WALSegment,
+    WriteBehindStore,
+    decode_cursor,
+    encode_cursor,
+    scan_row_id
+)
+
+def record(diagnosis_id, timestamp='2026-10-01T12:00:00', vehicle_id='veh-1'):
+    return {
+        'request': {'vehicle_id': vehicle_id, 'vin': 'JF1GR89658L800001', 'obd_data': {'DTC_CODES': ['P0300']}},
+        'result': {
+            'vehicle_id': vehicle_id,
+            'diagnosis_id': diagnosis_id,
+            'timestamp': timestamp,
+            'primary_issues': [{'description': 'Misfire'}],
+            'recommendations': [],
+            'confidence_score': 0.8,
+            'urgency_level': 'medium'
+        },
+        'ai_model': 'rule_based'
+    }
+
+def write_orphan_segment(wal_dir, records, name='wal-00000000000000000001-99999.log', torn_tail=''):
+    os.makedirs(wal_dir, exist_ok=True)
+    path = os.path.join(wal_dir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(json.dumps(item) + '\n' for item in records) + torn_tail)
+    return path
+
+def count(db_path, table):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'diagnostics.db')
+
+@pytest.fixture
+def wal_dir(tmp_path):
+    return str(tmp_path / 'wal')
+
+def new_store(db_path, wal_dir, backend=None):
+    return WriteBehindStore(backend or SQLiteBackend(db_path), wal_dir=wal_dir, flush_interval=3600, fsync_mode='never')
+
+@pytest.mark.asyncio
+async def test_flush_writes_rows_and_deletes_the_segment(db_path, wal_dir):
+    store = new_store(db_path, wal_dir)
+    store.append([record('diag_a'), record('diag_b')])
+
+    assert await store.flush() == 2
+
+    assert count(db_path, 'diagnostic_scans') == 2
+    assert count(db_path, 'ai_interpretations') == 2
+    assert os.listdir(wal_dir) == []
+    assert (await store.fetch_result('diag_a'))['urgency_level'] == 'medium'
+
+@pytest.mark.asyncio
+async def test_replaying_a_committed_segment_inserts_each_row_once(db_path, wal_dir):
+    records = [record('diag_a'), record('diag_b')]
+    for attempt in range(2):
+        # A crash between the commit and the unlink leaves the segment behind
+        write_orphan_segment(wal_dir, records)
+        store = new_store(db_path, wal_dir)
+        assert store.recover() == 2
+        assert await store.flush() == 2
+
+    assert count(db_path, 'diagnostic_scans') == 2
+    assert count(db_path, 'ai_interpretations') == 2
+
+@pytest.mark.asyncio
+async def test_recovery_claims_only_segments_of_dead_processes(db_path, wal_dir):
+    orphan = write_orphan_segment(wal_dir, [record('diag_a'), record('diag_b')], torn_tail='{"request": {"vehi')
+    live = WALSegment.create(wal_dir)
+    live.append([record('diag_live')])
+    store = new_store(db_path, wal_dir)
+
+    assert store.recover() == 2
+    # Recovered rows are readable before they reach the database
+    assert (await store.fetch_result('diag_b'))['diagnosis_id'] == 'diag_b'
+    assert await store.flush() == 2
+
+    assert not os.path.exists(orphan)
+    assert os.path.exists(live.path)
+    assert await store.fetch_result('diag_live') is None
+    assert store.stats()['recovered'] == 2
+    live.release(delete=False)
+
+@pytest.mark.asyncio
+async def test_rejected_rows_are_dead_lettered_and_the_rest_written(db_path, wal_dir):
+    bad = record('diag_bad')
+    del bad['result']['timestamp']
+    store = new_store(db_path, wal_dir)
+    store.append([record('diag_a'), bad, record('diag_b')])
+
+    await store.flush()
+
+    assert count(db_path, 'diagnostic_scans') == 2
+    assert store.stats()['dead_lettered'] == 1
+    with open(os.path.join(wal_dir, DEAD_LETTER_FILE), encoding='utf-8') as f:
+        [dead] = [json.loads(line) for line in f]
+    assert dead['record']['result']['diagnosis_id'] == 'diag_bad'
+    assert os.listdir(wal_dir) == [DEAD_LETTER_FILE]
+
+@pytest.mark.asyncio
+async def test_unavailable_database_keeps_rows_in_the_wal(db_path, wal_dir):
+    class DownBackend(SQLiteBackend):
+        def write_batch(self, records):
+            raise sqlite3.OperationalError('database is locked')
+
+    store = new_store(db_path, wal_dir, backend=DownBackend(db_path))
+    store.append([record('diag_a')])
+
+    with pytest.raises(sqlite3.OperationalError):
+        await store.flush()
+
+    assert store.pending_rows == 1
+    assert (await store.fetch_result('diag_a')) is not None
+    await store.stop()
+    retry = new_store(db_path, wal_dir)
+    assert retry.recover() == 1
+    assert await retry.flush() == 1
+    assert count(db_path, 'diagnostic_scans') == 1
+
+def test_cursor_round_trip():
+    position = ('2026-10-01T12:00:00.000000', scan_row_id('diag_a'))
+
+    assert decode_cursor(encode_cursor(position)) == position
+    assert decode_cursor(encode_cursor(('2026-10-01T14:00:00+02:00', position[1]))) == position
+
+@pytest.mark.parametrize('cursor', [
+    'not-a-cursor',
+    encode_cursor(('2026-10-01T12:00:00', 'not-a-uuid')),
+    encode_cursor(('yesterday', scan_row_id('diag_a'))),
+    'WzFd'
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor)
+
+@pytest.mark.asyncio
+async def test_history_pages_merge_stored_and_pending_rows_without_gaps(db_path, wal_dir):
+    store = new_store(db_path, wal_dir)
+    timestamps = ['2026-10-01T10:00:00', '2026-10-01T11:00:00', '2026-10-01T11:00:00', '2026-10-01T12:00:00',
+                  '2026-10-01T13:00:00']
+    store.append([record(f'diag_{index}', timestamp) for index, timestamp in enumerate(timestamps[:3])])
+    store.append([record('diag_other', timestamps[4], vehicle_id='veh-2')])
+    await store.flush()
+    store.append([record(f'diag_{index}', timestamp) for index, timestamp in enumerate(timestamps) if index >= 3])
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        results, cursor = await store.list_vehicle_results('veh-1', cursor, limit=2)
+        seen.extend(result['diagnosis_id'] for result in results)
+        pages += 1
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert len(seen) == len(set(seen)) == 5
+    assert seen[:2] == ['diag_4', 'diag_3'] and seen[-1] == 'diag_0'
+    # Rows sharing a timestamp are ordered by row id, so a page boundary between them is stable
+    assert sorted(seen[2:4], key=scan_row_id, reverse=True) == seen[2:4]
+
+@pytest.mark.asyncio
+async def test_history_rejects_an_invalid_cursor(db_path, wal_dir):
+    store = new_store(db_path, wal_dir)
+
+    with pytest.raises(ValueError):
+        await store.list_vehicle_results('veh-1', 'bogus')
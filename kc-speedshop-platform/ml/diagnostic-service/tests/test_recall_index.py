@@ -0,0 +1,142 @@
+import json
+import os
+
+import pytest
+
+from recall_index import ALL_YEARS, FLAT_MIN_COLUMNS, RecallIndex, read_flat_file, vehicle_key, year_intervals
+
+def flat_row(campaign, make, model, year, component='ENGINE', report_date='20200101'):
+    fields = [''] * FLAT_MIN_COLUMNS
+    fields[0] = '1'
+    fields[1] = campaign
+    fields[2] = make
+    fields[3] = model
+    fields[4] = str(year)
+    fields[6] = component
+    fields[7] = f"{make} Motor Co."
+    fields[11] = '1000'
+    fields[15] = report_date
+    fields[19] = f"Summary of {campaign}"
+    return '\t'.join(fields)
+
+def write_dump(path, rows):
+    path.write_text('\n'.join(rows) + '\n', encoding='utf-8')
+    return str(path)
+
+def campaigns_of(results):
+    return [result['campaign'] for result in results]
+
+@pytest.fixture
+def index(tmp_path):
+    dump = write_dump(tmp_path / 'FLAT_RCL.txt', [
+        *(flat_row('10V001000', 'HONDA', 'CR-V', year, report_date='20100301') for year in range(2002, 2012)),
+        *(flat_row('20V002000', 'HONDA', 'CR-V', year, report_date='20200301') for year in (2017, 2018, 2020)),
+        flat_row('20V002000', 'HONDA', 'CR-V', 2020, component='AIR BAGS', report_date='20200301'),
+        flat_row('15V003000', 'HONDA', 'CR-V', 9999, report_date='20150301'),
+        flat_row('18V004000', 'FORD', 'MUSTANG', 2015, report_date='20180301'),
+        flat_row('19V005000', 'HONDA', 'CIVIC', 'not a year')
+    ])
+    recall_index = RecallIndex(dump_path=dump, delta_dir=str(tmp_path / 'deltas'), refresh_seconds=0)
+    recall_index.load(*read_flat_file(dump))
+    return recall_index
+
+@pytest.mark.parametrize('years, intervals', [
+    ([2004, 2002, 2003, 2003, 2007], [(2002, 2004), (2007, 2007)]),
+    ([2019], [(2019, 2019)]),
+    ([2015, 9999], [ALL_YEARS]),
+    ([], [])
+])
+def test_year_intervals(years, intervals):
+    assert year_intervals(years) == intervals
+
+def test_vehicle_key_ignores_case_and_punctuation():
+    assert vehicle_key('Honda', 'CR-V') == vehicle_key('HONDA', 'cr v') == vehicle_key('honda', 'CRV') == ('HONDA', 'CRV')
+
+def test_flat_file_rows_fold_into_campaigns(index):
+    assert len(index) == 4
+    assert index.stats()['intervals'] == 4
+    assert index.stats()['any_year_entries'] == 1
+
+    [result] = index.lookup('Honda', 'CR-V', 2020, limit=1)
+
+    assert result['campaign'] == '20V002000'
+    assert result['components'] == ['ENGINE', 'AIR BAGS']
+    assert result['manufacturer'] == 'HONDA Motor Co.'
+    assert result['potentially_affected'] == 1000
+
+@pytest.mark.parametrize('year, expected', [
+    (2001, ['15V003000']),
+    (2002, ['15V003000', '10V001000']),
+    (2011, ['15V003000', '10V001000']),
+    (2017, ['20V002000', '15V003000']),
+    # 2019 falls between the 2017-2018 and 2020 intervals of the same campaign
+    (2019, ['15V003000']),
+    (2020, ['20V002000', '15V003000']),
+    (None, ['20V002000', '15V003000', '10V001000'])
+])
+def test_lookup_matches_intervals_covering_the_year(index, year, expected):
+    assert campaigns_of(index.lookup('HONDA', 'CRV', year)) == expected
+
+def test_lookup_scans_back_past_shorter_intervals(index):
+    index.upsert({'campaign': '21V006000', 'make': 'HONDA', 'model': 'CR-V', 'years': [2009], 'report_date': '20210301'})
+
+    assert campaigns_of(index.lookup('HONDA', 'CR-V', 2009)) == ['21V006000', '15V003000', '10V001000']
+    assert campaigns_of(index.lookup('HONDA', 'CR-V', 2010)) == ['15V003000', '10V001000']
+
+@pytest.mark.parametrize('make, model', [(None, 'CR-V'), ('HONDA', ''), ('TOYOTA', 'COROLLA')])
+def test_lookup_of_unknown_vehicle_is_empty(index, make, model):
+    assert index.lookup(make, model, 2015) == []
+
+def test_upsert_replaces_campaign_years_for_one_vehicle(index):
+    index.upsert({
+        'campaign': '10V001000', 'make': 'Honda', 'model': 'CR-V', 'years': [2012, 2013],
+        'remedy': 'Replace the pump', 'component': 'FUEL SYSTEM'
+    })
+
+    assert '10V001000' not in campaigns_of(index.lookup('HONDA', 'CR-V', 2005))
+    [result] = [result for result in index.lookup('HONDA', 'CR-V', 2013) if result['campaign'] == '10V001000']
+    assert result['remedy'] == 'Replace the pump'
+    assert result['components'] == ['ENGINE', 'FUEL SYSTEM']
+    assert result['summary'] == 'Summary of 10V001000'
+
+def test_upsert_without_years_matches_every_year(index):
+    index.upsert({'campaign': '22V007000', 'make': 'FORD', 'model': 'MUSTANG', 'report_date': '20220301'})
+
+    assert campaigns_of(index.lookup('FORD', 'MUSTANG', 1970)) == ['22V007000']
+    assert campaigns_of(index.lookup('FORD', 'MUSTANG', 2015)) == ['22V007000', '18V004000']
+
+def test_delete_of_one_vehicle_keeps_the_campaign_for_others(index):
+    index.upsert({'campaign': '18V004000', 'make': 'FORD', 'model': 'F-150', 'years': [2015]})
+
+    index.delete('18V004000', 'FORD', 'MUSTANG')
+
+    assert index.lookup('FORD', 'MUSTANG', 2015) == []
+    assert campaigns_of(index.lookup('FORD', 'F150', 2015)) == ['18V004000']
+
+    index.delete('18V004000')
+
+    assert index.lookup('FORD', 'F150', 2015) == []
+    assert len(index) == 3
+
+def test_apply_rejects_unknown_operations(index):
+    with pytest.raises(ValueError, match='Unknown recall delta operation'):
+        index.apply([{'op': 'truncate'}])
+
+@pytest.mark.asyncio
+async def test_refresh_applies_new_delta_files_once(index, tmp_path):
+    os.makedirs(index.delta_dir)
+    await index.refresh()
+    delta = tmp_path / 'deltas' / '0001.jsonl'
+    delta.write_text('\n'.join(json.dumps(operation) for operation in [
+        {'op': 'upsert', 'campaign': '23V008000', 'make': 'FORD', 'model': 'MUSTANG', 'years': [2015, 2016],
+         'report_date': '20230301'},
+        {'op': 'delete', 'campaign': '18V004000'}
+    ]), encoding='utf-8')
+    # Files no newer than the dump are taken to be part of it
+    dump_mtime = os.path.getmtime(index.dump_path)
+    os.utime(delta, (dump_mtime + 10, dump_mtime + 10))
+
+    assert await index.refresh() == {'dump_reloaded': 0, 'deltas_applied': 1}
+    assert await index.refresh() == {'dump_reloaded': 0, 'deltas_applied': 0}
+    assert campaigns_of(index.lookup('FORD', 'MUSTANG', 2016)) == ['23V008000']
+    assert campaigns_of(index.lookup('FORD', 'MUSTANG', 2015)) == ['23V008000']
@@ -0,0 +1,91 @@
+import numpy as np
+
+from rule_engine import RuleEngine
+
+RX8 = {'make': 'Mazda', 'model': 'RX-8', 'year': 2006}
+CIVIC = {'make': 'Honda', 'model': 'Civic', 'year': 2006}
+
+def test_scoped_variant_replaces_unscoped_rule_for_matching_vehicles():
+    engine = RuleEngine([
+        {'id': 'high_rpm', 'description': 'High RPM', 'severity': 'maintenance_required',
+         'when': {'pid': 'RPM', 'gt': 6000}},
+        {'id': 'high_rpm', 'description': 'High RPM', 'severity': 'maintenance_required',
+         'when': {'pid': 'RPM', 'gt': 9000}, 'scope': {'make': 'Mazda', 'model': 'RX-8'}}
+    ])
+
+    verdicts = engine.evaluate_batch([{'RPM': 7000}, {'RPM': 7000}, {'RPM': 9500}], [RX8, CIVIC, RX8])
+
+    assert [verdict['rules_fired'] for verdict in verdicts] == [[], ['high_rpm'], ['high_rpm']]
+
+def test_scoped_only_rule_fires_for_matching_vehicles():
+    engine = RuleEngine([
+        {'id': 'rotary_flood', 'description': 'Rotary flooding risk', 'severity': 'critical',
+         'when': {'pid': 'RPM', 'lt': 400}, 'scope': {'make': 'Mazda', 'years': [2003, 2012]}}
+    ])
+
+    verdicts = engine.evaluate_batch(
+        [{'RPM': 300}, {'RPM': 300}, {'RPM': 300}],
+        [RX8, CIVIC, {'make': 'Mazda', 'model': 'RX-7', 'year': 1995}]
+    )
+
+    assert verdicts[0]['rules_fired'] == ['rotary_flood']
+    assert verdicts[0]['prediction'] == 'critical'
+    assert verdicts[1]['rules_fired'] == []
+    assert verdicts[2]['rules_fired'] == []
+    # Without a vehicle no scoped rule is in scope
+    assert engine.evaluate({'RPM': 300})['rules_fired'] == []
+
+OVERHEAT = {'id': 'sustained_overheating', 'description': 'Coolant above 110 for 60s', 'severity': 'critical',
+            'when': {'pid': 'COOLANT_TEMP', 'gt': 110}, 'duration_seconds': 60}
+
+def window(coolant):
+    timestamps_ms = np.arange(len(coolant), dtype=np.int64) * 10_000
+    return timestamps_ms, {'COOLANT_TEMP': np.array(coolant, dtype=np.float32)}
+
+def test_duration_rule_fires_once_condition_held_long_enough():
+    engine = RuleEngine([OVERHEAT])
+    # Rows every 10 s: above 110 from 20 s to 90 s
+    verdict = engine.evaluate_window(*window([100, 100, 115, 115, 115, 115, 115, 115, 115, 115, 100]))
+
+    assert verdict['prediction'] == 'critical'
+    [firing] = verdict['firings']
+    assert firing['first_timestamp_ms'] == 80_000
+    assert firing['last_timestamp_ms'] == 90_000
+    assert firing['rows'] == 2
+
+def test_interrupted_condition_restarts_the_duration():
+    engine = RuleEngine([OVERHEAT])
+    verdict = engine.evaluate_window(*window([115, 115, 115, 115, 115, np.nan, 115, 115, 115, 115, 115]))
+
+    assert verdict['firings'] == []
+    assert verdict['prediction'] == 'normal'
+
+def test_duration_rule_never_fires_on_a_single_snapshot():
+    engine = RuleEngine([OVERHEAT])
+    assert engine.evaluate({'COOLANT_TEMP': 130})['rules_fired'] == []
+
+def test_negation_does_not_match_missing_pids():
+    engine = RuleEngine([
+        {'id': 'closed_loop_lost', 'description': 'Fuel trim outside the normal band', 'severity': 'maintenance_required',
+         'when': {'not': {'all': [{'pid': 'RPM', 'gt': 0}, {'pid': 'SHORT_FUEL_TRIM_1', 'between': [-10, 10]}]}}}
+    ])
+
+    verdicts = engine.evaluate_batch([
+        {'RPM': 800, 'SHORT_FUEL_TRIM_1': 25},
+        {'RPM': 800, 'SHORT_FUEL_TRIM_1': 2},
+        {'RPM': 800},
+        {}
+    ])
+
+    assert [verdict['rules_fired'] for verdict in verdicts] == [['closed_loop_lost'], [], [], []]
+
+def test_row_conditions_agree_with_the_compiled_table():
+    engine = RuleEngine.from_file()
+    rng = np.random.default_rng(7)
+    scales = np.array([{'RPM': 9000, 'COOLANT_TEMP': 140, 'MAF': 20, 'O2_SENSOR': 1.2}.get(pid, 300) for pid in engine.pids])
+    matrix = (rng.random((2000, len(engine.pids))) * scales).astype(np.float32)
+    matrix[rng.random(matrix.shape) < 0.2] = np.nan
+
+    for rule in engine.rules:
+        expected = rule.condition(matrix)
+        assert [rule.row_condition(row) for row in matrix.tolist()] == expected.tolist(), rule.id
@@ -0,0 +1,157 @@
+import math
+
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from rule_engine import RuleEngine
+from telemetry import TelemetryHub, TelemetrySession, validate_frame
+
+RULES = RuleEngine.from_file()
+
+async def score(snapshot, vehicle=None):
+    return {'rpm': snapshot['RPM']}
+
+def triggers(session, frames):
+    return [trigger for trigger in (session.ingest(frame) for frame in frames) if trigger is not None]
+
+def client_for(hub, vehicle=None):
+    app = FastAPI()
+
+    @app.websocket('/telemetry/{vehicle_id}')
+    async def telemetry(websocket: WebSocket, vehicle_id: str):
+        await hub.serve(websocket, vehicle_id, vehicle)
+
+    return TestClient(app)
+
+@pytest.mark.parametrize('frame', [
+    {'t': 1700000000.5, 'pids': {'RPM': 3000, 'COOLANT_TEMP': 90.0}},
+    {'RPM': 3000, 'DTC_CODES': ['P0300']},
+    {'pids': {'RPM': None, 'UNKNOWN_PID': float('nan')}}
+])
+def test_valid_frames(frame):
+    validate_frame(frame)
+
+@pytest.mark.parametrize('frame, error', [
+    ({'t': float('nan'), 'RPM': 3000}, "'t' must be"),
+    ({'t': True, 'RPM': 3000}, "'t' must be"),
+    ({'t': '1700000000', 'RPM': 3000}, "'t' must be"),
+    ({'pids': {'RPM': float('inf')}}, 'RPM must be a finite number'),
+    ({'COOLANT_TEMP': -math.inf}, 'COOLANT_TEMP must be a finite number'),
+    ({'RPM': False}, 'RPM must be a finite number')
+])
+def test_invalid_frames(frame, error):
+    with pytest.raises(ValueError, match=error):
+        validate_frame(frame)
+
+def test_ingest_keeps_window_finite():
+    session = TelemetrySession('v1', window_size=4)
+    session.ingest({'t': 1.0, 'RPM': 3000})
+    session.ingest({'t': float('nan'), 'RPM': float('inf')})
+
+    features = session.window.features()['RPM']
+
+    assert all(math.isfinite(value) for value in features.values())
+    assert features['mean'] == 3000
+
+def test_non_finite_frame_is_rejected_and_session_keeps_scoring():
+    hub = TelemetryHub(score, window_size=2)
+    with client_for(hub).websocket_connect('/telemetry/v1') as websocket:
+        websocket.send_text('{"t": NaN, "RPM": 3000}')
+        assert websocket.receive_json() == {'type': 'error', 'detail': "Invalid frame: 't' must be a finite number of unix seconds"}
+        websocket.send_text('{"t": 1, "RPM": Infinity}')
+        assert websocket.receive_json()['detail'] == 'Invalid frame: RPM must be a finite number'
+
+        websocket.send_text('{"t": 1, "RPM": 7000}')
+        websocket.send_text('{"t": 2, "RPM": 7000}')
+        message = websocket.receive_json()
+
+    assert message['type'] == 'score'
+    assert message['analysis'] == {'rpm': 7000}
+    assert hub.stats()['frames_invalid'] == 2
+
+def test_socket_is_closed_when_frame_processing_fails(monkeypatch):
+    def broken_ingest(self, frame):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(TelemetrySession, 'ingest', broken_ingest)
+    hub = TelemetryHub(score, window_size=2)
+    with client_for(hub).websocket_connect('/telemetry/v1') as websocket:
+        websocket.send_text('{"t": 1, "RPM": 3000}')
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            websocket.receive_json()
+
+    assert disconnect.value.code == 1011
+    assert hub.stats()['active_sessions'] == 0
+
+def test_history_store_failure_does_not_end_the_session():
+    class BrokenStore:
+        def append(self, vehicle_id, timestamp, values):
+            raise OSError('disk full')
+
+    hub = TelemetryHub(score, history_store=BrokenStore(), window_size=2)
+    with client_for(hub).websocket_connect('/telemetry/v1') as websocket:
+        for t in range(4):
+            websocket.send_text(f'{{"t": {t}, "RPM": 3000}}')
+        assert websocket.receive_json()['type'] == 'score'
+        assert websocket.receive_json()['type'] == 'score'
+
+    assert hub.stats()['history_errors'] == 4
+
+def test_rules_trigger_scoring_when_they_start_firing():
+    session = TelemetrySession('v1', window_size=1000, rule_engine=RULES)
+
+    fired = triggers(session, [
+        {'t': 0, 'COOLANT_TEMP': 90},
+        {'t': 1, 'COOLANT_TEMP': 105},
+        {'t': 2, 'COOLANT_TEMP': 106},
+        {'t': 3, 'COOLANT_TEMP': 125},
+        {'t': 4, 'COOLANT_TEMP': 95},
+        {'t': 5, 'COOLANT_TEMP': 105}
+    ])
+
+    assert fired == ['rule:engine_overheating', 'rule:severe_overheating', 'rule:engine_overheating']
+    assert session.stats()['active_rules'] == ['engine_overheating']
+
+@pytest.mark.parametrize('vehicle, fired', [
+    (None, ['rule:high_rpm']),
+    ({'make': 'Toyota', 'model': 'Hilux', 'year': 2016}, ['rule:high_rpm']),
+    ({'make': 'Mazda', 'model': 'RX-8', 'year': 2006}, [])
+])
+def test_rule_triggers_follow_the_vehicle_scope(vehicle, fired):
+    session = TelemetrySession('v1', window_size=1000, rule_engine=RULES, vehicle=vehicle)
+    rpm = 4800 if vehicle and vehicle['model'] == 'Hilux' else 7000
+
+    assert triggers(session, [{'t': 0, 'RPM': 3000}, {'t': 1, 'RPM': rpm}]) == fired
+
+def test_combination_rules_use_pids_outside_the_feature_window():
+    session = TelemetrySession('v1', window_size=1000, rule_engine=RULES)
+
+    fired = triggers(session, [{'t': 0, 'RPM': 3000}, {'t': 1, 'MAF': 1.5}])
+
+    assert fired == ['rule:maf_implausible']
+
+def test_duration_rules_fire_once_held_on_the_stream():
+    session = TelemetrySession('v1', window_size=1000, rule_engine=RULES)
+
+    fired = triggers(session, [{'t': t, 'COOLANT_TEMP': 115} for t in range(0, 75, 5)])
+
+    assert fired == ['rule:engine_overheating', 'rule:sustained_overheating']
+    assert session.ingest({'t': 75, 'COOLANT_TEMP': 105}) is None
+    assert triggers(session, [{'t': t, 'COOLANT_TEMP': 115} for t in range(80, 135, 5)]) == []
+
+def test_vehicle_scope_applies_to_rules_and_scoring_over_the_socket():
+    hilux = {'make': 'Toyota', 'model': 'Hilux', 'year': 2016}
+    seen = []
+
+    async def scoped_score(snapshot, vehicle=None):
+        seen.append(vehicle)
+        return {}
+
+    hub = TelemetryHub(scoped_score, rule_engine=RULES, window_size=1000)
+    with client_for(hub, hilux).websocket_connect('/telemetry/v1') as websocket:
+        websocket.send_text('{"t": 1, "RPM": 4800}')
+        assert websocket.receive_json()['trigger'] == 'rule:high_rpm'
+
+    assert seen == [hilux]
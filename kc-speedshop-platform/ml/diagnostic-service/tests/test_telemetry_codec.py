@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from telemetry_codec import (
+    ENCODING_PACKED,
+    ENCODING_RAW,
+    MAGIC_TIMESTAMPS,
+    MAGIC_VALUES,
+    _blocks,
+    _pack_fixed,
+    _pack_variable,
+    _unpack_fixed,
+    _unpack_variable,
+    decode_timestamps,
+    decode_values,
+    encode_timestamps,
+    encode_values
+)
+
+def block_encodings(data: bytes, magic: bytes):
+    return [encoding for _, encoding, _ in _blocks(data, magic)]
+
+def assert_bit_exact(decoded: np.ndarray, values: np.ndarray):
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded.view(np.uint32), values.astype(np.float32).view(np.uint32))
+
+@pytest.mark.parametrize('timestamps', [
+    np.zeros(0, dtype=np.int64),
+    np.array([1_700_000_000_000], dtype=np.int64),
+    np.array([1_700_000_000_000, 1_700_000_000_100], dtype=np.int64),
+    1_700_000_000_000 + np.arange(5000, dtype=np.int64) * 100,
+    1_700_000_000_000 + np.cumsum(np.random.default_rng(1).integers(90, 110, 5000)),
+    np.array([5, 3, 3, 100, -7, 2**40], dtype=np.int64),
+])
+def test_timestamps_round_trip(timestamps):
+    np.testing.assert_array_equal(decode_timestamps(encode_timestamps(timestamps)), timestamps)
+
+def test_regular_timestamps_compress_to_about_one_bit_per_row():
+    timestamps = 1_700_000_000_000 + np.arange(65536, dtype=np.int64) * 100
+    assert len(encode_timestamps(timestamps)) * 8 / len(timestamps) < 1.1
+
+def test_clock_jump_wider_than_32_bits_falls_back_to_a_raw_block():
+    timestamps = np.array([0, 100, 200, 2**40, 2**40 + 100], dtype=np.int64)
+    encoded = encode_timestamps(timestamps)
+    assert block_encodings(encoded, MAGIC_TIMESTAMPS) == [ENCODING_RAW]
+    np.testing.assert_array_equal(decode_timestamps(encoded), timestamps)
+
+def test_timestamps_span_several_blocks():
+    timestamps = 1_700_000_000_000 + np.arange(1000, dtype=np.int64) * 250
+    encoded = encode_timestamps(timestamps, block_rows=128)
+    assert len(block_encodings(encoded, MAGIC_TIMESTAMPS)) == 8
+    np.testing.assert_array_equal(decode_timestamps(encoded), timestamps)
+
+@pytest.mark.parametrize('values', [
+    np.zeros(0, dtype=np.float32),
+    np.array([42.5], dtype=np.float32),
+    np.full(4096, 90.0, dtype=np.float32),
+    (np.sin(np.arange(4096) / 50) * 3000 + 3000).round(),
+    np.array([1.0, -0.0, 0.0, np.inf, -np.inf, 1e-45, 3.4e38], dtype=np.float32),
+])
+def test_values_round_trip_bit_exactly(values):
+    assert_bit_exact(decode_values(encode_values(values)), values)
+
+def test_nan_payloads_survive():
+    payloads = np.array([0x7FC00000, 0x7FC00001, 0xFFC00000, 0x7F800001, 0x7FBFFFFF], dtype=np.uint32)
+    values = np.concatenate([np.full(10, 88.0, dtype=np.float32), payloads.view(np.float32), np.full(10, 88.0, dtype=np.float32)])
+    decoded = decode_values(encode_values(values))
+    np.testing.assert_array_equal(decoded.view(np.uint32), values.view(np.uint32))
+
+def test_sensor_noise_falls_back_to_a_raw_block():
+    values = np.random.default_rng(7).random(4096).astype(np.float32)
+    encoded = encode_values(values)
+    assert block_encodings(encoded, MAGIC_VALUES) == [ENCODING_RAW]
+    assert_bit_exact(decode_values(encoded), values)
+
+def test_raw_and_packed_blocks_mix_in_one_series():
+    steady = np.full(256, 14.7, dtype=np.float32)
+    noise = np.random.default_rng(3).random(256).astype(np.float32)
+    values = np.concatenate([steady, noise, steady])
+    encoded = encode_values(values, block_rows=256)
+    assert block_encodings(encoded, MAGIC_VALUES) == [ENCODING_PACKED, ENCODING_RAW, ENCODING_PACKED]
+    assert_bit_exact(decode_values(encoded), values)
+
+def test_slightly_compressible_noise_is_stored_raw():
+    # Gaussian noise around a level packs to about 30 of 32 bits, too little to be worth decoding
+    values = (10 + np.random.default_rng(5).normal(0, 0.5, 4096)).astype(np.float32)
+    encoded = encode_values(values)
+    assert block_encodings(encoded, MAGIC_VALUES) == [ENCODING_RAW]
+    assert_bit_exact(decode_values(encoded), values)
+
+@pytest.mark.parametrize('width', [1, 2, 3, 7, 10, 11, 16])
+@pytest.mark.parametrize('count', [1, 3, 4, 5, 1001])
+def test_fixed_width_fields_round_trip(width, count):
+    values = np.random.default_rng(width * count).integers(0, 1 << width, count).astype(np.uint64)
+    np.testing.assert_array_equal(_unpack_fixed(_pack_fixed(values, width), count, width), values)
+
+def test_variable_width_fields_round_trip_across_word_boundaries():
+    rng = np.random.default_rng(11)
+    widths = rng.integers(1, 33, 5000).astype(np.uint8)
+    values = (rng.integers(0, 1 << 32, 5000, dtype=np.uint64) >> (np.uint64(32) - widths.astype(np.uint64)))
+    np.testing.assert_array_equal(_unpack_variable(_pack_variable(values, widths), widths), values)
@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+import pytest
+
+from telemetry_rollup import RAW_TIER, TelemetryRollups, merge_bucket_rows, rollup_column
+from telemetry_store import TelemetryStore
+
+PIDS = ('RPM', 'COOLANT_TEMP')
+NAN = float('nan')
+
+def bucket_columns(rows):
+    """Tier columns for one PID from (min, max, mean, count, last) rows"""
+    stats = np.array(rows, dtype=np.float32).T
+    return {rollup_column('RPM', stat): stats[index] for index, stat in enumerate(('min', 'max', 'mean', 'count', 'last'))}
+
+@pytest.fixture
+def rollups(tmp_path):
+    raw = TelemetryStore(str(tmp_path / 'raw'), pids=PIDS, segment_rows=100, compress_after=0, retention_seconds=0)
+    return TelemetryRollups(raw, root=str(tmp_path / 'rollups'), retention={'1m': 0, '1h': 0, '1d': 0})
+
+def test_merge_bucket_rows_weights_means_by_count_and_keeps_latest_last():
+    timestamps = np.array([0, 0, 60_000, 120_000, 120_000])
+    columns = bucket_columns([
+        (800, 1000, 900, 3, 1000),
+        (700, 2000, 1500, 1, 2000),
+        (900, 900, 900, 1, 900),
+        (850, 950, 900, 2, 950),
+        (NAN, NAN, NAN, 0, NAN)
+    ])
+
+    merged_timestamps, merged = merge_bucket_rows(timestamps, columns, ['RPM'])
+
+    assert merged_timestamps.tolist() == [0, 60_000, 120_000]
+    assert merged[rollup_column('RPM', 'mean')].tolist() == [1050.0, 900.0, 900.0]
+    assert merged[rollup_column('RPM', 'count')].tolist() == [4.0, 1.0, 2.0]
+    assert merged[rollup_column('RPM', 'min')].tolist() == [700.0, 900.0, 850.0]
+    assert merged[rollup_column('RPM', 'max')].tolist() == [2000.0, 900.0, 950.0]
+    # The empty later row does not blank out the bucket's last value
+    assert merged[rollup_column('RPM', 'last')].tolist() == [2000.0, 900.0, 950.0]
+
+def test_merge_bucket_rows_passes_distinct_buckets_through():
+    timestamps = np.array([0, 60_000])
+    columns = bucket_columns([(1, 1, 1, 1, 1), (2, 2, 2, 1, 2)])
+
+    assert merge_bucket_rows(timestamps, columns, ['RPM']) == (timestamps, columns)
+
+def test_open_buckets_across_an_hour_boundary_are_served_as_two_partials(rollups):
+    for timestamp, rpm in [(3540.0, 1000.0), (3599.0, 3000.0), (3600.0, 2000.0), (3601.0, 4000.0)]:
+        rollups.append('v1', timestamp, np.array([rpm, 90.0]))
+
+    minutes = rollups._partials('v1', 0)
+    hours = rollups._partials('v1', 1)
+
+    assert [bucket.start_ms for bucket in minutes] == [3_600_000]
+    assert [bucket.start_ms for bucket in hours] == [0, 3_600_000]
+    assert [bucket.count[0] for bucket in hours] == [2, 2]
+    assert [bucket.last[0] for bucket in hours] == [3000.0, 4000.0]
+
+    result = rollups.query('v1', 0, 7200, resolution=3600, pids=['RPM'])
+    assert result.tier == '1h'
+    assert result.timestamps.tolist() == [0, 3_600_000]
+    assert result.stat('RPM', 'mean').tolist() == [2000.0, 3000.0]
+    assert result.stat('RPM', 'max').tolist() == [3000.0, 4000.0]
+
+def test_partials_merge_with_stored_rows_of_the_same_bucket(rollups):
+    for timestamp, rpm in [(0.0, 1000.0), (60.0, 3000.0), (120.0, 2000.0)]:
+        rollups.append('v1', timestamp, np.array([rpm, 90.0]))
+    rollups.close_open_buckets()
+    # A restart continues the 1-hour bucket that was written partially at shutdown
+    rollups.append('v1', 180.0, np.array([6000.0, 90.0]))
+
+    result = rollups.query('v1', 0, 3600, resolution=3600, pids=['RPM'])
+
+    assert result.timestamps.tolist() == [0]
+    assert result.stat('RPM', 'count').tolist() == [4.0]
+    assert result.stat('RPM', 'mean').tolist() == [3000.0]
+    assert result.stat('RPM', 'last').tolist() == [6000.0]
+
+def test_plan_picks_the_coarsest_tier_within_the_resolution(rollups):
+    now = time.time()
+
+    assert rollups.plan(now - 60, now, resolution=0) == (RAW_TIER, 0)
+    assert rollups.plan(now - 86400, now, resolution=300) == ('1m', 60_000)
+    assert rollups.plan(now - 86400, now, resolution=3600) == ('1h', 3_600_000)
+    assert rollups.plan(now - 86400 * 30, now, resolution=86400 * 7) == ('1d', 86_400_000)
+
+def test_plan_falls_back_to_a_coarser_tier_once_raw_data_has_expired(tmp_path):
+    now = time.time()
+    raw = TelemetryStore(str(tmp_path / 'raw'), pids=PIDS, retention_seconds=86400)
+    rollups = TelemetryRollups(raw, root=str(tmp_path / 'rollups'), retention={'1m': 86400 * 7, '1h': 0, '1d': 0})
+
+    assert rollups.plan(now - 3600, now, resolution=0) == (RAW_TIER, 0)
+    assert rollups.plan(now - 86400 * 2, now, resolution=0) == ('1m', 60_000)
+    assert rollups.plan(now - 86400 * 30, now, resolution=0) == ('1h', 3_600_000)
@@ -0,0 +1,107 @@
+import pytest
+
+from vin_decoder import MODEL_YEARS, VINDecoder, check_digit, normalize_vin
+
+TABLES = {
+    'wmi': {
+        '1FA': ['Ford', 'United States', 'passenger car'],
+        '1G1': ['Chevrolet', 'United States', 'passenger car'],
+        'JF1': ['Subaru', 'Japan', 'passenger car']
+    },
+    'vds': {
+        '1FA': [['6P8', 'Mustang', None, 2015, 2023], ['FP4', 'Mustang', None, 1994, 2004]],
+        'JF1': [['GR', 'Impreza WRX', '2.5L turbo EJ25', 2008, 2014]]
+    },
+    'plants': {'Ford': {'5': 'Flat Rock'}}
+}
+
+def with_check_digit(vin):
+    return vin[:8] + check_digit(vin) + vin[9:]
+
+@pytest.fixture
+def decoder():
+    return VINDecoder(TABLES, remote_enabled=False)
+
+@pytest.mark.parametrize('vin, expected', [
+    ('1M8GDM9AXKP042788', 'X'),
+    ('11111111111111111', '1'),
+    ('1HGCM82633A004352', '3')
+])
+def test_check_digit(vin, expected):
+    assert check_digit(vin) == expected
+
+def test_normalize_vin_strips_spaces_and_dashes():
+    assert normalize_vin(' 1m8gdm9a-xkp042788 ') == '1M8GDM9AXKP042788'
+
+def test_year_codes_cover_two_thirty_year_cycles():
+    assert MODEL_YEARS['A'] == (1980, 2010)
+    assert MODEL_YEARS['Y'] == (2000, 2030)
+    assert MODEL_YEARS['1'] == (2001, 2031)
+    assert MODEL_YEARS['9'] == (2009, 2039)
+    assert not {'I', 'O', 'Q', 'U', 'Z', '0'} & set(MODEL_YEARS)
+
+@pytest.mark.parametrize('vin, error', [
+    ('1FA6P8TH5F500001', 'must be 17 characters'),
+    ('1FA6P8TH5F50000I1', 'invalid characters: I')
+])
+def test_malformed_vins_are_rejected(decoder, vin, error):
+    result = decoder.decode(vin)
+
+    assert not result['valid']
+    assert error in result['errors'][0]
+    assert result['check_digit_valid'] is None
+
+def test_north_american_check_digit_mismatch_is_invalid(decoder):
+    vin = with_check_digit('1FA6P8TH0F5000001')
+    wrong = vin[:8] + ('1' if vin[8] != '1' else '2') + vin[9:]
+
+    result = decoder.decode(wrong)
+
+    assert not result['valid']
+    assert result['check_digit_valid'] is False
+    assert result['errors'] == [f"Check digit mismatch: expected {vin[8]}, got {wrong[8]}"]
+
+def test_check_digit_mismatch_is_tolerated_outside_north_america(decoder):
+    vin = 'JF1GR89658L800001'
+    assert check_digit(vin) != vin[8]
+
+    result = decoder.decode(vin)
+
+    assert result['valid']
+    assert result['check_digit_valid'] is False
+    assert (result['make'], result['model'], result['year']) == ('Subaru', 'Impreza WRX', 2008)
+    assert result['engine'] == '2.5L turbo EJ25'
+    assert result['complete']
+
+@pytest.mark.parametrize('vin, model_year', [
+    # Year code F: 1985 or 2015, the VDS pattern covers 2015-2023
+    ('1FA6P8TH0F5000001', 2015),
+    # Year code R: 1994 or 2024, the VDS pattern covers 1994-2004
+    ('1FAFP4040R5000001', 1994)
+])
+def test_model_year_follows_vds_year_range(decoder, vin, model_year):
+    result = decoder.decode(with_check_digit(vin))
+
+    assert result['valid']
+    assert (result['make'], result['model'], result['year']) == ('Ford', 'Mustang', model_year)
+    assert result['plant'] == 'Flat Rock'
+
+@pytest.mark.parametrize('vin, model_year', [
+    # Without a matching VDS pattern, numeric position 7 means the 1980-2009 cycle
+    ('1G1JC5440A7000001', 1980),
+    ('1G1JC5A40A7000001', 2010)
+])
+def test_north_american_model_year_uses_position_seven(decoder, vin, model_year):
+    result = decoder.decode(with_check_digit(vin))
+
+    assert result['valid']
+    assert result['year'] == model_year
+    assert result['model'] is None
+    assert not result['complete']
+
+def test_unknown_wmi_still_decodes_year(decoder):
+    result = decoder.decode(with_check_digit('WVWZZZ1KZ8W000001'))
+
+    assert result['valid']
+    assert result['make'] is None
+    assert result['year'] == 2008
@@ -0,0 +1,364 @@
+"""
+KC Speedshop ML Diagnostic Service - VIN decoder
+Offline VIN decoding from precomputed WMI, VDS, model-year and plant tables
+
+The tables (VIN_TABLES_PATH) map a world manufacturer identifier (VIN
+positions 1-3) to make, country and vehicle type, VDS prefixes (positions
+4-8) of each WMI to model, engine and production years, and plant codes
+(position 11) of each make to a location. Model-year codes (position 10)
+repeat every 30 years; the candidate inside the model's production years
+wins, then the North American position 7 rule, then the latest year that is
+not in the future.
+
+Local decoding is a few dict lookups. VINs the tables cannot fully resolve
+can be completed by the NHTSA vPIC batch decoder (VIN_REMOTE_URL), fronted
+by an LRU so each VIN is fetched at most once per TTL.
+"""
+
+import asyncio
+import json
+import logging
+import operator
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from caching import MemoryTTLCache
+
+logger = logging.getLogger(__name__)
+
+VIN_TABLES_PATH = os.getenv(
+    "VIN_TABLES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "vin_tables.json")
+)
+
+# Remote fallback for VINs the local tables cannot complete
+VIN_REMOTE_ENABLED = os.getenv("VIN_REMOTE_ENABLED", "true").lower() in ("1", "true", "yes")
+VIN_REMOTE_URL = os.getenv("VIN_REMOTE_URL", "https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVINValuesBatch/")
+VIN_REMOTE_TIMEOUT = float(os.getenv("VIN_REMOTE_TIMEOUT", "10"))
+# vPIC accepts at most 50 VINs per batch call
+VIN_REMOTE_BATCH_SIZE = int(os.getenv("VIN_REMOTE_BATCH_SIZE", "50"))
+VIN_REMOTE_CONCURRENCY = int(os.getenv("VIN_REMOTE_CONCURRENCY", "4"))
+
+# LRU in front of the remote decoder; decodes never change, misses are retried sooner
+VIN_CACHE_MAX_ENTRIES = int(os.getenv("VIN_CACHE_MAX_ENTRIES", "50000"))
+VIN_CACHE_TTL_SECONDS = float(os.getenv("VIN_CACHE_TTL_SECONDS", str(30 * 86400)))
+VIN_CACHE_MISS_TTL_SECONDS = float(os.getenv("VIN_CACHE_MISS_TTL_SECONDS", "3600"))
+
+VIN_LENGTH = 17
+VIN_ALPHABET = frozenset("0123456789ABCDEFGHJKLMNPRSTUVWXYZ")
+
+# Check digit (position 9) transliteration and position weights
+TRANSLITERATION = {
+    **{str(digit): digit for digit in range(10)},
+    **dict(zip("ABCDEFGH", range(1, 9))),
+    **dict(zip("JKLMN", range(1, 6))),
+    'P': 7, 'R': 9,
+    **dict(zip("STUVWXYZ", range(2, 10)))
+}
+CHECK_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+
+# Model-year code -> the two years it stands for (1980-2009 and 2010-2039)
+YEAR_CODES = "ABCDEFGHJKLMNPRSTVWXY123456789"
+MODEL_YEARS = {code: (1980 + index, 2010 + index) for index, code in enumerate(YEAR_CODES)}
+
+# WMIs starting with these characters are North American, where the check
+# digit is mandatory and position 7 tells the two year cycles apart
+NORTH_AMERICA = frozenset("12345")
+
+# WMIs ending in 9 are small manufacturers identified further by positions 12-14
+SMALL_MANUFACTURER_MARKER = '9'
+
+# Fields a remote decode may fill in
+DECODED_FIELDS = ('make', 'model', 'year', 'engine', 'plant')
+
+def normalize_vin(vin: str) -> str:
+    return "".join(str(vin).split()).replace('-', '').upper()
+
+def check_digit(vin: str) -> str:
+    """Expected position-9 check digit of a 17-character VIN"""
+    remainder = sum(map(operator.mul, map(TRANSLITERATION.__getitem__, vin), CHECK_WEIGHTS)) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+def _remote_engine(row: Dict[str, Any]) -> Optional[str]:
+    parts = []
+    try:
+        parts.append(f"{float(row['DisplacementL']):.1f}L")
+    except (KeyError, TypeError, ValueError):
+        pass
+    if row.get('EngineCylinders'):
+        parts.append(f"{row['EngineCylinders']}-cyl")
+    if row.get('EngineModel'):
+        parts.append(row['EngineModel'])
+    return " ".join(parts) or None
+
+def _remote_fields(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Decoded fields of one vPIC DecodeVINValues result row"""
+    make = (row.get('Make') or '').strip()
+    try:
+        year = int(row.get('ModelYear'))
+    except (TypeError, ValueError):
+        year = None
+    plant = ", ".join(part for part in (row.get('PlantCity'), row.get('PlantCountry')) if part)
+    return {
+        # vPIC reports makes in upper case
+        'make': (make.title() if len(make) > 3 else make) or None,
+        'model': (row.get('Model') or '').strip() or None,
+        'year': year,
+        'engine': _remote_engine(row),
+        'plant': plant.title() or None
+    }
+
+class VINDecoder:
+    """Local VIN decoding with a cached remote fallback"""
+
+    def __init__(
+        self,
+        tables: Dict[str, Any],
+        source: str = "<tables>",
+        remote_enabled: bool = VIN_REMOTE_ENABLED,
+        remote_url: str = VIN_REMOTE_URL,
+        remote_timeout: float = VIN_REMOTE_TIMEOUT,
+        remote_batch_size: int = VIN_REMOTE_BATCH_SIZE,
+        remote_concurrency: int = VIN_REMOTE_CONCURRENCY,
+        cache_max_entries: int = VIN_CACHE_MAX_ENTRIES
+    ):
+        self.source = source
+        self.wmi: Dict[str, Tuple[str, str, str]] = {
+            wmi.upper(): tuple(fields) for wmi, fields in tables.get('wmi', {}).items()
+        }
+        # (WMI, VDS prefix) -> [(model, engine, first year, last year)], probed longest prefix first
+        self.vds: Dict[Tuple[str, str], List[Tuple[str, Optional[str], int, int]]] = {}
+        for wmi, rows in tables.get('vds', {}).items():
+            for prefix, model, engine, first_year, last_year in rows:
+                self.vds.setdefault((wmi.upper(), prefix.upper()), []).append((model, engine, first_year, last_year))
+        self._vds_lengths = sorted({len(prefix) for _, prefix in self.vds}, reverse=True)
+        self.plants: Dict[Tuple[str, str], str] = {
+            (make, code): plant
+            for make, codes in tables.get('plants', {}).items()
+            for code, plant in codes.items()
+        }
+
+        self.remote_enabled = remote_enabled
+        self.remote_url = remote_url
+        self.remote_timeout = remote_timeout
+        self.remote_batch_size = max(1, remote_batch_size)
+        self.remote_concurrency = max(1, remote_concurrency)
+        self.remote_cache = MemoryTTLCache(cache_max_entries, VIN_CACHE_TTL_SECONDS, name="vin_remote")
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Metrics
+        self.decoded = 0
+        self.complete = 0
+        self.invalid = 0
+        self.remote_cache_hits = 0
+        self.remote_requests = 0
+        self.remote_vins = 0
+        self.remote_errors = 0
+
+    @classmethod
+    def from_file(cls, path: str = VIN_TABLES_PATH, **kwargs) -> "VINDecoder":
+        with open(path, encoding='utf-8') as f:
+            tables = json.load(f)
+        decoder = cls(tables, source=path, **kwargs)
+        logger.info(
+            f"Loaded VIN tables from {path}: {len(decoder.wmi)} WMIs, {len(decoder.vds)} VDS patterns, "
+            f"{len(decoder.plants)} plants"
+        )
+        return decoder
+
+    def _model_year(self, vin: str, candidates: Tuple[int, int], ranges: Sequence[Tuple[int, int]]) -> int:
+        earlier, later = candidates
+        for first, last in ranges:
+            if first <= later <= last:
+                return later
+        for first, last in ranges:
+            if first <= earlier <= last:
+                return earlier
+        if vin[0] in NORTH_AMERICA:
+            # Numeric position 7 means the 1980-2009 cycle
+            return earlier if vin[6].isdigit() else later
+        return later if later <= datetime.utcnow().year + 1 else earlier
+
+    def _vds_match(self, wmi: str, vin: str) -> Optional[List[Tuple[str, Optional[str], int, int]]]:
+        vds = vin[3:8]
+        for length in self._vds_lengths:
+            rows = self.vds.get((wmi, vds[:length]))
+            if rows is not None:
+                return rows
+        return None
+
+    def decode(self, vin: str) -> Dict[str, Any]:
+        """Decode a VIN from the local tables alone"""
+        self.decoded += 1
+        vin = normalize_vin(vin)
+        result: Dict[str, Any] = {
+            'vin': vin,
+            'valid': False,
+            'errors': [],
+            'check_digit_valid': None,
+            'make': None,
+            'model': None,
+            'year': None,
+            'engine': None,
+            'plant': None,
+            'manufacturer_country': None,
+            'vehicle_type': None,
+            'source': 'local',
+            'complete': False
+        }
+
+        if len(vin) != VIN_LENGTH:
+            result['errors'].append(f"VIN must be {VIN_LENGTH} characters, got {len(vin)}")
+        if not VIN_ALPHABET.issuperset(vin):
+            result['errors'].append(f"VIN contains invalid characters: {''.join(sorted(set(vin) - VIN_ALPHABET))}")
+        if result['errors']:
+            self.invalid += 1
+            return result
+
+        expected = check_digit(vin)
+        result['check_digit_valid'] = expected == vin[8]
+        if not result['check_digit_valid'] and vin[0] in NORTH_AMERICA:
+            result['errors'].append(f"Check digit mismatch: expected {expected}, got {vin[8]}")
+            self.invalid += 1
+            return result
+        result['valid'] = True
+
+        wmi = vin[:3]
+        manufacturer = None
+        if wmi[2] == SMALL_MANUFACTURER_MARKER:
+            manufacturer = self.wmi.get(wmi + vin[11:14])
+            if manufacturer is not None:
+                wmi = wmi + vin[11:14]
+        if manufacturer is None:
+            manufacturer = self.wmi.get(wmi)
+        if manufacturer is not None:
+            result['make'], result['manufacturer_country'], result['vehicle_type'] = manufacturer
+
+        candidates = MODEL_YEARS.get(vin[9])
+        rows = self._vds_match(wmi, vin) if manufacturer is not None else None
+        if candidates is not None:
+            result['year'] = self._model_year(vin, candidates, [(row[2], row[3]) for row in rows or ()])
+        if rows:
+            year = result['year']
+            model, engine, _, _ = next((row for row in rows if year is not None and row[2] <= year <= row[3]), rows[0])
+            result['model'] = model
+            result['engine'] = engine
+        if result['make'] is not None:
+            result['plant'] = self.plants.get((result['make'], vin[10]))
+
+        result['complete'] = all(result[field] is not None for field in ('make', 'model', 'year'))
+        if result['complete']:
+            self.complete += 1
+        return result
+
+    def decode_many(self, vins: Sequence[str]) -> List[Dict[str, Any]]:
+        """Decode a batch of VINs locally (fleet imports)"""
+        return [self.decode(vin) for vin in vins]
+
+    async def resolve(self, vin: str, remote: bool = True) -> Dict[str, Any]:
+        """Decode a VIN, completing it remotely if the tables cannot"""
+        return (await self.resolve_many([vin], remote=remote))[0]
+
+    async def resolve_many(self, vins: Sequence[str], remote: bool = True) -> List[Dict[str, Any]]:
+        """Decode a batch locally, then complete the rest with batched, cached remote calls"""
+        results = self.decode_many(vins)
+        if not (remote and self.remote_enabled):
+            return results
+
+        incomplete = [result for result in results if result['valid'] and not result['complete']]
+        remote_fields: Dict[str, Optional[Dict[str, Any]]] = {}
+        to_fetch = []
+        for vin in dict.fromkeys(result['vin'] for result in incomplete):
+            cached = self.remote_cache.get(vin)
+            if cached is not None:
+                self.remote_cache_hits += 1
+                remote_fields[vin] = cached
+            else:
+                to_fetch.append(vin)
+
+        if to_fetch:
+            semaphore = asyncio.Semaphore(self.remote_concurrency)
+
+            async def fetch_chunk(chunk: List[str]):
+                async with semaphore:
+                    remote_fields.update(await self._fetch_remote(chunk))
+
+            await asyncio.gather(*(
+                fetch_chunk(to_fetch[start:start + self.remote_batch_size])
+                for start in range(0, len(to_fetch), self.remote_batch_size)
+            ))
+
+        for result in incomplete:
+            fields = remote_fields.get(result['vin'])
+            if not fields:
+                continue
+            filled = False
+            for field in DECODED_FIELDS:
+                if result[field] is None and fields.get(field) is not None:
+                    result[field] = fields[field]
+                    filled = True
+            if filled:
+                result['source'] = 'local+remote'
+                result['complete'] = all(result[field] is not None for field in ('make', 'model', 'year'))
+        return results
+
+    async def _fetch_remote(self, vins: List[str]) -> Dict[str, Dict[str, Any]]:
+        """One vPIC batch call; failures are logged and leave the VINs undecoded"""
+        if self._client is None:
+            await self.start()
+        self.remote_requests += 1
+        self.remote_vins += len(vins)
+        try:
+            response = await self._client.post(
+                self.remote_url,
+                data={'format': 'json', 'data': ';'.join(vins)}
+            )
+            response.raise_for_status()
+            rows = response.json().get('Results', [])
+        except Exception as e:
+            self.remote_errors += 1
+            logger.warning(f"Remote VIN decode of {len(vins)} VINs failed: {e}")
+            return {}
+
+        decoded = {}
+        for row in rows:
+            vin = normalize_vin(row.get('VIN') or '')
+            if vin in vins:
+                decoded[vin] = _remote_fields(row)
+        for vin in vins:
+            fields = decoded.get(vin)
+            if fields and fields['make'] and fields['model']:
+                self.remote_cache.set(vin, fields)
+            else:
+                # Remember misses too, but retry them sooner
+                self.remote_cache.set(vin, fields or {}, ttl=VIN_CACHE_MISS_TTL_SECONDS)
+        return decoded
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.remote_timeout)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'source': self.source,
+            'wmis': len(self.wmi),
+            'vds_patterns': len(self.vds),
+            'plants': len(self.plants),
+            'decoded': self.decoded,
+            'complete': self.complete,
+            'invalid': self.invalid,
+            'remote_enabled': self.remote_enabled,
+            'remote_cache': self.remote_cache.stats(),
+            'remote_cache_hits': self.remote_cache_hits,
+            'remote_requests': self.remote_requests,
+            'remote_vins': self.remote_vins,
+            'remote_errors': self.remote_errors
+        }
@@ -0,0 +1,217 @@
+"""
+KC Speedshop ML Diagnostic Service - X.AI client
+Long-lived, pooled HTTP client for the X.AI (Grok) API
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from metrics import STAGE_TIMERS, XAI_ERRORS, XAI_TIMEOUTS, stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Connection settings (XAI_BASE_URL lets tests point the client at a local stub)
+XAI_BASE_URL = os.getenv("XAI_BASE_URL", "https://api.x.ai/v1")
+XAI_MAX_CONNECTIONS = int(os.getenv("XAI_MAX_CONNECTIONS", "20"))
+XAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("XAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+XAI_KEEPALIVE_EXPIRY = float(os.getenv("XAI_KEEPALIVE_EXPIRY", "30"))
+XAI_HTTP2 = os.getenv("XAI_HTTP2", "false").lower() in ("1", "true", "yes")
+XAI_TIMEOUT = float(os.getenv("XAI_TIMEOUT", "30"))
+XAI_POOL_TIMEOUT = float(os.getenv("XAI_POOL_TIMEOUT", "5"))
+
+class XAIStreamError(Exception):
+    """Raised when a streaming completion fails before or during streaming"""
+
+def _record_failure(error: Exception):
+    """Count a failed X.AI call as a timeout or an error"""
+    if isinstance(error, httpx.PoolTimeout):
+        XAI_TIMEOUTS.labels('pool').inc()
+    elif isinstance(error, httpx.TimeoutException):
+        XAI_TIMEOUTS.labels('request').inc()
+    elif isinstance(error, XAIStreamError):
+        XAI_ERRORS.labels('http_status').inc()
+    else:
+        XAI_ERRORS.labels('transport').inc()
+
+class XAIClient:
+    """Service-lifetime httpx client with pool limits and saturation stats"""
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: str = XAI_BASE_URL,
+        max_connections: int = XAI_MAX_CONNECTIONS,
+        max_keepalive_connections: int = XAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = XAI_KEEPALIVE_EXPIRY,
+        http2: bool = XAI_HTTP2,
+        timeout: float = XAI_TIMEOUT,
+        pool_timeout: float = XAI_POOL_TIMEOUT
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.timeout = timeout
+        self.pool_timeout = pool_timeout
+
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Metrics
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_total = 0
+        self.request_errors = 0
+        self.pool_timeouts = 0
+
+    @property
+    def started(self) -> bool:
+        return self._client is not None and not self._client.is_closed
+
+    async def start(self):
+        """Create the pooled client (called from the app lifespan)"""
+        if self.started:
+            return
+
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("XAI_HTTP2 requested but the 'h2' package is not installed - using HTTP/1.1")
+                http2 = False
+
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=httpx.Timeout(self.timeout, pool=self.pool_timeout),
+            headers={"Content-Type": "application/json"}
+        )
+        logger.info(
+            f"X.AI client started (base_url={self.base_url}, max_connections={self.max_connections}, "
+            f"keepalive={self.max_keepalive_connections}, http2={http2})"
+        )
+
+    async def aclose(self):
+        """Close pooled connections (called on shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("X.AI client closed")
+
+    async def post_chat_completion(self, payload: Dict[str, Any]) -> httpx.Response:
+        """POST /chat/completions over the shared connection pool"""
+        if not self.started:
+            await self.start()
+
+        self.requests_total += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            with stage_timer('xai_call'):
+                response = await self._client.post(
+                    "/chat/completions",
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    json=payload
+                )
+            if response.status_code != 200:
+                XAI_ERRORS.labels('http_status').inc()
+            return response
+        except httpx.PoolTimeout as e:
+            self.pool_timeouts += 1
+            self.request_errors += 1
+            _record_failure(e)
+            raise
+        except httpx.HTTPError as e:
+            self.request_errors += 1
+            _record_failure(e)
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def stream_chat_completion(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream /chat/completions, yielding content deltas as they arrive"""
+        if not self.started:
+            await self.start()
+
+        self.requests_total += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            async with self._client.stream(
+                "POST",
+                "/chat/completions",
+                headers={"Authorization": f"Bearer {self.api_key}", "Accept": "text/event-stream"},
+                json={**payload, "stream": True}
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise XAIStreamError(f"X.AI API error: {response.status_code}")
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        choices = json.loads(data).get('choices') or [{}]
+                    except json.JSONDecodeError:
+                        logger.warning("Skipping malformed X.AI stream chunk")
+                        continue
+                    content = (choices[0].get('delta') or {}).get('content')
+                    if content:
+                        yield content
+        except httpx.PoolTimeout as e:
+            self.pool_timeouts += 1
+            self.request_errors += 1
+            _record_failure(e)
+            raise
+        except (httpx.HTTPError, XAIStreamError) as e:
+            self.request_errors += 1
+            _record_failure(e)
+            raise
+        finally:
+            # The call lasts until the last chunk, however long the caller takes between chunks
+            STAGE_TIMERS['xai_call'].observe(time.perf_counter() - started)
+            self.in_flight -= 1
+
+    def _connection_counts(self) -> Dict[str, int]:
+        # httpx does not expose its pool publicly; read httpcore's view when available
+        try:
+            connections = self._client._transport._pool.connections
+        except AttributeError:
+            return {}
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {'open_connections': len(connections), 'idle_connections': idle}
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool occupancy and request counters"""
+        stats = {
+            'base_url': self.base_url,
+            'started': self.started,
+            'http2': self.http2,
+            'max_connections': self.max_connections,
+            'max_keepalive_connections': self.max_keepalive_connections,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'saturation': self.in_flight / self.max_connections if self.max_connections else 0.0,
+            'requests_total': self.requests_total,
+            'request_errors': self.request_errors,
+            'pool_timeouts': self.pool_timeouts
+        }
+        if self.started:
+            stats.update(self._connection_counts())
+        return stats
@@ -0,0 +1,18 @@
+/*
+  # Diagnostic history lookups
+
+  1. Changes
+    - `diagnostic_scans.vehicle_key` - vehicle identifier as sent to the ML
+      diagnostic service (vehicle_id only holds values that are vehicle uuids)
+
+  2. Indexes
+    - (vehicle_key, scan_timestamp DESC, id DESC) for newest-first, keyset
+      paginated vehicle diagnostic history
+*/
+
+ALTER TABLE diagnostic_scans ADD COLUMN IF NOT EXISTS vehicle_key text;
+
+UPDATE diagnostic_scans SET vehicle_key = vehicle_id::text WHERE vehicle_key IS NULL AND vehicle_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_diagnostic_scans_vehicle_key_timestamp
+  ON diagnostic_scans (vehicle_key, scan_timestamp DESC, id DESC);
@@ -0,0 +1,17 @@
+/*
+  # Parts catalogue change feed
+
+  1. Triggers
+    - `parts.updated_at` is set on every update (with the existing
+      `update_updated_at_column()` function), so the ML diagnostic
+      service's fitment index can poll for changed parts
+
+  2. Indexes
+    - (updated_at, id) for keyset paginated reads of changed parts
+*/
+
+DROP TRIGGER IF EXISTS update_parts_updated_at ON parts;
+CREATE TRIGGER update_parts_updated_at BEFORE UPDATE ON parts
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_parts_updated_at_id ON parts (updated_at, id);
@@ -0,0 +1,20 @@
+/*
+  # Price and labour rate change feeds
+
+  1. Triggers
+    - `workshop_bays.updated_at` is set on every update, so the ML diagnostic
+      service's cost index can poll for changed labour rates
+
+  2. Indexes
+    - (updated_at, id) on `inventory_items` and `workshop_bays`, and
+      (last_checked, id) on `competitor_prices`, for keyset paginated reads
+      of changed rows
+*/
+
+DROP TRIGGER IF EXISTS update_workshop_bays_updated_at ON workshop_bays;
+CREATE TRIGGER update_workshop_bays_updated_at BEFORE UPDATE ON workshop_bays
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_inventory_items_updated_at_id ON inventory_items (updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_workshop_bays_updated_at_id ON workshop_bays (updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_competitor_prices_last_checked_id ON competitor_prices (last_checked, id);